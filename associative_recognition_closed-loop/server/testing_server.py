@@ -1,66 +1,193 @@
-import socket
-import threading
+"""
+Elemem Stand-in Server
+
+Local stand-in for the Elemem server, for testing and timing the task
+without the Blackrock rig. Answers CONNECTED, CONFIGURE, READY, and HEARTBEAT
+as Elemem does, checks every other message of elemem_message_dictionary.py,
+and simulates the classification windows of CLNORMALIZE, CLSTIM, and CLSHAM.
+
+Faults can be injected into the responses (latency, dropped responses, partial
+frames, coalesced writes), and message throughput is printed periodically.
+If the task runs on the same computer, the time between a message being sent
+(its 'time' field) and received is reported for every message type.
+
+Run before starting the task, e.g.:
+    python server/testing_server.py --latency normal:2,0.5 --drop 0.01 --record received.jsonl
+
+"""
+from smile.message_server import MessageServer
+import argparse
 import json
+import time
+import random
 from datetime import datetime
 
 
-server_ip = '192.168.1.1'
-server_port = 8888
-datetime_format = 
+server_ip = '127.0.0.1'
+server_port = 5000
+datetime_format = '%Y-%m-%d_%H-%M-%S_%f'
+
+### Data fields of each message type, as in elemem_message_dictionary.py
+message_data_fields = {
+    'CCLSTARTSTIM': {'duration_s'},
+    'CLNORMALIZE': {'classifyms'},
+    'CLSHAM': {'classifyms'},
+    'CLSTIM': {'classifyms'},
+    'CONFIGURE': {'stim_mode', 'experiment', 'subject', 'tags'},
+    'CONNECTED': set(),
+    'COUNTDOWN': set(),
+    'DISTRACT': set(),
+    'EXIT': set(),
+    'HEARTBEAT': {'count'},
+    'INSTRUCT': set(),
+    'MATH': {'problem', 'response', 'response_time_ms', 'correct'},
+    'ORIENT': set(),
+    'READY': set(),
+    'RECALL': {'duration'},
+    'REST': set(),
+    'SESSION': {'session'},
+    'STIM': set(),
+    'STIMSELECT': {'stimtag'},
+    'TRIAL': {'trial', 'stim'},
+    'TRIALEND': set(),
+    'WORD': {'word', 'serialpos', 'stim'}}
 
 ### Message types for which Elemem sends a response back to client
 message_types_with_response = {'CONNECTED', 'CONFIGURE', 'READY', 'HEARTBEAT'}
 
+### Message types starting a classification window of 'classifyms' milliseconds
+classification_message_types = {'CLNORMALIZE', 'CLSTIM', 'CLSHAM'}
+
+### Replaced by parsed command line arguments
+stimulation_probability = 0.5
+random_generator = random.Random()
+record_file = None
+
+### Milliseconds between the 'time' of each message and its receipt, by message type
+message_latencies = {}
+
 def prepare_response(client_message):
     server_response = {
         'type': f"{client_message['type']}_OK",
         'id': client_message['id'],
-        'time': datetime.now(),
+        'time': datetime.now().strftime(datetime_format),
         'data': client_message['data']
     }
     return server_response
 
-def handle_client(client, client_address):
-    
-    message_buffer = ''
-    receiving_from_client = True
-    try:
-        while receiving_from_client:
-            
-            new_bytes = client.recv(1024)
-            
-            if not new_bytes:
-                break
-
-            message_buffer += new_bytes.decode('utf-8')
-
-            while '\n' in message_buffer:
-                message_string, message_buffer = message_buffer.split('\n', 1)
-     
-                message = json.loads(message_string)
-                
-                message_type = message['type']
-
-                if message_type in message_types_with_response:
-                    server_response = prepare_response(message)
-                    response_string = json.dumps(server_response) + '\n'
-                    client.sendall(response_string.encode('utf-8'))
-
-    except ConnectionResetError:
-        print("Connection reset by client.")
-    finally:
-        client.close()
-        print(f"Client disconnected.")
+### Print a warning for messages that are not in the Elemem message set
+def check_message(message):
+    message_type = message.get('type')
+    if message_type not in message_data_fields:
+        print(f"Unknown message type: {message_type}")
+        return False
+    for key in ('id', 'time', 'data'):
+        if key not in message:
+            print(f"{message_type} message {message.get('id')} is missing '{key}'.")
+            return False
+    data_fields = set(message['data'])
+    if data_fields != message_data_fields[message_type]:
+        print(f"{message_type} message {message['id']} has data fields {sorted(data_fields)}, expected {sorted(message_data_fields[message_type])}.")
+        return False
+    return True
+
+### Log every received message, with its latency from the client's message time
+def record_message(connection, message, receive_time):
+    receive_ms = receive_time * 1000
+    latency_ms = None
+    if isinstance(message.get('time'), (int, float)) and message['time'] > 0:
+        latency_ms = receive_ms - message['time']
+        message_latencies.setdefault(message.get('type'), []).append(latency_ms)
+    if record_file is not None:
+        record = {
+            'server_time': datetime.now().strftime(datetime_format),
+            'receive_ms': receive_ms,
+            'latency_ms': latency_ms,
+            'message': message}
+        record_file.write(json.dumps(record) + '\n')
 
-def start_server():
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
-        server_socket.bind((server_ip, server_port))
-        server_socket.listen(1)
+### Elemem's handling of each message
+def handle_message(connection, message):
+    state = connection.state
+    if not check_message(message):
+        return
+    message_type = message['type']
+    now = time.perf_counter()
 
-        while True:
-            client, client_address = server_socket.accept()
-            client_thread = threading.Thread(target=handle_client, args=(client, client_address))
-            client_thread.start()
+    if message_type == 'HEARTBEAT':
+        count = message['data']['count']
+        if 'heartbeat_count' in state and count != state['heartbeat_count'] + 1:
+            print(f"Heartbeat count {count} after {state['heartbeat_count']}.")
+        state['heartbeat_count'] = count
+
+    elif message_type == 'CONFIGURE':
+        print(f"Configured: {message['data']}")
+
+    elif message_type == 'SESSION':
+        print(f"Session {message['data']['session']} started.")
+
+    elif message_type in classification_message_types:
+        ### A classification window still open means the task sent messages too close together
+        window_end = state.get('classification_end', 0)
+        if now < window_end:
+            print(f"{message_type} {message['id']} arrived {(window_end - now) * 1000:.1f} ms before the previous classification window ended.")
+        state['classification_end'] = now + message['data']['classifyms'] / 1000
+        if message_type == 'CLNORMALIZE':
+            state['normalization_count'] = state.get('normalization_count', 0) + 1
+        elif message_type == 'CLSTIM':
+            stimulated = random_generator.random() < stimulation_probability
+            state['n_stimulated'] = state.get('n_stimulated', 0) + stimulated
+            state['n_classified'] = state.get('n_classified', 0) + 1
+
+    elif message_type == 'EXIT':
+        print(f"EXIT after {state.get('n_classified', 0)} CLSTIM classifications ({state.get('n_stimulated', 0)} stimulated) and {state.get('normalization_count', 0)} CLNORMALIZE.")
+        connection.close()
+
+    if message_type in message_types_with_response:
+        connection.send(prepare_response(message))
+
+def print_latencies():
+    print("Message latencies (ms, only meaningful if client and server share a computer):")
+    for message_type, latencies in sorted(message_latencies.items()):
+        latencies = sorted(latencies)
+        print(f"{message_type:>12}: n {len(latencies)}, mean {sum(latencies) / len(latencies):.2f}, median {latencies[len(latencies) // 2]:.2f}, max {latencies[-1]:.2f}")
+
+def start_server(args):
+    server = MessageServer(handle_message,
+                           host=args.host,
+                           port=args.port,
+                           latency=args.latency,
+                           drop=args.drop,
+                           split=args.split,
+                           split_delay=args.split_delay / 1000,
+                           coalesce=args.coalesce / 1000,
+                           report_interval=args.report_interval,
+                           log=record_message,
+                           seed=args.seed)
+    server.serve_forever()
 
 if __name__ == "__main__":
-    start_server()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Local stand-in for the Elemem server.")
+    parser.add_argument('--host', default=server_ip)
+    parser.add_argument('--port', type=int, default=server_port)
+    parser.add_argument('--latency', default=None, help="response latency distribution in ms, e.g. 'fixed:2', 'uniform:1,5', 'normal:2,0.5', 'lognormal:2,0.5', 'exponential:2'")
+    parser.add_argument('--drop', type=float, default=0.0, help="probability of dropping a response")
+    parser.add_argument('--split', type=float, default=0.0, help="probability of writing a response as two partial frames")
+    parser.add_argument('--split-delay', type=float, default=5.0, help="ms between partial frames")
+    parser.add_argument('--coalesce', type=float, default=0.0, help="ms to hold responses so they are written together")
+    parser.add_argument('--report-interval', type=float, default=10.0, help="seconds between throughput reports (0 for none)")
+    parser.add_argument('--record', default=None, help="file to record received messages in, one JSON per line")
+    parser.add_argument('--stim-probability', type=float, default=stimulation_probability, help="probability a CLSTIM classification results in stimulation")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    stimulation_probability = args.stim_probability
+    random_generator.seed(args.seed)
+    if args.record is not None:
+        record_file = open(args.record, 'a')
+    try:
+        start_server(args)
+    finally:
+        if record_file is not None:
+            record_file.close()
+        print_latencies()
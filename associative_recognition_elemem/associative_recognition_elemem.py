@@ -11,16 +11,18 @@ For details about experiment parameters view configuration.py
 
 """
 from smile.common import *
+from smile.checkpoint import CheckpointJournal
 from smile.pennsyncbox import *
+from smile.session_writer import SessionWriter
+from smile.message_client import MessageClient, MessageSender
+from smile.message_template import compile_message_templates
 from smile.math_distract import MathDistract
 from smile.clock import clock
 from smile.log import log2dl
 import pandas as pd
 import os
-import socket
 import json
 import time
-from csv import DictWriter
 
 ### Import configuration, initialization, and experiment functions
 from configuration import *
@@ -41,12 +43,12 @@ if 'test000' not in experiment.subject:
     quit()
 
 ### Start connection to server
-### SMILE's server utility only allows sending but not receiving communication at runtime
+### The message client runs the connection on its own thread, so messages can be sent without blocking at runtime
 if server_connection_enabled:
     try:
-        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server.connect((server_ip_address, server_port))
-    except:
+        server = MessageClient(server_ip_address, server_port)
+        server.connect(timeout=server_response_timeout)
+    except Exception:
         print("Could not establish connection to server. Check connection and try again.")
         quit()
 else:
@@ -66,6 +68,7 @@ session_directory = data_directory + subject + '/session_'+ session + '/'
 session_logs = session_directory + 'session_logs/'
 experiment_block_list_file = session_directory + 'experiment_block_list.json'
 checkpoint_file = session_directory + 'checkpoint.csv'
+checkpoint_journal_file = session_directory + 'checkpoint.journal'
 pulses_file = session_directory + 'pulses.csv'
 events_file = session_directory + 'events.csv'
 timing_file = session_directory + 'timing.csv'
@@ -121,6 +124,16 @@ if not os.path.isfile(communications_file):
 ### Allow time for files to be written before accessing
 time.sleep(0.5)
 
+### The communications file stays open, and rows are buffered and written by a background thread
+### so that sending messages during the experiment never waits on file writes
+session_writer = SessionWriter()
+session_writer.add_file(communications_file, communications_fieldnames)
+
+### Outgoing messages wait in a queue for a background thread to send them and write them to the communications file
+message_sender = MessageSender(server,
+                               log=lambda message: session_writer.writerow(communications_file, message),
+                               stamp=lambda: round(clock.now() * 1000))
+
 ### Retrieve experiment block list and message dictionaries from saved files
 with open(experiment_block_list_file, 'r') as file_handle:
     experiment_block_list = json.load(file_handle)
@@ -128,124 +141,87 @@ with open(experiment_block_list_file, 'r') as file_handle:
 with open(message_dictionary_file, 'r') as file_handle:
     message_dictionary = json.load(file_handle)
 
+### Each message type is precompiled into an encoder that only fills in the fields that vary between messages
+message_templates = compile_message_templates(message_dictionary)
+
 ### If experimental session has been executed before gather information from checkpoint file
 ### to start from the appropriate trial
-experiment_block_list, experiment.skip_study_phase = update_list_from_checkpoint(experiment_block_list, checkpoint_file, session_lock_file)
+experiment_block_list, experiment.skip_study_phase = update_list_from_checkpoint(experiment_block_list, checkpoint_file, checkpoint_journal_file, session_lock_file)
+
+### Each completed trial is committed to the checkpoint journal so a session can resume after a power interruption
+### Records are committed on a background thread so the fsyncs do not delay the next trial
+checkpoint_journal = CheckpointJournal(checkpoint_journal_file, checkpoint_journal_fields, background=True)
 
 ############################################################## Experiment Subroutine and Function Definitions ###########################################################
-### TODO: Runtime error caused by handling of message variables. Already tried fully parameterizing functions and separating them in different files.
-### Will still continue to error when handling 'WORD' type messages during test phase. No errors after commenting out this part.
+### TODO: Runtime error caused by handling of message variables. 'WORD' type messages during test phase errored and are commented out.
+### Messages used to be shallow copies sharing their 'data' dictionary. They are now encoded from precompiled templates
+### that share nothing between messages, so test phase 'WORD' messages can be re-enabled once tested with Elemem.
 
 ############# Functions for communications between task client and Elemem server ##########
 
 ### Function to send messages to Elemem server and write communication to .csv
-### During experiment runtime, messages can only be sent
-def send_server_message(message):
-
-    message['time'] = round(clock.now() * 1000)
-    
-    message_string = json.dumps(message) + '\n'
-    
+### Takes the message type and its varying fields (e.g., id, word, serialpos).
+### The message is stamped with the time it is queued and handed to the message sender, whose own thread
+### encodes it from its template, sends it, and writes it to .csv, so this is safe to call through Func at runtime.
+### With expect_response, returns the pending response to pass to receive_server_response.
+def send_server_message(message_type, expect_response=False, **fields):
+    return message_sender.send_template(message_templates[message_type], expect_response, **fields)
+
+### Function to wait for the response matched (by id) to a sent message and write it to .csv
+### Can only wait for responses from server during experiment buildtime and after runtime
+def receive_server_response(response):
+    message = response.result(timeout=server_response_timeout)
+    message_sender.wait()  ### so that the sent message is written first
+    session_writer.writerow(communications_file, message)
+    return message
+
+### Series of 'HEARTBEAT' messages, all in flight at once, then waiting for their responses
+def send_heartbeats():
+    global message_id, heartbeat_count
+    responses = []
+    for _ in range(n_heartbeats):
+        message_id += 1
+        heartbeat_count += 1
+        responses.append(send_server_message('HEARTBEAT', expect_response=True, id=message_id, count=heartbeat_count))
     if server_connection_enabled:
-        server.send(message_string.encode('utf-8'))
-    
-    with open(communications_file, 'a', newline='') as file_handle:
-        csv_writer = DictWriter(file_handle, fieldnames=communications_fieldnames)
-        csv_writer.writerow(message)
-
-### Function to receive messages from Elemem server and write communication to .csv
-### Can only receive messages from server during experiment buildtime and after runtime
-def receive_server_response():
-    
-    message_buffer = ''
-
-    receiving_from_server = True
-    while receiving_from_server:
-
-        new_bytes = server.recv(1024)  ### Read up to 1024 bytes
-
-        ### If no data is received, the connection has been closed or lost
-        if not new_bytes:
-            break
-        
-        ### Decode the data and add it to the buffer
-        message_buffer += new_bytes.decode('utf-8')
-
-        ### Process complete messages
-        while '\n' in message_buffer:
-            ### Split the buffer at the first newline
-            message_string, message_buffer = message_buffer.split('\n', 1)
-
-            ### Parse the JSON string into a dictionary
-            message = json.loads(message_string)
-                    
-        ### If buffer is empty after processing the message, stop the loop
-        if not message_buffer:
-            receiving_from_server = False
-    
-    with open(communications_file, 'a', newline='') as file_handle:
-        csv_writer = DictWriter(file_handle, fieldnames=communications_fieldnames)
-        csv_writer.writerow(message)
+        for response in responses:
+            receive_server_response(response)
+        latency = server.get_latency_stats('HEARTBEAT')
+        print(f"Heartbeat round trip: mean {latency['mean'] * 1000:.1f} ms, max {latency['max'] * 1000:.1f} ms over {latency['n']} heartbeats.")
 
 ### Initial communications with Elemem server
 def initial_communications():
-    global message_id, heartbeat_count
+    global message_id
+
     ### CONNECTED message
     message_id += 1
-    message = message_dictionary['CONNECTED'].copy()
-    message['id'] = message_id
-    send_server_message(message)
+    response = send_server_message('CONNECTED', expect_response=True, id=message_id)
     if server_connection_enabled:
-        receive_server_response()
+        receive_server_response(response)
 
     ### CONFIGURE message
     message_id += 1
-    message = message_dictionary['CONFIGURE'].copy()
-    message['id'] = message_id
-    send_server_message(message)
+    response = send_server_message('CONFIGURE', expect_response=True, id=message_id)
     if server_connection_enabled:
-        receive_server_response()
+        receive_server_response(response)
 
     ### READY message
     message_id += 1
-    message = message_dictionary['READY'].copy()
-    message['id'] = message_id
-    send_server_message(message)
+    response = send_server_message('READY', expect_response=True, id=message_id)
     if server_connection_enabled:
-        receive_server_response()
+        receive_server_response(response)
+
+    send_heartbeats()
 
-    ### Series of 'HEARTBEAT' messages
-    for _ in range(n_heartbeats):
-        message_id += 1
-        heartbeat_count += 1
-        message = message_dictionary['HEARTBEAT'].copy()
-        message['id'] = message_id
-        message['data']['count'] = heartbeat_count
-        send_server_message(message)
-        if server_connection_enabled:
-            receive_server_response()
-        time.sleep(0.1)
-    
 ### Final communications with Elemem server
 def final_communications():
-    global message_id, heartbeat_count
-    ### Series of 'HEARTBEAT' messages
-    for _ in range(n_heartbeats):
-        message_id += 1
-        heartbeat_count += 1
-        message = message_dictionary['HEARTBEAT'].copy()
-        message['id'] = message_id
-        message['data']['count'] = heartbeat_count
-        send_server_message(message)
-        if server_connection_enabled:
-            receive_server_response()
-        time.sleep(0.1)
-    
+    global message_id
+
+    send_heartbeats()
+
     ### EXIT message
     message_id += 1
-    message = message_dictionary['EXIT'].copy()
-    message['id'] = message_id
-    send_server_message(message)
+    send_server_message('EXIT', id=message_id)
 
 ###################### Messages to Elemem Server #########################
 
@@ -253,50 +229,42 @@ def final_communications():
 @Subroutine
 def SessionMessage(self):
     experiment.message_id += 1
-    message = message_dictionary['SESSION'].copy()
-    message['id'] = experiment.message_id
-    Func(send_server_message, message)
+    Func(send_server_message, 'SESSION', id=experiment.message_id)
 
 ### To indicate that instructions are being displayed
 @Subroutine
 def InstructionsMessage(self):
     experiment.message_id += 1
-    message = message_dictionary['INSTRUCT'].copy()
-    message['id'] = experiment.message_id
-    Func(send_server_message, message)
+    Func(send_server_message, 'INSTRUCT', id=experiment.message_id)
 
 ### To indicate time that crosshair to orient view to center is being displayed
 @Subroutine
 def OrientMessage(self):
     experiment.message_id += 1
-    message = message_dictionary['ORIENT'].copy()
-    message['id'] = experiment.message_id
-    Func(send_server_message, message)
+    Func(send_server_message, 'ORIENT', id=experiment.message_id)
 
 ### To provide information about trial including start time, words displayed, and serial position
 @Subroutine
-def WordMessage(self, message):
-    Func(send_server_message, message)
+def WordMessage(self, word, serial_position):
+    experiment.message_id += 1
+    Func(send_server_message, 'WORD', id=experiment.message_id, word=word, serialpos=serial_position)
 
 @Subroutine
-def WordMessageTest(self, message):
-    Func(send_server_message, message)
+def WordMessageTest(self, word, serial_position):
+    experiment.message_id += 1
+    Func(send_server_message, 'WORD', id=experiment.message_id, word=word, serialpos=serial_position)
 
 ### To indicate the end time of a trial
 @Subroutine
 def TrialEndMessage(self):
     experiment.message_id += 1
-    message = message_dictionary['TRIALEND'].copy()
-    message['id'] = experiment.message_id
-    Func(send_server_message, message) 
+    Func(send_server_message, 'TRIALEND', id=experiment.message_id) 
 
 ### To indicate the start time of math distraction trials
 @Subroutine
 def MathMessage(self):
     experiment.message_id += 1
-    message = message_dictionary['MATH'].copy()
-    message['id'] = experiment.message_id
-    Func(send_server_message, message)
+    Func(send_server_message, 'MATH', id=experiment.message_id)
 
 ####################### Exeriment Subroutines ###########################
 
@@ -367,12 +335,7 @@ def StudyPhase(self, study_phase):
         orient_image = Image(source=crosshair_image, size=screen_size, duration=orient_duration, allow_stretch=True)
 
         ### Start of trial with gathering of response
-        experiment.message_id += 1
-        message = message_dictionary['WORD'].copy()
-        message['id'] = experiment.message_id
-        message['data']['word'] = trial.current['top_word'] + '/' + trial.current['bottom_word']
-        message['data']['serialpos'] = trial.current['trial_index']
-        WordMessage(message)
+        WordMessage(trial.current['top_word'] + '/' + trial.current['bottom_word'], trial.current['trial_index'])
 
         with Parallel():
             ### Display of word pair
@@ -437,6 +400,10 @@ def StudyPhase(self, study_phase):
                 experiment_block=trial.current['experiment_block'],
                 experiment_phase=trial.current['experiment_phase'],
                 trial_index=trial.current['trial_index'])
+            Func(checkpoint_journal.append,
+                 experiment_block=trial.current['experiment_block'],
+                 experiment_phase=trial.current['experiment_phase'],
+                 trial_index=trial.current['trial_index'])
 
 ### Subroutine for looping through trials of test phase of an experiment block
 @Subroutine
@@ -451,12 +418,7 @@ def TestPhase(self, test_phase):
         orient_image = Image(source=crosshair_image, duration=orient_duration, size=screen_size, allow_stretch=True)
 
         ### Start of trial with gathering of response
-        #experiment.message_id += 1
-        #message = message_dictionary['WORD'].copy()
-        #message['id'] = experiment.message_id
-        #message['data']['word'] = trial.current['top_word'] + '/' + trial.current['bottom_word']
-        #message['data']['serialpos'] = trial.current['trial_index']
-        #WordMessageTest(message)
+        #WordMessageTest(trial.current['top_word'] + '/' + trial.current['bottom_word'], trial.current['trial_index'])
 
         with Parallel():
             ### Display of word pair
@@ -522,6 +484,10 @@ def TestPhase(self, test_phase):
                 experiment_block=trial.current['experiment_block'],
                 experiment_phase=trial.current['experiment_phase'],
                 trial_index=trial.current['trial_index'])
+            Func(checkpoint_journal.append,
+                 experiment_block=trial.current['experiment_block'],
+                 experiment_phase=trial.current['experiment_phase'],
+                 trial_index=trial.current['trial_index'])
 
 ####################################################################### Experiment Definition ###########################################################################
 
@@ -595,14 +561,27 @@ Label(text="Thank you for participating!", font_size=large_font, duration=5)
 ### Run the experiment
 experiment.run()
 
+### Commit the checkpoints still waiting on the background thread
+checkpoint_journal.close()
+
 ### Final communications with Elemem server
 message_id = experiment.get_var('message_id')
 final_communications()
 
+### Send remaining messages and report how long messages waited between being queued and sent
+message_sender.close()
+if server_connection_enabled:
+    latency = message_sender.get_latency_stats('WORD')
+    if latency['n']:
+        print(f"WORD queued to sent: mean {latency['mean'] * 1000:.2f} ms, max {latency['max'] * 1000:.2f} ms over {latency['n']} messages.")
+
 ### Close server
 if server_connection_enabled:
     server.close()
 
+### Write remaining communications and close session files
+session_writer.close()
+
 #################################################################### Post-Experiment Run Data Management ################################################################
 ### The lines below will run at experiment end or after exiting the experiment
 ### If there is a power interruption, then experiment data may need to be recovered 
@@ -23,6 +23,7 @@ digit_string = '#' * n_subject_code_digits
 ### Connection to Blackrock computer server and stimulation parameters
 server_ip_address = '127.0.0.1'
 server_port = 5000
+server_response_timeout = 5        # seconds to wait for a server response before giving up
 server_connection_enabled = True
 
 ### Durations in seconds of several experimental elements
@@ -119,6 +120,10 @@ checkpoint_fieldnames = [
     'subject', 'session', 'experiment_block', 'experiment_phase', 'trial_index',
     'log_num', 'log_time']
 
+### Fixed-size checkpoint journal records used to resume a session: (field, struct format)
+checkpoint_journal_fields = [
+    ('experiment_block', 'i'), ('experiment_phase', '16s'), ('trial_index', 'i')]
+
 pulses_fieldnames = [
     'subject', 'session', 'experiment_block', 'experiment_phase', 'trial_index', 
     'pulse_time', 'log_num', 'log_time']
@@ -9,6 +9,7 @@ For details about experiment parameters view configuration.py
 
 from smile.pennsyncbox import *
 from smile.common import *
+from smile.checkpoint import CheckpointJournal
 from smile.math_distract import MathDistract
 from smile.clock import clock
 from smile.scale import scale as s
@@ -55,6 +56,7 @@ session_directory = data_directory + subject + '/session_'+ session + '/'
 session_logs = session_directory + 'session_logs/'
 experiment_block_list_file = session_directory + 'experiment_block_list.json'
 checkpoint_file = session_directory + 'checkpoint.csv'
+checkpoint_journal_file = session_directory + 'checkpoint.journal'
 pulses_file = session_directory + 'pulses.csv'
 events_file = session_directory + 'events.csv'
 timing_file = session_directory + 'timing.csv'
@@ -122,7 +124,11 @@ with open(experiment_block_list_file, 'r') as file_handle:
 
 ### If experimental session has been executed before gather information from checkpoint file
 ### to start from the appropriate trial
-experiment_block_list, experiment.skip_study_phase = update_list_from_checkpoint(experiment_block_list, checkpoint_file, session_lock_file)
+experiment_block_list, experiment.skip_study_phase = update_list_from_checkpoint(experiment_block_list, checkpoint_file, checkpoint_journal_file, session_lock_file)
+
+### Each completed trial is committed to the checkpoint journal so a session can resume after a power interruption
+### Records are committed on a background thread so the fsyncs do not delay the next trial
+checkpoint_journal = CheckpointJournal(checkpoint_journal_file, checkpoint_journal_fields, background=True)
             
 ####################################################################### Experiment Definition ###########################################################################
 
@@ -155,7 +161,7 @@ with Loop(experiment_block_list) as experiment_block:
             KeyPress(keys=continue_key)
         
         ### Start study phase
-        StudyPhase(experiment_block.current['study_phase'])
+        StudyPhase(experiment_block.current['study_phase'], checkpoint_journal)
 
         ### Small pause before start of math distraction
         Wait(2)
@@ -172,7 +178,7 @@ with Loop(experiment_block_list) as experiment_block:
     with UntilDone():
         KeyPress(keys=continue_key)
     # Start test phase
-    TestPhase(experiment_block.current['test_phase'], server_connection_enabled, server)
+    TestPhase(experiment_block.current['test_phase'], server_connection_enabled, server, checkpoint_journal)
 
 # If the execution of the experiment ends with no exits or power interruptions:
 # USB port will be closed, a file locking the session will be created, and thank you note displayed
@@ -184,6 +190,9 @@ Label(text="Thank you for participating!", font_size=large_font, duration=5)
 # Run the experiment
 experiment.run()
 
+### Commit the checkpoints still waiting on the background thread
+checkpoint_journal.close()
+
 if server_connection_enabled:
     server.close()
 
@@ -111,6 +111,10 @@ checkpoint_fieldnames = [
     'subject', 'session', 'experiment_block', 'experiment_phase', 'trial_index',
     'log_num', 'log_time']
 
+### Fixed-size checkpoint journal records used to resume a session: (field, struct format)
+checkpoint_journal_fields = [
+    ('experiment_block', 'i'), ('experiment_phase', '16s'), ('trial_index', 'i')]
+
 pulses_fieldnames = [
     'subject', 'session', 'experiment_block', 'experiment_phase', 'trial_index', 
     'pulse_time', 'log_num', 'log_time']
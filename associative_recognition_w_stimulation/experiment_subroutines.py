@@ -73,7 +73,7 @@ def DisplayTextInstructions(self):
 
 ### Subroutine to display word pairs and gather response regarding subdominant item in interaction
 @Subroutine
-def StudyPhase(self, study_phase):
+def StudyPhase(self, study_phase, checkpoint_journal):
     with Loop(study_phase) as trial:
         
         ### Send a sync pulse right before each sequence is started
@@ -143,9 +143,13 @@ def StudyPhase(self, study_phase):
                 experiment_block=trial.current['experiment_block'],
                 experiment_phase=trial.current['experiment_phase'],
                 trial_index=trial.current['trial_index'])
+            Func(checkpoint_journal.append,
+                 experiment_block=trial.current['experiment_block'],
+                 experiment_phase=trial.current['experiment_phase'],
+                 trial_index=trial.current['trial_index'])
 
 @Subroutine
-def TestPhase(self, test_phase, server_connection_enabled, server):
+def TestPhase(self, test_phase, server_connection_enabled, server, checkpoint_journal):
     with Loop(test_phase) as trial:
         
         ### Send a sync pulse right before each sequence is started
@@ -223,4 +227,8 @@ def TestPhase(self, test_phase, server_connection_enabled, server):
                 session=trial.current['session'],
                 experiment_block=trial.current['experiment_block'],
                 experiment_phase=trial.current['experiment_phase'],
-                trial_index=trial.current['trial_index'])
\ No newline at end of file
+                trial_index=trial.current['trial_index'])
+            Func(checkpoint_journal.append,
+                 experiment_block=trial.current['experiment_block'],
+                 experiment_phase=trial.current['experiment_phase'],
+                 trial_index=trial.current['trial_index'])
\ No newline at end of file
@@ -74,7 +74,7 @@ def DisplayTextInstructions(self, instructions_text):
 
 ### Subroutine to display environment image/noun pairs and gather response for noun type
 @Subroutine
-def ExperimentPhase(self, experiment_block, experiment_phase_keys):
+def ExperimentPhase(self, experiment_block, experiment_phase_keys, checkpoint_journal):
     with Loop(experiment_block) as trial:
 
         ### Send a sync pulse right before each sequence is started
@@ -85,6 +85,7 @@ def ExperimentPhase(self, experiment_block, experiment_phase_keys):
         
         ### Start of trial with gathering of response
         environment_source = environment_directory + trial.current['environment'] + '.png'
+        trial.prefetch(environment_source)
         with Parallel():
             environment_image = Image(source=environment_source, size=environment_size, duration=allowed_response_time, top=top, blocking=False)
             Label(text=trial.current['noun'], duration=allowed_response_time, font_size=large_font, bottom=label_offset, blocking=False)
@@ -133,4 +134,7 @@ def ExperimentPhase(self, experiment_block, experiment_phase_keys):
                 subject=trial.current['subject'],
                 session=trial.current['session'],
                 experiment_phase=trial.current['experiment_phase'],
-                trial_index=trial.current['trial_index'])
\ No newline at end of file
+                trial_index=trial.current['trial_index'])
+            Func(checkpoint_journal.append,
+                 experiment_phase=trial.current['experiment_phase'],
+                 trial_index=trial.current['trial_index'])
\ No newline at end of file
@@ -9,6 +9,7 @@ For details about experiment parameters view configuration.py
 
 from smile.pennsyncbox import *
 from smile.common import *
+from smile.checkpoint import CheckpointJournal
 from smile.clock import clock
 from smile.scale import scale as s
 from smile.log import log2dl
@@ -48,6 +49,7 @@ session_directory = data_directory + subject + '/session_'+ session + '/'
 experiment_block_list_file = session_directory + 'experiment_block_list.json'
 session_logs = session_directory + 'session_logs/'
 checkpoint_file = session_directory + 'checkpoint.csv'
+checkpoint_journal_file = session_directory + 'checkpoint.journal'
 pulses_file = session_directory + 'pulses.csv'
 events_file = session_directory + 'events.csv'
 timing_file = session_directory + 'timing.csv'
@@ -106,7 +108,11 @@ with open(experiment_block_list_file) as file_handle:
 
 ### If experimental session has been executed before gather information from checkpoint file
 ### to start from the appropriate trial
-experiment_block, experiment_phase, experiment_phase_keys = update_list_from_checkpoint(experiment_block_list, checkpoint_file, session_lock_file)
+experiment_block, experiment_phase, experiment_phase_keys = update_list_from_checkpoint(experiment_block_list, checkpoint_file, checkpoint_journal_file, session_lock_file)
+
+### Each completed trial is committed to the checkpoint journal so a session can resume after a power interruption
+### Records are committed on a background thread so the fsyncs do not delay the next trial
+checkpoint_journal = CheckpointJournal(checkpoint_journal_file, checkpoint_journal_fields, background=True)
 
 instructions_text = instructions[experiment_phase]
 phase_label = phase_labels[experiment_phase]
@@ -134,7 +140,7 @@ with Parallel():
 with UntilDone():
     KeyPress(keys=continue_key)
 
-ExperimentPhase(experiment_block, experiment_phase_keys)
+ExperimentPhase(experiment_block, experiment_phase_keys, checkpoint_journal)
 
 # If the execution of the experiment ends with no exits or power interruptions:
 # USB port will be closed, a file locking the session will be created, and thank you note displayed
@@ -149,6 +155,9 @@ with Parallel():
 # Run the experiment
 experiment.run()
 
+### Commit the checkpoints still waiting on the background thread
+checkpoint_journal.close()
+
 ################################################################## Post-Experiment Run Data Management #################################################################
 ### The lines below will run at experiment end or after exiting the experiment
 ### If there is a power interruption, then experiment data may need to be recovered 
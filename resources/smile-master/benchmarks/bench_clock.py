@@ -0,0 +1,112 @@
+"""Micro-benchmark of smile.clock.Clock scheduling cost vs. queue length.
+
+Compares the heap scheduler against the previous sorted-list scheduler
+(reproduced below) for schedule, unschedule, and tick at several queue
+lengths.
+
+    python benchmarks/bench_clock.py
+
+"""
+from __future__ import print_function
+import random
+import timeit
+
+from smile.clock import Clock, _ClockEvent
+
+
+class ListClock(object):
+    """The sorted-list scheduler smile.clock used before the heap."""
+    def __init__(self):
+        self._events = []
+        self._now = 0.0
+
+    def now(self):
+        return self._now
+
+    def tick(self):
+        now = self.now()
+        while len(self._events):
+            event = self._events[0]
+            if event.event_time is None or now >= event.event_time:
+                del self._events[0]
+                if event.repeat_interval is not None:
+                    if event.event_time is None:
+                        event.event_time = now + event.repeat_interval
+                    else:
+                        event.event_time += event.repeat_interval
+                    self._schedule(event)
+                event.func()
+            else:
+                break
+
+    def _schedule(self, event):
+        for n, cmp_event in enumerate(self._events):
+            if ((event.event_time is None and
+                 cmp_event.event_time is not None) or
+                (event.event_time is not None and
+                 cmp_event.event_time is not None and
+                 event.event_time < cmp_event.event_time)):
+                self._events.insert(n, event)
+                break
+        else:
+            self._events.append(event)
+
+    def schedule(self, func, event_delay=None, event_time=None,
+                 repeat_interval=None):
+        if event_delay is not None:
+            event_time = self.now() + event_delay
+        self._schedule(_ClockEvent(self, func, event_time, repeat_interval))
+        return func
+
+    def unschedule(self, func):
+        self._events = [event for event in self._events if event.func != func]
+
+
+class Callback(object):
+    def __call__(self):
+        pass
+
+
+def fill(clock, n, rng):
+    # a queue of n future events, as left by a deep state tree
+    for _ in range(n):
+        clock.schedule(Callback(), event_time=1000.0 + rng.random() * 100.0)
+
+
+def bench(clock_class, n, reps=2000):
+    rng = random.Random(0)
+    clock = clock_class()
+    clock.now = lambda: 0.0
+    fill(clock, n, rng)
+    funcs = [Callback() for _ in range(reps)]
+
+    # schedule then unschedule a timed event (e.g., a state's end)
+    def sched_unsched():
+        for func in funcs:
+            clock.schedule(func, event_time=1000.0 + rng.random() * 100.0)
+        for func in funcs:
+            clock.unschedule(func)
+
+    # schedule and run an immediate event (e.g., child_enter_callback)
+    def sched_tick():
+        for func in funcs:
+            clock.schedule(func)
+            clock.tick()
+
+    t_unsched = min(timeit.repeat(sched_unsched, number=1, repeat=3))
+    t_tick = min(timeit.repeat(sched_tick, number=1, repeat=3))
+    return t_unsched / reps * 1e6, t_tick / reps * 1e6
+
+
+if __name__ == "__main__":
+    print("%8s %28s %28s" % ("", "schedule+unschedule (us)",
+                             "schedule+tick (us)"))
+    print("%8s %14s%14s %14s%14s" % ("queue", "list", "heap",
+                                      "list", "heap"))
+    for n in [10, 100, 1000, 10000]:
+        list_unsched, list_tick = bench(ListClock, n,
+                                        reps=200 if n >= 10000 else 2000)
+        heap_unsched, heap_tick = bench(Clock, n)
+        print("%8d %14.2f%14.2f %14.2f%14.2f" % (n, list_unsched,
+                                                  heap_unsched, list_tick,
+                                                  heap_tick))
@@ -0,0 +1,58 @@
+"""Benchmark of running a static trial loop with and without freeze.
+
+Runs the same Loop of trials, each a Serial and Parallel of Funcs, Waits,
+and a Log, once with Experiment.run(freeze=False) and once with
+freeze=True, twice each in turn, and reports the best time per trial
+spent in clock ticks (the state machine itself, not the waits between
+frames).
+
+    python benchmarks/bench_freeze.py
+
+"""
+from __future__ import print_function
+import time
+
+from smile.common import *
+from smile.clock import clock
+
+N_TRIALS = 1000
+
+
+def identity(value):
+    return value
+
+
+spent = [0.0]
+tick = clock.tick
+
+
+def timed_tick():
+    start = time.perf_counter()
+    tick()
+    spent[0] += time.perf_counter() - start
+
+
+clock.tick = timed_tick
+
+exp = Experiment(show_splash=False, fullscreen=False)
+with Loop([{"word": "w%d" % i, "n": i % 3} for i in range(N_TRIALS)]) as trial:
+    with Serial():
+        Func(identity, trial.i)
+        Wait(0.0)
+        with Parallel():
+            Func(identity, [trial.current["word"], trial.current["n"]])
+            Wait(0.0)
+        Func(identity, "constant")
+        Wait(0.0)
+        Log(name="trial", i=trial.i, word=trial.current["word"])
+
+times = {False: [], True: []}
+for freeze in [False, True, False, True]:
+    spent[0] = 0.0
+    exp.run(freeze=freeze)
+    times[freeze].append(spent[0] / N_TRIALS * 1e6)
+
+print("%d trials" % N_TRIALS)
+print("%12s %10s" % ("", "us/trial"))
+print("%12s %10.1f" % ("dynamic", min(times[False])))
+print("%12s %10.1f" % ("frozen", min(times[True])))
@@ -0,0 +1,101 @@
+"""Benchmark of computing Grating textures.
+
+Compares the vectorized smile.grating.grating_buffer and mask_buffer
+with the previous implementation (reproduced below), which computed one
+pixel at a time and recomputed the grating on every change of a
+property, and reports the largest difference between their pixels.
+Also times precomputing every variant of a session, after which a
+Grating only takes textures from the cache.
+
+    python benchmarks/bench_grating.py
+
+"""
+from __future__ import print_function
+from itertools import chain
+import math
+import timeit
+
+import numpy as np
+
+from smile.grating import (GratingTextureCache, grating_buffer, mask_buffer,
+                           _mask_envelope)
+
+
+def old_color(x, frequency, phase, contrast, color_one, color_two):
+    amp = ((contrast *
+            (0.5 + 0.5 * math.sin((x * math.pi / 180) *
+                                  frequency + phase))) +
+           (1.0 - contrast) / 2)
+    return (int((color_one[0] * amp + color_two[0] * (1.0 - amp))*255),
+            int((color_one[1] * amp + color_two[1] * (1.0 - amp))*255),
+            int((color_one[2] * amp + color_two[2] * (1.0 - amp))*255))
+
+
+def old_grating_buffer(frequency, contrast, color_one, color_two, phase=0.0):
+    period = int(round(360. / frequency))
+    return bytearray(list(chain.from_iterable(
+        [old_color(x, frequency, phase, contrast, color_one, color_two)
+         for x in range(period)])))
+
+
+def old_mask(envelope, width, height, std_dev, rx, ry):
+    dx = rx - (width / 2.)
+    dy = ry - (height / 2.)
+    if envelope == 'g':
+        transparency = math.exp(-0.5 * (dy / (std_dev * math.pi)) ** 2 -
+                                0.5 * (dx / (std_dev * math.pi)) ** 2)
+    elif envelope == 'l':
+        radius = math.sqrt(dx ** 2 + dy ** 2)
+        transparency = max(0, (0.5 * width - radius) / (0.5 * width))
+    elif envelope == 'c':
+        radius = math.sqrt(dx ** 2 + dy ** 2)
+        transparency = 0.0 if radius > 0.5 * width else 1.0
+    else:
+        transparency = 1.0
+    return 0, 0, 0, int(round((1 - transparency)*255))
+
+
+def old_mask_buffer(envelope, width, height, std_dev):
+    envelope = _mask_envelope(envelope)
+    return bytearray(list(chain.from_iterable(
+        [old_mask(envelope, width, height, std_dev, rx, ry)
+         for rx in range(int(width / 2))
+         for ry in range(int(height / 2))])))
+
+
+def max_difference(a, b):
+    return np.abs(np.frombuffer(bytes(a), dtype=np.uint8).astype(int) -
+                  np.frombuffer(bytes(b), dtype=np.uint8).astype(int)).max()
+
+
+def best_time(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1000
+
+
+print("%10s %6s %12s %12s %8s" % ("texture", "size", "per-pixel ms",
+                                  "vector ms", "max diff"))
+for frequency in [10, 20, 75]:
+    args = (frequency, 0.4, (0., 0., 1.), (1., 0., 0.), 1.0)
+    print("%10s %6d %12.3f %12.3f %8d" % (
+        "grating", int(round(360. / frequency)),
+        best_time(lambda: old_grating_buffer(*args), 100),
+        best_time(lambda: grating_buffer(*args), 100),
+        max_difference(old_grating_buffer(*args), grating_buffer(*args))))
+for envelope in ["Gaussian", "Linear", "Circular"]:
+    for width in [250, 500, 1000]:
+        args = (envelope, width, width, width / 20.)
+        number = 1 if width > 250 else 3
+        print("%10s %6d %12.3f %12.3f %8d" % (
+            envelope, width,
+            best_time(lambda: old_mask_buffer(*args), number),
+            best_time(lambda: mask_buffer(*args), number * 10),
+            max_difference(old_mask_buffer(*args), mask_buffer(*args))))
+
+# everything a session showing 20 contrasts needs, before it starts
+cache = GratingTextureCache()
+cache.precompute_trials([{"contrast": c} for c in np.linspace(0.05, 1., 20)],
+                        width=500, envelope="g")
+stats = cache.get_stats()
+print("precomputed %d textures (%d KiB) in %.1f ms" %
+      (stats["entries"], stats["bytes"] // 1024,
+       stats["synthesis_time"] * 1000))
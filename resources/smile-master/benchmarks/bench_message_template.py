@@ -0,0 +1,74 @@
+"""Micro-benchmark of encoding Elemem messages.
+
+Compares copying a message dictionary, setting its fields, and calling
+json.dumps (how the tasks built their messages before) against
+smile.message_template.MessageTemplate.encode, for a message without
+data fields and for a WORD message.
+
+    python benchmarks/bench_message_template.py
+
+"""
+from __future__ import print_function
+import copy
+import json
+import timeit
+
+from smile.message_template import MessageTemplate
+
+TRIALEND = {'type': 'TRIALEND', 'data': {}, 'id': 0, 'time': 0.0}
+WORD = {'type': 'WORD',
+        'data': {'word': 'WORD_PAIR', 'serialpos': 0, 'stim': False},
+        'id': 0,
+        'time': 0.0}
+
+
+def dumps_trialend(message_id, time):
+    message = TRIALEND.copy()
+    message['id'] = message_id
+    message['time'] = time
+    return (json.dumps(message) + '\n').encode('utf-8')
+
+
+def dumps_word(message_id, time, word, serialpos):
+    # deepcopy, since a shallow copy would share the data dictionary
+    message = copy.deepcopy(WORD)
+    message['id'] = message_id
+    message['time'] = time
+    message['data']['word'] = word
+    message['data']['serialpos'] = serialpos
+    return (json.dumps(message) + '\n').encode('utf-8')
+
+
+def dumps_word_shallow(message_id, time, word, serialpos):
+    # the old, shared-data path, for reference
+    message = WORD.copy()
+    message['id'] = message_id
+    message['time'] = time
+    message['data']['word'] = word
+    message['data']['serialpos'] = serialpos
+    return (json.dumps(message) + '\n').encode('utf-8')
+
+
+def bench(func, number=100000):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+if __name__ == "__main__":
+    trialend = MessageTemplate(TRIALEND)
+    word = MessageTemplate(WORD)
+    assert trialend.encode(id=7, time=1234) == dumps_trialend(7, 1234)
+    assert word.encode(id=7, time=1234, word='CAT/DOG', serialpos=3) == \
+        dumps_word(7, 1234, 'CAT/DOG', 3)
+
+    print("%-10s %14s %14s %14s" % ("message", "copy+dumps", "deepcopy+dumps",
+                                    "template"))
+    print("%-10s %14.2f %14s %14.2f" % (
+        "TRIALEND", bench(lambda: dumps_trialend(7, 1234)), "",
+        bench(lambda: trialend.encode(id=7, time=1234))))
+    print("%-10s %14.2f %14.2f %14.2f" % (
+        "WORD",
+        bench(lambda: dumps_word_shallow(7, 1234, 'CAT/DOG', 3)),
+        bench(lambda: dumps_word(7, 1234, 'CAT/DOG', 3)),
+        bench(lambda: word.encode(id=7, time=1234, word='CAT/DOG',
+                                  serialpos=3))))
+    print("(microseconds per message)")
@@ -0,0 +1,148 @@
+"""Benchmark of updating MovingDots frames.
+
+Compares the vectorized smile.moving_dots.DotField with persistent Point
+instructions against the previous implementation (reproduced below),
+which updated one Dot object per dot, flattened their locations, and
+rebuilt the canvas on every frame.  Reports the time per frame and the
+memory allocated by each frame (tracemalloc) for increasing numbers of
+dots.  The previous implementation drew all the dots with one Point
+instruction, which can not hold more than 8191 dots.
+
+    python benchmarks/bench_moving_dots.py
+
+"""
+from __future__ import print_function
+from itertools import chain
+import math
+import random
+import timeit
+import tracemalloc
+
+# smile must be imported before kivy
+from smile.moving_dots import DotField, _MAX_POINTS_PER_INSTRUCTION
+
+from kivy.uix.widget import Widget
+from kivy.graphics import Color, Point
+from kivy.graphics.vertex_instructions import GraphicException
+
+FRAME = 1 / 60.
+PARAMS = {"radius": 300, "direction": 0, "direction_variance": 0,
+          "speed": 100., "speed_variance": 0, "lifespan": .75,
+          "lifespan_variance": 0.5}
+
+
+def random_variance(base, variance):
+    return base + variance * (random.random() * 2.0 - 1.0)
+
+
+class Dot(object):
+    """One dot, as MovingDots kept them before DotField."""
+    def __init__(self, radius=100, direction=0, direction_variance=0.0,
+                 speed=1.0, speed_variance=0.0, lifespan=.02,
+                 lifespan_variance=0.0):
+        self.radius = radius
+        self.direction = direction
+        self.direction_variance = direction_variance
+        self.speed = speed
+        self.speed_variance = speed_variance
+        self.lifespan = lifespan
+        self.lifespan_variance = lifespan_variance
+        self.reset()
+
+    def update(self, passed_time):
+        self.current_time += passed_time
+        if self.current_time > self.total_time:
+            self.reset()
+            return self.x, self.y
+        self.x += self.velocity_x * passed_time
+        self.y += self.velocity_y * passed_time
+        if math.sqrt((self.x * self.x) + (self.y * self.y)) > self.radius:
+            self.reset()
+            return self.x, self.y
+        return self.x, self.y
+
+    def reset(self):
+        t = 2 * math.pi * random.random()
+        u = random.random() + random.random()
+        if u > 1:
+            r = 2 - u
+        else:
+            r = u
+        self.x = (self.radius * r * math.cos(t))
+        self.y = (self.radius * r * math.sin(t))
+        angle = random_variance(self.direction * math.pi / 180,
+                                self.direction_variance * math.pi / 180)
+        speed = random_variance(self.speed, self.speed_variance)
+        self.velocity_x = speed * math.cos(angle)
+        self.velocity_y = speed * math.sin(angle)
+        self.current_time = 0.0
+        self.total_time = random_variance(self.lifespan,
+                                          self.lifespan_variance)
+
+
+def object_frame(widget, dots):
+    bases = (widget.x + 4, widget.y + 4)
+    locs = [bases[i % 2] + p + 300
+            for i, p in enumerate(chain.from_iterable([d.update(FRAME)
+                                                       for d in dots]))]
+    widget.canvas.clear()
+    with widget.canvas:
+        Color(1., 1., 1., 1.)
+        Point(points=locs, pointsize=4)
+
+
+def make_array_frame(widget, num_dots):
+    field = DotField([(num_dots, PARAMS)])
+    chunks = [(2 * start,
+               2 * min(start + _MAX_POINTS_PER_INSTRUCTION, num_dots))
+              for start in range(0, num_dots, _MAX_POINTS_PER_INSTRUCTION)]
+    with widget.canvas:
+        Color(1., 1., 1., 1.)
+        instructions = [Point(points=[], pointsize=4) for chunk in chunks]
+
+    def array_frame():
+        field.update(FRAME)
+        points = field.get_points(widget.x + 4 + 300, widget.y + 4 + 300)
+        for point, (start, stop) in zip(instructions, chunks):
+            point.points = points[start:stop].tolist()
+    return array_frame
+
+
+def measure(frame, number):
+    # seconds per frame, and the peak memory allocated during a frame
+    # beyond what it keeps
+    frame()
+    seconds = min(timeit.repeat(frame, number=number, repeat=3)) / number
+    tracemalloc.start()
+    frame()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    frame()
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main():
+    print("%8s %14s %14s %14s %14s" % ("dots", "objects ms", "arrays ms",
+                                       "objects KiB", "arrays KiB"))
+    for num_dots in (100, 1000, 5000, 20000):
+        number = max(1, 20000 // num_dots)
+        object_widget = Widget()
+        dots = [Dot(**PARAMS) for i in range(num_dots)]
+        try:
+            object_time, object_peak = measure(
+                lambda: object_frame(object_widget, dots), number)
+            object_results = "%14.3f" % (object_time * 1000), \
+                "%14.1f" % (object_peak / 1024.)
+        except GraphicException:
+            object_results = "%14s" % "too many", "%14s" % "-"
+        array_time, array_peak = measure(
+            make_array_frame(Widget(), num_dots), number)
+        print("%8d %s %14.3f %s %14.1f" %
+              (num_dots, object_results[0], array_time * 1000,
+               object_results[1], array_peak / 1024.))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Benchmark of aligning a long session's pulses with the EEG.
+
+Simulates sync pulses every 5000 +/- 300 ms (and 50 ms bursts) over
+sessions of increasing length, with missed, displaced, and spurious EEG
+pulses and a drifting EEG clock, and times matching the pulses, fitting
+the clock model, and converting 100000 event times to samples with
+smile.pulse_alignment.
+
+    python benchmarks/bench_pulse_alignment.py
+
+"""
+from __future__ import print_function
+import time
+
+import numpy as np
+
+from smile.pulse_alignment import match_pulses, fit_alignment
+
+SAMPLERATE = 1000.
+
+
+def simulate(n_pulses, rng):
+    intervals = rng.normal(5000, 300, n_pulses - 1)
+    intervals[::500] = 50.
+    task_times = np.concatenate([[0], np.cumsum(intervals)])
+    seconds = task_times / 1000.
+    eeg_times = (1000. + seconds * SAMPLERATE * (1 + 30e-6) +
+                 2. * np.sin(seconds / 3000.) +
+                 rng.normal(0, 0.3, n_pulses))
+    eeg_times[rng.choice(n_pulses, n_pulses // 1000, replace=False)] += 40.
+    keep = rng.rand(n_pulses) > 0.02
+    spurious = rng.uniform(eeg_times[0], eeg_times[-1], n_pulses // 500)
+    eeg_samples = np.round(np.sort(np.concatenate([eeg_times[keep],
+                                                   spurious])))
+    return task_times, eeg_samples
+
+
+def main():
+    rng = np.random.RandomState(0)
+    print("%8s %8s %10s %10s %10s %10s" %
+          ("pulses", "hours", "match ms", "fit ms", "convert ms", "matched"))
+    for n_pulses in (1000, 10000, 30000, 60000):
+        task_times, eeg_samples = simulate(n_pulses, rng)
+        events = rng.uniform(task_times[0], task_times[-1], 100000)
+
+        start = time.perf_counter()
+        task_index, eeg_index = match_pulses(task_times, eeg_samples,
+                                             SAMPLERATE)
+        matched = time.perf_counter()
+        alignment = fit_alignment(task_times[task_index],
+                                  eeg_samples[eeg_index])
+        fitted = time.perf_counter()
+        alignment.to_samples(events)
+        converted = time.perf_counter()
+
+        print("%8d %8.1f %10.1f %10.1f %10.1f %10d" %
+              (n_pulses, task_times[-1] / 3600000.,
+               (matched - start) * 1000, (fitted - matched) * 1000,
+               (converted - fitted) * 1000, len(task_index)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Benchmark of evaluating Refs and propagating their changes.
+
+Compares compiled Refs (smile.ref) with the previous implementation
+(reproduced below), which evaluated each Ref by recursing through val,
+and called dep_changed recursively through every path from the Ref that
+changed.  Reports microseconds for:
+
+- eval: evaluating a chain of Refs with no callbacks, like the Refs in
+  the parameters of a state when it starts, e.g.,
+  trial.current['top_word'] + '/' + trial.current['bottom_word'] + ...
+- change: a change at the start of a chain with a callback on its end
+  that evaluates it, like a widget property following a Ref
+- ladder: the same for a chain of diamonds (two Refs each depending on
+  the Ref before them, and both used by the next), where the previous
+  implementation reaches the end by 2 ** depth paths
+
+    python benchmarks/bench_ref.py
+
+"""
+from __future__ import print_function
+import timeit
+import types
+
+from smile.ref import Ref, NotAvailable, NotAvailableError
+
+
+def old_val(obj):
+    try:
+        if isinstance(obj, Ref):
+            return old_eval(obj)
+        elif isinstance(obj, list):
+            return [old_val(value) for value in obj]
+        elif isinstance(obj, tuple):
+            return tuple(old_val(value) for value in obj)
+        elif isinstance(obj, dict):
+            return {old_val(key): old_val(value)
+                    for key, value in obj.items()}
+        elif isinstance(obj, slice):
+            return slice(old_val(obj.start), old_val(obj.stop),
+                         old_val(obj.step))
+        elif obj is NotAvailable:
+            raise NotAvailableError("'val' produced NotAvailable result.")
+        else:
+            return obj
+    except NotAvailableError:
+        raise NotAvailableError("val(%r) produced NotAvailable result" %
+                                repr(obj))
+
+
+def old_eval(ref):
+    if ref.cache_valid and len(ref.change_callbacks):
+        return ref.cache_value
+    value = old_val(old_val(ref.func)(*old_val(ref.pargs),
+                                      **old_val(ref.kwargs)))
+    if ref.use_cache:
+        ref.cache_value = value
+        ref.cache_valid = True
+    return value
+
+
+def old_dep_changed(ref):
+    ref.cache_valid = False
+    for func, pargs, kwargs in list(ref.change_callbacks):
+        if type(func) is types.MethodType and \
+           func.__func__ is Ref.dep_changed:
+            old_dep_changed(func.__self__)
+        else:
+            func(*pargs, **dict(kwargs))
+
+
+def make_chain(depth):
+    trial = {'top_word': 'dog', 'bottom_word': 'cat'}
+    leaf = Ref(lambda: trial)
+    ref = leaf['top_word']
+    for i in range(depth - 1):
+        ref = ref + '/' + leaf['bottom_word']
+    return leaf, ref
+
+
+def make_ladder(depth):
+    x = [0]
+    leaf = Ref(lambda: x[0])
+    ref = leaf
+    for i in range(depth):
+        ref = (ref + 1) + (ref * 2)
+    return leaf, ref
+
+
+def best_time(func, number):
+    try:
+        return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+    except RecursionError:
+        return None
+
+
+def print_times(name, depth, old, new):
+    if old is None:
+        print("%8s %6d %10s %12.1f %8s" % (name, depth, "too deep", new, "-"))
+    else:
+        print("%8s %6d %10.1f %12.1f %7.1fx" % (name, depth, old, new,
+                                               old / new))
+
+
+print("%8s %6s %10s %12s %8s" % ("", "depth", "old us", "compiled us",
+                                 "speedup"))
+for depth in [5, 20, 50, 100]:
+    leaf, ref = make_chain(depth)
+    print_times("eval", depth, best_time(lambda: old_eval(ref), 200),
+                best_time(lambda: ref.eval(), 200))
+
+for name, make, depths in [("change", make_chain, [5, 20, 50, 100]),
+                           ("ladder", make_ladder, [4, 8, 12])]:
+    for depth in depths:
+        times = []
+        for dep_changed, evaluate in [(old_dep_changed, old_eval),
+                                      (Ref.dep_changed, Ref.eval)]:
+            leaf, ref = make(depth)
+
+            def callback(ref=ref, evaluate=evaluate):
+                evaluate(ref)
+            ref.add_change_callback(callback)
+            evaluate(ref)
+            times.append(best_time(lambda: dep_changed(leaf), 50))
+            ref.remove_change_callback(callback)
+        print_times(name, depth, *times)
@@ -0,0 +1,105 @@
+"""Benchmark of cloning states as they are entered.
+
+Compares the copy-on-write clones of smile.state.StateBuilder._clone with
+the previous implementation (reproduced below), which copied the whole
+dictionary of the builder into each clone.  Every state of a trial of
+15 states is cloned and given the attributes enter sets, as one
+iteration of a Loop does, and the clones are kept until the end of the
+trial.  Reports the memory blocks and bytes still allocated at the end
+of the trial (tracemalloc), and the time per trial.
+
+    python benchmarks/bench_state_clone.py
+
+"""
+from __future__ import print_function
+import copy
+import timeit
+import tracemalloc
+
+from smile.common import *
+
+
+def old_clone(builder, parent):
+    state_class = type(builder)._state_class
+    new_clone = state_class.__new__(state_class, use_state_class=True)
+    new_clone.__dict__.update(builder.__dict__)
+    del new_clone.__dict__["_State__most_recently_entered_clone"]
+    for attr in builder._deepcopy_attrs:
+        setattr(new_clone, attr, copy.deepcopy(getattr(builder, attr)))
+    new_clone._active = False
+    new_clone._parent = parent
+    new_clone._ref_context = {builder: new_clone}
+    return new_clone
+
+
+def new_clone(builder, parent):
+    return builder._clone(parent)
+
+
+def enter(clone, start_time):
+    # the attributes State.enter sets, without scheduling anything or
+    # evaluating Refs, which needs a running experiment
+    clone._State__finalize_callbacks = []
+    clone._start_time = start_time
+    clone._enter_time = start_time
+    clone._started = False
+    clone._ended = False
+    clone._leave_time = None
+    clone._finalize_time = None
+    clone._active = True
+    clone._following_may_run = False
+    for name, value in clone._refs_for_init_attrs.items():
+        setattr(clone, name, value)
+    clone._end_time = None
+
+
+def iter_states(state):
+    yield state
+    for child in state.__dict__.get("_children", []):
+        for state in iter_states(child):
+            yield state
+
+
+def run_trial(clone, states):
+    clones = {None: None}
+    for state in states:
+        parent = clones[state.__dict__.get("_parent") if state is not states[0]
+                        else None]
+        clones[state] = clone(state, parent)
+        enter(clones[state], 0.0)
+    return clones
+
+
+exp = Experiment(show_splash=False, fullscreen=False)
+with Serial() as trial:
+    with Parallel():
+        stim = Label(text="dog", duration=1.0)
+        Rectangle(width=100, height=100, color="red", duration=1.0)
+    Wait(0.5, jitter=0.25)
+    with Parallel():
+        Label(text="+", duration=0.5)
+        Image(source="face.png", duration=0.5)
+    with If(stim.text == "dog"):
+        Func(print, "dog")
+    with Else():
+        Debug(text=stim.text)
+    Wait(until=stim.disappear_time["time"] != None)
+    Log(name="trial", word=stim.text, appear=stim.appear_time["time"])
+states = list(iter_states(trial))
+
+print("%d states per trial" % len(states))
+print("%8s %8s %10s %10s" % ("", "blocks", "bytes", "us/trial"))
+for name, clone in [("old", old_clone), ("new", new_clone)]:
+    run_trial(clone, states)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    clones = run_trial(clone, states)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    n_blocks = sum(stat.count_diff for stat in stats)
+    n_bytes = sum(stat.size_diff for stat in stats)
+    del clones
+    us = min(timeit.repeat(lambda: run_trial(clone, states), number=200,
+                           repeat=5)) / 200 * 1e6
+    print("%8s %8d %10d %10.1f" % (name, n_blocks, n_bytes, us))
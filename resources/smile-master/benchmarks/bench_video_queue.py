@@ -0,0 +1,108 @@
+"""Micro-benchmark of the SmileApp video change queue.
+
+Compares smile.main._VideoQueue against the previous sorted list
+(reproduced below) by scheduling thousands of widget appear/disappear
+changes spread over upcoming flips, cancelling some of them (states
+cancelled before they appear), and then draining the queue flip by flip
+the way SmileApp._idle_callback does.
+
+    python benchmarks/bench_video_queue.py
+
+"""
+from __future__ import print_function
+import random
+import timeit
+
+from smile.main import _VideoChange, _VideoQueue
+
+FLIP_INTERVAL = 1 / 60.
+
+
+class ListVideoQueue(object):
+    """The sorted list SmileApp used before _VideoQueue."""
+    def __init__(self):
+        self._queue = []
+
+    def push(self, new_video):
+        for n, video in enumerate(self._queue):
+            if video.flip_time > new_video.flip_time:
+                self._queue.insert(n, new_video)
+                break
+        else:
+            self._queue.append(new_video)
+
+    def cancel(self, video):
+        if not video.drawn:
+            try:
+                self._queue.remove(video)
+            except ValueError:
+                pass
+
+    def flip(self, next_flip_time):
+        pending_flip_time = None
+        for video in self._queue:
+            if video.flip_time < next_flip_time and \
+               (pending_flip_time is None or
+                video.flip_time == pending_flip_time):
+                video.update_cb()
+                video.drawn = True
+                pending_flip_time = video.flip_time
+            else:
+                break
+        for video in self._queue:
+            if video.drawn:
+                video.flipped = True
+            else:
+                break
+        while len(self._queue) and self._queue[0].flipped:
+            del self._queue[0]
+
+
+class HeapVideoQueue(_VideoQueue):
+    def flip(self, next_flip_time):
+        pending_flip_time = None
+        while True:
+            video = self.peek()
+            if video is not None and video.flip_time < next_flip_time and \
+               (pending_flip_time is None or
+                video.flip_time == pending_flip_time):
+                self.pop()
+                video.update_cb()
+                video.drawn = True
+                pending_flip_time = video.flip_time
+            else:
+                break
+        for video in self.take_drawn():
+            video.flipped = True
+
+
+def noop():
+    pass
+
+
+def bench(queue_class, n_changes, n_flips=600, cancel_frac=0.25):
+    rng = random.Random(0)
+    flip_times = [i * FLIP_INTERVAL for i in range(1, n_flips + 1)]
+    changes = [_VideoChange(noop, rng.choice(flip_times), None)
+               for _ in range(n_changes)]
+    cancelled = rng.sample(changes, int(n_changes * cancel_frac))
+
+    def run():
+        for video in changes:
+            video.drawn = video.flipped = video.cancelled = False
+        queue = queue_class()
+        for video in changes:
+            queue.push(video)
+        for video in cancelled:
+            queue.cancel(video)
+        for flip_time in flip_times:
+            queue.flip(flip_time + FLIP_INTERVAL / 2.)
+
+    return min(timeit.repeat(run, number=1, repeat=3)) * 1e3
+
+
+if __name__ == "__main__":
+    print("%10s %14s %14s" % ("changes", "list (ms)", "heap (ms)"))
+    for n in [100, 1000, 5000, 20000]:
+        print("%10d %14.2f %14.2f" % (n, bench(ListVideoQueue, n),
+                                      bench(HeapVideoQueue, n)))
@@ -0,0 +1,389 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 et:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the smile package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import os
+import csv
+import json
+import struct
+import zlib
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# Magic bytes at the start of a checkpoint journal
+_JOURNAL_MAGIC = b"SMILECJ1"
+
+# the two slots holding the number of committed records, each as
+# (count, crc32 of count), written alternately so one is always whole
+_POINTER = struct.Struct("<QI4x")
+_POINTER_OFFSETS = (len(_JOURNAL_MAGIC),
+                    len(_JOURNAL_MAGIC) + _POINTER.size)
+_LAYOUT = struct.Struct("<II")
+_LAYOUT_OFFSET = _POINTER_OFFSETS[1] + _POINTER.size
+
+
+def _pack_pointer(count):
+    count_bytes = struct.pack("<Q", count)
+    return _POINTER.pack(count, zlib.crc32(count_bytes) & 0xffffffff)
+
+
+def _unpack_pointer(data):
+    count, crc = _POINTER.unpack(data)
+    if zlib.crc32(struct.pack("<Q", count)) & 0xffffffff != crc:
+        return None
+    return count
+
+
+class CheckpointJournal(object):
+    """Append-only journal of fixed-size checkpoint records.
+
+    Every record has the same size, so the last one is found from the
+    number of committed records kept in the header, and resuming a
+    session reads the same few bytes no matter how long it has run.
+
+    Appending is atomic: the record is written and fsynced first, and
+    only then is the count in the header advanced.  The count alternates
+    between two checksummed slots, so if the power goes out while either
+    is being written, the journal still opens at the last record that
+    was fully committed.
+
+    With *background*, *append* only packs the record and a writer thread
+    commits it, so the fsyncs never hold up the thread running the
+    experiment.  Records are committed in the order they were appended,
+    and those waiting when the thread gets to them are written together
+    before the count is advanced past all of them.  *len*, *last*, and
+    indexing only see committed records; *flush* waits for every record
+    appended so far, and *close* commits what is left.  An error on the
+    writer thread is raised by every later call to *append*, *flush*,
+    or *close*, and no later record is committed.
+
+    Parameters
+    ----------
+    filename : string
+        The journal file. It is created if it does not exist.
+    fields : list (optional)
+        (name, format) pairs, one per field of a record, where the format
+        is a *struct* code such as 'i' (integer), 'd' (float), or '16s'
+        (string of up to 16 bytes).  Required to create a journal; an
+        existing journal keeps the fields it was created with.
+    background : boolean (optional)
+        Commit records on a writer thread. Defaults to False.
+
+    """
+    def __init__(self, filename, fields=None, background=False):
+        self._filename = filename
+        self._lock = threading.Lock()
+        self._error = None
+        self._queue = None
+        self._thread = None
+        if os.path.isfile(filename) and os.path.getsize(filename):
+            self._file = open(filename, "r+b")
+            self._read_header()
+        else:
+            if fields is None:
+                raise ValueError("fields are needed to create the "
+                                 "checkpoint journal %s" % filename)
+            self._set_fields(fields)
+            self._file = open(filename, "w+b")
+            self._write_header()
+        if background:
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run,
+                                            name="SMILE checkpoint journal")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _set_fields(self, fields):
+        self._fields = [(str(name), str(fmt)) for name, fmt in fields]
+        self._record = struct.Struct("<" +
+                                     "".join(fmt for name, fmt in
+                                             self._fields) + "I")
+
+    def _write_header(self):
+        spec = json.dumps(self._fields).encode("utf8")
+        self._data_offset = _LAYOUT_OFFSET + _LAYOUT.size + len(spec)
+        self._count = 0
+        self._slot = 0
+        self._file.write(_JOURNAL_MAGIC)
+        self._file.write(_pack_pointer(0))
+        self._file.write(_pack_pointer(0))
+        self._file.write(_LAYOUT.pack(self._record.size, len(spec)))
+        self._file.write(spec)
+        self._sync()
+
+    def _read_header(self):
+        header = self._file.read(_LAYOUT_OFFSET + _LAYOUT.size)
+        if header[:len(_JOURNAL_MAGIC)] != _JOURNAL_MAGIC:
+            self._file.close()
+            raise IOError("%r is not a checkpoint journal." % self._filename)
+        record_size, spec_size = _LAYOUT.unpack_from(header, _LAYOUT_OFFSET)
+        self._set_fields(json.loads(self._file.read(spec_size).decode("utf8")))
+        if self._record.size != record_size:
+            self._file.close()
+            raise IOError("%r has an unknown record layout." %
+                          self._filename)
+        self._data_offset = _LAYOUT_OFFSET + _LAYOUT.size + spec_size
+
+        # the slot with the higher valid count is the latest
+        counts = [(_unpack_pointer(header[offset:offset + _POINTER.size]),
+                   slot) for slot, offset in enumerate(_POINTER_OFFSETS)]
+        counts = [(count, slot) for count, slot in counts
+                  if count is not None]
+        self._count, self._slot = max(counts) if len(counts) else (0, 0)
+
+        # never trust a count past the end of the file
+        n_written = ((os.path.getsize(self._filename) - self._data_offset) //
+                     self._record.size)
+        self._count = min(self._count, max(n_written, 0))
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    @property
+    def filename(self):
+        return self._filename
+
+    @property
+    def fields(self):
+        return [name for name, fmt in self._fields]
+
+    def __len__(self):
+        return self._count
+
+    def _pack(self, values):
+        packed = []
+        for name, fmt in self._fields:
+            value = values.get(name)
+            if fmt.endswith("s"):
+                value = b"" if value is None else str(value).encode("utf8")
+            elif fmt in ("f", "d", "e"):
+                value = float("nan") if value is None else float(value)
+            elif fmt == "?":
+                value = bool(value)
+            else:
+                value = 0 if value is None else int(value)
+            packed.append(value)
+        body = self._record.pack(*(packed + [0]))[:-4]
+        return body + struct.pack("<I", zlib.crc32(body) & 0xffffffff)
+
+    def _unpack(self, data):
+        values = self._record.unpack(data)
+        if zlib.crc32(data[:-4]) & 0xffffffff != values[-1]:
+            return None
+        record = {}
+        for (name, fmt), value in zip(self._fields, values):
+            if fmt.endswith("s"):
+                value = value.rstrip(b"\0").decode("utf8", "replace")
+            record[name] = value
+        return record
+
+    def append(self, **values):
+        """Commit a record, given a value for each field by name.
+
+        Fields without a value are stored as 0 (empty for strings), and
+        strings longer than their field are cut off.  With *background*,
+        the record is committed later on the writer thread.
+        """
+        data = self._pack(values)
+        if self._queue is None:
+            self._commit([data])
+        else:
+            self._check_error()
+            self._queue.put(data)
+
+    def _commit(self, records):
+        with self._lock:
+            # the records must be on disk before the count points at them
+            self._file.seek(self._data_offset +
+                            self._count * self._record.size)
+            self._file.write(b"".join(records))
+            self._sync()
+
+            # the other slot keeps the previous count until this is synced
+            count = self._count + len(records)
+            slot = 1 - self._slot
+            self._file.seek(_POINTER_OFFSETS[slot])
+            self._file.write(_pack_pointer(count))
+            self._sync()
+            self._count = count
+            self._slot = slot
+
+    def _run(self):
+        while True:
+            # commit everything waiting at once
+            items = [self._queue.get()]
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [item for item in items if item is not None]
+            try:
+                if len(records) and self._error is None:
+                    self._commit(records)
+            except Exception as error:
+                self._error = error
+            finally:
+                for item in items:
+                    self._queue.task_done()
+            if len(records) < len(items):
+                return
+
+    def _check_error(self):
+        # re-raise errors from the writer thread on the calling thread,
+        # every time, since nothing is committed after one
+        if self._error is not None:
+            raise self._error
+
+    def flush(self):
+        """Block until every record appended so far is committed."""
+        if self._queue is not None:
+            self._queue.join()
+        self._check_error()
+
+    def __getitem__(self, index):
+        with self._lock:
+            if index < 0:
+                index += self._count
+            if not 0 <= index < self._count:
+                raise IndexError("checkpoint journal index out of range")
+            self._file.seek(self._data_offset + index * self._record.size)
+            return self._unpack(self._file.read(self._record.size))
+
+    def last(self):
+        """The last committed record as a dictionary, or None if empty."""
+        if not self._count:
+            return None
+        return self[-1]
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self[index]
+
+    def close(self):
+        """Commit any records still waiting and close the file."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._check_error()
+
+
+def _last_csv_row(csv_filename, block_size=4096):
+    # read blocks back from the end until they hold the whole last line,
+    # so only the tail of a long csv is read
+    with open(csv_filename, "rb") as f:
+        header = f.readline()
+        header_end = f.tell()
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        tail = b""
+        while position > header_end:
+            step = min(block_size, position - header_end)
+            position -= step
+            f.seek(position)
+            tail = f.read(step) + tail
+            if b"\n" in tail.rstrip(b"\r\n"):
+                break
+    last_line = tail.rstrip(b"\r\n").split(b"\n")[-1]
+    if not len(last_line.strip()):
+        return None
+    names, values = csv.reader([header.decode("utf8"),
+                                last_line.decode("utf8")])
+    return dict(zip(names, values))
+
+
+def read_last_checkpoint(journal_filename, csv_filename=None):
+    """The last checkpoint of a session, or None if there is none.
+
+    The journal is read if it holds any records.  Otherwise, the last row
+    of *csv_filename* is returned (e.g., the checkpoint.csv consolidated
+    from the logs of sessions run before they had a journal), with every
+    value as a string.
+
+    Parameters
+    ----------
+    journal_filename : string
+        The session's *CheckpointJournal*.
+    csv_filename : string (optional)
+        CSV with a header, read when the journal is missing or empty.
+
+    """
+    if os.path.isfile(journal_filename) and \
+       os.path.getsize(journal_filename):
+        journal = CheckpointJournal(journal_filename)
+        try:
+            last = journal.last()
+        finally:
+            journal.close()
+        if last is not None:
+            return last
+    if csv_filename is not None and os.path.isfile(csv_filename):
+        return _last_csv_row(csv_filename)
+    return None
+
+
+def compact_checkpoint_journal(filename, keep=1):
+    """Rewrite a journal with only its last *keep* records.
+
+    Resuming only needs the last record, so this trims the journal of a
+    long session.  The compacted journal is written to a temporary file
+    and renamed over the original, so it is never left half written.
+
+    Returns the number of records dropped.
+    """
+    journal = CheckpointJournal(filename)
+    try:
+        fields = journal._fields
+        n_records = len(journal)
+        records = [journal[index] for index in
+                   range(max(0, n_records - keep), n_records)]
+    finally:
+        journal.close()
+
+    tmp_filename = filename + ".tmp"
+    if os.path.exists(tmp_filename):
+        os.remove(tmp_filename)
+    compacted = CheckpointJournal(tmp_filename, fields)
+    try:
+        for record in records:
+            if record is not None:
+                compacted.append(**record)
+    finally:
+        compacted.close()
+    os.replace(tmp_filename, filename)
+    return n_records - len(records)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Show or compact SMILE checkpoint journals.")
+    parser.add_argument("journals", nargs="+")
+    parser.add_argument("--compact", action="store_true",
+                        help="keep only the last --keep records")
+    parser.add_argument("--keep", type=int, default=1)
+    args = parser.parse_args()
+
+    for filename in args.journals:
+        if args.compact:
+            dropped = compact_checkpoint_journal(filename, args.keep)
+            print("%s: dropped %d records" % (filename, dropped))
+        journal = CheckpointJournal(filename)
+        print("%s: %d records, last %r" % (filename, len(journal),
+                                             journal.last()))
+        journal.close()
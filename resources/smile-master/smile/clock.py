@@ -1,63 +1,196 @@
 from . import kivy_overrides
 import kivy.clock
+from heapq import heappush, heappop, heapify
+from itertools import count
 
 _get_time = kivy.clock._default_time
 _kivy_clock = kivy.clock.Clock
 
+# heap groups: events without a time always run before timed events
+_IMMEDIATE = 0
+_TIMED = 1
+
+# priority classes for scheduled events, video callbacks are never
+# deferred when a tick runs over its budget
+PRIORITY_VIDEO = 0
+PRIORITY_NORMAL = 1
+
 class _ClockEvent(object):
-    def __init__(self, clock, func, event_time, repeat_interval):
+    __slots__ = ("clock", "func", "event_time", "repeat_interval",
+                 "priority", "cancelled")
+
+    def __init__(self, clock, func, event_time, repeat_interval,
+                 priority=PRIORITY_NORMAL):
         self.clock = clock
         self.func = func
         self.event_time = event_time
         self.repeat_interval = repeat_interval
+        self.priority = priority
+        self.cancelled = False
 
 class Clock(object):
+    """Scheduler for the callbacks that drive the state machine.
+
+    Events live in a binary heap keyed on (group, event_time, sequence),
+    so scheduling and popping are O(log n).  Events scheduled without a
+    time run first, in the order they were scheduled, and timed events
+    with the same time also keep their scheduling order.  Unscheduling
+    only marks the events for a function as cancelled (found through a
+    map from function to its pending events); they are dropped when they
+    reach the top of the heap.
+
+    Each priority class has its own heap, and without a tick budget the
+    heaps are merged so events run in exactly the order described above.
+    With a budget (see *set_tick_budget*), once a tick has used it up
+    only video events keep running; everything else that is due rolls
+    over to the next tick.
+    """
     def __init__(self):
-        self._events = []
+        self._queues = [[], []]
+        self._pending = {}
+        self._unhashable = []
+        self._n_cancelled = 0
+        self._sequence = count()
+        self._tick_budget = None
+        self._overrun_callback = None
+        self._n_overruns = 0
 
     def now(self):
         return _get_time()
 
+    def set_tick_budget(self, budget=None, overrun_callback=None):
+        """Limit how long each *tick* runs non-video events.
+
+        Parameters
+        ----------
+        budget : float (optional)
+            Seconds per tick after which only video events run.  None
+            (the default) runs every due event in each tick.
+        overrun_callback : callable (optional)
+            Called as overrun_callback(duration, n_run, deferred) after a
+            tick that took longer than the budget, where *duration* is
+            the time spent in the tick, *n_run* the number of events run,
+            and *deferred* whether due events were left for the next tick.
+        """
+        self._tick_budget = budget
+        self._overrun_callback = overrun_callback
+
+    @property
+    def n_overruns(self):
+        """Number of ticks that ran over the tick budget."""
+        return self._n_overruns
+
+    def _next_entry(self, video_only):
+        # find the earliest live entry across the priority heaps
+        best = None
+        best_heap = None
+        for priority, heap in enumerate(self._queues):
+            if video_only and priority != PRIORITY_VIDEO:
+                break
+            while len(heap) and heap[0][3].cancelled:
+                heappop(heap)
+                self._n_cancelled -= 1
+            if len(heap) and (best is None or heap[0] < best):
+                best = heap[0]
+                best_heap = heap
+        return best, best_heap
+
+    def _is_due(self, entry, now):
+        return entry is not None and (entry[0] == _IMMEDIATE or
+                                      now >= entry[1])
+
     def tick(self):
-        #TODO: limit time spent in each tick?
         now = self.now()
-        while len(self._events):
-            event = self._events[0]
-            if event.event_time is None or now >= event.event_time:
-                del self._events[0]
-                if event.repeat_interval is not None:
-                    if event.event_time is None:
-                        event.event_time = now + event.repeat_interval
-                    else:
-                        event.event_time += event.repeat_interval
-                    self._schedule(event)
-                event.func()
-            else:
+        if self._tick_budget is None:
+            deadline = None
+        else:
+            deadline = now + self._tick_budget
+        over_budget = False
+        n_run = 0
+        while True:
+            # always run at least one event so nothing starves
+            if deadline is not None and not over_budget and n_run and \
+               self.now() >= deadline:
+                over_budget = True
+            entry, heap = self._next_entry(over_budget)
+            if not self._is_due(entry, now):
                 break
+            heappop(heap)
+            event = entry[3]
+            if event.repeat_interval is not None:
+                if event.event_time is None:
+                    event.event_time = now + event.repeat_interval
+                else:
+                    event.event_time += event.repeat_interval
+                self._push(event)
+            else:
+                self._forget(event)
+            event.func()
+            n_run += 1
+
+        if over_budget:
+            self._n_overruns += 1
+            if self._overrun_callback is not None:
+                deferred = self._is_due(self._next_entry(False)[0], now)
+                self._overrun_callback(self.now() - now, n_run, deferred)
 
     def usleep(self, usec):
         _kivy_clock.usleep(usec)
 
-    def _schedule(self, event):
-        for n, cmp_event in enumerate(self._events):
-            if ((event.event_time is None and
-                 cmp_event.event_time is not None) or
-                (event.event_time is not None and
-                 cmp_event.event_time is not None and
-                 event.event_time < cmp_event.event_time)):
-                self._events.insert(n, event)
-                break
+    def _push(self, event):
+        if event.event_time is None:
+            entry = (_IMMEDIATE, 0.0, next(self._sequence), event)
         else:
-            self._events.append(event)
+            entry = (_TIMED, event.event_time, next(self._sequence), event)
+        heappush(self._queues[event.priority], entry)
+
+    def _schedule(self, event):
+        self._push(event)
+        try:
+            self._pending.setdefault(event.func, []).append(event)
+        except TypeError:
+            self._unhashable.append(event)
+
+    def _forget(self, event):
+        # drop a finished event from the func -> events map
+        try:
+            pending = self._pending[event.func]
+        except KeyError:
+            return
+        except TypeError:
+            self._unhashable.remove(event)
+            return
+        pending.remove(event)
+        if not len(pending):
+            del self._pending[event.func]
 
     def schedule(self, func, event_delay=None, event_time=None,
-                 repeat_interval=None):
+                 repeat_interval=None, priority=PRIORITY_NORMAL):
         if event_delay is not None:
             event_time = self.now() + event_delay
-        self._schedule(_ClockEvent(self, func, event_time, repeat_interval))
+        self._schedule(_ClockEvent(self, func, event_time, repeat_interval,
+                                   priority))
         return func
 
     def unschedule(self, func):
-        self._events = [event for event in self._events if event.func != func]
+        try:
+            cancelled = self._pending.pop(func, [])
+        except TypeError:
+            cancelled = [event for event in self._unhashable
+                         if event.func == func]
+            self._unhashable = [event for event in self._unhashable
+                                if event.func != func]
+        for event in cancelled:
+            event.cancelled = True
+        self._n_cancelled += len(cancelled)
+
+        # rebuild the heaps once they are mostly tombstones
+        if self._n_cancelled > 64 and \
+           self._n_cancelled * 2 > sum(len(heap) for heap in self._queues):
+            for priority, heap in enumerate(self._queues):
+                heap = [entry for entry in heap if not entry[3].cancelled]
+                heapify(heap)
+                self._queues[priority] = heap
+            self._n_cancelled = 0
 
 clock = Clock()
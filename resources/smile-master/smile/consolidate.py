@@ -0,0 +1,419 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 et:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the smile package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import os
+import csv
+import json
+import heapq
+import shutil
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from .log import log2dl, _get_log_reader
+
+# name of the file in the log directory recording what was consolidated
+CONSOLIDATION_STATE_FILENAME = "consolidation_state.json"
+
+# name of the file in the log root recording which folders were consolidated
+CONSOLIDATION_MANIFEST_FILENAME = "consolidation_manifest.json"
+
+
+def _sort_key(log_time):
+    # records without a log_time go last
+    if log_time is None:
+        return (1, 0.0)
+    return (0, log_time)
+
+
+def _sort_log_file(log_filename, fieldnames, run_filename):
+    """Write the records of one log, sorted on log_time, to a run file.
+
+    Runs in a worker process. Returns the number of records.
+    """
+    rows = [(_sort_key(record.get("log_time")),
+             [record.get(name) for name in fieldnames])
+            for record in log2dl(log_filename)]
+    rows.sort(key=lambda row: row[0])
+    with open(run_filename, "wb") as f:
+        for row in rows:
+            pickle.dump(row, f, pickle.HIGHEST_PROTOCOL)
+    return len(rows)
+
+
+def _iter_run(run_filename):
+    with open(run_filename, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def get_log_files(log_directory, name):
+    """Filenames of the logs written by *Log(name=name)*, in order.
+
+    SMILE numbers them log_{name}_0.slog, log_{name}_1.slog, ..., and the
+    numbering stops at the first one missing.
+    """
+    filenames = []
+    while True:
+        filename = os.path.join(log_directory,
+                                "log_%s_%d.slog" % (name, len(filenames)))
+        if not os.path.isfile(filename):
+            return filenames
+        filenames.append(filename)
+
+
+def _load_state(state_filename):
+    if not os.path.isfile(state_filename):
+        return {}
+    with open(state_filename, "r") as f:
+        return json.load(f)
+
+
+def _save_state(state, state_filename):
+    # write then rename, so a crash never leaves a partial state file
+    tmp_filename = state_filename + ".tmp"
+    with open(tmp_filename, "w") as f:
+        json.dump(state, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, state_filename)
+
+
+def _append_runs(csv_filename, fieldnames, run_filenames):
+    # k-way merge of the sorted runs, appended to the csv as we go
+    if not os.path.isfile(csv_filename) or \
+       not os.path.getsize(csv_filename):
+        with open(csv_filename, "w", newline="") as f:
+            csv.writer(f).writerow(fieldnames)
+    n_rows = 0
+    with open(csv_filename, "a", newline="") as f:
+        writer = csv.writer(f)
+        for sort_key, row in heapq.merge(*map(_iter_run, run_filenames),
+                                         key=lambda row: row[0]):
+            writer.writerow(row)
+            n_rows += 1
+        f.flush()
+        os.fsync(f.fileno())
+    return n_rows
+
+
+def consolidate_logs(log_directory, file_dictionary, processes=None,
+                     state_filename=None):
+    """Append the records of a session's SMILE logs to CSV files.
+
+    For every name in *file_dictionary*, the records of all of the
+    log_{name}_{i}.slog files in *log_directory* are appended to that
+    name's CSV file, sorted on log_time.  The logs are read in parallel
+    by a pool of processes, each writing its log sorted to a temporary
+    run file, and the runs are merged and written to the CSV one row at a
+    time, so only one log per process is ever held in memory.
+
+    What has been appended is recorded in a state file in
+    *log_directory*.  Running again only appends logs that were not
+    appended before, and if a previous run stopped while writing a CSV,
+    the rows it had written are removed first, so no row is duplicated.
+
+    Parameters
+    ----------
+    log_directory : string
+        Directory holding the .slog files.
+    file_dictionary : dict
+        Maps each log name to (csv_filename, fieldnames). Fields missing
+        from a record are left empty.  A header is written to CSV files
+        that do not exist yet.
+    processes : integer (optional)
+        Number of worker processes, or 0 to read the logs in this process.
+        By default, one per CPU where workers are forked (e.g., Linux),
+        and 0 elsewhere: spawned workers (e.g., Windows) re-run the main
+        script, so only pass a count from code under
+        ``if __name__ == '__main__':``.
+    state_filename : string (optional)
+        Defaults to CONSOLIDATION_STATE_FILENAME in *log_directory*.
+
+    Returns a dictionary with the number of rows appended for each name.
+
+    """
+    if state_filename is None:
+        state_filename = os.path.join(log_directory,
+                                      CONSOLIDATION_STATE_FILENAME)
+    state = _load_state(state_filename)
+
+    # find the logs not yet appended for each name
+    pending = {}
+    for name in file_dictionary:
+        done = set(state.get(name, {}).get("files", []))
+        pending[name] = [filename for filename in
+                         get_log_files(log_directory, name) if
+                         os.path.basename(filename) not in done]
+
+    appended = {name: 0 for name in file_dictionary}
+    if not any(len(filenames) for filenames in pending.values()):
+        return appended
+
+    run_directory = tempfile.mkdtemp(prefix="smile_consolidate_")
+    try:
+        # sort every log into a run file, all names at once
+        runs = {}
+        jobs = []
+        for name, filenames in pending.items():
+            fieldnames = file_dictionary[name][1]
+            runs[name] = []
+            for filename in filenames:
+                run_filename = os.path.join(run_directory,
+                                            "run_%d" % len(jobs))
+                runs[name].append(run_filename)
+                jobs.append((filename, fieldnames, run_filename))
+        if processes is None and \
+           multiprocessing.get_start_method() != "fork":
+            processes = 0
+        if processes == 0:
+            for job in jobs:
+                _sort_log_file(*job)
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                for _ in executor.map(_sort_log_file, *zip(*jobs)):
+                    pass
+
+        # merge each name's runs onto the end of its csv
+        for name, (csv_filename, fieldnames) in file_dictionary.items():
+            if not len(pending[name]):
+                continue
+            name_state = state.setdefault(name, {"files": []})
+
+            # undo a write that was interrupted
+            if "offset" in name_state:
+                if os.path.isfile(csv_filename):
+                    with open(csv_filename, "r+b") as f:
+                        f.truncate(name_state["offset"])
+            elif os.path.isfile(csv_filename):
+                name_state["offset"] = os.path.getsize(csv_filename)
+            else:
+                name_state["offset"] = 0
+            _save_state(state, state_filename)
+
+            appended[name] = _append_runs(csv_filename, fieldnames,
+                                          runs[name])
+
+            name_state["files"].extend(os.path.basename(filename) for
+                                       filename in pending[name])
+            del name_state["offset"]
+            _save_state(state, state_filename)
+    finally:
+        shutil.rmtree(run_directory, ignore_errors=True)
+
+    return appended
+
+
+def consolidate_and_move_logs(log_directory, new_log_directory,
+                              file_dictionary, processes=None):
+    """Consolidate a SMILE log folder, then move its files elsewhere.
+
+    The logs are consolidated (see *consolidate_logs*) where they are,
+    and only moved to *new_log_directory* once that succeeded, so a
+    failed consolidation leaves *log_directory* as it was to be tried
+    again.  The state file is moved last, along with the logs, so a move
+    that was interrupted is finished on the next call.  If
+    *log_directory* is gone or empty but *new_log_directory* exists
+    (e.g., its files were moved before being consolidated), the logs are
+    consolidated from *new_log_directory* instead.
+
+    Parameters
+    ----------
+    log_directory : string
+        Directory holding the .slog files.
+    new_log_directory : string
+        Directory to move the files to. Created if it does not exist.
+    file_dictionary : dict
+        As in *consolidate_logs*.
+    processes : integer (optional)
+        As in *consolidate_logs*.
+
+    Returns a dictionary with the number of rows appended for each name.
+
+    """
+    if not os.path.isdir(log_directory) or not os.listdir(log_directory):
+        if os.path.isdir(new_log_directory):
+            return consolidate_logs(new_log_directory, file_dictionary,
+                                    processes=processes)
+
+    appended = consolidate_logs(log_directory, file_dictionary,
+                                processes=processes)
+
+    filenames = sorted(os.listdir(log_directory),
+                       key=lambda filename:
+                       filename == CONSOLIDATION_STATE_FILENAME)
+    if not os.path.isdir(new_log_directory):
+        os.makedirs(new_log_directory)
+    for filename in filenames:
+        os.replace(os.path.join(log_directory, filename),
+                   os.path.join(new_log_directory, filename))
+    return appended
+
+
+def get_log_subject_session(log_directory, names=None):
+    """Subject and session logged in a SMILE log folder.
+
+    The logs are read until the first record with both a *subject* and a
+    *session* field.
+
+    Parameters
+    ----------
+    log_directory : string
+        Directory holding the .slog files.
+    names : list (optional)
+        Log names to look in, in order.  Defaults to every .slog file in
+        *log_directory*, in alphabetical order.
+
+    Returns (subject, session), or None if no record has both fields.
+    """
+    if names is None:
+        filenames = sorted(os.path.join(log_directory, filename) for
+                           filename in os.listdir(log_directory) if
+                           filename.endswith(".slog"))
+    else:
+        filenames = [filename for name in names for
+                     filename in get_log_files(log_directory, name)]
+    for filename in filenames:
+        try:
+            reader = _get_log_reader(filename)
+        except (IOError, ValueError):
+            continue
+        try:
+            for record in reader:
+                if record.get("subject") is not None and \
+                   record.get("session") is not None:
+                    return str(record["subject"]), str(record["session"])
+        except (EOFError, IOError, ValueError):
+            # truncated log from a crashed run
+            pass
+        finally:
+            reader.close()
+    return None
+
+
+def _consolidate_session(consolidate_folder, folders, subject, session):
+    """Consolidate the folders of one session in order.
+
+    Runs in a worker process. Returns (folder, result, error) for each
+    folder, stopping at the first that fails.
+    """
+    results = []
+    for folder, log_directory in folders:
+        try:
+            result = consolidate_folder(log_directory, subject, session)
+        except Exception as error:
+            results.append((folder, None, repr(error)))
+            break
+        results.append((folder, result, None))
+    return results
+
+
+def batch_consolidate(log_root, consolidate_folder, names=None,
+                      processes=None, manifest_filename=None):
+    """Consolidate every SMILE log folder under *log_root*.
+
+    Each folder in *log_root* (e.g., the datetime folders SMILE writes to
+    data/<experiment>/<subject>/) is matched to the subject and session
+    it logged (see *get_log_subject_session*) and handed to
+    *consolidate_folder*.  Sessions are consolidated in parallel, one
+    worker process each, and the folders of a session in the order of
+    their names (i.e., the order they were recorded).  Folders that
+    were consolidated are recorded in a manifest in *log_root*, so
+    running again only consolidates new folders.  Folders that do not
+    log a subject and session, or whose consolidation raised an
+    exception, are left out of the manifest and tried again next time,
+    as are the later folders of a session with a folder that failed.
+
+    Parameters
+    ----------
+    log_root : string
+        Directory holding the SMILE log folders.
+    consolidate_folder : function
+        Called as consolidate_folder(log_directory, subject, session).
+        It runs in a worker process, so it must be a module level
+        function.  What it returns is stored in the manifest, so it
+        should be JSON serializable (e.g., the result of
+        *consolidate_logs*).
+    names : list (optional)
+        Log names to read the subject and session from.
+    processes : integer (optional)
+        Number of worker processes, or 0 to consolidate in this process.
+        Defaults as in *consolidate_logs*.
+    manifest_filename : string (optional)
+        Defaults to CONSOLIDATION_MANIFEST_FILENAME in *log_root*.
+
+    Returns a dictionary with an entry for each folder tried in this run,
+    holding its *subject*, *session*, and either the *result* or, if it
+    failed or could not be matched, an *error* message.
+
+    """
+    if manifest_filename is None:
+        manifest_filename = os.path.join(log_root,
+                                         CONSOLIDATION_MANIFEST_FILENAME)
+    manifest = _load_state(manifest_filename)
+
+    # match the new folders to their subject and session
+    processed = {}
+    jobs = []
+    for folder in sorted(os.listdir(log_root)):
+        log_directory = os.path.join(log_root, folder)
+        if folder in manifest or not os.path.isdir(log_directory):
+            continue
+        subject_session = get_log_subject_session(log_directory, names)
+        if subject_session is None:
+            processed[folder] = {"subject": None, "session": None,
+                                 "error": "no subject and session logged"}
+        else:
+            jobs.append((folder, log_directory) + subject_session)
+
+    # folders of the same session append to the same files, so each
+    # session's folders are consolidated in order by a single worker
+    sessions = {}
+    for folder, log_directory, subject, session in jobs:
+        sessions.setdefault((subject, session), []).append((folder,
+                                                            log_directory))
+
+    def _record(subject, session, results):
+        for folder, result, error in results:
+            processed[folder] = {"subject": subject, "session": session}
+            if error is None:
+                processed[folder]["result"] = result
+                manifest[folder] = processed[folder]
+            else:
+                processed[folder]["error"] = error
+        _save_state(manifest, manifest_filename)
+
+    if processes is None and \
+       multiprocessing.get_start_method() != "fork":
+        processes = 0
+    if processes == 0:
+        for (subject, session), folders in sessions.items():
+            _record(subject, session,
+                    _consolidate_session(consolidate_folder, folders,
+                                         subject, session))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = {executor.submit(_consolidate_session,
+                                       consolidate_folder, folders,
+                                       subject, session): (subject, session)
+                       for (subject, session), folders in sessions.items()}
+            # record each session as soon as it is done
+            for future in as_completed(futures):
+                subject, session = futures[future]
+                _record(subject, session, future.result())
+
+    return processed
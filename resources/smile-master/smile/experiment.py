@@ -29,7 +29,8 @@ import kivy.clock
 from .state import Serial, AutoFinalizeState, Wait
 from .ref import Ref
 from .clock import clock
-from .log import LogWriter, log2csv
+from .log import LogWriter, LogSink, get_log_writer, log2csv
+from .frame_timing import format_frame_timing_summary
 from .event import event_time
 from .scale import scale
 from . import version
@@ -308,6 +309,34 @@ class Experiment(object):
     background_color : string (default = 'BLACK')
         If given a string color name, see colors in video.py, the
         background of the window will be set to that color
+    log_format : string (default = None)
+        The format of the .slog files written by states, either "pickle"
+        (a gzipped pickle stream, the default) or "columnar" (chunked
+        columns with an index for loading selected columns and time
+        ranges). *Log* and *Record* states can override this.
+    async_logging : boolean (default = False)
+        If True, log records are written and fsynced by a background
+        thread instead of the thread running the experiment. Records are
+        committed to disk in groups, see *log_commit_records* and
+        *log_commit_interval*.
+    log_commit_records : integer (default = 64)
+        With *async_logging*, commit once this many records are waiting.
+    log_commit_interval : float (default = 0.5)
+        With *async_logging*, commit no later than this many seconds
+        after a record was written.
+    tick_budget : float (default = None)
+        Seconds the scheduler may spend running due callbacks on each
+        pass of the main loop. Once spent, only video callbacks keep
+        running and the rest wait for the next pass. None means no limit.
+    tick_overrun_callback : callable (default = None)
+        Called as tick_overrun_callback(duration, n_run, deferred) each
+        time a pass runs over *tick_budget*, see *Clock.set_tick_budget*.
+    frame_timing : boolean (default = False)
+        If True, record how long each frame spent ticking the clock,
+        dispatching input, drawing, and flipping, along with any missed
+        flips, to frame_timing_0.bin in the session directory (see
+        *smile.frame_timing.read_frame_timing*). A summary is printed
+        when the experiment finishes and kept in *frame_timing_summary*.
 
     Properties
     ----------
@@ -359,7 +388,11 @@ class Experiment(object):
                  background_color=None, name="SMILE", debug=False, Touch=None,
                  save_private_computer_info=False, data_dir=None,
                  working_dir=None,
-                 local_crashlog=False, cmd_traceback=True, show_splash=True):
+                 local_crashlog=False, cmd_traceback=True, show_splash=True,
+                 log_format=None, async_logging=False,
+                 log_commit_records=64, log_commit_interval=0.5,
+                 tick_budget=None, tick_overrun_callback=None,
+                 frame_timing=False):
 
         self._sysinfo = {}
         self._sysinfo['DEFAULTDATADIR'] = kivy_overrides._get_config()['default_data_dir']
@@ -374,6 +407,16 @@ class Experiment(object):
 
         self._cmd_traceback = cmd_traceback
         self._local_crashlog = local_crashlog
+        self._log_format = log_format
+        if async_logging:
+            self._log_sink = LogSink(commit_records=log_commit_records,
+                                     commit_interval=log_commit_interval)
+        else:
+            self._log_sink = None
+        self._tick_budget = tick_budget
+        self._tick_overrun_callback = tick_overrun_callback
+        self._frame_timing = frame_timing
+        self._frame_timing_summary = None
         self._save_private_computer_info = save_private_computer_info
         self._platform = platform
         self._exp_name = name
@@ -484,6 +527,9 @@ class Experiment(object):
         self._reserved_data_filenames_lock = threading.Lock()
         self._state_loggers = {}
         self._root_state.begin_log()
+        if self._app is not None and self._app.frame_timer is not None:
+            self._app.frame_timer.set_filename(
+                self.reserve_data_filename("frame_timing", "bin"))
         return self._subject_dir
 
     def clean_path(self, file_path):
@@ -614,7 +660,9 @@ class Experiment(object):
         else:
             title = "state_" + state_class_name
             filename = self.reserve_data_filename(title, "slog")
-            logger = LogWriter(filename)
+            logger = get_log_writer(filename, self._log_format)
+            if self._log_sink is not None:
+                logger = self._log_sink.get_writer(logger)
             self._state_loggers[state_class_name] = filename, logger
         return filename
 
@@ -627,14 +675,16 @@ class Experiment(object):
                 log2csv(filename, csv_filename)
         self._state_loggers = {}
 
+        # everything is written, so stop the log writer thread
+        if self._log_sink is not None:
+            self._log_sink.close()
+
     def write_to_state_log(self, state_class_name, record):
         self._state_loggers[state_class_name][1].write_record(record)
 
     def _flush_state_loggers(self):
-        # Fix this for py3
         for key in self._state_loggers.keys():
-            self._state_loggers[key][1]._file.flush()
-            os.fsync(self._state_loggers[key][1]._file)
+            self._state_loggers[key][1].flush()
 
     def _write_sysinfo(self, save_private=None, filename=None):
         if filename is None:
@@ -650,6 +700,29 @@ class Experiment(object):
         sysinfo_logger.write_record(data=logged_info)
         sysinfo_logger.close()
 
+    def log_barrier(self, timeout=None):
+        """Wait until every queued log record has been written and
+        committed to disk.  Does nothing without *async_logging*.
+        """
+        if self._log_sink is not None:
+            self._log_sink.barrier(timeout)
+
+    @property
+    def log_stats(self):
+        """Queue depth and commit latency counters of the background log
+        writer, or None without *async_logging*.
+        """
+        if self._log_sink is None:
+            return None
+        return self._log_sink.get_stats()
+
+    @property
+    def frame_timing_summary(self):
+        """Frame timing summary from the last run with *frame_timing*, see
+        *smile.frame_timing.summarize_frame_timing*.
+        """
+        return self._frame_timing_summary
+
     @property
     def screen(self):
         return self._screen
@@ -698,11 +771,18 @@ class Experiment(object):
         self._root_state.end_log(self._csv)
         self.close_state_loggers(self._csv)
 
-    def run(self, trace=False):
+    def run(self, trace=False, freeze=False):
         self._current_state = None
         if trace:
             self._root_state.tron()
 
+        # precompute what entering and logging each state needs (see
+        # State.freeze), or drop the plans of an earlier frozen run
+        if freeze:
+            self._root_state.freeze()
+        else:
+            self._root_state.thaw()
+
         # open all the logs
         # (this will call begin_log for entire state machine)
         self._root_state.begin_log()
@@ -734,6 +814,8 @@ class Experiment(object):
             # clean up the logs
             self._root_state.end_log(self._csv)
             self.close_state_loggers(self._csv)
+            if self._app is not None and self._app.frame_timer is not None:
+                self._app.frame_timer.close()
 
             exc_type, exc_value, exc_traceback = sys.exc_info()
             tra =  traceback.format_exception(exc_type, exc_value,
@@ -762,6 +844,14 @@ class Experiment(object):
         self._root_state.end_log(self._csv)
         self.close_state_loggers(self._csv)
 
+        # report on frame timing
+        if self._app.frame_timer is not None:
+            self._app.frame_timer.close()
+            self._frame_timing_summary = self._app.frame_timer.summary()
+            for line in format_frame_timing_summary(
+                    self._frame_timing_summary):
+                print(line)
+
 
 class Set(AutoFinalizeState):
     """How to set a variable during Experimental Runtime.
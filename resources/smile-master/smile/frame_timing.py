@@ -0,0 +1,260 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 et:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the smile package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import os
+import sys
+import json
+import struct
+from array import array
+
+# Magic bytes at the start of a frame timing sidecar file
+_FRAME_TIMING_MAGIC = b"SMILEFT1"
+
+# One value per flip, in the order they are stored
+FRAME_TIMING_FIELDS = ("flip_time",          # time of the flip
+                       "flip_duration",      # time spent in the flip call
+                       "blocking",           # 1.0 if the flip blocked
+                       "missed_flips",       # refreshes skipped before it
+                       "draw_duration",      # kivy clock ticks and draw
+                       "tick_duration",      # smile clock ticks since last
+                       "n_ticks",            # idle loop passes since last
+                       "dispatch_time",      # last input dispatch
+                       "dispatch_duration")  # input dispatch since last
+
+# Fields summarized by percentile, with the frame interval
+_SUMMARY_FIELDS = ("interval", "flip_duration", "draw_duration",
+                   "tick_duration", "dispatch_duration")
+
+
+class FrameTimer(object):
+    """Ring buffer of per-frame timings from the SMILE idle loop.
+
+    Every value is stored in a preallocated array, so recording a frame
+    does not allocate.  Every *dump_every* frames the frames not yet
+    written are appended to a binary sidecar file, which
+    *read_frame_timing* loads back.
+
+    Parameters
+    ----------
+    filename : string (optional)
+        The sidecar file to write.  It is opened at the first dump, so it
+        can still be changed with *set_filename* before then.  If None,
+        only the frames in the ring buffer are kept.
+    flip_interval : float
+        Expected seconds between flips, used to count missed flips.
+    size : integer (default = 1024)
+        Number of frames held in the ring buffer.
+    dump_every : integer (optional)
+        Frames between dumps to the sidecar file, at most *size*.
+        Defaults to half of *size*.
+
+    """
+    def __init__(self, filename=None, flip_interval=1/60., size=1024,
+                 dump_every=None):
+        self._filename = filename
+        self._file = None
+        self.flip_interval = flip_interval
+        self._size = size
+        if dump_every is None:
+            dump_every = size // 2
+        self._dump_every = max(1, min(dump_every, size))
+        self._columns = [array('d', [0.0]) * size
+                         for _ in FRAME_TIMING_FIELDS]
+        self._n_frames = 0
+        self._n_dumped = 0
+        self._last_flip_time = None
+        self._reset_frame()
+
+    def _reset_frame(self):
+        self._tick_duration = 0.0
+        self._n_ticks = 0
+        self._draw_duration = 0.0
+        self._dispatch_time = 0.0
+        self._dispatch_duration = 0.0
+
+    @property
+    def filename(self):
+        return self._filename
+
+    @property
+    def n_frames(self):
+        return self._n_frames
+
+    def set_filename(self, filename):
+        """Write the sidecar to *filename*, moving what was dumped so far."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.rename(self._filename, filename)
+            self._file = open(filename, "ab")
+        self._filename = filename
+
+    def add_tick(self, duration):
+        self._tick_duration += duration
+        self._n_ticks += 1
+
+    def add_dispatch(self, dispatch_time, duration):
+        self._dispatch_time = dispatch_time
+        self._dispatch_duration += duration
+
+    def add_draw(self, duration):
+        self._draw_duration += duration
+
+    def add_flip(self, flip_time, duration, blocking):
+        # count the refreshes that went by without a flip
+        if self._last_flip_time is None:
+            missed = 0
+        else:
+            missed = max(0, int(round((flip_time - self._last_flip_time) /
+                                      self.flip_interval)) - 1)
+        self._last_flip_time = flip_time
+
+        # fill in the next row of the ring buffer
+        i = self._n_frames % self._size
+        columns = self._columns
+        columns[0][i] = flip_time
+        columns[1][i] = duration
+        columns[2][i] = 1.0 if blocking else 0.0
+        columns[3][i] = missed
+        columns[4][i] = self._draw_duration
+        columns[5][i] = self._tick_duration
+        columns[6][i] = self._n_ticks
+        columns[7][i] = self._dispatch_time
+        columns[8][i] = self._dispatch_duration
+        self._n_frames += 1
+        self._reset_frame()
+
+        if self._n_frames - self._n_dumped >= self._dump_every:
+            self.dump()
+
+    def _rows(self, start, stop):
+        # values from frame start up to frame stop, for each field
+        size = self._size
+        start = max(start, stop - size)
+        first = start % size
+        last = first + (stop - start)
+        if last <= size:
+            return [column[first:last] for column in self._columns]
+        return [column[first:] + column[:last - size]
+                for column in self._columns]
+
+    def dump(self):
+        """Append the frames not yet written to the sidecar file."""
+        n_rows = self._n_frames - self._n_dumped
+        if self._filename is None or not n_rows:
+            return
+        if self._file is None:
+            self._file = open(self._filename, "wb")
+            names = json.dumps(FRAME_TIMING_FIELDS).encode("utf8")
+            self._file.write(_FRAME_TIMING_MAGIC)
+            self._file.write(struct.pack("<I", len(names)))
+            self._file.write(names)
+        self._file.write(struct.pack("<I", n_rows))
+        for values in self._rows(self._n_dumped, self._n_frames):
+            if sys.byteorder == "big":
+                values.byteswap()
+            self._file.write(values.tobytes())
+        self._file.flush()
+        self._n_dumped = self._n_frames
+
+    def close(self):
+        self.dump()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def get_frames(self):
+        """Dictionary of arrays holding every recorded frame.
+
+        Frames come from the sidecar file when there is one, otherwise
+        only the frames still in the ring buffer are returned.
+        """
+        if self._filename is not None and self._n_dumped:
+            self.dump()
+            return read_frame_timing(self._filename)
+        return dict(zip(FRAME_TIMING_FIELDS,
+                        self._rows(0, self._n_frames)))
+
+    def summary(self):
+        """Summarize the frame timings.
+
+        Returns a dictionary with the number of frames, the total number
+        of missed flips, and for the frame interval and each duration
+        (in seconds) a dictionary with its p50, p99, and max.
+        """
+        return summarize_frame_timing(self.get_frames())
+
+
+def _percentile(values, p):
+    # nearest-rank percentile of sorted values
+    if not len(values):
+        return None
+    rank = int(round(p / 100. * (len(values) - 1)))
+    return values[rank]
+
+
+def summarize_frame_timing(frames):
+    """Summarize frame timings loaded with *read_frame_timing*."""
+    flip_times = frames["flip_time"]
+    summary = {"n_frames": len(flip_times),
+               "missed_flips": int(sum(frames["missed_flips"]))}
+    for name in _SUMMARY_FIELDS:
+        if name == "interval":
+            values = [b - a for a, b in zip(flip_times[:-1], flip_times[1:])]
+        else:
+            values = frames[name]
+        values = sorted(values)
+        summary[name] = {"p50": _percentile(values, 50),
+                         "p99": _percentile(values, 99),
+                         "max": values[-1] if len(values) else None}
+    return summary
+
+
+def format_frame_timing_summary(summary):
+    """Lines of text describing a frame timing summary, times in ms."""
+    lines = ["Frame timing: %d frames, %d missed flips" %
+             (summary["n_frames"], summary["missed_flips"])]
+    for name in _SUMMARY_FIELDS:
+        stats = summary[name]
+        if stats["max"] is None:
+            continue
+        lines.append("  %-18s p50 %7.3f  p99 %7.3f  max %7.3f ms" %
+                     (name, stats["p50"] * 1000., stats["p99"] * 1000.,
+                      stats["max"] * 1000.))
+    return lines
+
+
+def read_frame_timing(filename):
+    """Load a frame timing sidecar file.
+
+    Returns a dictionary mapping each field name to an array of values,
+    one per frame.
+    """
+    with open(filename, "rb") as f:
+        if f.read(len(_FRAME_TIMING_MAGIC)) != _FRAME_TIMING_MAGIC:
+            raise ValueError("%s is not a frame timing file" % filename)
+        n_bytes, = struct.unpack("<I", f.read(4))
+        names = json.loads(f.read(n_bytes).decode("utf8"))
+        frames = {name: array('d') for name in names}
+        while True:
+            header = f.read(4)
+            if len(header) < 4:
+                break
+            n_rows, = struct.unpack("<I", header)
+            block = array('d')
+            data = f.read(n_rows * len(names) * block.itemsize)
+            if len(data) < n_rows * len(names) * block.itemsize:
+                # partial dump at the end of a crashed session
+                break
+            block.frombytes(data)
+            if sys.byteorder == "big":
+                block.byteswap()
+            for i, name in enumerate(names):
+                frames[name].extend(block[i * n_rows:(i + 1) * n_rows])
+    return frames
@@ -5,20 +5,309 @@
 #
 # ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
 
-from .video import WidgetState
+from .video import WidgetState, normalize_color_spec
 from kivy.uix.widget import Widget
 from kivy.properties import NumericProperty, ListProperty, StringProperty
-from kivy.graphics import Rectangle, BindTexture, Callback
+from kivy.graphics import Rectangle, Callback
 from kivy.graphics.texture import Texture
 from kivy.graphics.opengl import glBlendFunc, GL_SRC_ALPHA
 from kivy.graphics.opengl import GL_ONE_MINUS_SRC_ALPHA
 from kivy.graphics.opengl import GL_ONE_MINUS_DST_ALPHA
+import json
 import math
-from itertools import chain
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
 
+# trial values precompute_trials takes as Grating parameters
+GRATING_PARAMETERS = ("envelope", "frequency", "std_dev", "contrast",
+                      "color_one", "color_two", "width", "height")
 
-# cache so we don't regenerate masks
-_mask_cache = {}
+
+def get_period(frequency):
+    """Width in pixels of the grating texture, one period of the sine."""
+    return int(round(360. / frequency))
+
+
+def _mask_envelope(envelope):
+    envelope = envelope[0].lower() if envelope else ""
+    if envelope not in ("g", "l", "c"):
+        return "u"
+    return envelope
+
+
+def grating_buffer(frequency, contrast=1.0, color_one=(1., 1., 1.),
+                   color_two=(0., 0., 0.), phase=0.0):
+    """Pixels of one period of the grating as rgb bytes.
+
+    The sine wave oscillates between *color_one* and *color_two*, and
+    *contrast* scales it around their midpoint.
+    """
+    x = np.arange(get_period(frequency))
+    amp = ((contrast *
+            (0.5 + 0.5 * np.sin((x * math.pi / 180) * frequency + phase))) +
+           (1.0 - contrast) / 2)[:, None]
+    rgb = (np.asarray(color_one[:3], dtype=float) * amp +
+           np.asarray(color_two[:3], dtype=float) * (1.0 - amp)) * 255
+    return np.clip(np.trunc(rgb), 0, 255).astype(np.uint8).tobytes()
+
+
+def mask_buffer(envelope, width, height, std_dev=None):
+    """Pixels of the bottom left quadrant of the mask as rgba bytes.
+
+    Only the alpha is set, from 0 where the grating shows to 255 where
+    the background shows.  The quadrant is mirrored into the other three
+    by the texture wrap.
+
+    - Gaussian: the grating fades out with the distance from the center,
+                with *std_dev* controlling how quickly
+    - Linear: the grating fades out linearly to the edge of the circle
+    - Circular: the grating is cut off at the edge of the circle
+    - anything else: no mask
+
+    """
+    dx = (np.arange(int(width / 2)) - (width / 2.))[:, None]
+    dy = (np.arange(int(height / 2)) - (height / 2.))[None, :]
+    envelope = _mask_envelope(envelope)
+    if envelope == "g":
+        transparency = np.exp(-0.5 * (dy / (std_dev * math.pi)) ** 2 -
+                              0.5 * (dx / (std_dev * math.pi)) ** 2)
+    elif envelope == "l":
+        radius = np.sqrt(dx ** 2 + dy ** 2)
+        transparency = np.maximum(0, (0.5 * width - radius) / (0.5 * width))
+    elif envelope == "c":
+        radius = np.sqrt(dx ** 2 + dy ** 2)
+        transparency = (radius <= 0.5 * width).astype(float)
+    else:
+        transparency = np.ones((dx.shape[0], dy.shape[1]))
+
+    rgba = np.zeros(transparency.shape + (4,), dtype=np.uint8)
+    rgba[..., 3] = np.round((1 - transparency) * 255)
+    return rgba.tobytes()
+
+
+class _GratingEntry(object):
+    __slots__ = ("buf", "size", "colorfmt", "texture")
+
+    def __init__(self, buf, size, colorfmt):
+        self.buf = buf
+        self.size = size
+        self.colorfmt = colorfmt
+        self.texture = None
+
+
+class GratingTextureCache(object):
+    """LRU cache of the grating and mask textures of *Grating* states.
+
+    Grating textures are keyed on the frequency, contrast, and colors, and
+    mask textures on the envelope, size, and (for Gaussian masks) std_dev,
+    so every *Grating* showing the same variant shares them.  The phase is
+    not part of the key, as *Grating* applies it by shifting the texture
+    coordinates.  The pixels of the variants in a list of trials can be
+    computed before the experiment runs with *precompute* or
+    *precompute_trials*; the textures themselves have to be created on
+    the thread running the experiment, so that is done the first time a
+    *Grating* shows them.  Once the pixels add up to more than
+    *max_bytes*, the least recently used variants are dropped.
+
+    Parameters
+    ----------
+    max_bytes : integer (default = 64 MB)
+        Budget for the cached pixels.
+
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._n_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0,
+                       "misses": 0,
+                       "precomputed": 0,
+                       "evictions": 0,
+                       "synthesis_time": 0.0,
+                       "upload_time": 0.0}
+
+    def _grating_key(self, frequency, contrast, color_one, color_two):
+        return ("grating", float(frequency), float(contrast),
+                tuple(float(c) for c in color_one[:3]),
+                tuple(float(c) for c in color_two[:3]))
+
+    def _mask_key(self, envelope, width, height, std_dev):
+        envelope = _mask_envelope(envelope)
+        if envelope != "g":
+            # only the Gaussian mask depends on std_dev
+            std_dev = None
+        else:
+            std_dev = float(std_dev)
+        return ("mask", envelope, float(width), float(height), std_dev)
+
+    def _synthesize(self, key):
+        start = time.perf_counter()
+        if key[0] == "grating":
+            frequency, contrast, color_one, color_two = key[1:]
+            entry = _GratingEntry(grating_buffer(frequency, contrast,
+                                                 color_one, color_two),
+                                  (get_period(frequency), 1), "rgb")
+        else:
+            envelope, width, height, std_dev = key[1:]
+            entry = _GratingEntry(mask_buffer(envelope, width, height,
+                                              std_dev),
+                                  (int(width / 2), int(height / 2)), "rgba")
+        with self._lock:
+            self._stats["synthesis_time"] += time.perf_counter() - start
+        return entry
+
+    def _add(self, key, entry):
+        # add synthesized pixels, evicting the least recently used ones
+        with self._lock:
+            old_entry = self._entries.get(key)
+            if old_entry is not None:
+                return old_entry
+            self._entries[key] = entry
+            self._n_bytes += len(entry.buf)
+            # the new entry is last, so it is never dropped
+            while self._n_bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, old_entry = self._entries.popitem(last=False)
+                self._n_bytes -= len(old_entry.buf)
+                self._stats["evictions"] += 1
+            return entry
+
+    def _get_texture(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+            else:
+                self._stats["misses"] += 1
+        if entry is None:
+            entry = self._add(key, self._synthesize(key))
+        if entry.texture is None:
+            start = time.perf_counter()
+            texture = Texture.create(size=entry.size,
+                                     colorfmt=entry.colorfmt,
+                                     bufferfmt='ubyte')
+            texture.blit_buffer(entry.buf, colorfmt=entry.colorfmt,
+                                bufferfmt='ubyte')
+            if key[0] == "grating":
+                # one period, repeated to fill the rectangle
+                texture.wrap = 'repeat'
+            else:
+                # one quadrant, mirrored into the other three
+                texture.wrap = 'mirrored_repeat'
+                texture.mag_filter = 'nearest'
+            entry.texture = texture
+            with self._lock:
+                self._stats["upload_time"] += time.perf_counter() - start
+        return entry.texture
+
+    def get_grating_texture(self, frequency, contrast, color_one, color_two):
+        """Texture of one period of the grating.
+
+        Must be called from the thread running the experiment.
+        """
+        return self._get_texture(self._grating_key(frequency, contrast,
+                                                   color_one, color_two))
+
+    def get_mask_texture(self, envelope, width, height, std_dev):
+        """Texture of the bottom left quadrant of the mask.
+
+        Must be called from the thread running the experiment.
+        """
+        return self._get_texture(self._mask_key(envelope, width, height,
+                                                std_dev))
+
+    def precompute(self, width, height=None, envelope='g', frequency=20,
+                   std_dev=None, contrast=1.0, color_one=(1., 1., 1., 1.),
+                   color_two=(0., 0., 0., 0.)):
+        """Compute the pixels of a *Grating* variant ahead of time.
+
+        The parameters are those of *Grating*, with the same defaults;
+        *height* defaults to *width*.  Any phase is covered, so it is not
+        a parameter.  Returns the number of textures that were computed
+        (0 if they were already cached).
+        """
+        if height is None:
+            height = width
+        if std_dev is None:
+            std_dev = (width / 2) * 0.1
+        keys = [self._grating_key(frequency, contrast,
+                                  normalize_color_spec(color_one),
+                                  normalize_color_spec(color_two)),
+                self._mask_key(envelope, width, height, std_dev)]
+        n_computed = 0
+        for key in keys:
+            with self._lock:
+                cached = key in self._entries
+            if not cached:
+                self._add(key, self._synthesize(key))
+                n_computed += 1
+        with self._lock:
+            self._stats["precomputed"] += n_computed
+        return n_computed
+
+    def precompute_trials(self, trials, **defaults):
+        """Compute the pixels of every *Grating* variant in a list of
+        trials.
+
+        Parameters
+        ----------
+        trials : list or string
+            Trials (e.g., a list of dictionaries of trial values, nested
+            lists of blocks of them are fine) or the filename of a JSON
+            file holding them.  Every dictionary with any of
+            *GRATING_PARAMETERS* as keys is a variant, with its values for
+            them.
+        **defaults
+            *precompute* parameters of the variants that the trials do not
+            set (e.g., width=250).
+
+        Returns the list of the parameters of the variants.
+        """
+        if isinstance(trials, str):
+            with open(trials, "r") as f:
+                trials = json.load(f)
+        variants = []
+        seen = set()
+        stack = [trials]
+        while len(stack):
+            value = stack.pop()
+            if isinstance(value, dict):
+                if any(name in value for name in GRATING_PARAMETERS):
+                    params = dict(defaults)
+                    params.update((name, value[name]) for name in
+                                  GRATING_PARAMETERS if name in value)
+                    variant = repr(sorted(params.items()))
+                    if variant not in seen:
+                        seen.add(variant)
+                        variants.append(params)
+                stack.extend(reversed(list(value.values())))
+            elif isinstance(value, (list, tuple)):
+                stack.extend(reversed(value))
+        for params in variants:
+            self.precompute(**params)
+        return variants
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._n_bytes = 0
+
+    def get_stats(self):
+        """Hit, miss, precompute, and eviction counts, the seconds spent
+        synthesizing pixels and creating textures, and the entries and
+        bytes cached.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._n_bytes
+        return stats
+
+
+grating_cache = GratingTextureCache()
 
 
 @WidgetState.wrap
@@ -55,6 +344,16 @@ class Grating(Widget):
         transparency and smaller values create smaller grating on screen due to
         less transparency.
 
+    The textures are shared through *smile.grating.grating_cache*, and
+    changing the phase only shifts them, so a drifting grating never
+    computes pixels.  To compute the other variants (e.g., each contrast)
+    before the experiment runs:
+
+    ::
+
+        from smile.grating import grating_cache
+        grating_cache.precompute_trials(trials, width=250, envelope='g')
+
     """
 
     envelope = StringProperty('g')
@@ -74,10 +373,11 @@ class Grating(Widget):
         self._texture = None
         self._mask_texture = None
         self._period = None
+        self._grating = None
 
         self.bind(envelope=self._update_texture,
                   std_dev=self._update_texture,
-                  phase=self._update_texture,
+                  phase=self._update_phase,
                   color_one=self._update_texture,
                   color_two=self._update_texture,
                   frequency=self._update_texture,
@@ -86,89 +386,39 @@ class Grating(Widget):
                   contrast=self._update_texture)
         self._update_texture()
 
-    def _calc_gaussian_mask(self, rx, ry):
-        '''Performs the calculation for the mask either Gaussian, linear, or circular.
-        The function creates the bottom left quadrant of the mask, then mirrors
-        and repeats the texture 3 times in the top left, top right, and bottom
-        left quadrants'''
-        dx = rx - (self.width / 2.)   # horizontal center of Grating
-        dy = ry - (self.height / 2.)  # vertical center of Grating
-
-        # Gaussian Gabor stimuli calculations
-        transparency = math.exp(-0.5 *
-                                (dy / (self.std_dev * math.pi)) ** 2 -
-                                0.5 *
-                                (dx / (self.std_dev * math.pi)) ** 2)
-
-        return 0, 0, 0, int(round((1 - transparency) * 255))  # 0 is no alpha
-
-    def _calc_linear_mask(self, rx, ry):
-        dx = rx - (self.width / 2.)   # horizontal center of Grating
-        dy = ry - (self.height / 2.)  # vertical center of Grating
-        radius = math.sqrt(dx ** 2 + dy ** 2)
-
-        transparency =\
-            max(0, (0.5 * self.width - radius) / (0.5 * self.width))
-
-        return 0, 0, 0, int(round((1 - transparency)*255))  # 0 is no alpha
-
-    def _calc_circular_mask(self, rx, ry):
-        dx = rx - (self.width / 2.)   # horizontal center of Grating
-        dy = ry - (self.height / 2.)  # vertical center of Grating
-        radius = math.sqrt(dx ** 2 + dy ** 2)
-        if (radius > 0.5 * self.width):
-            transparency = 0.0
-        else:
-            transparency = 1.0
-        return 0, 0, 0, int(round((1 - transparency)*255))  # 0 is no alpha
+    def _update_texture(self, *pargs):
+        '''Updates textures by getting them from the grating cache'''
 
-    def _calc_undefined_mask(self, rx, ry):
-        transparency = 1.0
-        # Return
-        return 0, 0, 0, int(round((1 - transparency)*255))  # 0 is no alpha
+        self._update_grating()
+        self._update_mask()
+        self._update()
 
-    def _calc_color(self, x):
-        '''Performs the calculation for the grating behind the mask
+    def _get_tex_coords(self):
+        '''Texture coordinates of the grating rectangle
 
-        This works by creating one period of a sin wave, then using
-        tex_coords, a repeat function not residing in this function to
-        fill the rectangle with the grating
+        The grating texture holds one period of the sin wave at zero
+        phase, repeated to fill the rectangle, and the phase shifts it
+        by the matching fraction of the period.
 
         '''
+        shift = self.phase * 180. / (math.pi * self.frequency) / self._period
+        shift %= 1.0
+        return (shift, 0, shift + self.width / self._period,
+                0, shift + self.width / self._period,
+                self.height, shift, self.height)
 
-        # Creation of the sin wave for the grating texture
-        amp = ((self.contrast *
-                (0.5 + 0.5 * math.sin((x * math.pi / 180) *
-                                      self.frequency + self.phase))) +
-               (1.0 - self.contrast) / 2)
-
-        # RGB color return
-        return (int((self.color_one[0] * amp + self.color_two[0] *
-                     (1.0 - amp))*255),
-                int((self.color_one[1] * amp + self.color_two[1] *
-                     (1.0 - amp))*255),
-                int((self.color_one[2] * amp + self.color_two[2] *
-                     (1.0 - amp))*255))
-
-    def _update_texture(self, *pargs):
-        '''Updates textures by calling update functions'''
-
-        self._update_grating()
-        if self._mask_texture is None or \
-           self.size != self._prev_size or \
-           self.std_dev != self._prev_std_dev:
-            self._update_mask()
-            self._prev_size = self.size
-            self._prev_std_dev = self.std_dev
-        self._update()
+    def _update_phase(self, *pargs):
+        '''Shifts the grating without recomputing its texture'''
+        if self._grating is not None:
+            self._grating.tex_coords = self._get_tex_coords()
 
     def _update(self, *pargs):
         '''Updates the drawling of the textures on screen
 
         The function mirror repeats the mask 3 times in the top left,
         top right and bottom left quadrant to increase
-        efficiency. Also it repeats the sin wave, created in the
-        _calc_color function to fill the rectangle with the sin wave
+        efficiency. Also it repeats the sin wave, created in
+        grating_buffer, to fill the rectangle with the sin wave
         based grating.
 
         '''
@@ -189,13 +439,11 @@ class Grating(Widget):
             mask.tex_coords = 0, 0, 2, 0, 2, 2, 0, 2
 
             # draw the grating
-            grating = Rectangle(size=self.size, pos=self.pos,
-                                texture=self._texture)
+            self._grating = Rectangle(size=self.size, pos=self.pos,
+                                      texture=self._texture)
 
             # repeats the grating to fill the texture rectangle
-            grating.tex_coords = (0, 0, self.width / self._period,
-                                  0, self.width / self._period,
-                                  self.height, 0, self.height)
+            self._grating.tex_coords = self._get_tex_coords()
 
         # clean up the blending
         with self.canvas.after:
@@ -204,102 +452,27 @@ class Grating(Widget):
     def _update_grating(self, *args):
         '''Update grating variables
 
-        The function calls the _calc_color function to create the
-        grating texture which is layered behind the mask.
+        The grating texture, which is layered behind the mask, is
+        computed by grating_buffer the first time each frequency,
+        contrast, and pair of colors is used.
 
         '''
         # calculate the num needed for period
-        self._period = int(round(360. / self.frequency))
-
-        # make new texture
-        self._texture = Texture.create(size=(self._period, 1),
-                                       colorfmt='rgb',
-                                       bufferfmt='ubyte')
-
-        # fill the buffer for the texture
-        grating_buf = list(chain.from_iterable([self._calc_color(x)
-                                                for x in range(self._period)]))
-
-        # make an array from the buffer
-        grating_arr = bytearray(grating_buf)
-
-        # blit the array to the texture
-        self._texture.blit_buffer(grating_arr, colorfmt='rgb',
-                                  bufferfmt='ubyte')
-
-        # set it to repeat
-        self._texture.wrap = 'repeat'
-        BindTexture(texture=self._texture, index=0)
+        self._period = get_period(self.frequency)
+        self._texture = grating_cache.get_grating_texture(
+            self.frequency, self.contrast, self.color_one, self.color_two)
 
     def _update_mask(self, *args):
         '''Update Mask variables
 
-        The function calls the mask creating function. Also, it stores
-        masks in a cache, for later use to increase function
-        efficiency.
+        The mask texture is half the width and height, and is
+        reflected to completely cover the grating texture.  It is
+        computed by mask_buffer the first time each envelope, size, and
+        std_dev is used.
 
         '''
-
-        # creation of texture, half the width and height, will be reflected to
-        # completely cover the grating texture
-        self._mask_texture = Texture.create(size=(self.width / 2,
-                                                  self.height / 2),
-                                            colorfmt='rgba',
-                                            bufferfmt='ubyte')
-
-        # generate a unique mask id for cache lookup
-        mask_id = 'e%s_w%d_h%d_sd%f' % (self.envelope[0].lower(),
-                                        self.width, self.height,
-                                        self.std_dev)
-        global _mask_cache
-
-        try:
-            # see if we've already created this mask
-            mask_arr = _mask_cache[mask_id]
-        except KeyError:
-            # set mask (this is the slow part)
-            if self.envelope[0].lower() == 'g':
-                mask_buf =\
-                    list(chain.from_iterable([
-                        self._calc_gaussian_mask(rx, ry)
-                        for rx in range(int(self.width / 2))
-                        for ry in range(int(self.height / 2))]))
-            elif self.envelope[0].lower() == 'l':
-                mask_buf =\
-                    list(chain.from_iterable([
-                        self._calc_linear_mask(rx, ry)
-                        for rx in range(int(self.width / 2))
-                        for ry in range(int(self.height / 2))]))
-            elif self.envelope[0].lower() == 'c':
-                mask_buf =\
-                    list(chain.from_iterable([
-                        self._calc_circular_mask(rx, ry)
-                        for rx in range(int(self.width / 2))
-                        for ry in range(int(self.height / 2))]))
-            else:
-                mask_buf =\
-                    list(chain.from_iterable([
-                        self._calc_undefined_mask(rx, ry)
-                        for rx in range(int(self.width / 2))
-                        for ry in range(int(self.height / 2))]))
-
-            # turn into an array
-            mask_arr = bytearray(mask_buf)
-
-            # print mask_arr
-            # add it to the cache
-            _mask_cache[mask_id] = mask_arr
-
-        # blit it
-        self._mask_texture.blit_buffer(mask_arr, colorfmt='rgba',
-                                       bufferfmt='ubyte')
-
-        # mask is mirrored and repeated
-        self._mask_texture.wrap = 'mirrored_repeat'
-
-        # mask is set to foremost texture
-        self._mask_texture.mag_filter = 'nearest'
-        BindTexture(texture=self._mask_texture, index=1)
+        self._mask_texture = grating_cache.get_mask_texture(
+            self.envelope, self.width, self.height, self.std_dev)
 
     def _set_blend_func(self, instruction):
         '''Controller for the Gabor blending to the background color
@@ -10,6 +10,18 @@
 import gzip
 import csv
 import os
+import sys
+import json
+import zlib
+import struct
+import threading
+import time
+from array import array
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 try:
     import cPickle as pickle
@@ -33,6 +45,7 @@ class LogWriter(object):
 
     def __init__(self, filename, protocol=3):
         self._file = gzip.open(filename, "wb")
+        self._protocol = protocol
         self._pickler = pickle.Pickler(self._file, protocol=protocol)
         self._pickler.fast = True
 
@@ -48,9 +61,26 @@ class LogWriter(object):
         # data must be a dict
         if not isinstance(data, dict):
             raise ValueError("data to log must be a dict instance.")
+        # unpack values an AsyncLogWriter pickled when they were queued
+        if any(isinstance(value, _Pickled) for value in data.values()):
+            data = dict((key, pickle.loads(value))
+                        if isinstance(value, _Pickled) else (key, value)
+                        for key, value in data.items())
         self._pickler.dump(data)
         self._pickler.memo.clear()
 
+    def flush(self, sync=True):
+        """Push any buffered records to disk.
+
+        Parameters
+        ----------
+        sync : boolean
+            Whether to also fsync the file so the records survive a crash.
+        """
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
     def close(self):
         self._file.close()
 
@@ -113,6 +143,870 @@ class LogReader(object):
         self.close()
 
 
+# Magic bytes identifying the columnar format (gzip files start with 1f 8b)
+_COLUMNAR_MAGIC = b"SMILECL1"
+_CHUNK_MAGIC = b"CHNK"
+_FOOTER_MAGIC = b"FOOT"
+
+# Suffix of the journal holding flushed records that are not in a chunk yet
+_JOURNAL_SUFFIX = ".journal"
+
+# Row states stored at the start of every column block
+_ROW_MISSING = 0
+_ROW_NONE = 1
+_ROW_VALUE = 2
+
+_INT64_MIN = -2**63
+_INT64_MAX = 2**63 - 1
+
+
+class _Pickled(bytes):
+    """Marker for values that were pickled as soon as they were written."""
+    pass
+
+
+def _snapshot_record(data, protocol):
+    """Copy scalars and pickle everything else right away, so later changes
+    to the caller's objects can't leak into the log.
+    """
+    row = {}
+    for key, value in data.items():
+        if value is None or type(value) in (bool, int, float, str, _Pickled):
+            row[key] = value
+        else:
+            row[key] = _Pickled(pickle.dumps(value, protocol=protocol))
+    return row
+
+
+def _to_little_endian(arr):
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr
+
+
+def _column_kind(values):
+    """Pick the narrowest column type that round-trips every value."""
+    if not len(values):
+        return "?"
+    types = set(type(v) for v in values)
+    if types == {bool}:
+        return "?"
+    if types == {int} and \
+       all(_INT64_MIN <= v <= _INT64_MAX for v in values):
+        return "q"
+    if types == {float}:
+        return "d"
+    if types == {str}:
+        return "s"
+    return "p"
+
+
+def _encode_column(values, protocol):
+    """Encode one column of a chunk as (kind, uncompressed bytes)."""
+    states = bytearray(len(values))
+    present = []
+    for i, v in enumerate(values):
+        if v is _Missing:
+            states[i] = _ROW_MISSING
+        elif v is None:
+            states[i] = _ROW_NONE
+        else:
+            states[i] = _ROW_VALUE
+            present.append(v)
+
+    kind = _column_kind(present)
+    if kind == "?":
+        payload = bytes(bytearray(present))
+    elif kind in ("q", "d"):
+        payload = _to_little_endian(array(kind, present)).tobytes()
+    else:
+        if kind == "s":
+            blobs = [v.encode("utf-8") for v in present]
+        else:
+            blobs = [v if isinstance(v, _Pickled)
+                     else pickle.dumps(v, protocol=protocol)
+                     for v in present]
+        lengths = _to_little_endian(array("Q", [len(b) for b in blobs]))
+        payload = lengths.tobytes() + b"".join(blobs)
+    return kind, bytes(states) + payload
+
+
+def _decode_column(kind, data, n_rows):
+    """Decode a column block into a list of values (_Missing for absent)."""
+    states = bytearray(data[:n_rows])
+    payload = data[n_rows:]
+    n_present = sum(1 for s in states if s == _ROW_VALUE)
+
+    if kind == "?":
+        present = [bool(b) for b in bytearray(payload[:n_present])]
+    elif kind in ("q", "d"):
+        arr = array(kind)
+        arr.frombytes(payload)
+        present = _to_little_endian(arr).tolist()
+    else:
+        lengths = array("Q")
+        lengths.frombytes(payload[:8 * n_present])
+        lengths = _to_little_endian(lengths)
+        present = []
+        pos = 8 * n_present
+        for length in lengths:
+            blob = payload[pos:pos + length]
+            pos += length
+            if kind == "s":
+                present.append(blob.decode("utf-8"))
+            else:
+                present.append(pickle.loads(blob))
+
+    values = []
+    present = iter(present)
+    for s in states:
+        if s == _ROW_VALUE:
+            values.append(next(present))
+        elif s == _ROW_NONE:
+            values.append(None)
+        else:
+            values.append(_Missing)
+    return values
+
+
+class _MissingType(object):
+    """Placeholder for a column a record did not have."""
+    def __repr__(self):
+        return "_Missing"
+
+_Missing = _MissingType()
+
+
+def is_columnar_log(filename):
+    """Return True if filename was written by a *ColumnarLogWriter*."""
+    with open(filename, "rb") as f:
+        return f.read(len(_COLUMNAR_MAGIC)) == _COLUMNAR_MAGIC
+
+
+class ColumnarLogWriter(object):
+    """An object that writes .slog files in a chunked, columnar layout.
+
+    Records are buffered in memory and written out in chunks.  Each
+    chunk stores every column as its own zlib-compressed block of typed
+    values (bool, int64, float64, utf-8 text, or pickled objects for
+    anything else), along with the min and max *log_time* of its rows.
+    When the writer is closed a footer indexing the chunk and column
+    offsets is appended, so *ColumnarLogReader* can load only the
+    columns and time ranges it needs.  A file that was never closed
+    (e.g., after a crash) can still be read by scanning the chunks.
+
+    Flushing does not cut a chunk.  The records that are not in a chunk
+    yet are appended to a journal next to the file (the filename plus
+    ".journal"), which is emptied whenever a chunk is written and
+    removed when the writer is closed.  Reading a file that was never
+    closed picks up the journaled records after the chunks.
+
+    The file keeps the .slog extension and *log2dl*/*log2csv* detect
+    the format automatically.
+
+    Parameters
+    ----------
+    filename : string
+        The filename that you would like to write to. Must end in .slog.
+    chunk_size : int
+        The number of records to buffer before writing a chunk.
+    protocol : int
+        The pickle protocol to use for non-scalar values. Defaults to 3.
+    compresslevel : int
+        The zlib compression level for each column block.
+    time_column : string
+        The column whose min/max are stored in the index for time
+        range queries.
+
+    """
+    def __init__(self, filename, chunk_size=1024, protocol=3,
+                 compresslevel=6, time_column="log_time"):
+        self._filename = filename
+        self._chunk_size = chunk_size
+        self._protocol = protocol
+        self._compresslevel = compresslevel
+        self._time_column = time_column
+        self._file = open(filename, "wb")
+        self._file.write(_COLUMNAR_MAGIC)
+        self._rows = []
+        self._index = []
+        self._n_records = 0
+        self._journal = None
+        self._n_journaled = 0
+        self._synced = True
+
+    def write_record(self, data):
+        """Call this funciton to write a single row to the .slog file.
+
+        Parameters
+        ----------
+        data : dict
+            This is a dictionary where the keys are the
+            field names that you are writing out to the .slog file.
+        """
+        # data must be a dict
+        if not isinstance(data, dict):
+            raise ValueError("data to log must be a dict instance.")
+
+        self._rows.append(_snapshot_record(data, self._protocol))
+        self._n_records += 1
+        if len(self._rows) >= self._chunk_size:
+            self._write_chunk()
+
+    def _write_chunk(self):
+        if not len(self._rows):
+            return
+        rows = self._rows
+        self._rows = []
+
+        # columns in order of first appearance
+        names = []
+        seen = set()
+        for row in rows:
+            for key in row:
+                if key not in seen:
+                    seen.add(key)
+                    names.append(key)
+
+        # time range of the chunk for the index
+        times = [row[self._time_column] for row in rows
+                 if type(row.get(self._time_column)) in (int, float)]
+        min_time = min(times) if len(times) else None
+        max_time = max(times) if len(times) else None
+
+        # encode and compress each column separately
+        blocks = []
+        columns = []
+        for name in names:
+            kind, raw = _encode_column([row.get(name, _Missing)
+                                        for row in rows],
+                                       self._protocol)
+            block = zlib.compress(raw, self._compresslevel)
+            blocks.append(block)
+            columns.append([name, kind, len(block)])
+
+        header = json.dumps({"n_rows": len(rows),
+                             "min_time": min_time,
+                             "max_time": max_time,
+                             "columns": columns}).encode("utf-8")
+        offset = self._file.tell()
+        self._file.write(_CHUNK_MAGIC + struct.pack("<I", len(header)))
+        self._file.write(header)
+        pos = offset + len(_CHUNK_MAGIC) + 4 + len(header)
+        for block in blocks:
+            self._file.write(block)
+
+        # index the absolute offset of every column block
+        index_columns = []
+        for (name, kind, length) in columns:
+            index_columns.append([name, kind, pos, length])
+            pos += length
+        self._index.append({"offset": offset,
+                            "n_rows": len(rows),
+                            "min_time": min_time,
+                            "max_time": max_time,
+                            "columns": index_columns})
+        self._synced = False
+
+        # the journaled records are in the file now, so once it is on
+        # disk the journal can be emptied
+        if self._journal is not None and self._journal.tell():
+            self._sync_file()
+            self._journal.seek(0)
+            self._journal.truncate()
+
+    def _sync_file(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._synced = True
+
+    def flush(self, sync=True):
+        """Push the records written so far to disk, journaling those that
+        are not in a chunk yet.
+
+        Parameters
+        ----------
+        sync : boolean
+            Whether to also fsync the file so the records survive a crash.
+        """
+        first = self._n_records - len(self._rows)
+        if self._n_journaled < self._n_records:
+            if self._journal is None:
+                self._journal = open(self._filename + _JOURNAL_SUFFIX, "wb")
+            for i in range(max(self._n_journaled, first), self._n_records):
+                blob = pickle.dumps((i, self._rows[i - first]),
+                                    protocol=self._protocol)
+                self._journal.write(struct.pack("<I", len(blob)) + blob)
+            self._n_journaled = self._n_records
+        self._file.flush()
+        if self._journal is not None:
+            self._journal.flush()
+        if sync:
+            if not self._synced:
+                self._sync_file()
+            if self._journal is not None:
+                os.fsync(self._journal.fileno())
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._write_chunk()
+        footer = json.dumps({"n_records": self._n_records,
+                             "time_column": self._time_column,
+                             "chunks": self._index}).encode("utf-8")
+        self._file.write(_FOOTER_MAGIC + struct.pack("<I", len(footer)))
+        self._file.write(footer)
+        self._file.write(struct.pack("<Q", len(footer)) + _COLUMNAR_MAGIC)
+        if self._journal is not None:
+            # keep the journal until the footer is on disk
+            self._sync_file()
+            self._journal.close()
+            os.remove(self._filename + _JOURNAL_SUFFIX)
+        self._file.close()
+
+
+class ColumnarLogReader(object):
+    """An object that handles reading from columnar .slog files.
+
+    Only the chunks overlapping the requested time range are touched,
+    and only the requested columns of those chunks are decompressed.
+
+    Parameters
+    ----------
+    filename : string
+        The name of the .slog that you wish to read.
+    unwrap : boolean
+        Whether to unwrap sub-dicts and tuples when reading.
+    columns : list (optional)
+        The column names to read. Defaults to all columns.
+    start_time : float (optional)
+        Only read records whose *log_time* is at or after this time.
+    end_time : float (optional)
+        Only read records whose *log_time* is at or before this time.
+    append_columns : dict
+        Additional columns to add to each record.
+    """
+    def __init__(self, filename, unwrap=False, columns=None,
+                 start_time=None, end_time=None, **append_columns):
+        self._filename = filename
+        self._file = open(filename, "rb")
+        if self._file.read(len(_COLUMNAR_MAGIC)) != _COLUMNAR_MAGIC:
+            self._file.close()
+            raise IOError("%r is not a columnar slog file." % filename)
+        self._unwrap = unwrap
+        self._columns = columns
+        self._start_time = start_time
+        self._end_time = end_time
+        self._append_columns = append_columns
+        self._time_column = "log_time"
+        self._chunks = self._read_index()
+
+    def _read_index(self):
+        """Load the chunk index from the footer, or by scanning the chunk
+        headers (and the journal) if the file was not closed properly.
+        """
+        trailer_size = 8 + len(_COLUMNAR_MAGIC)
+        self._file.seek(0, os.SEEK_END)
+        file_size = self._file.tell()
+        if file_size >= len(_COLUMNAR_MAGIC) + trailer_size:
+            self._file.seek(file_size - trailer_size)
+            trailer = self._file.read(trailer_size)
+            if trailer[8:] == _COLUMNAR_MAGIC:
+                footer_size = struct.unpack("<Q", trailer[:8])[0]
+                self._file.seek(file_size - trailer_size - footer_size)
+                footer = json.loads(
+                    self._file.read(footer_size).decode("utf-8"))
+                self._time_column = footer["time_column"]
+                return footer["chunks"]
+
+        # no footer, so walk the chunks (a truncated last chunk is dropped)
+        chunks = []
+        offset = len(_COLUMNAR_MAGIC)
+        while True:
+            self._file.seek(offset)
+            prefix = self._file.read(len(_CHUNK_MAGIC) + 4)
+            if len(prefix) < len(_CHUNK_MAGIC) + 4 or \
+               prefix[:len(_CHUNK_MAGIC)] != _CHUNK_MAGIC:
+                break
+            header_size = struct.unpack("<I", prefix[len(_CHUNK_MAGIC):])[0]
+            try:
+                header = json.loads(
+                    self._file.read(header_size).decode("utf-8"))
+            except ValueError:
+                break
+            pos = offset + len(prefix) + header_size
+            columns = []
+            for (name, kind, length) in header["columns"]:
+                columns.append([name, kind, pos, length])
+                pos += length
+            if pos > file_size:
+                break
+            chunks.append({"offset": offset,
+                           "n_rows": header["n_rows"],
+                           "min_time": header["min_time"],
+                           "max_time": header["max_time"],
+                           "columns": columns})
+            offset = pos
+
+        # flushed records that had not made it into a chunk
+        rows = self._read_journal(sum(chunk["n_rows"] for chunk in chunks))
+        if len(rows):
+            names = []
+            for row in rows:
+                for name in row:
+                    if name not in names:
+                        names.append(name)
+            times = [row[self._time_column] for row in rows
+                     if type(row.get(self._time_column)) in (int, float)]
+            chunks.append({"offset": None,
+                           "n_rows": len(rows),
+                           "min_time": min(times) if len(times) else None,
+                           "max_time": max(times) if len(times) else None,
+                           "columns": [[name, None, None, None]
+                                       for name in names],
+                           "rows": rows})
+        return chunks
+
+    def _read_journal(self, n_rows):
+        """Return the journaled rows after the first *n_rows* records (a
+        truncated last entry is dropped).
+        """
+        rows = []
+        try:
+            journal = open(self._filename + _JOURNAL_SUFFIX, "rb")
+        except (IOError, OSError):
+            return rows
+        with journal:
+            while True:
+                prefix = journal.read(4)
+                if len(prefix) < 4:
+                    break
+                size = struct.unpack("<I", prefix)[0]
+                blob = journal.read(size)
+                if len(blob) < size:
+                    break
+                i, row = pickle.loads(blob)
+                # records before n_rows were also written to a chunk
+                if i == n_rows + len(rows):
+                    rows.append(row)
+                elif i > n_rows + len(rows):
+                    break
+        return rows
+
+    @property
+    def column_names(self):
+        """All column names in the file, in order of first appearance."""
+        names = []
+        for chunk in self._chunks:
+            for column in chunk["columns"]:
+                if column[0] not in names:
+                    names.append(column[0])
+        return names
+
+    def _selected_chunks(self):
+        for chunk in self._chunks:
+            if self._start_time is not None or self._end_time is not None:
+                if chunk["min_time"] is None:
+                    # no timed rows in this chunk
+                    continue
+                if self._start_time is not None and \
+                   chunk["max_time"] < self._start_time:
+                    continue
+                if self._end_time is not None and \
+                   chunk["min_time"] > self._end_time:
+                    continue
+            yield chunk
+
+    def _read_chunk(self, chunk, columns):
+        """Return {name: values} for the requested columns of a chunk."""
+        if "rows" in chunk:
+            return dict((name, [pickle.loads(row[name])
+                                if isinstance(row.get(name), _Pickled)
+                                else row.get(name, _Missing)
+                                for row in chunk["rows"]])
+                        for name, kind, offset, length in chunk["columns"]
+                        if columns is None or name in columns)
+        data = {}
+        for (name, kind, offset, length) in chunk["columns"]:
+            if columns is not None and name not in columns:
+                continue
+            self._file.seek(offset)
+            data[name] = _decode_column(kind,
+                                        zlib.decompress(
+                                            self._file.read(length)),
+                                        chunk["n_rows"])
+        return data
+
+    def _row_mask(self, chunk, data):
+        """Which rows of a chunk fall in the requested time range."""
+        if self._start_time is None and self._end_time is None:
+            return None
+        times = data.get(self._time_column)
+        if times is None:
+            return [False] * chunk["n_rows"]
+        mask = []
+        for t in times:
+            keep = type(t) in (int, float)
+            if keep and self._start_time is not None:
+                keep = t >= self._start_time
+            if keep and self._end_time is not None:
+                keep = t <= self._end_time
+            mask.append(keep)
+        return mask
+
+    def _iter_chunk_data(self):
+        columns = self._columns
+        if columns is not None and \
+           (self._start_time is not None or self._end_time is not None):
+            columns = set(columns) | {self._time_column}
+        for chunk in self._selected_chunks():
+            data = self._read_chunk(chunk, columns)
+            yield chunk, data, self._row_mask(chunk, data)
+
+    def read_columns(self):
+        """Return a dict of lists, one per selected column.
+
+        Rows that did not have a column are filled with None.
+        """
+        names = self._columns
+        if names is None:
+            names = self.column_names
+        result = dict((name, []) for name in names)
+        for chunk, data, mask in self._iter_chunk_data():
+            for name in names:
+                values = data.get(name, [_Missing] * chunk["n_rows"])
+                if mask is not None:
+                    values = [v for v, keep in zip(values, mask) if keep]
+                result[name].extend(None if v is _Missing else v
+                                    for v in values)
+        return result
+
+    def read_record(self):
+        """Returns a dicitionary with the field names as keys.
+        """
+        if not hasattr(self, "_record_iter"):
+            self._record_iter = self._iter_records()
+        return next(self._record_iter, None)
+
+    def _iter_records(self):
+        for chunk, data, mask in self._iter_chunk_data():
+            if self._columns is not None:
+                data = dict((name, values) for name, values in data.items()
+                            if name in self._columns)
+            for i in range(chunk["n_rows"]):
+                if mask is not None and not mask[i]:
+                    continue
+                rec = dict((name, values[i])
+                           for name, values in data.items()
+                           if values[i] is not _Missing)
+
+                # unwrap it
+                if self._unwrap:
+                    rec = _unwrap(rec)
+
+                # append additional cols
+                rec.update(self._append_columns)
+                yield rec
+
+    def close(self):
+        self._file.close()
+
+    def __iter__(self):
+        for record in self._iter_records():
+            yield record
+        self.close()
+
+
+# operations handled by the LogSink writer thread
+_SINK_WRITE = 0
+_SINK_WRITE_DURABLE = 1
+_SINK_COMMIT = 2
+_SINK_BARRIER = 3
+_SINK_CLOSE = 4
+_SINK_STOP = 5
+
+
+class LogSink(object):
+    """Writes log records on a background thread with group commit.
+
+    Instead of serializing and fsyncing every record on the thread that
+    runs the experiment, records are put on a bounded queue and a single
+    writer thread serializes them.  Writers that received records are
+    flushed and fsynced together (a group commit) once *commit_records*
+    records are waiting, *commit_interval* seconds have passed since the
+    first of them, or a barrier is requested.  Records written through a
+    durable writer are committed as soon as they are written.  *close*
+    commits what is left and stops the thread, which starts again if
+    more records are written.
+
+    Parameters
+    ----------
+    commit_records : int
+        Commit after this many uncommitted records.
+    commit_interval : float
+        Commit no later than this many seconds after the oldest
+        uncommitted record was written.
+    max_queue_size : int
+        Maximum number of queued operations.  Once the queue is full,
+        writing a record blocks until the writer thread catches up.
+
+    """
+    def __init__(self, commit_records=64, commit_interval=0.5,
+                 max_queue_size=4096):
+        self._commit_records = commit_records
+        self._commit_interval = commit_interval
+        self._queue = queue.Queue(max_queue_size)
+        self._error = None
+
+        # counters
+        self._stats_lock = threading.Lock()
+        self._records_written = 0
+        self._max_queue_depth = 0
+        self._blocked_puts = 0
+        self._commits = 0
+        self._total_commit_latency = 0.0
+        self._max_commit_latency = 0.0
+        self._last_commit_latency = 0.0
+
+        self._thread = None
+        self._start()
+
+    def _start(self):
+        # daemon only so a crashed experiment can still exit; close()
+        # joins the thread
+        self._thread = threading.Thread(target=self._run,
+                                        name="SMILE log sink")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def get_writer(self, writer, durable=False):
+        """Wrap a log writer so its records go through this sink.
+
+        Parameters
+        ----------
+        writer : LogWriter or ColumnarLogWriter
+            The writer that serializes the records.
+        durable : boolean
+            If True, every record is fsynced as soon as it is written
+            instead of waiting for the next group commit.
+        """
+        return AsyncLogWriter(self, writer, durable)
+
+    def barrier(self, timeout=None):
+        """Block until everything queued so far is written and committed.
+        """
+        done = threading.Event()
+        self._put((_SINK_BARRIER, None, done))
+        done.wait(timeout)
+        self._check_error()
+
+    def close(self, timeout=None):
+        """Commit everything queued so far, stop the writer thread, and wait
+        for it to finish.
+        """
+        if self._thread is None:
+            return
+        # stop the thread even if it already failed, then raise its error
+        self._queue.put((_SINK_STOP, None, None))
+        self._thread.join(timeout)
+        self._thread = None
+        self._check_error()
+
+    def get_stats(self):
+        """Return a dict of queue and commit counters."""
+        with self._stats_lock:
+            if self._commits:
+                mean_latency = self._total_commit_latency / self._commits
+            else:
+                mean_latency = 0.0
+            return {"queue_depth": self._queue.qsize(),
+                    "max_queue_depth": self._max_queue_depth,
+                    "blocked_puts": self._blocked_puts,
+                    "records_written": self._records_written,
+                    "commits": self._commits,
+                    "last_commit_latency": self._last_commit_latency,
+                    "mean_commit_latency": mean_latency,
+                    "max_commit_latency": self._max_commit_latency}
+
+    def _check_error(self):
+        # re-raise errors from the writer thread on the calling thread
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+    def _put(self, item):
+        self._check_error()
+        if self._thread is None:
+            self._start()
+        if self._queue.full():
+            with self._stats_lock:
+                self._blocked_puts += 1
+        self._queue.put(item)
+        depth = self._queue.qsize()
+        if depth > self._max_queue_depth:
+            with self._stats_lock:
+                self._max_queue_depth = max(self._max_queue_depth, depth)
+
+    def _commit(self, writers):
+        if not len(writers):
+            return
+        start = time.perf_counter()
+        for writer in writers:
+            writer.flush(sync=True)
+        latency = time.perf_counter() - start
+        with self._stats_lock:
+            self._commits += 1
+            self._last_commit_latency = latency
+            self._total_commit_latency += latency
+            self._max_commit_latency = max(self._max_commit_latency,
+                                           latency)
+
+    def _run(self):
+        dirty = set()
+        pending = 0
+        first_pending_time = None
+        while True:
+            # wake up in time for the interval commit
+            timeout = None
+            if pending:
+                timeout = max(0.0, first_pending_time +
+                              self._commit_interval - time.perf_counter())
+            try:
+                op, writer, arg = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                op, writer, arg = _SINK_BARRIER, None, None
+
+            try:
+                if op == _SINK_WRITE or op == _SINK_WRITE_DURABLE:
+                    writer.write_record(arg)
+                    with self._stats_lock:
+                        self._records_written += 1
+                    if op == _SINK_WRITE_DURABLE:
+                        self._commit([writer])
+                        continue
+                    dirty.add(writer)
+                    pending += 1
+                    if pending == 1:
+                        first_pending_time = time.perf_counter()
+                    if pending < self._commit_records:
+                        continue
+                elif op == _SINK_COMMIT:
+                    if writer not in dirty:
+                        continue
+                elif op == _SINK_CLOSE:
+                    dirty.discard(writer)
+                    writer.close()
+                    continue
+
+                # commit everything that is waiting
+                self._commit(dirty)
+                dirty = set()
+                pending = 0
+            except Exception as e:
+                # keep the error for the calling thread and drop the failed
+                # commit instead of retrying it right away
+                self._error = e
+                dirty = set()
+                pending = 0
+            finally:
+                if op in (_SINK_BARRIER, _SINK_CLOSE) and arg is not None:
+                    arg.set()
+            # stop after the final commit, whether or not it succeeded
+            if op == _SINK_STOP:
+                return
+
+
+class AsyncLogWriter(object):
+    """Log writer that hands its records to a *LogSink*.
+
+    Has the same interface as *LogWriter*, but *write_record* only queues
+    a snapshot of the record for the sink's writer thread, with any value
+    that is not a scalar already pickled.
+
+    Parameters
+    ----------
+    sink : LogSink
+        The sink whose thread will write the records.
+    writer : LogWriter or ColumnarLogWriter
+        The writer that serializes the records.
+    durable : boolean
+        If True, every record is fsynced as soon as it is written.
+
+    """
+    def __init__(self, sink, writer, durable=False):
+        self._sink = sink
+        self._writer = writer
+        self._durable = durable
+
+    def write_record(self, data):
+        """Queue a single row for the .slog file.
+
+        Parameters
+        ----------
+        data : dict
+            This is a dictionary where the keys are the
+            field names that you are writing out to the .slog file.
+        """
+        # data must be a dict
+        if not isinstance(data, dict):
+            raise ValueError("data to log must be a dict instance.")
+        if self._durable:
+            op = _SINK_WRITE_DURABLE
+        else:
+            op = _SINK_WRITE
+        # snapshot now, since the caller may change the record (or the
+        # objects in it) before the sink's thread gets to it
+        self._sink._put((op, self._writer,
+                         _snapshot_record(data, self._writer._protocol)))
+
+    def flush(self, sync=True):
+        """Ask the sink to commit this writer without waiting for it."""
+        self._sink._put((_SINK_COMMIT, self._writer, None))
+
+    def close(self):
+        """Write out everything queued for this writer and close it."""
+        done = threading.Event()
+        self._sink._put((_SINK_CLOSE, self._writer, done))
+        done.wait()
+        self._sink._check_error()
+
+
+# writer classes for each supported log format
+LOG_FORMATS = {"pickle": LogWriter,
+               "columnar": ColumnarLogWriter}
+
+
+def get_log_writer(filename, log_format=None, **kwargs):
+    """Create a log writer for the given format.
+
+    Parameters
+    ----------
+    filename : string
+        The filename that you would like to write to. Must end in .slog.
+    log_format : string (optional)
+        Either "pickle" (the default gzipped pickle stream) or "columnar".
+    kwargs : keyword arguments
+        Passed on to the writer class.
+    """
+    if log_format is None:
+        log_format = "pickle"
+    try:
+        writer_class = LOG_FORMATS[log_format]
+    except KeyError:
+        raise ValueError("Unknown log format %r, must be one of %r." %
+                         (log_format, sorted(LOG_FORMATS.keys())))
+    return writer_class(filename, **kwargs)
+
+
+def _get_log_reader(filename, unwrap=False, **append_columns):
+    """Open the right reader for either slog format."""
+    if is_columnar_log(filename):
+        return ColumnarLogReader(filename, unwrap=unwrap, **append_columns)
+    else:
+        return LogReader(filename, unwrap=unwrap, **append_columns)
+
+
 def _unwrap(d, prefix=''):
     """Process the items of a dict and unwrap them to the top level based
     on the key names.
@@ -202,12 +1096,85 @@ def log2dl(log_filename, unwrap=True, **append_columns):
     for i, slog in enumerate(log_files):
         append_columns.update({'log_num': i})
         dl.extend([r for r in
-                   LogReader(slog,
-                             unwrap=unwrap,
-                             **append_columns)])
+                   _get_log_reader(slog,
+                                   unwrap=unwrap,
+                                   **append_columns)])
     return dl
 
 
+def log2columns(log_filename, columns=None, start_time=None, end_time=None):
+    """Load selected columns of slog files as a dict of lists.
+
+    Columnar slogs only decompress the requested columns of the chunks
+    that overlap the requested *log_time* range.  Pickle slogs are read
+    in full and filtered afterwards.
+
+    Parameters
+    ----------
+    log_filename : string
+        Either a full filename with the slog extension or base
+        name with everything up to the numerical index of a log,
+        as in *log2dl*.
+    columns : list (optional)
+        The column names to load. Defaults to all columns.
+    start_time : float (optional)
+        Only load rows whose *log_time* is at or after this time.
+    end_time : float (optional)
+        Only load rows whose *log_time* is at or before this time.
+
+    Examples
+    --------
+    ..
+        cols = log2columns('log_event', columns=['trial_index'],
+                           start_time=1200.0, end_time=1800.0)
+
+    """
+    # determine set of slogs
+    log_files = _root_to_files(log_filename)
+    if len(log_files) == 0:
+        raise IOError("No matching slog files found.")
+
+    result = {}
+    n_rows = 0
+    for slog in log_files:
+        if is_columnar_log(slog):
+            reader = ColumnarLogReader(slog, columns=columns,
+                                       start_time=start_time,
+                                       end_time=end_time)
+            data = reader.read_columns()
+            reader.close()
+        else:
+            data = {}
+            records = []
+            for record in LogReader(slog):
+                t = record.get("log_time")
+                if start_time is not None or end_time is not None:
+                    if type(t) not in (int, float):
+                        continue
+                    if start_time is not None and t < start_time:
+                        continue
+                    if end_time is not None and t > end_time:
+                        continue
+                records.append(record)
+            names = columns
+            if names is None:
+                names = []
+                for record in records:
+                    names.extend(k for k in record if k not in names)
+            for name in names:
+                data[name] = [record.get(name) for record in records]
+
+        # line up columns that only some of the files have
+        slog_rows = max([len(v) for v in data.values()] + [0])
+        for name in data:
+            if name not in result:
+                result[name] = [None] * n_rows
+        for name in result:
+            result[name].extend(data.get(name, [None] * slog_rows))
+        n_rows += slog_rows
+    return result
+
+
 def log2csv(log_filename, csv_filename=None, **append_columns):
     """Convert slog files to a CSV.
 
@@ -247,7 +1214,7 @@ def log2csv(log_filename, csv_filename=None, **append_columns):
     for i, slog in enumerate(log_files):
         # update the append_columns
         append_columns.update({'log_num': i})
-        for record in LogReader(slog, unwrap=True, **append_columns):
+        for record in _get_log_reader(slog, unwrap=True, **append_columns):
             for fieldname in record:
                 if fieldname not in colnames:
                     colnames.append(fieldname)
@@ -257,7 +1224,7 @@ def log2csv(log_filename, csv_filename=None, **append_columns):
         csv_filename = os.path.splitext(log_filename)[0] + '.csv'
 
     # loop again and write out to file
-    with open(csv_filename, 'wb') as fout:
+    with open(csv_filename, 'w', newline='') as fout:
         # open CSV and write header
         dw = csv.DictWriter(fout, fieldnames=list(colnames))
         dw.writeheader()
@@ -268,12 +1235,7 @@ def log2csv(log_filename, csv_filename=None, **append_columns):
             append_columns.update({'log_num': i})
 
             # loop over all records
-            for record in LogReader(slog, unwrap=True, **append_columns):
-                # handle unicode
-                record = dict((k, v.encode('utf-8')
-                               if isinstance(v, unicode)
-                               else v)
-                              for k, v in record.items())
-
+            for record in _get_log_reader(slog, unwrap=True,
+                                          **append_columns):
                 # write it out
                 dw.writerow(record)
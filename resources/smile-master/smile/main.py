@@ -10,6 +10,8 @@
 # import main modules
 from __future__ import print_function
 import os
+from heapq import heappush, heappop, heapify
+from itertools import count
 
 # kivy imports
 from . import kivy_overrides
@@ -35,6 +37,7 @@ from packaging import version
 # local imports
 from .event import event_time
 from .clock import clock
+from .frame_timing import FrameTimer
 from .video import normalize_color_spec
 from .scale import scale
 
@@ -53,6 +56,64 @@ class _VideoChange(object):
         self.flip_time_cb = flip_time_cb
         self.drawn = False
         self.flipped = False
+        self.cancelled = False
+
+
+class _VideoQueue(object):
+    """Video changes waiting for a flip, ordered by flip time.
+
+    Pending changes live in a heap keyed on (flip_time, sequence), so
+    changes for the same flip keep the order they were scheduled in.
+    Cancelling only marks the change, which is dropped once it reaches
+    the top of the heap.  Changes that have been drawn move to *drawn*
+    until the flip, when they are all removed at once with *take_drawn*.
+    """
+    def __init__(self):
+        self._heap = []
+        self._sequence = count()
+        self._n_cancelled = 0
+        self.drawn = []
+
+    def __len__(self):
+        return len(self._heap) - self._n_cancelled + len(self.drawn)
+
+    def push(self, video):
+        heappush(self._heap, (video.flip_time, next(self._sequence), video))
+
+    def peek(self):
+        # return the next change to draw, or None if there are none
+        heap = self._heap
+        while len(heap):
+            video = heap[0][2]
+            if not video.cancelled:
+                return video
+            heappop(heap)
+            self._n_cancelled -= 1
+        return None
+
+    def pop(self):
+        # move the next change to the drawn list
+        video = heappop(self._heap)[2]
+        self.drawn.append(video)
+        return video
+
+    def take_drawn(self):
+        drawn = self.drawn
+        self.drawn = []
+        return drawn
+
+    def cancel(self, video):
+        if video.drawn or video.cancelled:
+            return
+        video.cancelled = True
+        self._n_cancelled += 1
+
+        # rebuild the heap once it is mostly tombstones
+        if self._n_cancelled > 64 and self._n_cancelled * 2 > len(self._heap):
+            self._heap = [entry for entry in self._heap
+                          if not entry[2].cancelled]
+            heapify(self._heap)
+            self._n_cancelled = 0
 
 
 class SmileApp(App):
@@ -64,7 +125,8 @@ class SmileApp(App):
         self.exp = exp
         self.callbacks = {}
         self.pending_flip_time = None
-        self.video_queue = []
+        self.video_queue = _VideoQueue()
+        self.frame_timer = None
         self.force_blocking_flip = False
         self.force_nonblocking_flip = False
         self.flip_interval = 1/60.  # default to 60 Hz
@@ -160,6 +222,12 @@ class SmileApp(App):
     def _on_start(self, *pargs):
         # print('ON_START:', self.exp._root_executor)
         self.get_flip_interval()
+        if self.exp._frame_timing:
+            self.frame_timer = FrameTimer(
+                self.exp.reserve_data_filename("frame_timing", "bin"),
+                self.flip_interval)
+        clock.set_tick_budget(self.exp._tick_budget,
+                              self.exp._tick_overrun_callback)
         self.do_flip(block=True)
 
         # start the state machine
@@ -355,46 +423,52 @@ class SmileApp(App):
         clock.tick()
 
         # dispatch input events
-        time_err = (clock.now() - self._post_dispatch_time) / 2.0
+        dispatch_start = clock.now()
+        time_err = (dispatch_start - self._post_dispatch_time) / 2.0
         self.dispatch_input_event_time = event_time(self._post_dispatch_time +
                                                     time_err, time_err)
         event_loop.dispatch_input()
         self._post_dispatch_time = clock.now()
 
+        if self.frame_timer is not None:
+            self.frame_timer.add_tick(dispatch_start - self._new_time)
+            self.frame_timer.add_dispatch(
+                dispatch_start, self._post_dispatch_time - dispatch_start)
+
         # processing video and drawing can only happen if we have
         # not already drawn
         if not self._did_draw:
             # prepare for every video to be drawn on the next flip
-            for video in self.video_queue:
+            while True:
+                video = self.video_queue.peek()
                 # the desired video time must be after the previous flip
                 # is done, so making sure the next_flip_time is after
                 # ensures this is the case
-                if (video.flip_time - self._next_flip_time) < 0.0:
-
-                    if (not video.drawn and
-                        ((self.pending_flip_time is None and
-                          self._new_time >= (video.flip_time -
-                                             (self.flip_interval / 2.0))) or
-                         video.flip_time == self.pending_flip_time)):
-                        # prepare that video change
-                        video.update_cb()
-
-                        # it will be drawn
-                        video.drawn = True
-
-                        # save the pending time so all other changes
-                        # for that time will also run
-                        self.pending_flip_time = video.flip_time
-                    else:
-                        # either none are ready or the remaining are
-                        # for a subsequent flip
-                        break
+                if (video is not None and
+                    (video.flip_time - self._next_flip_time) < 0.0 and
+                    ((self.pending_flip_time is None and
+                      self._new_time >= (video.flip_time -
+                                         (self.flip_interval / 2.0))) or
+                     video.flip_time == self.pending_flip_time)):
+                    # prepare that video change
+                    self.video_queue.pop()
+                    video.update_cb()
+
+                    # it will be drawn
+                    video.drawn = True
+
+                    # save the pending time so all other changes
+                    # for that time will also run
+                    self.pending_flip_time = video.flip_time
                 else:
+                    # either none are ready or the remaining are
+                    # for a subsequent flip
                     break
 
             # do kivy ticks and draw when we're ready
             # happens at half the flip interval since last flip
-            if clock.now() >= self._next_draw_time:
+            draw_start = clock.now()
+            if draw_start >= self._next_draw_time:
                 # tick the kivy clock
                 _kivy_clock.tick()
 
@@ -403,24 +477,19 @@ class SmileApp(App):
                 _kivy_clock.tick_draw()
                 Builder.sync()
                 EventLoop.window.dispatch('on_draw')
+                if self.frame_timer is not None:
+                    self.frame_timer.add_draw(clock.now() - draw_start)
 
-                # process smile video callbacks for the upcoming flip
+                # process smile video callbacks for the upcoming flip and
+                # remove every video change that's gonna be flipped
                 self._flip_time_callbacks = []
-                for video in self.video_queue:
-                    if video.drawn and video.flip_time == self.pending_flip_time:
-                        # append the flip time callback
-                        if video.flip_time_cb is not None:
-                            self._flip_time_callbacks.append(video.flip_time_cb)
-
-                        # mark that video as flipped (it's gonna be)
-                        video.flipped = True
-                    else:
-                        # no more of the videos could match, so break
-                        break
-
-                # remove any video change that's gonna be flipped
-                while len(self.video_queue) and self.video_queue[0].flipped:
-                    del self.video_queue[0]
+                for video in self.video_queue.take_drawn():
+                    # append the flip time callback
+                    if video.flip_time_cb is not None:
+                        self._flip_time_callbacks.append(video.flip_time_cb)
+
+                    # mark that video as flipped (it's gonna be)
+                    video.flipped = True
 
                 # we've drawn the one time we can this frame
                 self._did_draw = True
@@ -472,6 +541,8 @@ class SmileApp(App):
         self.event_time = event_time(self._new_time + time_err, time_err)
 
     def do_flip(self, block=True):
+        flip_start = clock.now()
+
         # call the flip
         EventLoop.window.dispatch('on_flip')
 
@@ -499,6 +570,10 @@ class SmileApp(App):
         self._next_draw_time = self.last_flip['time'] + self.flip_interval/2.
         self._did_draw = False
 
+        if self.frame_timer is not None:
+            self.frame_timer.add_flip(self.last_flip['time'],
+                                      clock.now() - flip_start, block)
+
         return self.last_flip
 
     def get_flip_interval(self):
@@ -538,20 +613,11 @@ class SmileApp(App):
             # set flip_time to pending_flip_time
             flip_time = self.pending_flip_time
             new_video.flip_time = self.pending_flip_time
-        for n, video in enumerate(self.video_queue):
-            if video.flip_time > flip_time:
-                self.video_queue.insert(n, new_video)
-                break
-        else:
-            self.video_queue.append(new_video)
+        self.video_queue.push(new_video)
         return new_video
 
     def cancel_video(self, video):
-        if not video.drawn:
-            try:
-                self.video_queue.remove(video)
-            except ValueError:
-                pass
+        self.video_queue.cancel(video)
 
     def screenshot(self, filename=None):
         Window.screenshot(filename)
@@ -0,0 +1,441 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 et:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the smile package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import json
+import time
+import traceback
+import asyncio
+import threading
+from itertools import count
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+def _latency_stats(latencies):
+    latencies = sorted(latencies)
+    if not len(latencies):
+        return {"n": 0, "mean": None, "max": None}
+    return {"n": len(latencies),
+            "mean": sum(latencies) / len(latencies),
+            "max": latencies[-1]}
+
+
+class MessageClient(object):
+    """Client for servers speaking newline-delimited JSON (e.g., Elemem).
+
+    The connection is run by an asyncio event loop on a background thread,
+    so *send* never blocks the thread calling it: the message is encoded
+    right away and written by the loop, and incoming lines are read with
+    a *StreamReader* as they arrive.
+
+    Messages sent with *expect_response* get a *Future* for the server's
+    reply.  A reply is matched to its message by the value of *id_key*;
+    a reply without an id (e.g., from servers that do not echo ids) is
+    matched to the oldest message still waiting for one, since replies
+    come back in order.  A reply whose id no message is waiting for goes
+    to *on_message*, unless *match_unknown_ids*.  Many messages can wait
+    for replies at once, and the round-trip time of each is recorded
+    (see *get_latencies*).
+
+    Parameters
+    ----------
+    host : string
+        Address of the server.
+    port : integer
+        Port of the server.
+    id_key : string (default = "id")
+        Field of the messages holding their id.
+    type_key : string (default = "type")
+        Field of the messages holding their type, used to group the
+        round-trip times.
+    on_message : function (optional)
+        Called with each message that is not a reply to a sent message.
+        It runs on the client's thread.
+    match_unknown_ids : boolean (default = False)
+        Match replies with an id no message is waiting for to the oldest
+        message waiting, as replies without an id are (e.g., for servers
+        that answer every message with the same id).
+
+    """
+    def __init__(self, host, port, id_key="id", type_key="type",
+                 on_message=None, match_unknown_ids=False):
+        self.host = host
+        self.port = port
+        self.id_key = id_key
+        self.type_key = type_key
+        self._on_message = on_message
+        self._match_unknown_ids = match_unknown_ids
+        self._loop = None
+        self._thread = None
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._pending = OrderedDict()
+        self._pending_ids = {}
+        self._keys = count()
+        self._latencies = []
+        self._wire_latencies = []
+        self._latency_lock = threading.Lock()
+
+    def connect(self, timeout=None):
+        """Start the client thread and connect, blocking until connected.
+
+        Raises the error of a failed connection (e.g., *OSError*).
+        """
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run,
+                                        name="SMILE message client")
+        self._thread.daemon = True
+        self._thread.start()
+        future = asyncio.run_coroutine_threadsafe(self._connect(), self._loop)
+        try:
+            future.result(timeout)
+        except BaseException:
+            self._stop()
+            raise
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host,
+                                                                   self.port)
+        self._read_task = self._loop.create_task(self._read())
+
+    async def _read(self):
+        error = ConnectionError("connection closed by the server")
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                self._receive(json.loads(line.decode("utf-8")),
+                              time.perf_counter())
+        except asyncio.CancelledError:
+            error = ConnectionError("client closed")
+        except Exception as e:
+            error = e
+        self._fail_pending(error)
+
+    def _pop_pending(self, key):
+        entry = self._pending.pop(key)
+        if entry[1] is not None:
+            keys = self._pending_ids[entry[1]]
+            keys.remove(key)
+            if not len(keys):
+                del self._pending_ids[entry[1]]
+        return entry
+
+    def _receive(self, message, receive_time):
+        # match a reply to its message by id, or else to the oldest
+        # message waiting for a reply
+        entry = None
+        message_id = message.get(self.id_key)
+        if message_id is not None and message_id in self._pending_ids:
+            entry = self._pop_pending(self._pending_ids[message_id][0])
+        elif len(self._pending) and \
+             (message_id is None or self._match_unknown_ids):
+            entry = self._pop_pending(next(iter(self._pending)))
+        if entry is None:
+            if self._on_message is not None:
+                self._on_message(message)
+            return
+        future, message_id, message_type, send_time = entry
+        if send_time is not None:
+            with self._latency_lock:
+                self._latencies.append((message_id, message_type,
+                                        receive_time - send_time))
+        if not future.cancelled():
+            future.set_result(message)
+
+    def _write(self, data, key, entry, message_type, queued_time):
+        # runs on the client thread, so replies are always expected in
+        # the order the messages go out
+        if self._writer is None or self._writer.transport.is_closing():
+            if entry is not None:
+                entry[0].set_exception(ConnectionError("not connected"))
+            return
+        if entry is not None:
+            entry[3] = time.perf_counter()
+            self._pending[key] = entry
+            if entry[1] is not None:
+                self._pending_ids.setdefault(entry[1], deque()).append(key)
+        self._writer.write(data)
+        if queued_time is not None:
+            with self._latency_lock:
+                self._wire_latencies.append((message_type, time.perf_counter() -
+                                             queued_time))
+
+    def send(self, message, expect_response=False, queued_time=None):
+        """Send a message (dictionary) without waiting.
+
+        The message is encoded right away, so it can be changed as soon
+        as this returns.
+
+        If *queued_time* (a *time.perf_counter* time, e.g., when the
+        message was queued by a *MessageSender*) is given, the time from
+        then until the message is handed to the socket is recorded (see
+        *get_wire_latency_stats*).
+
+        Returns a *Future* for the reply if *expect_response*, else None.
+        """
+        return self.send_encoded((json.dumps(message) + "\n").encode("utf-8"),
+                                 expect_response, message.get(self.id_key),
+                                 message.get(self.type_key), queued_time)
+
+    def send_encoded(self, data, expect_response=False, message_id=None,
+                     message_type=None, queued_time=None):
+        """Send a message already encoded as newline-terminated bytes
+        (e.g., by a *MessageTemplate*), as in *send*.  Its *message_id*
+        and *message_type* are used to match and group the replies.
+        """
+        if expect_response:
+            future = Future()
+            entry = [future, message_id, message_type, None]
+        else:
+            future = None
+            entry = None
+        self._loop.call_soon_threadsafe(self._write, data, next(self._keys),
+                                        entry, message_type, queued_time)
+        return future
+
+    def request(self, message, timeout=None):
+        """Send a message and block until its reply comes back."""
+        return self.send(message, True).result(timeout)
+
+    def get_latencies(self):
+        """(id, type, round-trip seconds) of each reply received."""
+        with self._latency_lock:
+            return list(self._latencies)
+
+    def get_latency_stats(self, message_type=None):
+        """Number, mean, and max round-trip seconds of the replies, only
+        to messages of *message_type* if given.
+        """
+        return _latency_stats(latency for message_id, mtype, latency in
+                              self.get_latencies() if message_type is None or
+                              mtype == message_type)
+
+    def get_wire_latency_stats(self, message_type=None):
+        """Number, mean, and max seconds from *queued_time* until the
+        message was handed to the socket, only for messages of
+        *message_type* if given.
+        """
+        with self._latency_lock:
+            latencies = list(self._wire_latencies)
+        return _latency_stats(latency for mtype, latency in latencies if
+                              message_type is None or mtype == message_type)
+
+    def _fail_pending(self, error):
+        pending = list(self._pending.values())
+        self._pending.clear()
+        self._pending_ids.clear()
+        for entry in pending:
+            if not entry[0].done():
+                entry[0].set_exception(error)
+
+    async def _close(self):
+        if self._writer is not None:
+            try:
+                await self._writer.drain()
+            except ConnectionError:
+                pass
+            self._writer.close()
+        if self._read_task is not None:
+            self._read_task.cancel()
+            try:
+                await self._read_task
+            except asyncio.CancelledError:
+                pass
+
+    def _stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    def close(self, timeout=5.0):
+        """Write what is still queued, close the connection, and stop the
+        client thread.  Messages still waiting get a *ConnectionError*.
+        """
+        if self._loop is None:
+            return
+        future = asyncio.run_coroutine_threadsafe(self._close(), self._loop)
+        try:
+            future.result(timeout)
+        finally:
+            self._stop()
+
+
+def _snapshot(message):
+    # copy the message and any dictionaries in it (e.g., "data"), so the
+    # caller can change them while the message waits in the queue
+    return {key: dict(value) if isinstance(value, dict) else value
+            for key, value in message.items()}
+
+
+def _chain(source, target):
+    # pass the result of the client's future on to the sender's
+    def _done(source):
+        if source.cancelled():
+            target.cancel()
+        elif source.exception() is not None:
+            target.set_exception(source.exception())
+        else:
+            target.set_result(source.result())
+    source.add_done_callback(_done)
+
+
+class MessageSender(object):
+    """Queue of outgoing messages sent and logged by a background thread.
+
+    *send* only stamps the time, copies the message, and puts it in a
+    bounded queue, so it is cheap enough to call from a *Func* while the
+    experiment is running.  The sender's thread then encodes the message,
+    hands it to the *MessageClient*, and logs it, in the order messages
+    were queued.  The time from queueing a message until it is handed to
+    the socket is recorded by the client (see *get_latency_stats*).
+
+    Parameters
+    ----------
+    client : MessageClient
+        Connected client to send the messages with, or None to only log
+        them (e.g., when running without a server).
+    log : function (optional)
+        Called on the sender's thread with each message after it is sent
+        (e.g., to write it to a CSV with a *SessionWriter*).
+    stamp : function (optional)
+        Called with no arguments when a message is queued, to get the
+        value put in the message's *time_key* field (e.g.,
+        ``lambda: round(clock.now() * 1000)``).
+    time_key : string (default = "time")
+        Field of the messages holding the time they were queued.
+    max_queued : integer (default = 1024)
+        Number of messages that can wait in the queue.  *send* blocks
+        while the queue is full.
+
+    """
+    def __init__(self, client=None, log=None, stamp=None, time_key="time",
+                 max_queued=1024):
+        self._client = client
+        self._log = log
+        self._stamp = stamp
+        self._time_key = time_key
+        self._queue = queue.Queue(max_queued)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run,
+                                        name="SMILE message sender")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def send(self, message, expect_response=False):
+        """Queue a message (dictionary) to be sent.
+
+        Returns a *Future* for the reply if *expect_response* and there is
+        a client, else None.
+        """
+        if self._closed:
+            raise ValueError("sending with a closed message sender")
+        queued_time = time.perf_counter()
+        message = _snapshot(message)
+        if self._stamp is not None:
+            message[self._time_key] = self._stamp()
+        future = None
+        if expect_response and self._client is not None:
+            future = Future()
+        self._queue.put((None, message, future, queued_time))
+        return future
+
+    def send_template(self, template, expect_response=False, **fields):
+        """Queue a message made from a *MessageTemplate* with *fields*.
+
+        The message is encoded by the sender's thread, and the dictionary
+        passed to *log* is made by *template.message*.  Returns as *send*.
+        """
+        if self._closed:
+            raise ValueError("sending with a closed message sender")
+        queued_time = time.perf_counter()
+        if self._stamp is not None:
+            fields[self._time_key] = self._stamp()
+        future = None
+        if expect_response and self._client is not None:
+            future = Future()
+        self._queue.put((template, fields, future, queued_time))
+        return future
+
+    def _send(self, template, message, future, queued_time):
+        if template is not None:
+            data = template.encode(**message)
+            message = template.message(**message)
+        if self._client is not None:
+            if template is None:
+                response = self._client.send(message, future is not None,
+                                             queued_time)
+            else:
+                response = self._client.send_encoded(
+                    data, future is not None,
+                    message.get(self._client.id_key),
+                    message.get(self._client.type_key), queued_time)
+            if future is not None:
+                _chain(response, future)
+        return message
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            template, message, future, queued_time = item
+            # report errors, and keep sending the messages that follow
+            try:
+                message = self._send(template, message, future, queued_time)
+            except Exception as e:
+                if future is not None:
+                    future.set_exception(e)
+                traceback.print_exc()
+                message = None
+            try:
+                if self._log is not None and message is not None:
+                    self._log(message)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self._queue.task_done()
+
+    def wait(self):
+        """Block until every queued message has been sent and logged."""
+        self._queue.join()
+
+    def get_latency_stats(self, message_type=None):
+        """Number, mean, and max seconds from queueing a message until it
+        was handed to the socket, only for messages of *message_type* if
+        given.
+        """
+        if self._client is None:
+            return _latency_stats([])
+        return self._client.get_wire_latency_stats(message_type)
+
+    def close(self):
+        """Send and log every queued message, then stop the thread.  Call
+        before closing the client.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
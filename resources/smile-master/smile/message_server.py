@@ -0,0 +1,349 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 et:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the smile package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import json
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+
+
+def latency_distribution(spec, rng=random):
+    """Function drawing latencies, in seconds, from a distribution.
+
+    Parameters
+    ----------
+    spec : string, number, or None
+        One of "fixed:MS", "uniform:LOW_MS,HIGH_MS", "normal:MEAN_MS,SD_MS",
+        "lognormal:MEDIAN_MS,SIGMA", or "exponential:MEAN_MS", with times in
+        milliseconds.  A number alone is a fixed latency in milliseconds,
+        and None no latency.  Negative draws are clipped to 0.
+    rng : random.Random (optional)
+        Source of the draws, for repeatable runs.
+
+    """
+    if spec is None:
+        return lambda: 0.0
+    if ":" not in str(spec):
+        spec = "fixed:%s" % spec
+    name, _, args = str(spec).partition(":")
+    try:
+        args = [float(arg) for arg in args.split(",") if len(arg.strip())]
+        if name == "fixed":
+            value, = args
+            draw = lambda: value
+        elif name == "uniform":
+            low, high = args
+            draw = lambda: rng.uniform(low, high)
+        elif name == "normal":
+            mean, sd = args
+            draw = lambda: rng.gauss(mean, sd)
+        elif name == "lognormal":
+            median, sigma = args
+            draw = lambda: median * rng.lognormvariate(0.0, sigma)
+        elif name == "exponential":
+            mean, = args
+            draw = lambda: rng.expovariate(1.0 / mean) if mean > 0 else 0.0
+        else:
+            raise ValueError("unknown distribution")
+    except ValueError:
+        raise ValueError("Invalid latency distribution %r." % spec)
+    return lambda: max(draw(), 0.0) / 1000.
+
+
+class _Stats(object):
+    __slots__ = ("messages_in", "bytes_in", "messages_out", "bytes_out",
+                 "dropped", "split", "writes")
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class MessageConnection(object):
+    """A client connected to a *MessageServer*.
+
+    Replies go out in the order they are sent, each no sooner than its
+    delay (plus the server's injected latency) after it was sent, as a
+    server handling one message at a time would send them.
+    """
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.peer = writer.get_extra_info("peername")
+        self.state = {}
+        self._reader = reader
+        self._writer = writer
+        self._outgoing = deque()
+        self._wake = asyncio.Event()
+        self._last_due = 0.0
+        self._closing = False
+
+    def send(self, message, delay=0.0):
+        """Queue a reply (dictionary) to go out after *delay* seconds.
+
+        Must be called from the server's thread (e.g., in its handler).
+        """
+        server = self.server
+        now = time.perf_counter()
+        due = max(now + delay + server.latency(), self._last_due)
+        self._last_due = due
+        self._outgoing.append((due, (json.dumps(message) + "\n")
+                               .encode("utf-8")))
+        self._wake.set()
+
+    def close(self):
+        """Close the connection once the queued replies are sent."""
+        self._closing = True
+        self._wake.set()
+
+    async def _read(self):
+        server = self.server
+        while True:
+            line = await self._reader.readline()
+            if not line:
+                return
+            receive_time = time.perf_counter()
+            server.stats.messages_in += 1
+            server.stats.bytes_in += len(line)
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                message = json.loads(line.decode("utf-8"))
+            except ValueError:
+                print("%s: bad message %r" % (self.peer, line[:80]))
+                continue
+            if server.log is not None:
+                server.log(self, message, receive_time)
+            server.handler(self, message)
+            if self._closing:
+                return
+
+    async def _write(self):
+        server = self.server
+        while True:
+            if not len(self._outgoing):
+                if self._closing:
+                    return
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            due = self._outgoing[0][0]
+            wait = due - time.perf_counter()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            # everything due by the end of the coalescing window goes out
+            # in a single write
+            if server.coalesce > 0:
+                await asyncio.sleep(server.coalesce)
+            now = time.perf_counter()
+            frames = []
+            while len(self._outgoing) and self._outgoing[0][0] <= now:
+                data = self._outgoing.popleft()[1]
+                if server.drop and server.rng.random() < server.drop:
+                    server.stats.dropped += 1
+                    continue
+                frames.append(data)
+            if not len(frames):
+                continue
+            data = b"".join(frames)
+            server.stats.messages_out += len(frames)
+            server.stats.bytes_out += len(data)
+
+            # a partial frame: half now, the rest after a pause
+            if server.split and server.rng.random() < server.split:
+                server.stats.split += 1
+                server.stats.writes += 1
+                self._writer.write(data[:len(data) // 2])
+                await self._writer.drain()
+                await asyncio.sleep(server.split_delay)
+                data = data[len(data) // 2:]
+            server.stats.writes += 1
+            self._writer.write(data)
+            await self._writer.drain()
+
+
+class MessageServer(object):
+    """Stand-in for a server speaking newline-delimited JSON.
+
+    Runs an asyncio server, so client scripts can be tested and timed
+    without the real server (e.g., Elemem or the stimulation server).
+    Every message received is passed to *handler*, which replies with
+    *connection.send*.  Faults of a real network can be injected into
+    the replies: latency drawn from a distribution, dropped replies,
+    replies split across writes (partial frames), and replies coalesced
+    into one write.  Message and byte counts are kept in *stats* and
+    printed every *report_interval* seconds.
+
+    Parameters
+    ----------
+    handler : function
+        Called as handler(connection, message) on the server's thread
+        for each message received.  *connection.state* is a dictionary
+        it can keep per-client state in.
+    host : string (default = "127.0.0.1")
+    port : integer (default = 0)
+        0 picks a free port (see *port* once started).
+    latency : string, number, or function (optional)
+        Added to the delay of each reply.  See *latency_distribution*.
+    drop : float (default = 0.0)
+        Probability of dropping a reply.
+    split : float (default = 0.0)
+        Probability of writing a reply in two parts.
+    split_delay : float (default = 0.005)
+        Seconds between the two parts of a split reply.
+    coalesce : float (default = 0.0)
+        Seconds to hold replies, so those due together go out in a
+        single write.
+    report_interval : float (optional)
+        Seconds between throughput reports.
+    log : function (optional)
+        Called as log(connection, message, receive_time) for each message
+        received, with a *time.perf_counter* receive time.
+    seed : integer (optional)
+        Seed of the random faults and latencies.
+
+    """
+    def __init__(self, handler, host="127.0.0.1", port=0, latency=None,
+                 drop=0.0, split=0.0, split_delay=0.005, coalesce=0.0,
+                 report_interval=None, log=None, seed=None):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.rng = random.Random(seed)
+        if callable(latency):
+            self.latency = latency
+        else:
+            self.latency = latency_distribution(latency, self.rng)
+        self.drop = drop
+        self.split = split
+        self.split_delay = split_delay
+        self.coalesce = coalesce
+        self.report_interval = report_interval
+        self.log = log
+        self.stats = _Stats()
+        self.connections = []
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._report_task = None
+
+    async def _handle(self, reader, writer):
+        connection = MessageConnection(self, reader, writer)
+        self.connections.append(connection)
+        print("Client connected from %s:%s." % connection.peer[:2])
+        write_task = self._loop.create_task(connection._write())
+        try:
+            await connection._read()
+        except ConnectionError:
+            print("Connection reset by client.")
+        finally:
+            connection.close()
+            try:
+                await write_task
+            except ConnectionError:
+                pass
+            writer.close()
+            self.connections.remove(connection)
+            print("Client disconnected.")
+
+    async def _report(self):
+        last = self.stats.as_dict()
+        last_time = time.perf_counter()
+        while True:
+            await asyncio.sleep(self.report_interval)
+            now = time.perf_counter()
+            stats = self.stats.as_dict()
+            elapsed = now - last_time
+            print("in %.1f msg/s (%.0f B/s), out %.1f msg/s (%.0f B/s), "
+                  "%d dropped, %d split, %d writes" %
+                  ((stats["messages_in"] - last["messages_in"]) / elapsed,
+                   (stats["bytes_in"] - last["bytes_in"]) / elapsed,
+                   (stats["messages_out"] - last["messages_out"]) / elapsed,
+                   (stats["bytes_out"] - last["bytes_out"]) / elapsed,
+                   stats["dropped"] - last["dropped"],
+                   stats["split"] - last["split"],
+                   stats["writes"] - last["writes"]))
+            last = stats
+            last_time = now
+
+    async def _start(self):
+        self._server = await asyncio.start_server(self._handle, self.host,
+                                                  self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if self.report_interval:
+            self._report_task = self._loop.create_task(self._report())
+
+    def serve_forever(self):
+        """Run the server on this thread until interrupted."""
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._start())
+        print("Listening on %s:%d." % (self.host, self.port))
+        try:
+            self._loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._shutdown()
+
+    def start(self):
+        """Run the server on a background thread.  Returns the port."""
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def _run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start())
+            started.set()
+            self._loop.run_forever()
+            self._shutdown()
+
+        self._thread = threading.Thread(target=_run,
+                                        name="SMILE message server")
+        self._thread.daemon = True
+        self._thread.start()
+        started.wait()
+        return self.port
+
+    def call(self, func, *args):
+        """Run func(*args) on the server's thread and return its result."""
+        future = asyncio.run_coroutine_threadsafe(self._call(func, args),
+                                                  self._loop)
+        return future.result()
+
+    async def _call(self, func, args):
+        return func(*args)
+
+    def _shutdown(self):
+        self._server.close()
+        self._loop.run_until_complete(self._server.wait_closed())
+
+        # cancel the connections and reports still running
+        all_tasks = getattr(asyncio, "all_tasks", None) or \
+            asyncio.Task.all_tasks
+        tasks = [task for task in all_tasks(self._loop) if not task.done()]
+        for task in tasks:
+            task.cancel()
+        self._loop.run_until_complete(asyncio.gather(*tasks,
+                                                     return_exceptions=True))
+        self._loop.close()
+
+    def stop(self):
+        """Stop a server started with *start*."""
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
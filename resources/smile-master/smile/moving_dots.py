@@ -11,86 +11,132 @@ from kivy.clock import Clock
 from kivy.graphics import Color, Point
 from kivy.properties import NumericProperty, ListProperty
 
-from itertools import chain
-import math
-import random
+import numpy as np
 
 __all__ = ['MovingDots']
 
+# most points a single Point instruction can draw (4 vertices each, with
+# 16-bit vertex indices)
+_MAX_POINTS_PER_INSTRUCTION = 8000
 
-def random_variance(base, variance):
-    return base + variance * (random.random() * 2.0 - 1.0)
+# motion parameters kept for each dot
+_MOTION_PARAMS = ("radius", "direction", "direction_variance", "speed",
+                  "speed_variance", "lifespan", "lifespan_variance")
 
 
-class Dot(object):
-    def __init__(self, radius=100, scale=1.0,
-                 color=[1.0, 1.0, 1.0, 1.0],
-                 direction=0, direction_variance=0.0,
-                 speed=1.0, speed_variance=0.0,
-                 lifespan=.02, lifespan_variance=0.0, **kwargs):
+class DotField(object):
+    """Locations and motion of a field of dots, in NumPy arrays.
 
-        # process the input vars
-        self.radius = radius
-        self.scale = scale
-        self.color = color
-        self.direction = direction
-        self.direction_variance = direction_variance
+    Dots are split into groups of consecutive dots, each with its own
+    motion parameters (see *MovingDots*).  Every array is allocated once,
+    and *update* moves all the dots and resets those past their lifespan
+    or outside the radius with array operations, so a frame costs the
+    same however long the dots have been moving.
 
-        self.speed = speed
-        self.speed_variance = speed_variance
-        self.lifespan = lifespan
-        self.lifespan_variance = lifespan_variance
+    Parameters
+    ----------
+    groups : list of (integer, dict)
+        Number of dots and motion parameters of each group.
+    seed : integer (optional)
+        Seed of the random locations, directions, speeds, and lifespans.
 
-        # call reset to initialize the dot loc and dir
-        self.reset()
+    """
+    def __init__(self, groups, seed=None):
+        self.num_dots = sum(count for count, params in groups)
+        self._rng = np.random.RandomState(seed)
+
+        # motion parameters and state of each dot
+        self._params = {name: np.zeros(self.num_dots)
+                        for name in _MOTION_PARAMS}
+        self.x = np.zeros(self.num_dots)
+        self.y = np.zeros(self.num_dots)
+        self.velocity_x = np.zeros(self.num_dots)
+        self.velocity_y = np.zeros(self.num_dots)
+        self.current_time = np.zeros(self.num_dots)
+        self.total_time = np.zeros(self.num_dots)
+
+        # buffers reused by every update
+        self._distance = np.zeros(self.num_dots)
+        self._buffer = np.zeros(self.num_dots)
+        self._expired = np.zeros(self.num_dots, dtype=bool)
+        self._outside = np.zeros(self.num_dots, dtype=bool)
+        self._points = np.zeros(2 * self.num_dots)
+
+        self.set_motion(groups)
+        self.reset(np.arange(self.num_dots))
+
+    def set_motion(self, groups):
+        """Change the motion parameters of each group of dots.
+
+        Dots keep moving as they were until they are next reset.
+        """
+        start = 0
+        for count, params in groups:
+            for name in _MOTION_PARAMS:
+                self._params[name][start:start + count] = params[name]
+            start += count
+
+    def _variance(self, base, variance):
+        return base + variance * (self._rng.random_sample(len(base)) *
+                                  2.0 - 1.0)
+
+    def reset(self, index):
+        """New location, velocity, and lifespan for the dots at *index*."""
+        params = {name: values[index]
+                  for name, values in self._params.items()}
+
+        # random location in the circle
+        t = 2 * np.pi * self._rng.random_sample(len(index))
+        u = self._rng.random_sample(len(index)) + \
+            self._rng.random_sample(len(index))
+        r = np.where(u > 1, 2 - u, u)
+        self.x[index] = params["radius"] * r * np.cos(t)
+        self.y[index] = params["radius"] * r * np.sin(t)
+
+        # movement direction and speed
+        angle = self._variance(params["direction"] * np.pi / 180,
+                               params["direction_variance"] * np.pi / 180)
+        speed = self._variance(params["speed"], params["speed_variance"])
+        self.velocity_x[index] = speed * np.cos(angle)
+        self.velocity_y[index] = speed * np.sin(angle)
+
+        # lifetime
+        self.current_time[index] = 0.0
+        self.total_time[index] = self._variance(params["lifespan"],
+                                                params["lifespan_variance"])
 
     def update(self, passed_time):
-        # update the lifetime
+        """Move the dots by *passed_time* seconds, resetting the dots past
+        their lifespan or outside the radius.
+        """
         self.current_time += passed_time
-
-        # reset if past lifetime
-        if self.current_time > self.total_time:
-            # reset
-            self.reset()
-            return self.x, self.y
-
-        # update the location
-        self.x += self.velocity_x * passed_time
-        self.y += self.velocity_y * passed_time
-
-        # reset if outside radius
-        if math.sqrt((self.x * self.x) + (self.y * self.y)) > self.radius:
-            # must reset
-            self.reset()
-            return self.x, self.y
-
-        # return x and y
-        return self.x, self.y
-
-    def reset(self):
-        # determine new location
-        t = 2 * math.pi * random.random()
-        u = random.random()+random.random()
-        if u > 1:
-            r = 2-u
-        else:
-            r = u
-        self.x = (self.radius * r * math.cos(t))
-        self.y = (self.radius * r * math.sin(t))
-        self.start_x = self.x
-        self.start_y = self.y
-
-        # process the movement direction
-        angle = random_variance(self.direction*math.pi/180,
-                                self.direction_variance*math.pi/180)
-        speed = random_variance(self.speed, self.speed_variance)
-        self.velocity_x = speed * math.cos(angle)
-        self.velocity_y = speed * math.sin(angle)
-
-        # set the time
-        self.current_time = 0.0
-        self.total_time = random_variance(self.lifespan,
-                                          self.lifespan_variance)
+        np.greater(self.current_time, self.total_time, out=self._expired)
+
+        np.multiply(self.velocity_x, passed_time, out=self._buffer)
+        self.x += self._buffer
+        np.multiply(self.velocity_y, passed_time, out=self._buffer)
+        self.y += self._buffer
+
+        # compare squared distances to squared radii
+        np.multiply(self.x, self.x, out=self._distance)
+        np.multiply(self.y, self.y, out=self._buffer)
+        self._distance += self._buffer
+        radius = self._params["radius"]
+        np.multiply(radius, radius, out=self._buffer)
+        np.greater(self._distance, self._buffer, out=self._outside)
+
+        np.logical_or(self._expired, self._outside, out=self._expired)
+        index = np.flatnonzero(self._expired)
+        if len(index):
+            self.reset(index)
+
+    def get_points(self, x_offset, y_offset):
+        """Interleaved x and y of every dot, offset by *x_offset* and
+        *y_offset*, in an array reused by every call.
+        """
+        np.add(self.x, x_offset, out=self._points[0::2])
+        np.add(self.y, y_offset, out=self._points[1::2])
+        return self._points
 
 
 class _MovingDotsWidget(Widget):
@@ -114,10 +160,35 @@ class _MovingDotsWidget(Widget):
         self.width = self.radius * 2
         self.height = self.radius * 2
 
-        # grab default motion params
+        # the dots' motion, by group
+        self._field = DotField(self._get_groups())
+        self.bind(motion_props=self.callback_motion_props)
+
+        # canvas instructions are made once, and the dot locations are
+        # updated in place on every frame
+        num_dots = int(self.num_dots)
+        self._chunks = [(2 * start,
+                         2 * min(start + _MAX_POINTS_PER_INSTRUCTION, num_dots))
+                        for start in range(0, num_dots,
+                                           _MAX_POINTS_PER_INSTRUCTION)]
+        with self.canvas:
+            self._color = Color(*self.color)
+            self._point_instructions = [Point(points=[],
+                                              pointsize=self.scale)
+                                        for chunk in self._chunks]
+        self.bind(color=self._update_color, scale=self._update_scale)
+
+        # prepare to keep track of updates
+        self._dt_avg = 0.0
+        self._avg_n = 0.0
+
+        # not currently running
+        self._active = False
+
+    def _get_groups(self):
+        # number of dots and motion parameters of each group: the coherent
+        # groups of motion_props, then the remaining dots moving randomly
         default_params = {"radius": self.radius,
-                          "scale": self.scale,
-                          "color": self.color,
                           "direction": self.direction,
                           "direction_variance": self.direction_variance,
                           "speed": self.speed,
@@ -125,90 +196,34 @@ class _MovingDotsWidget(Widget):
                           "lifespan": self.lifespan,
                           "lifespan_variance": self.lifespan_variance,
                           "coherence": self.coherence}
-
-        # determine distribution of dots
+        groups = []
         tot_coh = 0
-        self.__dots = []
-
-        # first create the coherent dots
         for mprop in self.motion_props:
             current_params = default_params.copy()
             current_params.update(mprop)
             num_coh = int(self.num_dots * current_params['coherence'])
             tot_coh += num_coh
-            self.__dots.extend([Dot(**current_params)
-                                for i in range(num_coh)])
+            groups.append((num_coh, current_params))
 
         # calc the number random coh
-        num_rand = self.num_dots - tot_coh
+        num_rand = int(self.num_dots) - tot_coh
         if num_rand < 0:
             raise ValueError('Total coherence must be less than 1.0.')
-
-        # now append the non-coh
-        if num_rand > 0:
-            # there are dots left to place based on the defaults
-            current_params = default_params.copy()
-            current_params['direction'] = 0.0
-            current_params['direction_variance'] = 360
-            self.__dots.extend([Dot(**current_params)
-                                for i in range(num_rand)])
-
-        self.bind(motion_props=self.callback_motion_props)
-
-        # shuffle that list
-        random.shuffle(self.__dots)
-
-        # prepare to keep track of updates
-        self._dt_avg = 0.0
-        self._avg_n = 0.0
-
-        # not currently running
-        self._active = False
+        current_params = default_params.copy()
+        current_params['direction'] = 0.0
+        current_params['direction_variance'] = 360
+        groups.append((num_rand, current_params))
+        return groups
 
     def callback_motion_props(self, obj, value):
-        # Grab the current default values for all of
-        # our parameters
-        default_params = {"radius": self.radius,
-                           "scale": self.scale,
-                           "color": self.color,
-                           "direction": self.direction,
-                           "direction_variance": self.direction_variance,
-                           "speed": self.speed,
-                           "speed_variance": self.speed_variance,
-                           "lifespan": self.lifespan,
-                           "lifespan_variance": self.lifespan_variance,
-                           "coherence": self.coherence}
+        self._field.set_motion(self._get_groups())
 
-        tot_coh = 0
-        # loop through the updated values for motion props
-        for mprop in self.motion_props:
-            # Copy the default parameters and only update the given parameters
-            current_params = default_params.copy()
-            current_params.update(mprop)
+    def _update_color(self, obj, value):
+        self._color.rgba = value
 
-            # Calculate how many dots need to get updated for this coherence
-            num_coh = int(self.num_dots * mprop['coherence'])
-            # Loop through that many dots and update their motion properties
-            for i in range(tot_coh, tot_coh + num_coh):
-                self.__dots[i].direction = current_params['direction']
-                self.__dots[i].direction_variance = current_params['direction_variance']
-                self.__dots[i].speed = current_params['speed']
-                self.__dots[i].speed_variance = current_params['speed_variance']
-                self.__dots[i].lifespan = current_params['lifespan']
-                self.__dots[i].lifespan_variance = current_params['lifespan_variance']
-
-            tot_coh += num_coh
-
-        # For all remaining dots, give them a 0 direction and 360 direction
-        # variance. Keep all remaining props as the default params
-        if tot_coh < self.num_dots:
-            for i in range(tot_coh, self.num_dots):
-                self.__dots[i].direction = 0
-                self.__dots[i].direction_variance = 360
-                self.__dots[i].speed = default_params['speed']
-                self.__dots[i].speed_variance = default_params['speed_variance']
-                self.__dots[i].lifespan = default_params['lifespan']
-                self.__dots[i].lifespan_variance = default_params['lifespan_variance']
+    def _update_scale(self, obj, value):
+        for point in self._point_instructions:
+            point.pointsize = value
 
     def start(self):
         # reset update tracker on each start
@@ -231,20 +246,14 @@ class _MovingDotsWidget(Widget):
         self._dt_avg += (dt - self._dt_avg) / self._avg_n
 
         # advance time and locs for all dots
-        bases = (self.x + self.scale, self.y+self.scale)
-        locs = [bases[i % 2]+p+self.radius
-                for i, p in enumerate(chain.from_iterable([d.update(dt)
-                                                           for d in
-                                                           self.__dots]))]
-
-        # draw the dots
-        self.canvas.clear()
-        with self.canvas:
-            # set the dot color
-            Color(*self.color)
-
-            # draw all the dots at their current locations
-            Point(points=locs, pointsize=self.scale)
+        self._field.update(dt)
+        points = self._field.get_points(self.x + self.scale + self.radius,
+                                        self.y + self.scale + self.radius)
+
+        # move the dots of the existing instructions
+        for point, (start, stop) in zip(self._point_instructions,
+                                        self._chunks):
+            point.points = points[start:stop].tolist()
 
         # schedule next update
         if self._active:
@@ -0,0 +1,367 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 et:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the smile package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import csv
+from datetime import datetime
+
+import numpy as np
+
+# candidate window pairs compared at once when matching
+_MAX_CANDIDATES = 1000000
+
+
+def read_times(csv_file, column, time_format=None):
+    """Times of a column of a CSV file (e.g., pulses.csv), in milliseconds.
+
+    Rows with an empty value are skipped.  If *time_format* is given, the
+    values are datetime strings in that format (e.g., the 'time' of the
+    stimulation GUIs, '%Y-%m-%d_%H-%M-%S_%f'), converted to milliseconds
+    since the epoch; otherwise they are numbers of milliseconds (e.g., the
+    'pulse_time' of the tasks).
+    """
+    values = []
+    with open(csv_file, "r", newline="") as f:
+        for row in csv.DictReader(f):
+            value = row.get(column)
+            if value is None or not len(value.strip()):
+                continue
+            if time_format is None:
+                values.append(float(value))
+            else:
+                values.append(datetime.strptime(value, time_format)
+                              .timestamp() * 1000.)
+    return np.array(values, dtype=float)
+
+
+def _windows(intervals, window):
+    # every run of *window* consecutive intervals, one per row
+    n_windows = len(intervals) - window + 1
+    if n_windows < 1:
+        return np.empty((0, window))
+    return intervals[np.arange(n_windows)[:, None] + np.arange(window)]
+
+
+def match_pulses(task_times, eeg_samples, samplerate, window=5,
+                 tolerance=5.0):
+    """Pair the pulses of the task with the pulses detected in the EEG.
+
+    Pulses sent with jittered intervals (e.g., every 5000 +/- 300 ms) have
+    a sequence of intervals that is unlikely to repeat, so a run of
+    *window* consecutive intervals of the task is matched to the run of
+    EEG intervals that agrees with it within *tolerance* milliseconds.
+    Only runs with a single match are kept, which leaves out runs of
+    regular intervals (e.g., pulse bursts), and pulses missed or detected
+    in error on either side only break the runs that include them.
+
+    Parameters
+    ----------
+    task_times : array
+        Times of the pulses on the task clock, in milliseconds.
+    eeg_samples : array
+        Sample indices of the pulses detected in the EEG.
+    samplerate : float
+        Samples per second of the EEG.
+    window : integer (default = 5)
+        Number of intervals that must agree for a match.
+    tolerance : float (default = 5.0)
+        Largest difference, in milliseconds, between matched intervals.
+
+    Returns
+    -------
+    task_index, eeg_index : arrays
+        Indices into *task_times* and *eeg_samples* of each matched pulse,
+        in order.
+
+    """
+    task_times = np.asarray(task_times, dtype=float)
+    eeg_times = np.asarray(eeg_samples, dtype=float) * 1000. / samplerate
+    task_windows = _windows(np.diff(task_times), window)
+    eeg_windows = _windows(np.diff(eeg_times), window)
+    empty = np.array([], dtype=int)
+    if not len(task_windows) or not len(eeg_windows):
+        return empty, empty
+
+    # candidates agree on the first interval of the window, found by
+    # binary search of the sorted EEG intervals
+    order = np.argsort(eeg_windows[:, 0], kind="mergesort")
+    first = eeg_windows[order, 0]
+    low = np.searchsorted(first, task_windows[:, 0] - tolerance, "left")
+    high = np.searchsorted(first, task_windows[:, 0] + tolerance, "right")
+    counts = high - low
+
+    # compare the whole windows of the candidates, a chunk of task windows
+    # at a time to bound the memory used
+    task_matched = []
+    eeg_matched = []
+    ends = np.cumsum(counts)
+    start = 0
+    while start < len(task_windows):
+        base = ends[start - 1] if start else 0
+        stop = max(start + 1, int(np.searchsorted(ends, base + _MAX_CANDIDATES,
+                                                  "right")))
+        chunk_counts = counts[start:stop]
+        n = int(chunk_counts.sum())
+        if n:
+            task_w = np.repeat(np.arange(start, stop), chunk_counts)
+            offsets = np.arange(n) - np.repeat(np.cumsum(chunk_counts) -
+                                               chunk_counts, chunk_counts)
+            eeg_w = order[np.repeat(low[start:stop], chunk_counts) + offsets]
+            agree = np.all(np.abs(task_windows[task_w] - eeg_windows[eeg_w])
+                           <= tolerance, axis=1)
+            task_matched.append(task_w[agree])
+            eeg_matched.append(eeg_w[agree])
+        start = stop
+    task_w = np.concatenate(task_matched)
+    eeg_w = np.concatenate(eeg_matched)
+
+    # keep windows matched only once, on both sides
+    unique = (np.bincount(task_w, minlength=len(task_windows))[task_w] == 1) & \
+        (np.bincount(eeg_w, minlength=len(eeg_windows))[eeg_w] == 1)
+    task_w = task_w[unique]
+    eeg_w = eeg_w[unique]
+    if not len(task_w):
+        return empty, empty
+
+    # every pulse of the matched windows, leaving out pulses the windows
+    # disagree on
+    pulses = np.arange(window + 1)
+    pairs = np.unique(np.stack([(task_w[:, None] + pulses).ravel(),
+                                (eeg_w[:, None] + pulses).ravel()], axis=1),
+                      axis=0)
+    consistent = \
+        (np.bincount(pairs[:, 0])[pairs[:, 0]] == 1) & \
+        (np.bincount(pairs[:, 1])[pairs[:, 1]] == 1)
+    pairs = pairs[consistent]
+    return pairs[:, 0], pairs[:, 1]
+
+
+def _fit_block(times, samples, knot_interval):
+    # continuous piecewise-linear least squares fit, with knots at data
+    # points close to every knot_interval so every segment has data
+    grid = np.arange(times[0], times[-1], knot_interval)
+    knots = np.unique(np.append(times[np.searchsorted(times, grid)],
+                                times[-1]))
+    if len(knots) < 2:
+        return knots, samples[:1].astype(float)
+    index = np.clip(np.searchsorted(knots, times, "right") - 1, 0,
+                    len(knots) - 2)
+    weight = (times - knots[index]) / (knots[index + 1] - knots[index])
+    design = np.zeros((len(times), len(knots)))
+    rows = np.arange(len(times))
+    design[rows, index] = 1 - weight
+    design[rows, index + 1] = weight
+
+    # the fit is of the offset from a line through the end points, which
+    # keeps the numbers small
+    slope = (samples[-1] - samples[0]) / (times[-1] - times[0])
+    base = samples[0] + slope * (times - times[0])
+    values = np.linalg.lstsq(design, samples - base, rcond=None)[0]
+    return knots, values + samples[0] + slope * (knots - times[0])
+
+
+def _evaluate(knots, values, times):
+    # linear interpolation, extrapolated along the first and last segments
+    if len(knots) < 2:
+        return np.full(len(times), values[0]) if len(values) else \
+            np.full(len(times), np.nan)
+    index = np.clip(np.searchsorted(knots, times, "right") - 1, 0,
+                    len(knots) - 2)
+    weight = (times - knots[index]) / (knots[index + 1] - knots[index])
+    return values[index] + weight * (values[index + 1] - values[index])
+
+
+class PulseAlignment(object):
+    """Model of the EEG clock as a function of the task clock.
+
+    Fit by *fit_alignment* (or *align_pulses*) to matched pulses.  The
+    pulses are split into blocks where none were matched for *max_gap*
+    milliseconds (e.g., a recording was restarted), and each block is
+    fit with a continuous piecewise-linear function of the task time,
+    which follows drift between the two clocks.
+
+    Attributes
+    ----------
+    blocks : list of (knots, values) arrays
+        Task times of the knots of each block, and their EEG samples.
+    task_times, eeg_samples : arrays
+        The matched pulses.
+    inliers : boolean array
+        Which of the matched pulses were kept by the outlier rejection.
+    residuals : array
+        EEG samples of the matched pulses minus the model's prediction.
+
+    """
+    def __init__(self, blocks, task_times, eeg_samples, inliers, max_gap):
+        self.blocks = blocks
+        self.task_times = task_times
+        self.eeg_samples = eeg_samples
+        self.inliers = inliers
+        self.max_gap = max_gap
+        self.residuals = eeg_samples - self.to_samples(task_times)
+
+    def to_samples(self, times):
+        """EEG samples (floats) of task *times*, in milliseconds.
+
+        Times are converted by the block closest to them.  Times more than
+        *max_gap* before or after every block are NaN.
+        """
+        times = np.asarray(times, dtype=float)
+        samples = np.full(times.shape, np.nan)
+        if not len(self.blocks):
+            return samples
+
+        # closest block, by distance to its span
+        starts = np.array([knots[0] for knots, values in self.blocks])
+        ends = np.array([knots[-1] for knots, values in self.blocks])
+        flat = times.ravel()
+        distance = np.maximum(starts[None, :] - flat[:, None],
+                              flat[:, None] - ends[None, :])
+        closest = np.argmin(distance, axis=1)
+        within = distance[np.arange(len(flat)), closest] <= self.max_gap
+        flat_samples = samples.ravel()
+        for i, (knots, values) in enumerate(self.blocks):
+            mask = within & (closest == i)
+            flat_samples[mask] = _evaluate(knots, values, flat[mask])
+        return flat_samples.reshape(times.shape)
+
+    def summary(self):
+        """Number of matched pulses and inliers, number of blocks, and the
+        standard deviation and largest absolute residual of the inliers,
+        in samples.
+        """
+        residuals = self.residuals[self.inliers]
+        return {"n_matched": len(self.task_times),
+                "n_inliers": int(self.inliers.sum()),
+                "n_blocks": len(self.blocks),
+                "residual_sd": float(np.std(residuals)) if len(residuals)
+                else None,
+                "residual_max": float(np.max(np.abs(residuals)))
+                if len(residuals) else None}
+
+
+def fit_alignment(task_times, eeg_samples, knot_interval=600000.,
+                  max_gap=60000., threshold=5.0, min_deviation=0.5,
+                  max_iterations=10):
+    """Fit a *PulseAlignment* to matched pulses, rejecting outliers.
+
+    Parameters
+    ----------
+    task_times : array
+        Task times of the matched pulses, in milliseconds, in order.
+    eeg_samples : array
+        EEG samples of the same pulses.
+    knot_interval : float (default = 600000.)
+        Milliseconds between the knots of the piecewise-linear fit
+        (10 minutes).
+    max_gap : float (default = 60000.)
+        Milliseconds without pulses that start a new block.
+    threshold : float (default = 5.0)
+        Pulses whose residual is more than *threshold* robust standard
+        deviations (from the median absolute deviation) are outliers, and
+        the fit is repeated without them until no more are found.
+    min_deviation : float (default = 0.5)
+        Smallest robust standard deviation, in samples, so pulses within
+        the quantization of the samples are never rejected.
+    max_iterations : integer (default = 10)
+
+    """
+    task_times = np.asarray(task_times, dtype=float)
+    eeg_samples = np.asarray(eeg_samples, dtype=float)
+    inliers = np.ones(len(task_times), dtype=bool)
+    if not len(task_times):
+        return PulseAlignment([], task_times, eeg_samples, inliers, max_gap)
+    block_starts = np.concatenate(
+        [[0], np.nonzero(np.diff(task_times) > max_gap)[0] + 1,
+         [len(task_times)]])
+
+    blocks = []
+    for start, stop in zip(block_starts[:-1], block_starts[1:]):
+        times = task_times[start:stop]
+        samples = eeg_samples[start:stop]
+        keep = np.ones(len(times), dtype=bool)
+        for iteration in range(max_iterations):
+            knots, values = _fit_block(times[keep], samples[keep],
+                                       knot_interval)
+            residuals = samples - _evaluate(knots, values, times)
+            deviation = max(1.4826 * np.median(np.abs(
+                residuals[keep] - np.median(residuals[keep]))),
+                min_deviation)
+            new_keep = np.abs(residuals) <= threshold * deviation
+            if np.array_equal(new_keep, keep) or new_keep.sum() < 2:
+                break
+            keep = new_keep
+        inliers[start:stop] = keep
+        blocks.append((knots, values))
+    return PulseAlignment(blocks, task_times, eeg_samples, inliers, max_gap)
+
+
+def align_pulses(task_times, eeg_samples, samplerate, window=5,
+                 tolerance=5.0, **fit_args):
+    """Match pulses (see *match_pulses*) and fit a *PulseAlignment* to
+    them (see *fit_alignment*, which takes the other keyword arguments).
+
+    Example
+    -------
+
+    ::
+
+        task_times = read_times('pulses.csv', 'pulse_time')
+        alignment = align_pulses(task_times, detected_samples, 1000.)
+        print(alignment.summary())
+        align_events_file('events.csv', alignment, ['trial_time'],
+                          'events_aligned.csv')
+
+    """
+    task_times = np.asarray(task_times, dtype=float)
+    eeg_samples = np.asarray(eeg_samples)
+    task_index, eeg_index = match_pulses(task_times, eeg_samples, samplerate,
+                                         window, tolerance)
+    return fit_alignment(task_times[task_index], eeg_samples[eeg_index],
+                         **fit_args)
+
+
+def align_events_file(events_file, alignment, time_columns,
+                      output_file=None, time_format=None):
+    """EEG samples of the times of an events file (e.g., events.csv).
+
+    A '<column>_sample' column is added for each of *time_columns*,
+    rounded to the nearest sample, and empty where the time is empty or
+    can not be aligned.  The rows are written to *output_file* if given,
+    and returned as a list of dictionaries.  *time_format* is as in
+    *read_times*.
+    """
+    with open(events_file, "r", newline="") as f:
+        reader = csv.DictReader(f)
+        fieldnames = list(reader.fieldnames)
+        rows = list(reader)
+
+    for column in time_columns:
+        times = np.full(len(rows), np.nan)
+        for i, row in enumerate(rows):
+            value = row.get(column)
+            if value is None or not len(value.strip()):
+                continue
+            if time_format is None:
+                times[i] = float(value)
+            else:
+                times[i] = datetime.strptime(value, time_format) \
+                    .timestamp() * 1000.
+        samples = alignment.to_samples(times)
+        sample_column = column + "_sample"
+        fieldnames.append(sample_column)
+        for row, sample in zip(rows, samples):
+            row[sample_column] = "" if np.isnan(sample) else \
+                int(np.round(sample))
+
+    if output_file is not None:
+        with open(output_file, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+    return rows
@@ -0,0 +1,180 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 et:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the smile package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import time
+import threading
+
+# integer nanoseconds of the monotonic high-resolution clock (perf_counter_ns
+# is new in Python 3.7)
+if hasattr(time, "perf_counter_ns"):
+    perf_counter_ns = time.perf_counter_ns
+else:
+    def perf_counter_ns():
+        return int(time.perf_counter() * 1e9)
+
+
+def sleep_until(deadline, spin=0.001, event=None):
+    """Wait until *deadline* (*perf_counter_ns* nanoseconds).
+
+    Sleeps until *spin* seconds before the deadline, then spins on the
+    clock for the rest, as a sleep can overshoot by a millisecond or more.
+    The spin only guards against that overshoot: waking from the sleep
+    still has to take the GIL back from other threads (e.g., a GUI), which
+    can also take it during the spin at every switch interval (see
+    *sys.getswitchinterval*), so they can still delay the end of the wait.
+    If *event* is given, the sleep waits on it instead, and returns False
+    as soon as it is set.  Returns True once the deadline is reached.
+    """
+    spin_ns = int(spin * 1e9)
+    while True:
+        remaining = deadline - perf_counter_ns()
+        if remaining <= spin_ns:
+            break
+        timeout = (remaining - spin_ns) / 1e9
+        if event is None:
+            time.sleep(timeout)
+        elif event.wait(timeout):
+            return False
+    while perf_counter_ns() < deadline:
+        pass
+    return True
+
+
+def interface_pulse(interface, code=15, width=0.010, spin=0.001):
+    """Function sending a pulse of *width* seconds with a *PulseInterface*
+    (see smile.pulse), for use with a *PulseScheduler*.
+    """
+    def _pulse():
+        start = perf_counter_ns()
+        interface.setData(code)
+        sleep_until(start + int(width * 1e9), spin)
+        interface.setData(0)
+    return _pulse
+
+
+class PulseScheduler(object):
+    """Sends pulses at absolute deadlines, without drift.
+
+    Each deadline is computed from the previous deadline, not from when
+    the previous pulse ended, so the time taken by the pulse, by logging,
+    or by waiting for the GIL never accumulates into the intervals.  The
+    wait for each deadline is a sleep followed by a spin on the clock
+    (see *sleep_until*).  When a deadline is missed by more than a whole
+    interval (e.g., the computer was suspended), the pulse is sent right
+    away and the schedule continues from it, rather than sending a burst
+    of the pulses missed.
+
+    Parameters
+    ----------
+    pulse : function
+        Called with no arguments to send each pulse (e.g.,
+        pennsyncbox.SyncPulse, or *interface_pulse* for a
+        *PulseInterface*).
+    log : function (optional)
+        Called after each pulse with a dictionary of its 'index', and its
+        'intended' time, 'actual' time (just before *pulse* was called),
+        'error' (actual - intended), and 'duration' (of the *pulse* call),
+        all in *time.perf_counter* seconds.  Called off the schedule, so
+        it can print or write files.
+    spin : float (default = 0.001)
+        Seconds before each deadline to stop sleeping and spin.
+
+    """
+    def __init__(self, pulse, log=None, spin=0.001):
+        self._pulse = pulse
+        self._log = log
+        self._spin = spin
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._n = 0
+        self._total_error = 0
+        self._max_error = None
+
+    def run(self, interval, count=None, start_delay=0.0, until=None):
+        """Send pulses on this thread, returning the number sent.
+
+        Parameters
+        ----------
+        interval : float or function
+            Seconds between the deadlines of consecutive pulses, or a
+            function returning them (e.g., drawing a jittered interval).
+        count : integer (optional)
+            Number of pulses to send.  Sends until stopped if None.
+        start_delay : float (default = 0.0)
+            Seconds before the first pulse.
+        until : function (optional)
+            Checked before each pulse, which is not sent if it returns
+            True (e.g., a stop flag).
+
+        """
+        self._stop_event.clear()
+        if callable(interval):
+            next_interval = interval
+        else:
+            next_interval = lambda: interval
+
+        deadline = perf_counter_ns() + int(start_delay * 1e9)
+        index = 0
+        while count is None or index < count:
+            if not sleep_until(deadline, self._spin, self._stop_event):
+                break
+            if until is not None and until():
+                break
+            actual = perf_counter_ns()
+            self._pulse()
+            end = perf_counter_ns()
+            self._add_error(actual - deadline)
+
+            if self._log is not None:
+                self._log({"index": index,
+                           "intended": deadline / 1e9,
+                           "actual": actual / 1e9,
+                           "error": (actual - deadline) / 1e9,
+                           "duration": (end - actual) / 1e9})
+            index += 1
+
+            step = int(next_interval() * 1e9)
+            deadline += step
+            # a late pulse is sent right away and keeps its deadline; the
+            # schedule only restarts once a whole interval was missed
+            now = perf_counter_ns()
+            if now - deadline > step:
+                deadline = now
+        return index
+
+    def start(self, interval, count=None, start_delay=0.0, until=None):
+        """Run on a new daemon thread, which is returned."""
+        thread = threading.Thread(target=self.run,
+                                  args=(interval, count, start_delay, until),
+                                  name="SMILE pulse scheduler")
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def stop(self):
+        """Stop sending pulses, interrupting the wait for the next one."""
+        self._stop_event.set()
+
+    def _add_error(self, error):
+        with self._lock:
+            self._n += 1
+            self._total_error += error
+            if self._max_error is None or error > self._max_error:
+                self._max_error = error
+
+    def get_error_stats(self):
+        """Number of pulses, and mean and max seconds they were sent after
+        their deadline.
+        """
+        with self._lock:
+            if not self._n:
+                return {"n": 0, "mean": None, "max": None}
+            return {"n": self._n,
+                    "mean": self._total_error / self._n / 1e9,
+                    "max": self._max_error / 1e9}
@@ -9,6 +9,7 @@
 
 import random
 import operator
+import types
 
 class NotAvailable(object):
     """Special value for indicating a variable is not available yet.
@@ -103,13 +104,25 @@ class Ref(object):
         # ***Must be a set to support proper boolean comparisons***
         self.change_callbacks = set()
 
-        # recursively find Refs this Ref depends on
-        for dep in iter_deps((pargs, kwargs)):
+        # compiled on first eval
+        self._plan = None
+
+        # find Refs this Ref depends on once, for setting up callbacks
+        deps = _find_deps((pargs, kwargs))
+        for dep in deps:
             # see if dep doesn't use cache
             if not dep.use_cache:
                 # override our cache state
                 self.use_cache = False
                 break
+        if isinstance(func, Ref):
+            deps.insert(0, func)
+        seen = set()
+        self._deps = []
+        for dep in deps:
+            if id(dep) not in seen:
+                seen.add(id(dep))
+                self._deps.append(dep)
 
     def __repr__(self):
         return "Ref(%s)" % ", ".join([repr(self.func)] +
@@ -198,7 +211,7 @@ class Ref(object):
         return Ref(operator.not_, obj)
 
     def eval(self):
-        """Recursively evaluate the reference.
+        """Evaluate the reference and every Ref it depends on.
 
         .. note::
           Internal use only!!!"""
@@ -208,14 +221,25 @@ class Ref(object):
             return self.cache_value
 
         # evaluate all possible Refs
-        value = val(val(self.func)(*val(self.pargs), **val(self.kwargs)))
+        if self._plan is None:
+            self._plan = _Plan(self)
+        return self._plan.run()
 
-        # save the cache if wanted
-        if self.use_cache:
-            self.cache_value = value
-            self.cache_valid = True
+    def compile(self):
+        """Flatten this Ref and the Refs it depends on into a plan.
 
-        return value
+        The plan is a list of steps, each calling the function of one Ref
+        (or building one list, tuple, dict, or slice holding Refs) with
+        the values of the steps before it, so evaluating it needs no
+        recursion.  A Ref used in several places is evaluated once,
+        unless it does not use its cache (e.g., *jitter*).  *eval*
+        compiles the first time it is called, so this only moves that
+        work earlier.  Returns this Ref.
+
+        """
+        if self._plan is None:
+            self._plan = _Plan(self)
+        return self
 
     def add_change_callback(self, func, *pargs, **kwargs):
         """Add callback that's called when this value changes.
@@ -237,21 +261,47 @@ class Ref(object):
             self.teardown_dep_callbacks()
 
     def setup_dep_callbacks(self):
-        for dep in iter_deps((self.func, self.pargs, self.kwargs)):
+        for dep in self._deps:
             dep.add_change_callback(self.dep_changed)
 
     def teardown_dep_callbacks(self):
         # explicitly remove all change callbacks
-        for dep in iter_deps((self.func, self.pargs, self.kwargs)):
+        for dep in self._deps:
             dep.remove_change_callback(self.dep_changed)
 
     def dep_changed(self):
+        """Invalidate this Ref and the Refs that depend on it, then call
+        their change callbacks.
+
+        Each Ref in the affected subgraph is invalidated once, and its
+        callbacks called once, however many paths the change reaches it
+        by, and only after every cache in the subgraph is invalid.
+        """
         #print "dep_changed %r, %r" % (self, self.change_callbacks)
-        # cache is not valid
-        self.cache_valid = False
-        # iter through each change callback and call them
-        for func, pargs, kwargs in list(self.change_callbacks):
-            func(*pargs, **dict(kwargs))
+        affected = []
+        seen = set()
+        stack = [self]
+        while len(stack):
+            ref = stack.pop()
+            if id(ref) in seen:
+                continue
+            seen.add(id(ref))
+            # cache is not valid
+            ref.cache_valid = False
+            for callback in list(ref.change_callbacks):
+                func = callback[0]
+                if type(func) is types.MethodType and \
+                   func.__func__ is Ref.dep_changed:
+                    # a Ref depending on this one
+                    stack.append(func.__self__)
+                else:
+                    affected.append((ref, callback))
+
+        # call each change callback still set up
+        for ref, callback in affected:
+            if callback in ref.change_callbacks:
+                func, pargs, kwargs = callback
+                func(*pargs, **dict(kwargs))
 
     # delayed operators...
     def __call__(self, *pargs, **kwargs):
@@ -433,24 +483,239 @@ def val(obj):
                                 repr(obj))
 
 
-def iter_deps(obj):
-    """Generator to find all Ref dependencies of an object."""
+def val_with(obj, substitutions):
+    """Evaluate *obj* like *val*, with some Refs replaced by values.
+
+    *substitutions* is a list of (Ref, value) pairs.  Wherever one of
+    those Refs appears in *obj*, its value is used instead of evaluating
+    it, so a Ref can be evaluated for a value one of its dependencies has
+    not taken yet (e.g., the current item of a later *Loop* iteration).
+    Caches are neither read nor written.
+    """
+    return _val_with(obj, {id(ref): value for ref, value in substitutions})
+
+
+def _val_with(obj, substitutions):
     if isinstance(obj, Ref):
-        yield obj
-    elif isinstance(obj, list) or isinstance(obj, tuple):
-        for value in obj:
-            for dep in iter_deps(value):
-                yield dep
+        try:
+            return substitutions[id(obj)]
+        except KeyError:
+            pass
+        func = _val_with(obj.func, substitutions)
+        pargs = _val_with(obj.pargs, substitutions)
+        kwargs = _val_with(obj.kwargs, substitutions)
+        return _val_with(func(*pargs, **kwargs), substitutions)
+    elif isinstance(obj, list):
+        return [_val_with(value, substitutions) for value in obj]
+    elif isinstance(obj, tuple):
+        return tuple(_val_with(value, substitutions) for value in obj)
     elif isinstance(obj, dict):
-        for key, value in obj.items():
-            for dep in iter_deps(key):
-                yield dep
-            for dep in iter_deps(value):
-                yield dep
+        return {_val_with(key, substitutions): _val_with(value, substitutions)
+                for key, value in obj.items()}
     elif isinstance(obj, slice):
-        for dep in iter_deps(obj.start):
-            yield dep
-        for dep in iter_deps(obj.stop):
-            yield dep
-        for dep in iter_deps(obj.step):
-            yield dep
+        return slice(_val_with(obj.start, substitutions),
+                     _val_with(obj.stop, substitutions),
+                     _val_with(obj.step, substitutions))
+    elif obj is NotAvailable:
+        raise NotAvailableError("'val_with' produced NotAvailable result.")
+    else:
+        return obj
+
+
+def iter_deps(obj):
+    """Iterate over all Ref dependencies of an object."""
+    return iter(_find_deps(obj))
+
+
+def _find_deps(obj):
+    # Refs in obj, in order, without looking inside the Refs themselves
+    deps = []
+    stack = [obj]
+    while len(stack):
+        obj = stack.pop()
+        if isinstance(obj, Ref):
+            deps.append(obj)
+        elif isinstance(obj, list) or isinstance(obj, tuple):
+            stack.extend(reversed(obj))
+        elif isinstance(obj, dict):
+            for key, value in reversed(list(obj.items())):
+                stack.append(value)
+                stack.append(key)
+        elif isinstance(obj, slice):
+            stack.extend((obj.step, obj.stop, obj.start))
+    return deps
+
+
+# types of values that val returns unchanged
+_PLAIN_TYPES = frozenset([int, float, complex, str, bytes, bool, type(None)])
+
+
+def _make_tuple(*values):
+    return values
+
+
+def _make_list(*values):
+    return list(values)
+
+
+def _make_dict(*items):
+    return dict(zip(items[0::2], items[1::2]))
+
+
+class _Plan(object):
+    """Evaluation of a Ref and the Refs it depends on as a flat list of
+    steps.
+
+    Every value the steps use (constants, and the result of each step) has
+    a slot in a list, and each step calls its function with the values in
+    its slots, which all come before its own.  Running the plan first
+    walks the steps from the Ref back, using the cached value of each Ref
+    that has one, as *Ref.eval* does, and then runs only the steps still
+    needed.
+
+    """
+    def __init__(self, ref):
+        self._values = []
+        self._steps = []
+        self._step_children = []
+        self._step_index = {}
+        self._ref_slots = {}
+        self._add_ref(ref)
+        self._cached_refs = [step[1] for step in self._steps[:-1]
+                             if step[1] is not None and step[1].use_cache]
+
+    def _add_value(self, value):
+        self._values.append(value)
+        return len(self._values) - 1
+
+    def _add_step(self, ref, func, pargs, kwargs=()):
+        # pargs and kwargs hold slots; returns the slot of the result
+        if len(pargs) > 1:
+            get_pargs = operator.itemgetter(*pargs)
+        elif len(pargs):
+            get_pargs = pargs[0]
+        else:
+            get_pargs = None
+        slot = self._add_value(None)
+        reads = [func] + list(pargs) + [value for name, value in kwargs]
+        self._step_children.append(sorted(set(
+            self._step_index[read] for read in reads
+            if read in self._step_index)))
+        self._step_index[slot] = len(self._steps)
+        self._steps.append((slot, ref, func, get_pargs, len(pargs),
+                            tuple(kwargs)))
+        return slot
+
+    def _add_ref(self, ref):
+        # compile ref and everything it depends on, depth first, without
+        # recursion, so chains of any depth compile; returns its slot
+        slots = []
+        stack = [(None, ref)]
+        while len(stack):
+            make, obj = stack.pop()
+            if make is Ref:
+                # its operands are compiled, so add the call
+                n_pargs = len(obj.pargs)
+                n_operands = 1 + n_pargs + len(obj.kwargs)
+                operands = slots[len(slots) - n_operands:]
+                del slots[len(slots) - n_operands:]
+                slot = self._add_step(obj, operands[0],
+                                      operands[1:1 + n_pargs],
+                                      list(zip(obj.kwargs.keys(),
+                                               operands[1 + n_pargs:])))
+                # Refs that don't use their cache are evaluated every time
+                # they are used, as they may give a different value each
+                # time
+                if obj.use_cache:
+                    self._ref_slots[id(obj)] = slot
+                slots.append(slot)
+            elif make is not None:
+                # its items are compiled, so add building it
+                n_items = obj
+                items = slots[len(slots) - n_items:]
+                del slots[len(slots) - n_items:]
+                slots.append(self._add_step(None, self._add_value(make),
+                                            items))
+            elif isinstance(obj, Ref):
+                if obj.use_cache and id(obj) in self._ref_slots:
+                    slots.append(self._ref_slots[id(obj)])
+                    continue
+                stack.append((Ref, obj))
+                operands = [obj.func] + list(obj.pargs) + \
+                    list(obj.kwargs.values())
+                stack.extend((None, operand) for operand in
+                             reversed(operands))
+            elif isinstance(obj, (list, tuple, dict, slice)) and \
+                 len(_find_deps(obj)):
+                # build it from the values of the Refs it holds
+                if isinstance(obj, list):
+                    items, make = obj, _make_list
+                elif isinstance(obj, tuple):
+                    items, make = obj, _make_tuple
+                elif isinstance(obj, dict):
+                    items = [item for key_value in obj.items()
+                             for item in key_value]
+                    make = _make_dict
+                else:
+                    items, make = (obj.start, obj.stop, obj.step), slice
+                stack.append((make, len(items)))
+                stack.extend((None, item) for item in reversed(items))
+            elif isinstance(obj, (list, tuple, dict, slice)) or \
+                 obj is NotAvailable:
+                # copied (or rejected) by val every time, like before
+                slots.append(self._add_step(None, self._add_value(val),
+                                            [self._add_value(obj)]))
+            else:
+                slots.append(self._add_value(obj))
+        return slots[0]
+
+    def run(self):
+        values = list(self._values)
+        steps = self._steps
+        n_steps = len(steps)
+        needed = [True] * n_steps
+
+        # use the caches of Refs other Refs keep up to date, skipping
+        # the steps only they needed
+        if any(len(ref.change_callbacks) for ref in self._cached_refs):
+            needed = [False] * n_steps
+            needed[-1] = True
+            for index in range(n_steps - 1, -1, -1):
+                if not needed[index]:
+                    continue
+                ref = steps[index][1]
+                if index < n_steps - 1 and ref is not None and \
+                   ref.cache_valid and len(ref.change_callbacks):
+                    values[steps[index][0]] = ref.cache_value
+                    needed[index] = False
+                    continue
+                for child in self._step_children[index]:
+                    needed[child] = True
+
+        value = None
+        for index in range(n_steps):
+            if not needed[index]:
+                continue
+            slot, ref, func, get_pargs, n_pargs, kwargs = steps[index]
+            if n_pargs > 1:
+                pargs = get_pargs(values)
+            elif n_pargs:
+                pargs = (values[get_pargs],)
+            else:
+                pargs = ()
+            if len(kwargs):
+                value = values[func](*pargs, **{name: values[kwarg_slot]
+                                                for name, kwarg_slot in
+                                                kwargs})
+            else:
+                value = values[func](*pargs)
+            if ref is not None:
+                # the result can hold Refs too
+                if value.__class__ not in _PLAIN_TYPES:
+                    value = val(value)
+                # save the cache if wanted
+                if ref.use_cache:
+                    ref.cache_value = value
+                    ref.cache_valid = True
+            values[slot] = value
+        return value
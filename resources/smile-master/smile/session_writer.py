@@ -0,0 +1,146 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 et:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the smile package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import os
+import csv
+import atexit
+import threading
+
+
+def _cell(value):
+    # containers are formatted now, since the caller may change them
+    # before the row is written
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    return str(value)
+
+
+class SessionWriter(object):
+    """Buffered rows for the CSV files of a session.
+
+    Every file added is opened once and kept open.  *writerow* only
+    copies the row into a buffer, so it is cheap enough for threads that
+    must keep their timing (e.g., sync pulses); a background thread
+    writes the buffered rows at least every *flush_interval* seconds, or
+    as soon as *max_rows* rows are waiting.  Rows are written in the
+    order they were added, whichever thread added them.
+
+    Everything buffered is written by *flush* and *close*, and *close* is
+    also called when the interpreter exits.
+
+    Parameters
+    ----------
+    flush_interval : float (default = 0.5)
+        Longest time, in seconds, a row stays in the buffer.
+    max_rows : integer (default = 256)
+        Number of buffered rows that triggers a write right away.
+    sync : boolean (default = True)
+        Whether to fsync the files after each write, so the rows survive
+        a power interruption.
+
+    """
+    def __init__(self, flush_interval=0.5, max_rows=256, sync=True):
+        self._flush_interval = flush_interval
+        self._max_rows = max_rows
+        self._sync = sync
+        self._files = {}
+        self._rows = []
+        self._closed = False
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run,
+                                        name="SMILE session writer")
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    def add_file(self, filename, fieldnames):
+        """Open *filename* for appending rows with *fieldnames*.
+
+        A header is written if the file is new or empty.
+        """
+        with self._write_lock:
+            if filename in self._files:
+                return
+            new_file = (not os.path.isfile(filename) or
+                        not os.path.getsize(filename))
+            file_handle = open(filename, "a", newline="")
+            writer = csv.writer(file_handle)
+            if new_file:
+                writer.writerow(fieldnames)
+            self._files[filename] = (file_handle, writer, list(fieldnames))
+
+    def writerow(self, filename, row):
+        """Buffer a row (dictionary keyed by field) for *filename*.
+
+        As with *csv.DictWriter*, missing fields are left empty and a
+        field that is not in the file's fieldnames raises a ValueError.
+        """
+        try:
+            fieldnames = self._files[filename][2]
+        except KeyError:
+            raise ValueError("%s was not added to the session writer" %
+                             filename)
+        extra = [key for key in row if key not in fieldnames]
+        if len(extra):
+            raise ValueError("dict contains fields not in fieldnames: %s" %
+                             ", ".join(repr(key) for key in extra))
+        values = [_cell(row.get(field)) for field in fieldnames]
+        with self._condition:
+            if self._closed:
+                raise ValueError("writing to a closed session writer")
+            self._rows.append((filename, values))
+            if len(self._rows) >= self._max_rows:
+                self._condition.notify()
+
+    def _write(self):
+        # take the buffered rows and write them, one thread at a time so
+        # rows keep their order
+        with self._write_lock:
+            with self._condition:
+                rows = self._rows
+                self._rows = []
+            if not len(rows):
+                return
+            written = set()
+            for filename, values in rows:
+                self._files[filename][1].writerow(values)
+                written.add(filename)
+            for filename in written:
+                file_handle = self._files[filename][0]
+                file_handle.flush()
+                if self._sync:
+                    os.fsync(file_handle.fileno())
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._closed and len(self._rows) < self._max_rows:
+                    self._condition.wait(self._flush_interval)
+                if self._closed:
+                    return
+            self._write()
+
+    def flush(self):
+        """Write every buffered row now."""
+        self._write()
+
+    def close(self):
+        """Write every buffered row and close the files."""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self._write()
+        with self._write_lock:
+            for file_handle, writer, fieldnames in self._files.values():
+                file_handle.close()
+            self._files.clear()
@@ -16,16 +16,17 @@ import inspect
 import weakref
 import sys
 
-from os import fsync, remove
+from os import remove
 import os.path
 from . import kivy_overrides
-from .ref import Ref, val, NotAvailable, NotAvailableError
+from kivy.logger import Logger
+from .ref import Ref, val, val_with, NotAvailable, NotAvailableError
 # Due to namespace issues, ref.jitter is imported as ref_jitter
 from .ref import jitter as ref_jitter
 # Due to namespace issues, ref.shuffle is imported as ref_shuffle
 from .ref import shuffle as ref_shuffle
-from .log import LogWriter, log2csv
-from .clock import clock
+from .log import get_log_writer, log2csv
+from .clock import clock, PRIORITY_NORMAL
 
 
 class StateConstructionError(RuntimeError):
@@ -35,6 +36,23 @@ class StateConstructionError(RuntimeError):
     pass
 
 
+# Attributes kept in slots of clones (see StateClone), rather than in a
+# dictionary.  Every execution of a state sets the first ones, and the rest
+# are read from the builder often enough to be worth copying.
+_CLONE_SLOTS = ("_builder_attrs", "_active", "_parent", "_ref_context",
+                "_start_time", "_end_time", "_started", "_ended",
+                "_enter_time", "_leave_time", "_finalize_time",
+                "_following_may_run", "_State__finalize_callbacks",
+                "_State__issued_refs", "_State__original_state", "_exp",
+                "_frozen_plan")
+
+# Builder attributes a clone must not read.
+_UNSHARED_ATTRS = frozenset(["_builder_attrs",
+                             "_State__most_recently_entered_clone",
+                             "_StateBuilder__shadowing_attrs",
+                             "_StateBuilder__cloned"])
+
+
 class StateBuilder(object):
     """A Mixin class that gives States Ref-based attribute access for state
     machine construction.
@@ -44,15 +62,26 @@ class StateBuilder(object):
         """Return an inactive copy of this state builder as an instance of its
         state class with the specified parent.
 
+        The copy is copy-on-write (see *StateClone*), so cloning does not copy
+        the attributes of the builder.  Should the builder set an attribute
+        once it has clones, it first moves to a copy of its attributes (see
+        *__setattr__*), so the clones keep the values they were cloned with.
+
         """
-        # Make a shallow copy of self.
-        state_class = type(self)._state_class
-        new_clone = state_class.__new__(state_class, use_state_class=True)
-        new_clone.__dict__.update(self.__dict__)
+        clone_class = type(self)._state_class._clone_class
+        new_clone = clone_class.__new__(clone_class, use_state_class=True)
+
+        # Share the attributes of self, copying the most used ones to slots.
+        builder_attrs = self.__dict__
+        builder_attrs["_StateBuilder__cloned"] = True
+        object.__setattr__(new_clone, "_builder_attrs", builder_attrs)
+        for attr in ("_State__issued_refs", "_State__original_state", "_exp",
+                     "_frozen_plan"):
+            object.__setattr__(new_clone, attr, builder_attrs[attr])
 
-        # Delete the __most_recently_entered_clone attribute from the new clone
-        # to avoid a chain of clones resulting in a memory leak.
-        del new_clone.__dict__["_State__most_recently_entered_clone"]
+        # Copy the attributes that a class attribute would otherwise hide.
+        for attr in self._get_shadowing_attrs():
+            new_clone.__dict__[attr] = builder_attrs[attr]
 
         # Replace certain attributes with deep copies of themselves.
         for attr in self._deepcopy_attrs:
@@ -69,6 +98,24 @@ class StateBuilder(object):
 
         return new_clone
 
+    def _get_shadowing_attrs(self):
+        # names of attributes of self that are also class attributes, which
+        # a clone would find before falling back to the builder's attributes
+        builder_attrs = self.__dict__
+        try:
+            n_attrs, attrs = builder_attrs["_StateBuilder__shadowing_attrs"]
+        except KeyError:
+            n_attrs, attrs = None, ()
+        if n_attrs != len(builder_attrs):
+            builder_attrs["_StateBuilder__shadowing_attrs"] = None
+            state_class = type(self)._state_class
+            attrs = tuple(attr for attr in builder_attrs
+                          if attr not in _CLONE_SLOTS and
+                          hasattr(state_class, attr))
+            builder_attrs["_StateBuilder__shadowing_attrs"] = (
+                len(builder_attrs), attrs)
+        return attrs
+
     def __getattr__(self, name):
         try:
             return self.get_attribute_ref(name)
@@ -86,6 +133,12 @@ class StateBuilder(object):
             except NotImplementedError:
                 raise AttributeError("State does not support attribute setting!")
 
+        # Leave the attributes shared with clones as they were cloned.
+        if "_StateBuilder__cloned" in self.__dict__:
+            builder_attrs = dict(self.__dict__)
+            del builder_attrs["_StateBuilder__cloned"]
+            object.__setattr__(self, "__dict__", builder_attrs)
+
         # First, set the attribute value as normal.
         super(StateBuilder, self).__setattr__(name, value)
 
@@ -105,16 +158,66 @@ class StateBuilder(object):
         # return that plus the log attribute names
         return lst + self._log_attrs
 
+class StateClone(object):
+    """A Mixin class for the copies of a state builder that are entered.
+
+    A clone shares the attributes of its builder until it sets its own, which
+    go in slots for the fields every execution of a state sets, and in its
+    own dictionary for the rest, so entering a state only allocates what that
+    execution changes.  Reading an attribute the clone has not set falls back
+    to the builder's.
+
+    """
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        if name not in _UNSHARED_ATTRS:
+            try:
+                return self._builder_attrs[name]
+            except KeyError:
+                pass
+        raise AttributeError("%r object has no attribute %r" %
+                             (type(self).__name__, name))
+
+
+class _FrozenPlan(object):
+    """What entering and logging a frozen state needs from its builder (see
+    *State.freeze*).
+
+    *init_attrs* holds (name, value, evaluate) for each '_init_' value, where
+    *evaluate* is None for a constant, the bound *eval* of a Ref, or a *val*
+    of the value otherwise.  *log_attrs* holds (name, attribute name, whether
+    to clean the path) for each logged attribute.
+    """
+    __slots__ = ("init_attrs", "log_attrs")
+
+    def __init__(self, init_attrs, log_attrs):
+        self.init_attrs = init_attrs
+        self.log_attrs = log_attrs
+
+
+def _init_attr_error(value, name, state):
+    return NotAvailableError(
+        ("Attempting to use unavailable value (%r) "
+         "for attribute %r of %r.  Do you need to use a Done "
+         "state?") % (value, name, state))
+
+
 class StateClass(type):
-    """A metaclass for States that creates a StateBuilder class for each State
-    class.
+    """A metaclass for States that creates a StateBuilder class and a
+    StateClone class for each State class.
     """
     def __init__(cls, name, bases, dict_):
         super(StateClass, cls).__init__(name, bases, dict_)
-        if StateBuilder not in bases:
+        if StateBuilder not in bases and StateClone not in bases:
             cls._builder_class = type(cls.__name__ + "Builder",
                                       (StateBuilder, cls),
                                       {"_state_class": cls})
+            # named like cls, as the class name is used in logs
+            cls._clone_class = type(cls.__name__, (cls, StateClone),
+                                    {"__slots__": _CLONE_SLOTS,
+                                     "__module__": cls.__module__,
+                                     "__qualname__": cls.__qualname__})
 
 
 class State(object, metaclass=StateClass):
@@ -174,6 +277,12 @@ class State(object, metaclass=StateClass):
     # it cleaned relative to the working directory.
     _to_be_cleaned_attrs = []
 
+    # clock priority class used when a parent schedules this state's enter
+    _clock_priority = PRIORITY_NORMAL
+
+    # The attributes of the builder, in clones (see StateClone).
+    _builder_attrs = {}
+
     def __new__(cls, *pargs, **kwargs):
         use_state_class = kwargs.pop("use_state_class", False)
         if use_state_class or issubclass(cls, StateBuilder):
@@ -189,6 +298,9 @@ class State(object, metaclass=StateClass):
         # change.  This is first so that __setattr__ will work.
         self.__dict__["_State__issued_refs"] = weakref.WeakValueDictionary()
 
+        # Precomputed plan for entering and logging this state, if frozen.
+        self.__dict__["_frozen_plan"] = None
+
         # If true, we write a log entry every time this state finalizes.
         self.__save_log = save_log
 
@@ -349,11 +461,9 @@ class State(object, metaclass=StateClass):
 
         # If we've issued a Ref for this attribute, notify the Ref that its
         # dependencies have changed.
-        try:
-            ref = self.__issued_refs[name[1:]]
-        except KeyError:
-            return
-        ref.dep_changed()
+        ref = self.__issued_refs.get(name[1:])
+        if ref is not None:
+            ref.dep_changed()
 
     def set_instantiation_context(self, obj=None):
         """Set this state's instantiation filename and line number to be the
@@ -430,6 +540,40 @@ class State(object, metaclass=StateClass):
         # clear the tracing flag
         self.__tracing = False
 
+    def freeze(self):
+        """Precompute what entering and logging this state needs from the
+        builder, which does not change once the state machine runs.
+
+        Constant '_init_' values are then set without *val*, Refs are
+        compiled ahead of time and evaluated directly, and the Refs issued
+        for the attributes of this state are bound in a plain dictionary, so
+        setting an attribute does not search the weak references for them.
+        """
+        init_attrs = []
+        for name, value in self._refs_for_init_attrs.items():
+            if isinstance(value, Ref):
+                evaluate = value.compile().eval
+            elif isinstance(value, (list, tuple, dict, slice)) or \
+                 value is NotAvailable:
+                evaluate = partial(val, value)
+            else:
+                evaluate = None
+            init_attrs.append((name, value, evaluate))
+        log_attrs = tuple((name, "_" + name,
+                           name in self._to_be_cleaned_attrs)
+                          for name in self._log_attrs)
+        self.__dict__["_frozen_plan"] = _FrozenPlan(tuple(init_attrs),
+                                                    log_attrs)
+        self.__dict__["_State__issued_refs"] = dict(self.__issued_refs)
+
+    def thaw(self):
+        """Undo *freeze*.
+        """
+        self.__dict__["_frozen_plan"] = None
+        if not isinstance(self.__issued_refs, weakref.WeakValueDictionary):
+            self.__dict__["_State__issued_refs"] = \
+                weakref.WeakValueDictionary(self.__issued_refs)
+
     def print_trace_msg(self, msg):
         """Print a one line message as part of trace output.
         """
@@ -562,7 +706,8 @@ class State(object, metaclass=StateClass):
 
     def get_attribute_ref(self, name):
         internal_name = "_" + name
-        if internal_name not in self.__dict__:
+        if internal_name not in self.__dict__ and \
+           internal_name not in self._builder_attrs:
             raise NameError
         try:
             # If we already issued such a Ref, return that preexisting Ref.
@@ -649,14 +794,21 @@ class State(object, metaclass=StateClass):
             self._exp = Experiment._last_instance()
 
         # evaluate the '_init_' Refs...
-        for name, value in self._refs_for_init_attrs.items():
-            try:
-                setattr(self, name, val(value))
-            except NotAvailableError:
-                raise NotAvailableError(
-                    ("Attempting to use unavailable value (%r) "
-                     "for attribute %r of %r.  Do you need to use a Done "
-                     "state?") % (value, name, self))
+        if self._frozen_plan is None:
+            for name, value in self._refs_for_init_attrs.items():
+                try:
+                    setattr(self, name, val(value))
+                except NotAvailableError:
+                    raise _init_attr_error(value, name, self)
+        else:
+            for name, value, evaluate in self._frozen_plan.init_attrs:
+                if evaluate is None:
+                    setattr(self, name, value)
+                    continue
+                try:
+                    setattr(self, name, evaluate())
+                except NotAvailableError:
+                    raise _init_attr_error(value, name, self)
 
         # propagate self to ancestors' ref contexts...
         ancestor = self._parent
@@ -787,10 +939,15 @@ class State(object, metaclass=StateClass):
         """Write a record to the state log for the current execution of the
         state.
         """
-        tempdict = {name: self._exp.clean_path(getattr(self, "_" + name))
-                    if name in self._to_be_cleaned_attrs
-                    else getattr(self, "_" + name)
-                    for name in self._log_attrs}
+        if self._frozen_plan is None:
+            tempdict = {name: self._exp.clean_path(getattr(self, "_" + name))
+                        if name in self._to_be_cleaned_attrs
+                        else getattr(self, "_" + name)
+                        for name in self._log_attrs}
+        else:
+            tempdict = {name: self._exp.clean_path(getattr(self, attr))
+                        if clean else getattr(self, attr)
+                        for name, attr, clean in self._frozen_plan.log_attrs}
         self._exp.write_to_state_log(type(self).__name__,
                                      tempdict)
 
@@ -951,6 +1108,21 @@ class ParentState(State):
         for child in self._children:
             child.troff()
 
+    def freeze(self):
+        """Precompute the plans of this state and all its children (see
+        *State.freeze*).
+        """
+        super(ParentState, self).freeze()
+        for child in self._children:
+            child.freeze()
+
+    def thaw(self):
+        """Undo *freeze* for this state and all its children.
+        """
+        super(ParentState, self).thaw()
+        for child in self._children:
+            child.thaw()
+
     def begin_log(self):
         """Prepare per-class state logs for this state and all its children.
         """
@@ -1187,7 +1359,8 @@ class Parallel(ParentState):
         # set of all non-run cloned children
         self.__remaining.add(child)
         # schedule the state to run
-        clock.schedule(partial(child.enter, start_time))
+        clock.schedule(partial(child.enter, start_time),
+                       priority=child._clock_priority)
         # return the child
         return child
 
@@ -1417,7 +1590,8 @@ class SequentialState(ParentState):
                 next(self.__child_iterator)._clone(self))
             # schedule the child based on the current start time
             clock.schedule(partial(self.__current_child.enter,
-                                   self._start_time))
+                                   self._start_time),
+                           priority=self.__current_child._clock_priority)
         except StopIteration:
             # if there are no children, we're done and can leave
             self._end_time = self._start_time
@@ -1447,7 +1621,8 @@ class SequentialState(ParentState):
                 # clone the next child and schedule it
                 self.__current_child = (
                     next(self.__child_iterator)._clone(self))
-                clock.schedule(partial(self.__current_child.enter, next_time))
+                clock.schedule(partial(self.__current_child.enter, next_time),
+                               priority=self.__current_child._clock_priority)
             except StopIteration:
                 # there are no more children, so set our end time and leave
                 self._end_time = next_time
@@ -1924,6 +2099,18 @@ class Loop(SequentialState):
             Label(text=exp.X, duration=3)
             exp.X += 1
 
+
+    To keep the files for upcoming trials loaded, pass the Refs that name
+    them to *prefetch*. They are evaluated for the next few iterations and
+    handed to a loader, by default the *Image* texture cache.
+
+    ::
+
+        with Loop(trials) as trial:
+            face_source = face_directory + trial.current['face'] + '.jpg'
+            trial.prefetch(face_source, window=3)
+            Image(source=face_source, duration=1)
+
     """
     def __init__(self, iterable=None, shuffle=False, conditional=True,
                  parent=None, save_log=True, name=None, blocking=True):
@@ -1946,9 +2133,74 @@ class Loop(SequentialState):
         self.__body_state._instantiation_lineno = self._instantiation_lineno
         self.__current_child = None
         self.__cancel_time = None
+        self._prefetchers = []
+        self.__prefetched = []
 
         self._log_attrs.extend(['outcome', 'i', 'current'])
 
+    def prefetch(self, *resources, window=3, loader=None):
+        """Load resources for upcoming iterations ahead of time.
+
+        Each iteration, *resources* are evaluated for the items of the
+        next *window* iterations, as if *current* and *i* already had
+        those values, and the results are passed as a list to *loader*.
+        Resources that can not be evaluated yet (e.g., they depend on a
+        response) are skipped.  So are resources that fail with a KeyError,
+        IndexError, or TypeError (e.g., a misspelled key), and the first
+        of those failures in each run of the loop is logged as a warning.
+
+        Parameters
+        ----------
+        *resources : Refs or values
+            Usually Refs built from *current*, like image filenames.
+        window : integer (default = 3)
+            How many iterations ahead to load; this bounds how much is
+            loaded but not yet used.
+        loader : callable (optional)
+            Called with each list of evaluated resources. Defaults to
+            *preload* of the *Image* texture cache.
+
+        """
+        if loader is None:
+            from .texture_cache import texture_cache
+            loader = texture_cache.preload
+        self._prefetchers.append((resources, window, loader,
+                                  self.get_attribute_ref("current"),
+                                  self.get_attribute_ref("i")))
+
+    def _prefetch_ahead(self, i, count):
+        # hand each loader everything up to its window past iteration i
+        for n, (resources, window, loader, current_ref, i_ref) in \
+            enumerate(self._prefetchers):
+            stop = min(i + window + 1, count)
+            values = []
+            for j in range(max(self.__prefetched[n], i), stop):
+                if isinstance(self._iterable, int):
+                    current = j
+                else:
+                    current = self._iterable[j]
+                substitutions = [(current_ref, current), (i_ref, j)]
+                for resource in resources:
+                    try:
+                        value = val_with(resource, substitutions)
+                    except (NotAvailableError, RuntimeError):
+                        # not known until the iteration runs (e.g., a state
+                        # that has no current clone yet)
+                        continue
+                    except (KeyError, IndexError, TypeError) as e:
+                        # prefetching is best effort, but this may be a typo
+                        if not self.__prefetch_warned:
+                            self.__prefetch_warned = True
+                            Logger.warning(
+                                "SMILE: Loop.prefetch skipped %r for "
+                                "iteration %d: %r" % (resource, j, e))
+                        continue
+                    if value is not None:
+                        values.append(value)
+            self.__prefetched[n] = max(self.__prefetched[n], stop)
+            if len(values):
+                loader(values)
+
     def iter_i(self):
         """Generate successive values of i for this loop, setting 'outcome'
         value as appropriate.
@@ -1977,12 +2229,20 @@ class Loop(SequentialState):
 
     def _get_child_iterator(self):
         self._outcome = NotAvailable
+        self.__prefetched = [0] * len(self._prefetchers)
+        self.__prefetch_warned = False
         for i in self.iter_i():
             self._i = i
             if self._iterable is None or isinstance(self._iterable, int):
                 self._current = i
             else:
                 self._current = self._iterable[i]
+            if len(self._prefetchers) and self._iterable is not None:
+                if isinstance(self._iterable, int):
+                    count = self._iterable
+                else:
+                    count = len(self._iterable)
+                self._prefetch_ahead(i, count)
             yield self.__body_state
 
     def __enter__(self):
@@ -2019,6 +2279,9 @@ class Record(State):
             List of strings matching key word arg names to trigger on. This
             makes it possible to only save out all values when a certain set
             of references change values
+        log_format : string (optional)
+            The .slog format to write, either "pickle" or "columnar".
+            Defaults to the format of the *Experiment*.
         kwargs : (keyword = parameter)
             This is where you add what variables to check to see if they
             change. Give *Record* a parameter name and then make that equal to
@@ -2040,7 +2303,7 @@ class Record(State):
 
     """
     def __init__(self, duration=None, parent=None, name=None, blocking=True,
-                 triggers=None, **kwargs):
+                 triggers=None, log_format=None, **kwargs):
         super(Record, self).__init__(parent=parent,
                                      duration=duration,
                                      save_log=False,
@@ -2049,6 +2312,7 @@ class Record(State):
 
         self.__refs = kwargs
         self.__triggers = triggers
+        self._log_format = log_format
         self.__log_filename = None
         self.__log_writer = None
 
@@ -2070,7 +2334,14 @@ class Record(State):
 
         if self.__log_writer is not None:
             self.__log_writer.close()
-        self.__log_writer = LogWriter(self.__log_filename)
+        if self._log_format is None:
+            log_format = self._exp._log_format
+        else:
+            log_format = self._log_format
+        self.__log_writer = get_log_writer(self.__log_filename, log_format)
+        if self._exp._log_sink is not None:
+            self.__log_writer = self._exp._log_sink.get_writer(
+                self.__log_writer)
 
     def end_log(self, to_csv=False):
         """Close logs.
@@ -2166,6 +2437,17 @@ class Log(AutoFinalizeState):
         Experiment automatically.
     name : string (optional)
         The unique name of this state
+    flush : boolean (optional, default = True)
+        Whether to push the record (and the state logs) to disk as soon
+        as it is written. Ignored when the *Experiment* uses
+        *async_logging*, which commits records in groups instead.
+    durable : boolean (optional, default = False)
+        If True, each record is fsynced as soon as it is written, even
+        with *async_logging*. Use this for logs that must survive a crash,
+        such as checkpoints.
+    log_format : string (optional)
+        The .slog format to write, either "pickle" or "columnar".
+        Defaults to the format of the *Experiment*.
     kwargs : (keyword = argument)
         As many arguments as you would like to pass in. Use the format
         `keyword = variable_name` and *Log* will log the value of
@@ -2212,7 +2494,7 @@ class Log(AutoFinalizeState):
 
     """
     def __init__(self, log_dict=None, parent=None, name=None, flush=True,
-                 **kwargs):
+                 durable=False, log_format=None, **kwargs):
         # init the parent class
         super(Log, self).__init__(parent=parent,
                                   name=name,
@@ -2221,6 +2503,8 @@ class Log(AutoFinalizeState):
         self._init_log_dict = log_dict
         self._init_log_items = kwargs
         self._flush = flush
+        self._durable = durable
+        self._log_format = log_format
         self.__log_filename = None
         self.__log_writer = None
 
@@ -2243,7 +2527,14 @@ class Log(AutoFinalizeState):
             remove(self.__log_filename)
 
         self.__log_filename = self._exp.reserve_data_filename(title, "slog")
-        self.__log_writer = LogWriter(self.__log_filename)
+        if self._log_format is None:
+            log_format = self._exp._log_format
+        else:
+            log_format = self._log_format
+        self.__log_writer = get_log_writer(self.__log_filename, log_format)
+        if self._exp._log_sink is not None:
+            self.__log_writer = self._exp._log_sink.get_writer(
+                self.__log_writer, durable=self._durable)
 
     def end_log(self, to_csv=False):
         """Close logs.
@@ -2274,9 +2565,8 @@ class Log(AutoFinalizeState):
                 self.__log_writer.write_record(record)
         else:
             raise ValueError("Invalid log_dict value: %r" % self._log_dict)
-        if self._flush:
-            self.__log_writer._file.flush()
-            fsync(self.__log_writer._file)
+        if self._exp._log_sink is None and (self._flush or self._durable):
+            self.__log_writer.flush()
             self._exp._flush_state_loggers()
         self._started = True
         self._ended = True
@@ -0,0 +1,263 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# ex: set sts=4 ts=4 sw=4 et:
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See the COPYING file distributed along with the smile package for the
+#   copyright and license terms.
+#
+# ## ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+
+import os
+import json
+import threading
+import time
+from collections import OrderedDict
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from . import kivy_overrides
+from kivy.core.image import ImageLoader
+from kivy.resources import resource_find
+
+# extensions of the files preload_trials treats as images
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff",
+                    ".tga", ".webp")
+
+
+class _TextureEntry(object):
+    __slots__ = ("image", "texture", "n_bytes", "texture_bytes")
+
+    def __init__(self, image, n_bytes):
+        self.image = image
+        self.texture = None
+        # decoded data held in memory, which is released on upload
+        self.n_bytes = n_bytes
+        self.texture_bytes = 0
+
+
+class TextureCache(object):
+    """LRU cache of decoded images and their textures for *Image* states.
+
+    Entries are keyed on the resolved file path and whether mipmaps are
+    generated.  Images can be decoded ahead of time on a background
+    thread with *preload* or *preload_trials*; the texture upload itself
+    has to happen on the thread running the experiment, so it is done the
+    first time an *Image* shows the file, which also releases the decoded
+    data.  Once the decoded images still held add up to more than
+    *max_bytes*, or the uploaded textures to more than
+    *max_texture_bytes*, the least recently used entries are dropped.
+
+    Animated images (e.g., gifs) are not cached, so *Image* falls back to
+    loading them the usual way.
+
+    Parameters
+    ----------
+    max_bytes : integer (default = 256 MB)
+        Budget for the decoded images that have not been uploaded yet,
+        counting 4 bytes per pixel.
+    max_texture_bytes : integer (default = 256 MB)
+        Budget for the uploaded textures, counting 4 bytes per pixel.
+
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024,
+                 max_texture_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_texture_bytes = max_texture_bytes
+        self._entries = OrderedDict()
+        self._n_bytes = 0
+        self._n_texture_bytes = 0
+        self._lock = threading.Lock()
+        self._preload_queue = queue.Queue()
+        self._preload_thread = None
+        self._stats = {"hits": 0,
+                       "misses": 0,
+                       "preloaded": 0,
+                       "evictions": 0,
+                       "errors": 0,
+                       "decode_time": 0.0,
+                       "upload_time": 0.0}
+
+    def _key(self, source, mipmap):
+        filename = resource_find(source)
+        if filename is None:
+            return None
+        return (os.path.abspath(filename), bool(mipmap))
+
+    def _decode(self, key):
+        # decode without touching OpenGL, so this works on any thread
+        start = time.perf_counter()
+        try:
+            image = ImageLoader.load(key[0], mipmap=key[1], keep_data=False,
+                                     nocache=True)
+        except Exception:
+            image = None
+        decode_time = time.perf_counter() - start
+        with self._lock:
+            self._stats["decode_time"] += decode_time
+            if image is None:
+                self._stats["errors"] += 1
+        return image
+
+    def _add(self, key, image):
+        # add a decoded image, evicting the least recently used ones
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry
+            entry = _TextureEntry(image, image.width * image.height * 4)
+            self._entries[key] = entry
+            self._n_bytes += entry.n_bytes
+            self._evict()
+            return entry
+
+    def _evict(self):
+        # drop the least recently used entries until both budgets are met
+        # (called with the lock held); the most recent entry is last, so
+        # it is never dropped
+        while (self._n_bytes > self.max_bytes or
+               self._n_texture_bytes > self.max_texture_bytes) and \
+              len(self._entries) > 1:
+            old_key, old_entry = self._entries.popitem(last=False)
+            self._n_bytes -= old_entry.n_bytes
+            self._n_texture_bytes -= old_entry.texture_bytes
+            self._stats["evictions"] += 1
+
+    def _uploaded(self, key, entry):
+        # the decoded data was released, so count the texture instead
+        with self._lock:
+            if self._entries.get(key) is not entry:
+                # evicted meanwhile, so it is no longer counted
+                return
+            entry.texture_bytes = entry.image.width * entry.image.height * 4
+            self._n_texture_bytes += entry.texture_bytes
+            self._n_bytes -= entry.n_bytes
+            entry.n_bytes = 0
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def get_texture(self, source, mipmap=False):
+        """Texture for *source*, or None if it must be loaded by kivy.
+
+        Must be called from the thread running the experiment.
+        """
+        key = self._key(source, mipmap)
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+            else:
+                self._stats["misses"] += 1
+        if entry is None:
+            image = self._decode(key)
+            if image is None:
+                return None
+            entry = self._add(key, image)
+        if len(entry.image._data) > 1:
+            # animated, so let kivy handle it
+            return None
+        if entry.texture is None:
+            start = time.perf_counter()
+            entry.texture = entry.image.texture
+            with self._lock:
+                self._stats["upload_time"] += time.perf_counter() - start
+            self._uploaded(key, entry)
+        return entry.texture
+
+    def preload(self, sources, mipmap=False):
+        """Decode *sources* on a background thread.
+
+        Parameters
+        ----------
+        sources : list of strings
+            Image files, found the same way *Image* finds its source.
+        mipmap : boolean (default = False)
+            Must match the *mipmap* of the *Image* states showing them.
+
+        """
+        for source in sources:
+            self._preload_queue.put((source, mipmap))
+        if self._preload_thread is None:
+            self._preload_thread = threading.Thread(target=self._run_preload)
+            self._preload_thread.daemon = True
+            self._preload_thread.start()
+
+    def preload_trials(self, trials, mipmap=False):
+        """Decode every image named in a list of trials.
+
+        Parameters
+        ----------
+        trials : list or string
+            Trials (e.g., a list of dictionaries of trial values, nested
+            lists of blocks of them are fine) or the filename of a JSON
+            file holding them.  Every string value ending in one of
+            *IMAGE_EXTENSIONS* is preloaded, in the order it appears.
+        mipmap : boolean (default = False)
+            Must match the *mipmap* of the *Image* states showing them.
+
+        Returns the list of sources that were queued.
+        """
+        if isinstance(trials, str):
+            with open(trials, "r") as f:
+                trials = json.load(f)
+        sources = []
+        seen = set()
+        stack = [trials]
+        while len(stack):
+            value = stack.pop()
+            if isinstance(value, dict):
+                stack.extend(reversed(list(value.values())))
+            elif isinstance(value, (list, tuple)):
+                stack.extend(reversed(value))
+            elif isinstance(value, str) and \
+                 value.lower().endswith(IMAGE_EXTENSIONS) and \
+                 value not in seen:
+                seen.add(value)
+                sources.append(value)
+        self.preload(sources, mipmap)
+        return sources
+
+    def _run_preload(self):
+        while True:
+            source, mipmap = self._preload_queue.get()
+            try:
+                key = self._key(source, mipmap)
+                with self._lock:
+                    cached = key is None or key in self._entries
+                if not cached:
+                    image = self._decode(key)
+                    if image is not None:
+                        self._add(key, image)
+                        with self._lock:
+                            self._stats["preloaded"] += 1
+            finally:
+                self._preload_queue.task_done()
+
+    def wait(self):
+        """Block until every queued preload has been decoded."""
+        self._preload_queue.join()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._n_bytes = 0
+            self._n_texture_bytes = 0
+
+    def get_stats(self):
+        """Hit, miss, preload, and eviction counts, the seconds spent
+        decoding and uploading, the entries cached, and the bytes of the
+        decoded images and of the uploaded textures.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._n_bytes
+            stats["texture_bytes"] = self._n_texture_bytes
+        return stats
+
+
+texture_cache = TextureCache()
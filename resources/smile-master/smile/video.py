@@ -13,7 +13,8 @@ import weakref
 from . import kivy_overrides
 from .state import State, CallbackState, Parallel, ParentState
 from .ref import val, Ref, NotAvailable
-from .clock import clock
+from .clock import clock, PRIORITY_VIDEO
+from .texture_cache import texture_cache
 
 import kivy.metrics
 import kivy.graphics
@@ -219,6 +220,9 @@ class VisualState(State):
         maximum error in calculating the disappear time of the stimulus.
 
     """
+    # enter ahead of deferred work so the video change is queued in time
+    _clock_priority = PRIORITY_VIDEO
+
     def __init__(self, duration=None, parent=None, save_log=True, name=None,
                  blocking=True):
         super(VisualState, self).__init__(parent=parent,
@@ -1136,6 +1140,8 @@ class Animate(State):
 
     """
     # TODO: log updates!
+    _clock_priority = PRIORITY_VIDEO
+
     def __init__(self, target, interval=None, duration=None, parent=None,
                  save_log=True, name=None, blocking=True, **anim_params):
         super(Animate, self).__init__(duration=duration, parent=parent,
@@ -1149,7 +1155,8 @@ class Animate(State):
     def _schedule_start(self):
         first_update_time = self._start_time + self._interval
         clock.schedule(self.update, event_time=first_update_time,
-                       repeat_interval=self._interval)
+                       repeat_interval=self._interval,
+                       priority=self._clock_priority)
 
     def _unschedule_start(self):
         clock.unschedule(self.update)
@@ -3247,7 +3254,20 @@ import kivy.uix.image
 kivy.uix.image.Image.__bases__ = (kivy.uix.widget.Widget, BlackHole,)
 
 
-class Image(WidgetState.wrap(kivy.uix.image.Image)):
+class _CachedImage(kivy.uix.image.Image):
+    """Kivy Image that takes static textures from the texture cache."""
+    def texture_update(self, *largs):
+        texture = None
+        if self.source and not self.nocache:
+            texture = texture_cache.get_texture(self.source, self.mipmap)
+        if texture is None:
+            super(_CachedImage, self).texture_update(*largs)
+        else:
+            self._clear_core_image()
+            self.texture = texture
+
+
+class Image(WidgetState.wrap(_CachedImage, name="Image")):
     """A WidgetState subclass to present and image on the screen.
 
     This state will present an image from a file onto the experiment window. By
@@ -3305,6 +3325,16 @@ class Image(WidgetState.wrap(kivy.uix.image.Image)):
     For other parameters or properties that this Widget might have, refer to the
     Kivy documentation for 'kivy.uix.image. <https://kivy.org/docs/api-kivy.uix.image.html>'_
 
+    Static images are shared through *smile.texture_cache.texture_cache*,
+    so each file is only decoded and uploaded once. To move that work off
+    the first trial, preload the files before running the experiment:
+
+    ::
+
+        from smile.texture_cache import texture_cache
+        texture_cache.preload_trials("experiment_block_list.json")
+        texture_cache.preload([crosshair_image, blank_image])
+
     """
     def _set_widget_defaults(self):
         self._widget.size = self._widget.texture_size
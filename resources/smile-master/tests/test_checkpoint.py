@@ -0,0 +1,69 @@
+import os
+import tempfile
+from smile.checkpoint import (CheckpointJournal, read_last_checkpoint,
+                              compact_checkpoint_journal)
+
+log_dir = tempfile.mkdtemp()
+journal_filename = os.path.join(log_dir, 'checkpoint.journal')
+fields = [('experiment_block', 'i'), ('experiment_phase', '16s'),
+          ('trial_index', 'i')]
+
+journal = CheckpointJournal(journal_filename, fields)
+print(journal.last(), len(journal))
+for i in range(1000):
+    journal.append(experiment_block=str(i // 100),
+                   experiment_phase='ENCODING', trial_index=i % 100)
+journal.close()
+
+# block 9, trial 99
+print(read_last_checkpoint(journal_filename))
+
+# a torn write of the newest count falls back to the record before it
+with open(journal_filename, 'r+b') as f:
+    f.seek(8 + 16 * (1000 % 2))
+    f.write(b'\xff' * 4)
+print(read_last_checkpoint(journal_filename))
+
+# compaction keeps only the last record
+print(compact_checkpoint_journal(journal_filename),
+      read_last_checkpoint(journal_filename),
+      os.path.getsize(journal_filename))
+
+# sessions without a journal fall back to the last row of the csv
+csv_filename = os.path.join(log_dir, 'checkpoint.csv')
+with open(csv_filename, 'w') as f:
+    f.write('subject,experiment_block,trial_index\n')
+print(read_last_checkpoint(journal_filename + '.missing', csv_filename))
+with open(csv_filename, 'a') as f:
+    f.write('R1001J,0,5\nR1001J,1,7\n')
+print(read_last_checkpoint(journal_filename + '.missing', csv_filename))
+
+# committing on a writer thread keeps the order of the records
+background_filename = os.path.join(log_dir, 'background.journal')
+journal = CheckpointJournal(background_filename, fields, background=True)
+for i in range(500):
+    journal.append(experiment_block=i // 100, experiment_phase='RETRIEVAL',
+                   trial_index=i % 100)
+journal.flush()
+print(len(journal), journal.last())
+print([record['trial_index'] for record in journal][95:105])
+journal.append(experiment_block=5, trial_index=0)
+journal.close()
+print(read_last_checkpoint(background_filename))
+reopened = CheckpointJournal(background_filename)
+print(len(reopened))
+reopened.close()
+
+# an error on the writer thread is raised on the experiment's thread
+journal = CheckpointJournal(background_filename, background=True)
+journal._file.close()
+journal.append(experiment_block=6, trial_index=0)
+try:
+    journal.flush()
+except ValueError:
+    print(True)
+try:
+    journal.close()
+except ValueError:
+    print(True)
+print(read_last_checkpoint(background_filename))
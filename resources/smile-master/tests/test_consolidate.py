@@ -0,0 +1,108 @@
+import os
+import csv
+import json
+import random
+import tempfile
+from smile.log import LogWriter
+from smile.consolidate import consolidate_logs, CONSOLIDATION_STATE_FILENAME
+
+log_dir = tempfile.mkdtemp()
+names = ['pulse', 'event', 'timing', 'checkpoint']
+
+# three unsorted logs per name, like a session run three times
+rng = random.Random(0)
+for name in names:
+    for i in range(3):
+        writer = LogWriter(os.path.join(log_dir, 'log_%s_%d.slog' % (name, i)))
+        for j in range(50):
+            writer.write_record({'log_time': rng.random() * 100, 'x': j,
+                                 'nested': {'a': i}})
+        writer.close()
+fieldnames = ['log_time', 'x', 'nested_a', 'missing']
+file_dictionary = {name: (os.path.join(log_dir, name + '.csv'), fieldnames)
+                   for name in names}
+
+# 150 rows each, then nothing on a rerun
+print(consolidate_logs(log_dir, file_dictionary))
+print(consolidate_logs(log_dir, file_dictionary))
+rows = list(csv.reader(open(file_dictionary['pulse'][0])))
+print(len(rows), rows[:2])
+print(all(float(a[0]) <= float(b[0]) for a, b in zip(rows[1:-1], rows[2:])))
+
+# a new log plus a write that crashed part way
+writer = LogWriter(os.path.join(log_dir, 'log_pulse_3.slog'))
+writer.write_record({'log_time': 1.0, 'x': 1})
+writer.close()
+state_filename = os.path.join(log_dir, CONSOLIDATION_STATE_FILENAME)
+state = json.load(open(state_filename))
+state['pulse']['offset'] = os.path.getsize(file_dictionary['pulse'][0])
+json.dump(state, open(state_filename, 'w'))
+with open(file_dictionary['pulse'][0], 'a') as f:
+    f.write('partial,row\n')
+
+# the partial row is dropped and only the new log appended (152 lines)
+print(consolidate_logs(log_dir, file_dictionary, processes=0))
+print(len(list(csv.reader(open(file_dictionary['pulse'][0])))))
+
+# batch mode: datetime folders under one root, matched on subject/session
+from smile.consolidate import batch_consolidate
+
+
+def consolidate_folder(log_directory, subject, session):
+    csv_dir = os.path.join(out_dir, subject, session)
+    if not os.path.isdir(csv_dir):
+        os.makedirs(csv_dir)
+    return consolidate_logs(log_directory,
+                            {'pulse': (os.path.join(csv_dir, 'pulse.csv'),
+                                       fieldnames)},
+                            processes=0)
+
+
+root_dir = tempfile.mkdtemp()
+out_dir = tempfile.mkdtemp()
+for k, folder in enumerate(['2024-01-01_10-00-00', '2024-01-01_11-00-00',
+                            '2024-01-02_10-00-00']):
+    os.makedirs(os.path.join(root_dir, folder))
+    writer = LogWriter(os.path.join(root_dir, folder, 'log_pulse_0.slog'))
+    writer.write_record({'log_time': 1.0, 'x': k, 'subject': 'R1001J',
+                         'session': str(k // 2)})
+    writer.close()
+os.makedirs(os.path.join(root_dir, 'empty'))
+
+# three folders consolidated, the empty one skipped, then nothing new
+print(batch_consolidate(root_dir, consolidate_folder, names=['pulse']))
+print(batch_consolidate(root_dir, consolidate_folder, names=['pulse'],
+                        processes=0))
+print(len(list(csv.reader(open(os.path.join(out_dir, 'R1001J', '0',
+                                            'pulse.csv'))))))
+
+# moving a folder after consolidating it: a failed consolidation leaves
+# the folder in place, so a rerun picks it up again
+from smile.consolidate import consolidate_and_move_logs
+
+src_dir = tempfile.mkdtemp()
+dst_dir = os.path.join(tempfile.mkdtemp(), 'session_logs', 'run_0')
+writer = LogWriter(os.path.join(src_dir, 'log_pulse_0.slog'))
+writer.write_record({'log_time': 1.0, 'x': 1})
+writer.close()
+csv_filename = os.path.join(tempfile.mkdtemp(), 'pulse.csv')
+bad_dictionary = {'pulse': (os.path.join(src_dir, 'missing', 'pulse.csv'),
+                            fieldnames)}
+try:
+    consolidate_and_move_logs(src_dir, dst_dir, bad_dictionary, processes=0)
+except IOError:
+    print(True)
+print(os.listdir(src_dir) == ['log_pulse_0.slog'], os.path.isdir(dst_dir))
+good_dictionary = {'pulse': (csv_filename, fieldnames)}
+print(consolidate_and_move_logs(src_dir, dst_dir, good_dictionary,
+                                processes=0))
+print(os.listdir(src_dir), sorted(os.listdir(dst_dir)))
+print(len(list(csv.reader(open(csv_filename)))))
+
+# a folder moved before it was consolidated is resumed where it went
+os.remove(os.path.join(dst_dir, CONSOLIDATION_STATE_FILENAME))
+os.remove(csv_filename)
+print(consolidate_and_move_logs(src_dir, dst_dir, good_dictionary,
+                                processes=0))
+print(consolidate_and_move_logs(src_dir, dst_dir, good_dictionary,
+                                processes=0))
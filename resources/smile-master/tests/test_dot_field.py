@@ -0,0 +1,34 @@
+import numpy as np
+from smile.moving_dots import DotField
+
+params = {"radius": 100, "direction": 90, "direction_variance": 0,
+          "speed": 50., "speed_variance": 0, "lifespan": 1.0,
+          "lifespan_variance": 0}
+random_params = dict(params, direction=0, direction_variance=360)
+
+# coherent dots move straight up, and every dot stays in the circle
+field = DotField([(300, params), (700, random_params)], seed=0)
+x, y = field.x.copy(), field.y.copy()
+field.update(0.01)
+moved = field.current_time > 0
+print(np.allclose(field.y[:300][moved[:300]] - y[:300][moved[:300]], 0.5),
+      np.allclose(field.x[:300][moved[:300]], x[:300][moved[:300]]))
+for i in range(200):
+    field.update(1 / 60.)
+print(np.all(np.hypot(field.x, field.y) <= 100 + 1e-9),
+      np.all(field.current_time <= field.total_time))
+
+# dots past their lifespan are reset
+field.update(2.0)
+print(np.all(field.current_time == 0.0))
+
+# new motion parameters apply from the next reset
+field.set_motion([(1000, dict(params, direction=0))])
+field.update(2.0)
+print(np.allclose(field.velocity_x, 50.), np.allclose(field.velocity_y, 0.))
+
+# points are interleaved and offset, in the same array every time
+points = field.get_points(10, 20)
+print(np.allclose(points[0::2], field.x + 10),
+      np.allclose(points[1::2], field.y + 20),
+      field.get_points(0, 0) is points)
@@ -0,0 +1,31 @@
+import os
+import tempfile
+from smile.frame_timing import FrameTimer, read_frame_timing, \
+                               format_frame_timing_summary
+
+tmp_dir = tempfile.mkdtemp()
+filename = os.path.join(tmp_dir, 'frame_timing_0.bin')
+
+# a small ring buffer so it wraps and dumps many times
+timer = FrameTimer(filename, flip_interval=1/60., size=64)
+flip_time = 0.0
+for i in range(1000):
+    # miss a flip every 100 frames
+    flip_time += 1/60. * (2 if i % 100 == 99 else 1)
+    timer.add_tick(0.0001)
+    timer.add_dispatch(flip_time - 0.001, 0.00005)
+    timer.add_draw(0.002)
+    timer.add_flip(flip_time, 0.004, True)
+timer.close()
+
+# every frame should be in the sidecar, with 10 missed flips
+frames = read_frame_timing(filename)
+print(len(frames['flip_time']), sum(frames['missed_flips']))
+for line in format_frame_timing_summary(timer.summary()):
+    print(line)
+
+# without a sidecar only the ring buffer is kept
+timer = FrameTimer(size=8)
+for i in range(20):
+    timer.add_flip(i / 60., 0.001, False)
+print(timer.summary()['n_frames'])
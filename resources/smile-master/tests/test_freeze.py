@@ -0,0 +1,35 @@
+import weakref
+from smile.common import *
+
+values = []
+
+exp = Experiment(show_splash=False, fullscreen=False)
+with Loop([{"word": "w%d" % i, "n": i % 3} for i in range(6)]) as trial:
+    with Parallel():
+        lbl = Label(text=trial.current["word"], duration=0.01)
+        Func(values.append, ["label", trial.i, trial.current["n"]])
+    with If(trial.current["n"] == 0):
+        Func(values.append, "zero")
+    with Elif(trial.current["n"] == 1):
+        Func(values.append, ("one", trial.current["word"]))
+    with Else():
+        Func(values.append, {"other": trial.i})
+    Wait(0.01)
+    with UntilDone():
+        Wait(0.005)
+    Done(lbl)
+    Func(values.append, lbl.text)
+
+exp.run(freeze=False)
+dynamic = values[:]
+del values[:]
+exp.run(freeze=True)
+
+# the same values, with the Refs issued for attributes bound while frozen
+print(values == dynamic, len(values) == 6 * 3)
+print(type(lbl._State__issued_refs) is dict, lbl._frozen_plan is not None)
+
+# and unbound again when not
+exp.run(freeze=False)
+print(isinstance(lbl._State__issued_refs, weakref.WeakValueDictionary),
+      lbl._frozen_plan is None)
@@ -0,0 +1,46 @@
+import math
+import numpy as np
+from smile.grating import (GratingTextureCache, grating_buffer, mask_buffer,
+                           get_period)
+
+# one period of the sine, from the midpoint of the colors at zero phase
+buf = np.frombuffer(grating_buffer(20, 1.0, (1., 0., 0.), (0., 0., 1.)),
+                    dtype=np.uint8).reshape(-1, 3)
+print(len(buf) == get_period(20), tuple(buf[0]) == (127, 0, 127))
+amp = 0.5 + 0.5 * math.sin(5 * math.pi / 180 * 20)
+print(tuple(buf[5]) == (int(amp * 255), 0, int((1.0 - amp) * 255)))
+
+# no contrast is the midpoint everywhere
+buf = np.frombuffer(grating_buffer(20, 0.0, (1., 1., 1.), (0., 0., 0.)),
+                    dtype=np.uint8)
+print(np.all(buf == 127))
+
+# masks only set the alpha, which grows away from the center (the last
+# pixel of the quadrant)
+for envelope in ["Gaussian", "Linear", "Circular"]:
+    mask = np.frombuffer(mask_buffer(envelope, 100, 100, 5.),
+                         dtype=np.uint8).reshape(50, 50, 4)
+    print(envelope, np.all(mask[..., :3] == 0), mask[49, 49, 3] < 10,
+          mask[0, 0, 3] == 255, np.all(np.diff(mask[:, 49, 3].astype(int)) <= 0))
+mask = np.frombuffer(mask_buffer("none", 100, 100), dtype=np.uint8)
+print(len(mask) == 50 * 50 * 4, np.all(mask == 0))
+
+# variants are computed once, with the phase and alpha not part of the key
+cache = GratingTextureCache()
+print(cache.precompute(250, contrast=0.5) == 2,
+      cache.precompute(250, contrast=0.5, color_one=(1., 1., 1., .5)) == 0,
+      cache.precompute(250, contrast=0.25) == 1)
+trials = [[{"contrast": c, "envelope": e, "word": "dog"}
+           for c in [0.25, 0.75] for e in ["g", "c"]],
+          [{"contrast": 0.25, "envelope": "g", "word": "cat"}]]
+variants = cache.precompute_trials(trials, width=250)
+stats = cache.get_stats()
+print(len(variants) == 4, stats["entries"] == 5, stats["precomputed"] == 5)
+
+# the least recently used variants are dropped once over budget
+n_bytes = 125 * 125 * 4
+cache = GratingTextureCache(max_bytes=2 * n_bytes)
+for width in [250, 250, 252, 254]:
+    cache.precompute(width, envelope="c", frequency=360)
+stats = cache.get_stats()
+print(stats["evictions"] > 0, stats["bytes"] <= 2 * n_bytes)
@@ -0,0 +1,107 @@
+import os
+import tempfile
+import time
+from smile.log import get_log_writer, log2dl, log2csv, log2columns, \
+                      is_columnar_log, LogSink, ColumnarLogReader, \
+                      LogWriter
+
+tmp_dir = tempfile.mkdtemp()
+
+# write the same records in both formats
+records = [{'log_time': 10.0 + i,
+            'trial_index': i,
+            'word': 'word_%d' % i,
+            'correct': i % 2 == 0,
+            'appear_time': {'time': 10.0 + i, 'error': 0.001}}
+           for i in range(100)]
+for log_format in ['pickle', 'columnar']:
+    root = os.path.join(tmp_dir, 'log_%s' % log_format)
+    writer = get_log_writer(root + '_0.slog', log_format)
+    for rec in records:
+        writer.write_record(rec)
+    writer.close()
+    print(log_format, is_columnar_log(root + '_0.slog'))
+
+    # both should read back the same way
+    dl = log2dl(root)
+    print(len(dl), dl[0])
+
+    # only some of the columns for a time range
+    print(log2columns(root, columns=['word'], start_time=50.0, end_time=52.0))
+
+    log2csv(root, root + '.csv')
+    with open(root + '.csv') as f:
+        print(f.readline().strip())
+
+# write through the background sink with group commit
+sink = LogSink(commit_records=16, commit_interval=0.1)
+root = os.path.join(tmp_dir, 'log_async')
+writer = sink.get_writer(get_log_writer(root + '_0.slog'))
+checkpoint = sink.get_writer(get_log_writer(root + '_checkpoint_0.slog'),
+                             durable=True)
+for rec in records:
+    writer.write_record(rec)
+    checkpoint.write_record({'log_time': rec['log_time'],
+                             'trial_index': rec['trial_index']})
+sink.barrier()
+print(sink.get_stats())
+writer.close()
+checkpoint.close()
+print(len(log2dl(root)), len(log2dl(root + '_checkpoint')))
+
+# records are snapshotted when queued, so changing the objects in them
+# afterwards doesn't reach the log, in either format
+for log_format in ['pickle', 'columnar']:
+    root = os.path.join(tmp_dir, 'log_snapshot_%s' % log_format)
+    writer = sink.get_writer(get_log_writer(root + '_0.slog', log_format))
+    responses = ['a']
+    writer.write_record({'log_time': 1.0, 'responses': responses})
+    responses.append('b')
+    writer.close()
+    print(log_format, log2dl(root, unwrap=False)[0]['responses'])
+
+# closing stops the writer thread, which starts again if needed
+sink.close()
+print(sink._thread is None)
+root = os.path.join(tmp_dir, 'log_restart')
+writer = sink.get_writer(get_log_writer(root + '_0.slog'))
+writer.write_record(records[0])
+writer.close()
+sink.close()
+print(len(log2dl(root)), sink._thread is None)
+
+
+# a commit that fails is reported once instead of being retried, and
+# closing still stops the writer thread before raising the error
+class FailingWriter(LogWriter):
+    flushes = 0
+
+    def flush(self, sync=True):
+        self.flushes += 1
+        raise OSError("disk full")
+
+
+root = os.path.join(tmp_dir, 'log_failing')
+failing = FailingWriter(root + '_0.slog')
+writer = sink.get_writer(failing)
+writer.write_record(records[0])
+time.sleep(0.5)
+thread = sink._thread
+try:
+    sink.close()
+except OSError as e:
+    print(repr(e))
+print(failing.flushes, sink._thread is None, thread.is_alive())
+
+# flushing every record journals it instead of cutting one-row chunks,
+# and a log that was never closed is read from its chunks and journal
+root = os.path.join(tmp_dir, 'log_flushed')
+writer = get_log_writer(root + '_0.slog', 'columnar', chunk_size=16)
+for rec in records[:40]:
+    writer.write_record(rec)
+    writer.flush()
+reader = ColumnarLogReader(root + '_0.slog')
+print(len(reader._chunks), list(reader) == records[:40],
+      os.path.exists(root + '_0.slog.journal'))
+writer.close()
+print(len(log2dl(root)) == 40, os.path.exists(root + '_0.slog.journal'))
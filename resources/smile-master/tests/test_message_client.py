@@ -0,0 +1,126 @@
+import json
+import time
+import socket
+import threading
+from smile.message_client import MessageClient, MessageSender
+from smile.message_template import MessageTemplate
+
+# a server that answers every message with its id, echoing heartbeats
+# only after a delay and answering the others right away
+server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+server_socket.bind(('127.0.0.1', 0))
+server_socket.listen(1)
+port = server_socket.getsockname()[1]
+
+
+def serve():
+    client, address = server_socket.accept()
+    buffer = b''
+    while True:
+        data = client.recv(4096)
+        if not data:
+            break
+        buffer += data
+        while b'\n' in buffer:
+            line, buffer = buffer.split(b'\n', 1)
+            message = json.loads(line.decode('utf-8'))
+            if message['type'] == 'EXIT':
+                continue
+            if message['type'] == 'HEARTBEAT':
+                time.sleep(0.01)
+            reply = {'type': message['type'] + '_OK', 'id': message['id'],
+                     'data': message['data']}
+            client.sendall((json.dumps(reply) + '\n').encode('utf-8'))
+    client.close()
+
+
+threading.Thread(target=serve, daemon=True).start()
+
+client = MessageClient('127.0.0.1', port)
+client.connect(timeout=5)
+print(client.request({'type': 'CONNECTED', 'id': 1, 'data': {}}, timeout=5))
+
+# ten heartbeats in flight at once, each matched to its own reply
+message = {'type': 'HEARTBEAT', 'id': 0, 'data': {'count': 0}}
+replies = []
+start = time.perf_counter()
+for i in range(10):
+    message['id'] = 100 + i
+    message['data']['count'] = i
+    replies.append(client.send(message, expect_response=True))
+print([reply.result(5)['data']['count'] for reply in replies])
+print(round(time.perf_counter() - start, 2))
+print(client.get_latency_stats('HEARTBEAT')['n'])
+
+# messages queued by a sender keep the time they were queued, and later
+# changes to the message do not leak into them
+logged = []
+sender = MessageSender(client, log=logged.append, stamp=time.perf_counter)
+message = {'type': 'WORD', 'id': 0, 'data': {'word': ''}}
+replies = []
+for i, word in enumerate(['APPLE', 'TABLE', 'RIVER']):
+    message['id'] = 300 + i
+    message['data']['word'] = word
+    replies.append(sender.send(message, expect_response=True))
+print([reply.result(5)['data']['word'] for reply in replies])
+sender.wait()
+print([entry['data']['word'] for entry in logged])
+print(logged[0]['time'] < logged[1]['time'] < logged[2]['time'])
+print(sender.get_latency_stats('WORD')['n'])
+
+# messages encoded from a template on the sender's thread
+template = MessageTemplate({'type': 'WORD', 'data': {'word': '', 'serialpos': 0},
+                            'id': 0, 'time': 0})
+reply = sender.send_template(template, True, id=400, word='LEMON', serialpos=4)
+print(reply.result(5)['data'])
+sender.wait()
+print(logged[-1]['id'], logged[-1]['data'])
+
+sender.send({'type': 'EXIT', 'id': 200, 'data': {}})
+sender.close()
+client.close()
+
+# replies with an id no message waits for go to on_message, unless the
+# client matches unknown ids; replies without an id go to the oldest
+server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+server_socket.bind(('127.0.0.1', 0))
+server_socket.listen(2)
+port = server_socket.getsockname()[1]
+
+
+def serve_reply_ids():
+    for _ in range(2):
+        client, address = server_socket.accept()
+        buffer = b''
+        while True:
+            data = client.recv(4096)
+            if not data:
+                break
+            buffer += data
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                message = json.loads(line.decode('utf-8'))
+                reply = {'type': message['type'] + '_OK'}
+                reply.update(message['data'])
+                client.sendall((json.dumps(reply) + '\n').encode('utf-8'))
+        client.close()
+
+
+threading.Thread(target=serve_reply_ids, daemon=True).start()
+
+unmatched = []
+client = MessageClient('127.0.0.1', port, on_message=unmatched.append)
+client.connect(timeout=5)
+first = client.send({'type': 'PING', 'id': 1, 'data': {'id': 99}}, True)
+second = client.send({'type': 'PING', 'id': 2, 'data': {'id': 2}}, True)
+print(second.result(5)['id'], first.done())
+third = client.send({'type': 'PING', 'id': 3, 'data': {}}, True)
+print(first.result(5), unmatched)
+client.close()
+print(type(third.exception()).__name__)
+
+client = MessageClient('127.0.0.1', port, match_unknown_ids=True)
+client.connect(timeout=5)
+print(client.request({'type': 'PING', 'id': 1, 'data': {'id': 0}},
+                     timeout=5))
+client.close()
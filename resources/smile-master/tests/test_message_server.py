@@ -0,0 +1,42 @@
+import time
+from smile.message_server import MessageServer, latency_distribution
+from smile.message_client import MessageClient
+
+print(latency_distribution(5)(), latency_distribution('uniform:1,1')())
+
+
+def echo(connection, message):
+    if message['type'] == 'EXIT':
+        connection.close()
+        return
+    connection.send({'type': message['type'] + '_OK', 'id': message['id'],
+                     'data': message['data']})
+
+
+# replies split into partial frames and coalesced into shared writes
+# still arrive whole and in order
+server = MessageServer(echo, latency='normal:2,1', split=0.5, coalesce=0.005,
+                       seed=0)
+port = server.start()
+client = MessageClient('127.0.0.1', port)
+client.connect(timeout=5)
+replies = [client.send({'type': 'HEARTBEAT', 'id': i, 'data': {'count': i}},
+                       expect_response=True) for i in range(20)]
+print([reply.result(5)['data']['count'] for reply in replies] ==
+      list(range(20)))
+stats = server.stats.as_dict()
+print(stats['messages_in'], stats['messages_out'], stats['split'] > 0,
+      stats['writes'] < stats['messages_out'] + stats['split'])
+client.close()
+server.stop()
+
+# dropped replies never arrive
+server = MessageServer(echo, drop=1.0)
+port = server.start()
+client = MessageClient('127.0.0.1', port)
+client.connect(timeout=5)
+reply = client.send({'type': 'HEARTBEAT', 'id': 1, 'data': {}}, True)
+time.sleep(0.1)
+print(reply.done(), server.stats.dropped)
+client.close()
+server.stop()
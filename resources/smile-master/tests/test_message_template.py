@@ -0,0 +1,40 @@
+import json
+from smile.message_template import MessageTemplate, compile_message_templates
+
+message_dictionary = {
+    'WORD': {'type': 'WORD',
+             'data': {'word': 'WORD_PAIR', 'serialpos': 0, 'stim': False},
+             'id': 0,
+             'time': 0.0},
+    'EXIT': {'type': 'EXIT', 'data': {}, 'id': 0, 'time': 0.0},
+    'STIMULATION_PARAMETERS': None}
+templates = compile_message_templates(message_dictionary)
+print(sorted(templates))
+print(templates['WORD'].fields)
+
+# same bytes as json.dumps, for defaults and for set fields
+print(templates['EXIT'].encode() ==
+      (json.dumps(message_dictionary['EXIT']) + '\n').encode('utf-8'))
+expected = {'type': 'WORD',
+            'data': {'word': 'CAT/DOG', 'serialpos': 3, 'stim': False},
+            'id': 12,
+            'time': 1234}
+print(templates['WORD'].encode(id=12, time=1234, word='CAT/DOG',
+                               serialpos=3) ==
+      (json.dumps(expected) + '\n').encode('utf-8'))
+
+# messages never share their data
+first = templates['WORD'].message(word='CAT/DOG')
+second = templates['WORD'].message(serialpos=5)
+print(first['data'], second['data'])
+print(message_dictionary['WORD']['data'])
+
+try:
+    templates['WORD'].encode(count=1)
+except ValueError as e:
+    print(e)
+
+try:
+    MessageTemplate({'type': 'BAD', 'data': {'id': 1}, 'id': 0})
+except ValueError as e:
+    print(e)
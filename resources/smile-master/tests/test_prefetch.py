@@ -0,0 +1,44 @@
+import logging
+from smile.common import *
+from smile.ref import Ref, val_with
+from kivy.logger import Logger
+
+# val_with evaluates as if some Refs had other values, without caching
+exp = Experiment(show_splash=False, fullscreen=False)
+items = [{"image": "a.png", "n": 1}, {"image": "b.png", "n": 2}]
+ref = Ref.getitem(Ref.object(items), 0)["image"]
+print(val_with(ref + "!", [(ref, "c.png")]), val(ref))
+print(val_with([ref, {"n": ref}], [(ref, 3)]))
+
+# capture the warnings about resources that could not be prefetched
+warnings = []
+handler = logging.Handler()
+handler.emit = lambda record: warnings.append(record.getMessage())
+Logger.addHandler(handler)
+
+trials = [{"image": "img%d.png" % i} for i in range(6)]
+loaded = []
+shown = []
+shuffled_loaded = []
+shuffled_shown = []
+with Loop(trials) as trial:
+    Func(shown.append, trial.current["image"])
+trial.prefetch(trial.current["image"], trial.i * 10, window=2,
+               loader=lambda values: loaded.append(values))
+# a misspelled key loads nothing and is reported once
+trial.prefetch(trial.current["imgae"],
+               loader=lambda values: loaded.append(values))
+with Loop(trials, shuffle=True) as shuffled:
+    Func(shuffled_shown.append, shuffled.current["image"])
+shuffled.prefetch(shuffled.current["image"], window=1,
+                  loader=lambda values: shuffled_loaded.extend(values))
+exp.run()
+
+# each iteration loads up to the window past it, never past the end
+print(loaded)
+print(shown == [t["image"] for t in trials])
+
+# shuffled loops prefetch in the order they present
+print(shuffled_loaded == shuffled_shown, len(shuffled_shown) == 6)
+
+print(len([w for w in warnings if "Loop.prefetch" in w]))
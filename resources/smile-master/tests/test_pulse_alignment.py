@@ -0,0 +1,68 @@
+import os
+import csv
+import tempfile
+import numpy as np
+from smile.pulse_alignment import match_pulses, align_pulses, read_times, \
+    align_events_file
+
+rng = np.random.RandomState(0)
+samplerate = 1000.
+
+# a burst, then pulses every 5000 +/- 300 ms, another burst, and more pulses
+intervals = np.concatenate([np.full(25, 50.),
+                            rng.normal(5000, 300, 2000),
+                            np.full(25, 50.),
+                            rng.normal(5000, 300, 2000)])
+task_times = 12345. + np.concatenate([[0], np.cumsum(intervals)])
+
+
+# the EEG clock is offset, runs 30 ppm fast, and drifts slowly
+def true_samples(times):
+    seconds = (times - task_times[0]) / 1000.
+    return (98765. + seconds * samplerate * (1 + 30e-6) +
+            2. * np.sin(seconds / 3000.))
+
+
+eeg_times = true_samples(task_times) + rng.normal(0, 0.3, len(task_times))
+
+# 2% of the pulses are missed, a few far off, and noise is detected
+keep = rng.rand(len(task_times)) > 0.02
+eeg_times[rng.choice(len(task_times), 10, replace=False)] += 40.
+eeg_samples = np.round(np.sort(np.concatenate(
+    [eeg_times[keep], rng.uniform(eeg_times[0], eeg_times[-1], 40)])))
+
+task_index, eeg_index = match_pulses(task_times, eeg_samples, samplerate)
+print(len(task_index) > 0.9 * keep.sum(),
+      np.all(np.abs(eeg_samples[eeg_index] -
+                    true_samples(task_times[task_index])) < 50))
+
+alignment = align_pulses(task_times, eeg_samples, samplerate)
+summary = alignment.summary()
+print(summary['n_blocks'], summary['residual_max'] < 2.)
+
+# event times convert to within a sample of their true sample
+event_times = rng.uniform(task_times[0], task_times[-1], 10000)
+print(np.max(np.abs(alignment.to_samples(event_times) -
+                    true_samples(event_times))) < 1.)
+
+# times far from every pulse can not be aligned
+print(np.isnan(alignment.to_samples([task_times[0] - 120000.]))[0])
+
+# the same from CSV files
+directory = tempfile.mkdtemp()
+pulses_file = os.path.join(directory, 'pulses.csv')
+events_file = os.path.join(directory, 'events.csv')
+with open(pulses_file, 'w', newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(['subject', 'pulse_time'])
+    writer.writerows([['SC000', t] for t in task_times])
+with open(events_file, 'w', newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(['subject', 'trial_time'])
+    writer.writerows([['SC000', event_times[0]], ['SC000', '']])
+alignment = align_pulses(read_times(pulses_file, 'pulse_time'), eeg_samples,
+                         samplerate)
+rows = align_events_file(events_file, alignment, ['trial_time'],
+                         os.path.join(directory, 'events_aligned.csv'))
+print(abs(rows[0]['trial_time_sample'] - true_samples(event_times[:1])[0]) <= 1,
+      rows[1]['trial_time_sample'] == '')
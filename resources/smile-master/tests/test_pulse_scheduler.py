@@ -0,0 +1,64 @@
+import time
+from smile.pulse_scheduler import PulseScheduler, interface_pulse, \
+    perf_counter_ns, sleep_until
+
+
+# a slow pulse and log do not push back the following deadlines
+def slow_pulse():
+    time.sleep(0.003)
+
+
+records = []
+scheduler = PulseScheduler(slow_pulse, log=records.append)
+start = perf_counter_ns() / 1e9
+print(scheduler.run(interval=0.02, count=20, start_delay=0.01))
+print(abs(records[-1]['intended'] - (start + 0.01 + 19 * 0.02)) < 0.002)
+print(max(record['error'] for record in records) < 0.002,
+      min(record['duration'] for record in records) >= 0.003)
+print(scheduler.get_error_stats())
+
+# a pulse sent late keeps the schedule, which only restarts once a whole
+# interval is missed
+def late_pulse():
+    if len(records) in (1, 4):
+        time.sleep(0.025 if len(records) == 1 else 0.045)
+
+
+records = []
+scheduler = PulseScheduler(late_pulse, log=records.append)
+print(scheduler.run(interval=0.02, count=8))
+intervals = [round(b['intended'] - a['intended'], 3)
+             for a, b in zip(records, records[1:])]
+print(intervals[:4], intervals[5:], intervals[4] > 0.04)
+
+# stopping interrupts the wait for the next pulse
+scheduler = PulseScheduler(lambda: None)
+thread = scheduler.start(interval=5.0, start_delay=5.0)
+time.sleep(0.05)
+scheduler.stop()
+thread.join(1.0)
+print(thread.is_alive(), scheduler.get_error_stats()['n'])
+
+# a stop flag is checked before each pulse
+pulses = []
+scheduler = PulseScheduler(lambda: pulses.append(1))
+print(scheduler.run(interval=0.001, until=lambda: len(pulses) >= 5))
+
+
+# pulses of a PulseInterface are set and cleared
+class FakeInterface(object):
+    def __init__(self):
+        self.data = []
+
+    def setData(self, data):
+        self.data.append((data, perf_counter_ns()))
+
+
+interface = FakeInterface()
+PulseScheduler(interface_pulse(interface, code=1, width=0.010)).run(0.02, 2)
+print([data for data, t in interface.data],
+      (interface.data[1][1] - interface.data[0][1]) / 1e9 >= 0.010)
+
+# waits end at the deadline, not a sleep overshoot later
+deadline = perf_counter_ns() + 5000000
+print(sleep_until(deadline), (perf_counter_ns() - deadline) / 1e9 < 0.0005)
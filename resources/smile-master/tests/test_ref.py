@@ -1,4 +1,4 @@
-from smile.ref import Ref, val, shuffle
+from smile.ref import Ref, val, shuffle, jitter
 import math
 x = [0.0]
 r = Ref(math.cos, Ref.getitem(x, 0))
@@ -64,3 +64,43 @@ print(val(y))
 y = y + [d]
 y = y + [f]
 print(val(y))
+
+# a change reaching a Ref by several paths invalidates it and calls its
+# callbacks once, with every cache on the way already invalid
+x = [1]
+calls = []
+leaf = Ref(lambda: x[0])
+d = (leaf + 1) + (leaf * 2)
+d.add_change_callback(lambda: calls.append(d.eval()))
+print(val(d))
+x[0] = 5
+leaf.dep_changed()
+print(calls)
+
+# only the Refs on the path of the change are evaluated again
+counts = {'a': 0, 'b': 0}
+def count(name, value):
+    counts[name] += 1
+    return value
+ya, yb = [1], [2]
+leaf_a = Ref(lambda: ya[0])
+leaf_b = Ref(lambda: yb[0])
+s = Ref(count, 'a', leaf_a) + Ref(count, 'b', leaf_b)
+s.add_change_callback(lambda: None)
+print(val(s), counts)
+yb[0] = 3
+leaf_b.dep_changed()
+print(val(s), counts)
+
+# Refs that don't use their cache are evaluated each time they are used
+j = jitter(0., 1.)
+print(val(j - j) != 0.0)
+
+# lists, tuples, and dicts holding Refs are built from their values
+print(val(Ref(lambda *a: a, [leaf_a], {'b': leaf_b}, (leaf_a, 7))))
+
+# deep chains evaluate without recursion
+r = Ref.object(x)[0]
+for i in range(5000):
+    r = r + 1
+print(val(r.compile()))
@@ -0,0 +1,41 @@
+import os
+import csv
+import tempfile
+import threading
+from smile.session_writer import SessionWriter
+
+log_dir = tempfile.mkdtemp()
+pulses_file = os.path.join(log_dir, 'pulses.csv')
+messages_file = os.path.join(log_dir, 'communications.csv')
+
+writer = SessionWriter(flush_interval=0.05, max_rows=16)
+writer.add_file(pulses_file, ['time', 'pulse_id'])
+writer.add_file(messages_file, ['type', 'data', 'id'])
+
+
+def pulses(thread_id):
+    for i in range(100):
+        writer.writerow(pulses_file, {'time': i * 0.05, 'pulse_id': thread_id})
+
+
+threads = [threading.Thread(target=pulses, args=(i,)) for i in range(4)]
+for thread in threads:
+    thread.start()
+message = {'type': 'HEARTBEAT', 'data': {'count': 1}, 'id': 0}
+writer.writerow(messages_file, message)
+# the row is copied, so changing the message afterwards is fine
+message['data']['count'] = 2
+for thread in threads:
+    thread.join()
+
+try:
+    writer.writerow(messages_file, {'type': 'EXIT', 'extra': 1})
+except ValueError as e:
+    print(e)
+
+writer.flush()
+print(len(list(csv.reader(open(pulses_file)))))
+writer.close()
+# 401 rows with the header, the message with count 1
+print(len(list(csv.reader(open(pulses_file)))))
+print(list(csv.reader(open(messages_file))))
@@ -0,0 +1,104 @@
+import copy
+from smile.common import *
+from smile.state import AutoFinalizeState, StateBuilder
+from smile.clock import clock
+
+
+class Tally(AutoFinalizeState):
+    # a class attribute the builder's own value shadows in clones
+    _mode = "class"
+
+    def __init__(self, parent=None, save_log=True, name=None):
+        super(Tally, self).__init__(parent=parent, duration=0.0,
+                                    save_log=save_log, name=name)
+        self._mode = "builder"
+        self._tallies = []
+        self._deepcopy_attrs.append("_tallies")
+
+    def _enter(self):
+        self._tallies.append(self._mode)
+        tallies.append(list(self._tallies))
+        self._started = True
+        self._ended = True
+        clock.schedule(self.leave)
+
+
+def old_clone(builder, parent):
+    # clones as they were made before copy-on-write: a copy of the whole
+    # dictionary of the builder
+    state_class = type(builder)._state_class
+    new_clone = state_class.__new__(state_class, use_state_class=True)
+    new_clone.__dict__.update(builder.__dict__)
+    for attr in ("_State__most_recently_entered_clone",
+                 "_StateBuilder__shadowing_attrs", "_StateBuilder__cloned"):
+        new_clone.__dict__.pop(attr, None)
+    for attr in builder._deepcopy_attrs:
+        setattr(new_clone, attr, copy.deepcopy(getattr(builder, attr)))
+    new_clone._active = False
+    new_clone._parent = parent
+    new_clone._ref_context = {builder: new_clone}
+    return new_clone
+
+
+records = []
+tallies = []
+write_to_state_log = Experiment.write_to_state_log
+
+
+def capture(self, state_class_name, record):
+    # the state logs without their times, which differ between runs
+    records.append((state_class_name,
+                    sorted((key, repr(value)) for key, value in record.items()
+                           if not key.endswith("_time"))))
+    write_to_state_log(self, state_class_name, record)
+
+
+Experiment.write_to_state_log = capture
+
+exp = Experiment(show_splash=False, fullscreen=False)
+with Loop([{"word": "w%d" % i, "n": i % 3} for i in range(6)]) as trial:
+    with Parallel():
+        Label(text=trial.current["word"], duration=0.01)
+        tally = Tally()
+    with If(trial.current["n"] == 0):
+        Wait(0.005)
+    with Elif(trial.current["n"] == 1):
+        Log(word=trial.current["word"], name="one")
+    with Else():
+        Tally(name="other")
+
+# the first run sizes the window, which the Labels log
+exp.run()
+del records[:], tallies[:]
+exp.run()
+new_records, new_tallies = sorted(records), tallies[:]
+del records[:], tallies[:]
+clone = StateBuilder._clone
+StateBuilder._clone = old_clone
+try:
+    exp.run()
+finally:
+    StateBuilder._clone = clone
+old_records, old_tallies = sorted(records), tallies[:]
+
+# the same state logs, and every clone tallied on its own copy
+print(new_records == old_records, len(new_records))
+print(new_tallies == old_tallies, new_tallies[:3], tally._tallies)
+
+# clones only see the builder's attributes as they were when cloned
+first = tally._clone(None)
+first._mode = "clone"
+first._tallies.append("clone")
+print(tally._mode, tally._tallies, first._mode, first._tallies)
+second = tally._clone(None)
+tally._mode = "later"
+tally._extra = True
+third = tally._clone(None)
+print(second._mode, third._mode, hasattr(second, "_extra"), third._extra)
+print(second._tallies is not tally._tallies,
+      second._name is tally._name)
+
+# nor the builder's bookkeeping
+print(hasattr(first, "_StateBuilder__shadowing_attrs"),
+      hasattr(third, "_StateBuilder__cloned"),
+      hasattr(third, "_State__most_recently_entered_clone"))
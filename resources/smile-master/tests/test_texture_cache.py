@@ -0,0 +1,81 @@
+import os
+import json
+import struct
+import tempfile
+import zlib
+from smile.texture_cache import TextureCache
+from kivy.core.window import Window
+from kivy.core.image import ImageLoaderBase, ImageData
+
+tmp_dir = tempfile.mkdtemp()
+
+
+def write_png(filename, width, height):
+    # solid red RGBA image
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data +
+                struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+    rows = b"".join(b"\x00" + b"\xff\x00\x00\xff" * width
+                    for i in range(height))
+    with open(filename, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n" +
+                chunk(b"IHDR", struct.pack(">IIBBBBB", width, height,
+                                           8, 6, 0, 0, 0)) +
+                chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b""))
+    return filename
+
+
+a, b, c = [write_png(os.path.join(tmp_dir, name + ".png"), 10, 10)
+           for name in "abc"]
+
+# the decoded images (400 bytes each) are kept within max_bytes, least
+# recently used first
+cache = TextureCache(max_bytes=800)
+cache.preload([a, b])
+cache.wait()
+print(cache.get_stats()["entries"], cache.get_stats()["bytes"])
+cache.preload([c])
+cache.wait()
+stats = cache.get_stats()
+print(stats["entries"], stats["bytes"], stats["evictions"], stats["preloaded"])
+print(cache._key(a, False) not in cache._entries)
+
+# uploading releases the decoded data, so it counts toward the textures
+texture = cache.get_texture(b)
+stats = cache.get_stats()
+print(texture is not None, texture.size, stats["hits"])
+print(stats["bytes"], stats["texture_bytes"])
+print(cache.get_texture(b) is texture, cache.get_stats()["hits"])
+
+# and the textures have their own budget
+cache = TextureCache(max_texture_bytes=800)
+for source in [a, b, c]:
+    cache.get_texture(source)
+stats = cache.get_stats()
+print(stats["entries"], stats["bytes"], stats["texture_bytes"],
+      stats["misses"], stats["evictions"])
+
+# every image named in the trials is queued once, in order, from nested
+# blocks in a JSON file
+trials = [{"study": [{"image": a, "word": "dog"}, {"image": b}],
+           "test": [{"image": a}, {"images": [c, "words.txt"]}]},
+          {"study": [], "image": os.path.join(tmp_dir, "d.GIF")}]
+filename = os.path.join(tmp_dir, "trials.json")
+with open(filename, "w") as f:
+    json.dump(trials, f)
+cache = TextureCache()
+print([os.path.basename(source)
+       for source in cache.preload_trials(filename)])
+cache.wait()
+stats = cache.get_stats()
+print(stats["preloaded"], stats["errors"])
+
+
+# animated images are left to kivy
+class TwoFrames(ImageLoaderBase):
+    def load(self, filename):
+        return [ImageData(2, 2, "rgba", b"\x00" * 16)] * 2
+
+
+cache._add(cache._key(a, True), TwoFrames(a))
+print(cache.get_texture(a, mipmap=True) is None)
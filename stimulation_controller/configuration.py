@@ -26,6 +26,7 @@ digit_string = '#' * n_subject_code_digits
 server_connection_enabled = True
 server_ip = '127.0.0.1'
 server_port = 5000
+server_response_timeout = 5  # seconds to wait for a server response before giving up
 
 ### Parameters being searched over
 parameter_types = ['amplitude', 'frequency', 'pulse_width', 'duration', 'location']
@@ -71,7 +72,7 @@ events_fieldnames = [
 
 notes_fieldnames = ['subject', 'session', 'note', 'time', 'note_id']
 
-pulses_fieldnames = ['subject', 'session', 'time', 'pulse_id']
+pulses_fieldnames = ['subject', 'session', 'time', 'pulse_id', 'intended_time', 'actual_time']
 
 communications_fieldnames = [
     'subject', 'session', 'message_type', 'data', 'sender', 
@@ -116,6 +117,7 @@ datetime_format = '%Y-%m-%d_%H-%M-%S_%f'
 stimulation_thread = None
 stop_stimulation = True
 sync_pulses_thread = None
+sync_pulses_scheduler = None
 stop_sync_pulses = True
 sync_pulse_burst_thread = None
 trial_idx = 1
@@ -74,11 +74,14 @@ def get_message_dictionary(subject, session, stimulation_parameters=None):
     }
     
     ### For logging times in which sync pulses were delivered to recording system
+    ### (intended and actual times in milliseconds of the client's performance counter)
     PULSE_dict = {
         'subject': subject,
         'session': session,
         'time': 0,
-        'pulse_id': 0
+        'pulse_id': 0,
+        'intended_time': 0,
+        'actual_time': 0
     }
     
     ### For logging experiment notes and the time when they were entered
@@ -92,6 +95,7 @@ def get_message_dictionary(subject, session, stimulation_parameters=None):
 
     message_dictionary = {
         'STIMULATION_PARAMETERS': stimulation_parameters,
+        'CONNECTED': CONNECTED_message,
         'STIMULATION_CONFIGURATION': STIMULATION_CONFIGURATION_message,
         'STOP_STIMULATION': STOP_STIMULATION_message,
         'SHAM': SHAM_message,
@@ -0,0 +1,157 @@
+"""
+Stimulation Stand-in Server
+
+Python stand-in for stimulation_server.m, for running the stimulation parameter
+search and the stimulation controller without the Blackrock computer and Cerestim.
+Answers the same messages with the same responses:
+    CONNECTED -> WAITING
+    SHAM -> SHAMMING
+    STIMULATION_CONFIGURATION -> DELIVERING_STIMULUS, after the configuration wait
+    STOP_STIMULATION -> STOPPING_STIMULATION
+    END -> no response, connection closed
+
+Every message received is recorded with its time to received_messages.csv, in a
+new session folder of the output directory, so that a run can be replayed and
+timed with replay_stimulation_loop.py (in stimulation_parameter_search/server).
+
+Run before starting the client, e.g.:
+    python server/stimulation_server.py --configuration-wait 100 --latency normal:2,0.5
+
+"""
+from smile.message_server import MessageServer
+import argparse
+import csv
+import os
+import time
+from datetime import datetime
+
+
+server_ip = '127.0.0.1'
+server_port = 5000
+datetime_format = '%Y-%m-%d_%H-%M-%S_%f'
+subject_code = 'SC000'
+
+configuration_wait = 100   # milliseconds for Cerestim to be configured before stimulus delivery
+max_amplitude = 10         # mA, server quits when configured with a higher amplitude
+
+parameter_fieldnames = ['label', 'anode', 'cathode', 'amplitude', 'frequency', 'pulse_width', 'duration']
+
+received_fieldnames = [
+    'message_type', 'message_id', 'client_time', 'server_time', 'receive_ms'] + parameter_fieldnames
+
+### Replaced when the server starts
+session = None
+received_file = None
+received_writer = None
+
+### Template of the general structure of a response, as in get_message_struct of stimulation_server.m
+def get_message_struct(message_type):
+    message_struct = {
+        'subject': subject_code,
+        'session': session,
+        'message_type': message_type,
+        'data': {'n_fields': 0},
+        'sender': 'server',
+        'server_time': datetime.now().strftime(datetime_format),
+        'client_time': 0,
+        'message_id': 0
+    }
+    return message_struct
+
+### Record every message received, with the parameters of stimulation configurations
+def record_message(connection, message, receive_time):
+    received_entry = {
+        'message_type': message.get('message_type'),
+        'message_id': message.get('message_id'),
+        'client_time': message.get('client_time'),
+        'server_time': datetime.now().strftime(datetime_format),
+        'receive_ms': round(receive_time * 1000, 3)}
+    if message.get('message_type') == 'STIMULATION_CONFIGURATION':
+        for parameter in parameter_fieldnames:
+            received_entry[parameter] = message['data'].get(parameter)
+    received_writer.writerow(received_entry)
+    received_file.flush()
+
+### Stimulation server's handling of each message
+def handle_message(connection, message):
+    state = connection.state
+    message_type = message.get('message_type')
+    now = time.perf_counter()
+
+    if message_type == 'CONNECTED':
+        print("Client connected.")
+        connection.send(get_message_struct('WAITING'))
+
+    elif message_type == 'SHAM':
+        print("Sham event.")
+        connection.send(get_message_struct('SHAMMING'))
+
+    elif message_type == 'STIMULATION_CONFIGURATION':
+        stimulation_configuration = message['data']
+
+        ### Stop any previous stimulus if still ongoing
+        if now < state.get('stimulus_end', 0):
+            print(f"Stopping previous stimulus {(state['stimulus_end'] - now) * 1000:.0f} ms before its end.")
+
+        if float(stimulation_configuration['amplitude']) > max_amplitude:
+            print(f"Amplitude {stimulation_configuration['amplitude']} mA is over {max_amplitude} mA. Quitting.")
+            connection.close()
+            return
+
+        print(f"Configuring stimulation {stimulation_configuration['label']} at: {stimulation_configuration['amplitude']} mA, {stimulation_configuration['frequency']} Hz, {stimulation_configuration['pulse_width']} us pulse width for {stimulation_configuration['duration']} ms in duration.")
+
+        ### Response goes out once Cerestim would be configured, right before the stimulus is delivered
+        wait = configuration_wait / 1000
+        state['stimulus_end'] = now + wait + float(stimulation_configuration['duration']) / 1000
+        state['n_stimuli'] = state.get('n_stimuli', 0) + 1
+        connection.send(get_message_struct('DELIVERING_STIMULUS'), delay=wait)
+
+    elif message_type == 'STOP_STIMULATION':
+        print("Stopping stimulation.")
+        state['stimulus_end'] = 0
+        connection.send(get_message_struct('STOPPING_STIMULATION'))
+
+    elif message_type == 'END':
+        print(f"Experiment ended after {state.get('n_stimuli', 0)} stimuli.")
+        connection.close()
+
+    else:
+        print(f"Unknown message type: {message_type}")
+
+def start_server(args):
+    global session, received_file, received_writer
+    session = datetime.now().strftime(datetime_format)
+    session_directory = os.path.join(args.output_directory, subject_code, 'session_' + session)
+    os.makedirs(session_directory)
+    received_file = open(os.path.join(session_directory, 'received_messages.csv'), 'w', newline='')
+    received_writer = csv.DictWriter(received_file, fieldnames=received_fieldnames)
+    received_writer.writeheader()
+    print(f"Recording received messages in {session_directory}.")
+
+    server = MessageServer(handle_message,
+                           host=args.host,
+                           port=args.port,
+                           latency=args.latency,
+                           report_interval=args.report_interval,
+                           log=record_message,
+                           seed=args.seed)
+    try:
+        server.serve_forever()
+    finally:
+        received_file.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for stimulation_server.m.")
+    parser.add_argument('--host', default=server_ip)
+    parser.add_argument('--port', type=int, default=server_port)
+    parser.add_argument('--subject', default=subject_code)
+    parser.add_argument('--configuration-wait', type=float, default=configuration_wait, help="ms to configure a stimulus before responding")
+    parser.add_argument('--latency', default=None, help="added response latency distribution in ms, e.g. 'fixed:2', 'normal:2,0.5'")
+    parser.add_argument('--output-directory', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stimulation_server_data'))
+    parser.add_argument('--report-interval', type=float, default=0, help="seconds between throughput reports (0 for none)")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    subject_code = args.subject
+    configuration_wait = args.configuration_wait
+    start_server(args)
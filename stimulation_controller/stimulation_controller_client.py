@@ -8,15 +8,17 @@ For details about experiment parameters view configuration.py
 """
 
 from smile.pennsyncbox import *
+from smile.session_writer import SessionWriter
+from smile.message_client import MessageClient
+from smile.message_template import compile_message_templates
+from smile.pulse_scheduler import PulseScheduler
 import pandas as pd
 import numpy as np
 import os
 import sys 
-import socket
 import json
 import time
-from csv import DictWriter
-from datetime import datetime
+from datetime import datetime, timedelta
 import tkinter as tk
 import ttkbootstrap as ttk
 from ttkbootstrap import Style
@@ -72,6 +74,14 @@ if not os.path.isfile(communications_file):
 ### Allow time for files to be written before accessing
 time.sleep(0.5)
 
+### Session files stay open, and rows are buffered and written by a background thread so that
+### sync pulse, stimulation, and GUI threads never wait on file writes
+session_writer = SessionWriter()
+session_writer.add_file(pulses_file, pulses_fieldnames)
+session_writer.add_file(events_file, events_fieldnames)
+session_writer.add_file(notes_file, notes_fieldnames)
+session_writer.add_file(communications_file, communications_fieldnames)
+
 ### Get possible stimulation parameters
 with open(parameters_file, 'r') as file_handle:
     possible_stimulation_parameters = json.load(file_handle)
@@ -80,107 +90,100 @@ with open(parameters_file, 'r') as file_handle:
 with open(message_dictionary_file, 'r') as file_handle:
     message_dictionary = json.load(file_handle)
 
+### Server-client messages are precompiled into encoders that only fill in the fields that vary between messages
+message_templates = compile_message_templates(message_dictionary, variable_keys=('client_time', 'sender', 'message_id'))
+
 stimulation_parameters = message_dictionary['STIMULATION_PARAMETERS']
 
 ##################################################################### Experiment Function Definitions ###################################################################
 
 ############################ Pulses and communications #############################
 
-### For executing sync pulse from imported pennsyncbox.py and recording client time in which it was sent
-def single_sync_pulse():
+### Sync pulses from imported pennsyncbox.py are sent by pulse schedulers at absolute deadlines, so the time
+### taken by each pulse, printing, and logging does not add up into drift of the pulse intervals.
+### For logging a sent pulse with the client time in which it was sent, and the times it was intended for and sent
+def log_sync_pulse(pulse_record, pulse_label):
     global pulse_id
     
-    current_time = datetime.now().strftime(datetime_format)
+    print(pulse_label)
     
-    SyncPulse()
+    pulse_time = datetime.now() - timedelta(seconds=time.perf_counter() - pulse_record['actual'])
     
     pulse_entry = message_dictionary['PULSE']
-    pulse_entry['time'] = current_time
+    pulse_entry['time'] = pulse_time.strftime(datetime_format)
     pulse_entry['pulse_id'] = pulse_id
+    pulse_entry['intended_time'] = round(pulse_record['intended'] * 1000, 3)
+    pulse_entry['actual_time'] = round(pulse_record['actual'] * 1000, 3)
     
-    with open(pulses_file, 'a') as file_handle:
-        writer = DictWriter(file_handle, fieldnames=pulses_fieldnames)
-        writer.writerow(pulse_entry)
+    session_writer.writerow(pulses_file, pulse_entry)
     
     pulse_id += 1
     
-### For sending message to server and logging message in communications file
-def send_server_message(server, communications_file, message):
+### For sending message to server and logging message in communications file.
+### Message is encoded from its precompiled template with the given data fields, and written to server
+### by the client thread, so this does not wait on the network.
+### Returns the future response of the server if one is expected.
+def send_server_message(server, communications_file, message_type, expect_response=True, **fields):
     global message_id
     
-    message['client_time'] = datetime.now().strftime(datetime_format)
-    message['sender'] = 'client'
-    message['message_id'] = message_id
-    message_string = json.dumps(message) + '\n'
+    fields['client_time'] = datetime.now().strftime(datetime_format)
+    fields['sender'] = 'client'
+    fields['message_id'] = message_id
+    template = message_templates[message_type]
+    response = None
 
     if server_connection_enabled:
-        server.send(message_string.encode('utf-8'))    
+        response = server.send_encoded(template.encode(**fields), expect_response, message_id, message_type)
     
-    with open(communications_file, 'a') as file_handle:
-        writer = DictWriter(file_handle, fieldnames=communications_fieldnames)
-        writer.writerow(message)
+    session_writer.writerow(communications_file, template.message(**fields))
     
     message_id += 1
+    
+    return response
 
 ### For receiving response from server and logging message in communications file
-def receive_server_response(server, communications_file):
+def receive_server_response(response, communications_file):
     global message_id
     
-    buffer = ''
-    continue_loop = True
-    
-    while continue_loop:
-        new_data = server.recv(1024)
-        if not new_data:
-            break
-        buffer += new_data.decode('utf-8')
-        while '\n' in buffer:
-            message_string, buffer = buffer.split('\n', 1)
-            message = json.loads(message_string)
-        if not buffer:
-            continue_loop = False
+    message = response.result(timeout=server_response_timeout)
     
     message['client_time'] = datetime.now().strftime(datetime_format)
     message['sender'] = 'server'
     message['message_id'] = message_id
     
-    with open(communications_file, 'a') as file_handle:
-        writer = DictWriter(file_handle, fieldnames=communications_fieldnames)
-        writer.writerow(message)
+    session_writer.writerow(communications_file, message)
     
     message_id += 1
 
 ### For executing a quicker burst of sync pulses to signal experiment start/interruptions
 def sync_pulses_burst():
-    for idx in range(n_sync_pulses_burst):
-        print("Burst Pulse")
-        single_sync_pulse()
-        time.sleep(inter_burst_time/1000)
+    burst_scheduler = PulseScheduler(SyncPulse, log=lambda pulse_record: log_sync_pulse(pulse_record, "Burst Pulse"))
+    burst_scheduler.run(inter_burst_time/1000, count=n_sync_pulses_burst)
 
 ### For executing a thread that will intermittently send sync pulses with a jittered time interval
 def sync_pulses_loop():
-    time.sleep(burst_wait_time/1000)
-    global stop_sync_pulses
-    while not stop_sync_pulses:
-        print("Sync Pulse")
-        single_sync_pulse()
-        jittered_time_duration = np.random.normal(inter_sync_pulses_interval, sync_pulses_jitter)
-        time.sleep(jittered_time_duration/1000)
+    global sync_pulses_scheduler
+    sync_pulses_scheduler = PulseScheduler(SyncPulse, log=lambda pulse_record: log_sync_pulse(pulse_record, "Sync Pulse"))
+    sync_pulses_scheduler.run(lambda: np.random.normal(inter_sync_pulses_interval, sync_pulses_jitter)/1000,
+                              start_delay=burst_wait_time/1000,
+                              until=lambda: stop_sync_pulses)
+    error_stats = sync_pulses_scheduler.get_error_stats()
+    if error_stats['n']:
+        print(f"{error_stats['n']} sync pulses sent {error_stats['mean']*1000:.3f} ms after their scheduled time on average (max {error_stats['max']*1000:.3f} ms).")
 
 ### For sending stimulation configurations as a message to server
 def send_stimulus():
     global trial_idx, stimulation_parameters
-    message = message_dictionary['STIMULATION_CONFIGURATION'].copy()
-    message['data']['label'] = stimulation_parameters['location']['label']
-    message['data']['anode'] = stimulation_parameters['location']['anode']
-    message['data']['cathode'] = stimulation_parameters['location']['cathode']
-    message['data']['amplitude'] = stimulation_parameters['amplitude']
-    message['data']['frequency'] = stimulation_parameters['frequency']
-    message['data']['pulse_width'] = stimulation_parameters['pulse_width']
-    message['data']['duration'] = stimulation_parameters['duration']
     
     print("Sending stimulation configurations.")
-    send_server_message(server, communications_file, message)
+    response = send_server_message(server, communications_file, 'STIMULATION_CONFIGURATION',
+                                   label=stimulation_parameters['location']['label'],
+                                   anode=stimulation_parameters['location']['anode'],
+                                   cathode=stimulation_parameters['location']['cathode'],
+                                   amplitude=stimulation_parameters['amplitude'],
+                                   frequency=stimulation_parameters['frequency'],
+                                   pulse_width=stimulation_parameters['pulse_width'],
+                                   duration=stimulation_parameters['duration'])
     
     event_entry = message_dictionary['EVENT']
     current_time = datetime.now().strftime(datetime_format)
@@ -197,7 +200,7 @@ def send_stimulus():
     print("Receiving response from Blackrock.")
     
     if server_connection_enabled:
-        receive_server_response(server, communications_file)
+        receive_server_response(response, communications_file)
     
     time.sleep(stimulation_duration/1000)
     time.sleep(post_stim_lockout/1000)
@@ -206,14 +209,12 @@ def send_stimulus():
 
 ### For sending message to server that would stop execution of stimulus
 def stop_stimulus():
-    message = message_dictionary['STOP_STIMULATION']
-    
     print("Stopping stimulation.")
-    send_server_message(server, communications_file, message)
+    response = send_server_message(server, communications_file, 'STOP_STIMULATION')
     
     print("Stopped stimulation.")
     if server_connection_enabled:
-        receive_server_response(server, communications_file)
+        receive_server_response(response, communications_file)
 
 ################################## GUI Button Commands ####################################
 
@@ -246,6 +247,8 @@ def command_stop_sync():
     enter_note_button.configure(state='disabled')
     global sync_pulses_thread, sync_pulses_burst_thread, stop_sync_pulses
     stop_sync_pulses = True
+    if sync_pulses_scheduler is not None:
+        sync_pulses_scheduler.stop()
     sync_pulses_burst_thread = Thread(target=sync_pulses_burst, daemon=True)
     sync_pulses_burst_thread.start()
     
@@ -284,9 +287,7 @@ def command_enter_note():
     note_entry['note'] = note_text
     note_entry['note_id'] = note_id
     note_entry['time'] = current_time
-    with open(notes_file, 'a') as file_handle:
-        writer = DictWriter(file_handle, fieldnames=notes_fieldnames)
-        writer.writerow(note_entry)
+    session_writer.writerow(notes_file, note_entry)
     note_id += 1
     note_entry_box.delete(1.0, tk.END)
 
@@ -300,17 +301,20 @@ def on_closing():
     command_stop_stimulus()
     global sync_pulses_thread, sync_pulses_burst_thread, stop_sync_pulses
     stop_sync_pulses = True
+    if sync_pulses_scheduler is not None:
+        sync_pulses_scheduler.stop()
     
     sync_pulses_burst_thread = Thread(target=sync_pulses_burst, daemon=False)
     sync_pulses_burst_thread.start()
     
-    message = message_dictionary['END']
     print("Closing server.")
-    send_server_message(server, communications_file, message)
+    send_server_message(server, communications_file, 'END', expect_response=False)
         
     if server_connection_enabled:
         server.close()
 
+    ### Write buffered rows now. Rows of the closing pulse burst are written when the program exits
+    session_writer.flush()
     root.destroy()
     sys.exit()
 
@@ -371,12 +375,12 @@ OpenUSB()
 
 ### Establish connection with server
 if server_connection_enabled:
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.connect((server_ip, server_port))
-    message = message_dictionary['CONNECTED']
+    ### Server answers every message with message_id 0 instead of echoing its id, so responses are matched to messages in the order they were sent
+    server = MessageClient(server_ip, server_port, id_key='message_id', type_key='message_type', match_unknown_ids=True)
+    server.connect(timeout=server_response_timeout)
     print("Connected to server.")
-    send_server_message(server, communications_file, message)
-    receive_server_response(server, communications_file)
+    response = send_server_message(server, communications_file, 'CONNECTED')
+    receive_server_response(response, communications_file)
 else:
     server = None
 
@@ -389,7 +393,6 @@ root.mainloop()
 ### Disconnect USB, send ending message to server, and close server.
 CloseUSB()
 if server_connection_enabled:
-    message = message_dictionary['END']
     print("Closing server.")
-    send_server_message(server, communications_file, message)
+    send_server_message(server, communications_file, 'END', expect_response=False)
     server.close()
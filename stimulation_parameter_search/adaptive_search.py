@@ -0,0 +1,177 @@
+"""
+Adaptive Stimulation Parameter Search
+
+Strategies choosing the stimulation parameters of each trial of the stimulation loop.
+The shuffled grid walks the stimulus list made by initialize_experiment.py, as the
+experiment always has. The adaptive strategies treat each combination of parameters in
+the stimulus list as an arm of a multi-armed bandit: they receive the outcome score of
+every trial (higher is better), choose the next combination online, and stop once one
+combination is the best, or within a margin of the best, with the configured confidence.
+Adaptive strategies that have not received any outcome after a trial of every combination
+warn, and walk the stimulus list like the shuffled grid until outcomes arrive.
+
+"""
+
+import math
+import warnings
+import numpy as np
+
+### Combination of stimulation parameters a trial belongs to
+def get_parameter_key(stimulation_parameters):
+    return (stimulation_parameters['location']['label'], stimulation_parameters['amplitude'],
+            stimulation_parameters['frequency'], stimulation_parameters['pulse_width'])
+
+### Shared bookkeeping of outcome scores for each combination in a stimulus list
+class ShuffledGridSearch(object):
+
+    def __init__(self, stimulus_list, min_trials=3, confidence=0.95, margin=0.0, prior_sd=1.0, n_draws=2000, seed=None):
+        self.stimulus_list = stimulus_list
+        self.min_trials = min_trials
+        self.confidence = confidence
+        self.margin = margin
+        self.prior_sd = prior_sd
+        self.n_draws = n_draws
+        self.random_state = np.random.RandomState(seed)
+
+        ### Unique combinations in the order they first appear in the stimulus list
+        self.combinations = []
+        self.combination_index = {}
+        for stimulation_parameters in stimulus_list:
+            key = get_parameter_key(stimulation_parameters)
+            if key not in self.combination_index:
+                self.combination_index[key] = len(self.combinations)
+                self.combinations.append(stimulation_parameters)
+
+        n_combinations = len(self.combinations)
+        self.counts = np.zeros(n_combinations)
+        self.sums = np.zeros(n_combinations)
+        self.sums_of_squares = np.zeros(n_combinations)
+        self._identified = None
+
+    ### Parameters for the trial, or None once the search is over
+    def next_parameters(self, trial_index):
+        if trial_index >= len(self.stimulus_list):
+            return None
+        return self.stimulus_list[trial_index]
+
+    ### Outcome score of a trial with the given parameters
+    def update(self, stimulation_parameters, score):
+        index = self.combination_index[get_parameter_key(stimulation_parameters)]
+        self.counts[index] += 1
+        self.sums[index] += score
+        self.sums_of_squares[index] += score ** 2
+        self._identified = None
+
+    def get_means(self):
+        means = np.full(len(self.counts), np.nan)
+        sampled = self.counts > 0
+        means[sampled] = self.sums[sampled] / self.counts[sampled]
+        return means
+
+    ### Standard deviation of scores within combinations, pooled over all combinations
+    def get_pooled_sd(self):
+        degrees_of_freedom = self.counts.sum() - np.sum(self.counts > 0)
+        if degrees_of_freedom < 2:
+            return self.prior_sd
+        sampled = self.counts > 0
+        squared_deviations = self.sums_of_squares[sampled] - self.sums[sampled] ** 2 / self.counts[sampled]
+        return max(np.sqrt(max(squared_deviations.sum(), 0) / degrees_of_freedom), 1e-9)
+
+    ### Probability of the combination with the highest mean score being within margin of the best,
+    ### from draws of the means of all combinations
+    def get_probability_best(self):
+        means = self.get_means()
+        standard_errors = self.get_pooled_sd() / np.sqrt(self.counts)
+        leader = int(np.nanargmax(means))
+        draws = self.random_state.normal(means, standard_errors, (self.n_draws, len(means)))
+        return np.mean(draws[:, leader] + self.margin >= draws.max(axis=1))
+
+    ### Whether every combination had min_trials and the leading one is within margin of the best with enough confidence
+    def is_identified(self):
+        if self._identified is None:
+            self._identified = self._is_identified()
+        return self._identified
+
+    def _is_identified(self):
+        if np.any(self.counts < self.min_trials):
+            return False
+
+        ### The leader must beat every other combination on its own with enough confidence,
+        ### which rules out most trials without drawing the means of all combinations
+        means = self.get_means()
+        standard_errors = self.get_pooled_sd() / np.sqrt(self.counts)
+        leader = int(np.argmax(means))
+        others = np.arange(len(means)) != leader
+        z = (means[leader] + self.margin - means[others]) / np.sqrt(standard_errors[leader] ** 2 + standard_errors[others] ** 2)
+        probability_beats = 0.5 * (1 + np.vectorize(math.erf)(z / math.sqrt(2)))
+        if probability_beats.min() < self.confidence:
+            return False
+        return self.get_probability_best() >= self.confidence
+
+    ### Combination with the highest mean score so far
+    def get_best_parameters(self):
+        means = self.get_means()
+        if np.all(np.isnan(means)):
+            return None
+        return self.combinations[int(np.nanargmax(means))]
+
+### Bandit strategies share the grid's bookkeeping, sample every combination min_trials times
+### in random order, then choose by their own rule until the best combination is identified
+class _BanditSearch(ShuffledGridSearch):
+
+    def __init__(self, stimulus_list, max_trials=None, **kwargs):
+        super(_BanditSearch, self).__init__(stimulus_list, **kwargs)
+        self.max_trials = len(stimulus_list) if max_trials is None else max_trials
+        self.warned_no_outcomes = False
+
+    def next_parameters(self, trial_index):
+        if trial_index >= self.max_trials or self.is_identified():
+            return None
+
+        ### Without outcomes (e.g., a server that does not send them) the counts never change and
+        ### choices would be random with replacement, so the stimulus list is walked instead
+        if not self.counts.sum():
+            if trial_index >= len(self.combinations) and not self.warned_no_outcomes:
+                warnings.warn(f"No trial outcomes received after {trial_index} trials, so the search cannot adapt. "
+                              "Following the stimulus list as the shuffled grid until outcomes are received.",
+                              RuntimeWarning)
+                self.warned_no_outcomes = True
+            return self.stimulus_list[trial_index % len(self.stimulus_list)]
+
+        least_sampled = np.nonzero(self.counts == self.counts.min())[0]
+        if self.counts.min() < self.min_trials:
+            return self.combinations[self.random_state.choice(least_sampled)]
+        return self.combinations[self._choose()]
+
+    def _choose(self):
+        raise NotImplementedError
+
+### Thompson sampling: the combination with the highest draw from the distribution of its mean
+class ThompsonSamplingSearch(_BanditSearch):
+
+    def _choose(self):
+        standard_errors = self.get_pooled_sd() / np.sqrt(self.counts)
+        return int(np.argmax(self.random_state.normal(self.get_means(), standard_errors)))
+
+### Upper confidence bound: the combination with the highest optimistic estimate of its mean
+class UpperConfidenceBoundSearch(_BanditSearch):
+
+    def __init__(self, stimulus_list, exploration=2.0, **kwargs):
+        super(UpperConfidenceBoundSearch, self).__init__(stimulus_list, **kwargs)
+        self.exploration = exploration
+
+    def _choose(self):
+        n_trials = self.counts.sum()
+        bounds = self.get_means() + self.get_pooled_sd() * np.sqrt(self.exploration * np.log(n_trials) / self.counts)
+        return int(np.argmax(bounds))
+
+search_strategies = {
+    'shuffled_grid': ShuffledGridSearch,
+    'thompson_sampling': ThompsonSamplingSearch,
+    'upper_confidence_bound': UpperConfidenceBoundSearch
+}
+
+def get_search_strategy(strategy_name, stimulus_list, **kwargs):
+    if strategy_name not in search_strategies:
+        raise ValueError(f"Unknown search strategy '{strategy_name}'. Options are: {', '.join(search_strategies)}.")
+    return search_strategies[strategy_name](stimulus_list, **kwargs)
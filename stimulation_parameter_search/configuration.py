@@ -10,7 +10,10 @@ run time.
 
 import os
 import numpy as np
-import Quartz
+try:
+    import Quartz
+except ImportError:
+    Quartz = None # Only on macOS. Needed for the GUI, not by headless scripts importing these parameters (e.g., server/replay_stimulation_loop.py)
 
 ########################################################################################################################################################################
 
@@ -27,6 +30,7 @@ digit_string = '#' * n_subject_code_digits
 ### Make sure that IP address matches the one set in Blackrock computer and stimulation_server.m
 server_ip = '127.0.0.1'
 server_port = 5000
+server_response_timeout = 5  # seconds to wait for a server response before giving up
 
 ### Parameters being searched over
 amplitudes = [1, 2, 4]       # mA  (valid range: 0.1mA-10mA)
@@ -37,6 +41,15 @@ stimulation_duration = 500   # ms (total time stimulation will occur for a serie
 
 ### General parameters
 trials_per_combination = 20 #trials for each possible combination of stimulation parameters
+
+### Search strategy choosing the parameters of each trial (see adaptive_search.py and simulate_parameter_search.py):
+### 'shuffled_grid' runs every combination trials_per_combination times in shuffled order,
+### 'thompson_sampling' and 'upper_confidence_bound' choose combinations online from trial outcome scores,
+### within the same maximum number of trials, and stop once the best combination is identified
+search_strategy = 'shuffled_grid'
+min_trials_per_combination = 3 # trials of every combination before adaptive strategies can identify the best
+best_combination_confidence = 0.95 # probability that the leading combination is within the margin of the best
+best_combination_margin = 0.1 # outcome score difference from the best within which a combination counts as the best
 p_sham_trials = 3 #percentage of times (integer from 0-100) that sham event will occur throughout run
 classification_duration = 1200 # milliseconds (duration of recording event used in classifier)
 post_stim_lockout = 400 # milliseconds (wait time for next event following stimulation)
@@ -58,7 +71,8 @@ configuration_dictionary = {
     'stimulation_duration': stimulation_duration,
     'post_stim_lockout': post_stim_lockout,
     'intertrial_interval': intertrial_interval,
-    'intertrial_jitter': intertrial_jitter
+    'intertrial_jitter': intertrial_jitter,
+    'search_strategy': search_strategy
 }
 
 ### List of directories with experiment resources and subject files
@@ -76,11 +90,11 @@ GUI_background = image_directory + 'stimulation_parameter_search_GUI.png'
 ### Definitions of fieldnames that will go into each type of event file
 events_fieldnames = [
     'subject', 'session', 'event_type', 'label', 'anode', 'cathode',
-    'amplitude', 'frequency', 'pulse_width', 'duration', 'time', 'trial_index']
+    'amplitude', 'frequency', 'pulse_width', 'duration', 'time', 'trial_index', 'outcome']
 
 notes_fieldnames = ['subject', 'session', 'note', 'time']
 
-pulses_fieldnames = ['subject', 'session', 'time', 'pulse_id']
+pulses_fieldnames = ['subject', 'session', 'time', 'pulse_id', 'intended_time', 'actual_time']
 
 communications_fieldnames = [
     'subject', 'session', 'message_type', 'data', 'sender',
@@ -97,9 +111,12 @@ parameter_fieldnames = ['location', 'amplitude', 'frequency', 'pulse_width']
 location_fieldnames = ['label', 'anode', 'cathode']
 
 ### Getting screen size to adjust the size of GUI screen and button positions
-display_id = Quartz.CGMainDisplayID()
-screen_width = Quartz.CGDisplayPixelsWide(display_id)
-screen_height = Quartz.CGDisplayPixelsHigh(display_id)
+if Quartz is not None:
+    display_id = Quartz.CGMainDisplayID()
+    screen_width = Quartz.CGDisplayPixelsWide(display_id)
+    screen_height = Quartz.CGDisplayPixelsHigh(display_id)
+else:
+    screen_width, screen_height = 1920, 1080
 screen_size = (screen_width, screen_height)
 f_width = screen_width/1920
 f_height = screen_height/1080
@@ -219,6 +236,7 @@ datetime_format = '%Y-%m-%d_%H-%M-%S_%f'
 stimulation_thread = None
 stop_stimulation = True
 sync_pulses_thread = None
+sync_pulses_scheduler = None
 stop_sync_pulses = True
 sync_pulses_burst_thread = None
 PANSS_scale_scores = [1] * n_PANSS_scales
@@ -73,15 +73,19 @@ def get_message_dictionary(subject, session, stimulation_parameters=None):
         'pulse_width': 0,
         'duration': 0,
         'time': 0,
-        'trial_index': 0
+        'trial_index': 0,
+        'outcome': None
     }
     
     ### For logging times in which sync pulses were delivered to recording system
+    ### (intended and actual times in milliseconds of the client's performance counter)
     PULSE_dict = {
         'subject': subject,
         'session': session,
         'time': 0,
-        'pulse_id': 0
+        'pulse_id': 0,
+        'intended_time': 0,
+        'actual_time': 0
     }
     
     ### For logging entry of psychiatric scale rating by user
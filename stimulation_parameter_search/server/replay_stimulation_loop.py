@@ -0,0 +1,201 @@
+"""
+Headless Stimulation Loop Replay
+
+Runs the trials of stimulation_loop in stimulation_parameter_search.py without
+the GUI or sync pulse device, with the same trial function (see stimulation_trial.py),
+search strategy, and messages, sending them to a stimulation server (e.g.,
+stimulation_server.py), and reports how long trials take and how many trials the
+search completes per hour.
+
+The stimulus list is either a session's stimulus_list.json, or the stimulation
+configurations recorded by stimulation_server.py, in the order they were received.
+Sham trials are drawn as in stimulation_loop, the outcomes in the server's responses
+are passed to the search strategy, and adaptive strategies end the replay once the best
+combination is identified. Waits between messages, the percentage of sham trials, and
+the search strategy default to those in configuration.py, or are read from a session's
+configurations.json. With a time scale below 1, waits are shortened for a faster run,
+and trial durations are reported as they would be at full length.
+
+    python server/replay_stimulation_loop.py --recording received_messages.csv --time-scale 0.01
+    python server/replay_stimulation_loop.py --stimulus-list stimulus_list.json --configurations configurations.json
+
+"""
+from smile.message_client import MessageClient
+from smile.message_template import compile_message_templates
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+task_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/'
+sys.path.insert(0, task_directory)
+from configuration import (server_ip, server_port, server_response_timeout, datetime_format, configuration_dictionary,
+                           p_sham_trials, min_trials_per_combination, best_combination_confidence, best_combination_margin)
+from message_dictionary import get_message_dictionary
+from adaptive_search import get_search_strategy
+from stimulation_trial import run_stimulation_trial, get_trial_outcome
+
+### Stimulus list from the stimulation configurations recorded by stimulation_server.py, and the
+### milliseconds between the first and last trial (stimulus or sham) in the recorded run
+def get_stimulus_list_from_recording(received_messages_file):
+    stimulus_list = []
+    receive_times = []
+    with open(received_messages_file, 'r', newline='') as file_handle:
+        for row in csv.DictReader(file_handle):
+            if row['message_type'] == 'STIMULATION_CONFIGURATION':
+                stimulation_parameters = {
+                    'location': {'label': row['label'], 'anode': row['anode'], 'cathode': row['cathode']},
+                    'amplitude': float(row['amplitude']),
+                    'frequency': float(row['frequency']),
+                    'pulse_width': float(row['pulse_width']),
+                    'duration': float(row['duration'])}
+                stimulus_list.append(stimulation_parameters)
+            elif row['message_type'] != 'SHAM':
+                continue
+            receive_times.append(float(row['receive_ms']))
+    recorded_duration = receive_times[-1] - receive_times[0] if len(receive_times) > 1 else None
+    return stimulus_list, recorded_duration
+
+def replay(args, stimulus_list):
+    random_generator = random.Random(args.seed)
+    parameter_search = get_search_strategy(args.search_strategy, stimulus_list,
+                                           min_trials=min_trials_per_combination,
+                                           confidence=best_combination_confidence,
+                                           margin=best_combination_margin,
+                                           seed=args.seed)
+    message_templates = compile_message_templates(get_message_dictionary(args.subject, args.session), variable_keys=('client_time', 'sender', 'message_id'))
+    message_id = 1
+
+    def send_message(message_type, **fields):
+        nonlocal message_id
+        fields['client_time'] = datetime.now().strftime(datetime_format)
+        fields['sender'] = 'client'
+        fields['message_id'] = message_id
+        message_id += 1
+        return server.send_encoded(message_templates[message_type].encode(**fields), True, fields['message_id'], message_type)
+
+    ### Full-length duration in milliseconds of the trial running
+    trial_duration = 0
+
+    def wait(duration):
+        nonlocal trial_duration
+        time.sleep(duration * args.time_scale / 1000)
+        trial_duration += duration
+
+    ### The server responds once it has processed the message, so that time is counted in full
+    def send_and_receive(message_type, **fields):
+        nonlocal trial_duration
+        start = time.perf_counter()
+        response = send_message(message_type, **fields).result(server_response_timeout)
+        trial_duration += (time.perf_counter() - start) * 1000
+        return response
+
+    ### Stimulus lists made by initialize_experiment.py leave the duration to STIMULATION_PARAMETERS, as configured
+    def send_stimulus(stimulation_parameters):
+        return send_and_receive('STIMULATION_CONFIGURATION',
+                                label=stimulation_parameters['location']['label'],
+                                anode=stimulation_parameters['location']['anode'],
+                                cathode=stimulation_parameters['location']['cathode'],
+                                amplitude=stimulation_parameters['amplitude'],
+                                frequency=stimulation_parameters['frequency'],
+                                pulse_width=stimulation_parameters['pulse_width'],
+                                duration=stimulation_parameters.get('duration', configuration_dictionary['stimulation_duration']))
+
+    def send_sham():
+        send_and_receive('SHAM')
+
+    def record_trial_outcome(stimulation_parameters, outcome):
+        parameter_search.update(stimulation_parameters, outcome)
+        trial_outcomes.append(outcome)
+
+    ### The server answers every message with message_id 0, so responses are matched in the order messages were sent
+    server = MessageClient(args.host, args.port, id_key='message_id', type_key='message_type', match_unknown_ids=True)
+    server.connect(timeout=server_response_timeout)
+    send_message('CONNECTED').result(server_response_timeout)
+
+    ### Full-length duration in milliseconds of every trial, by event type, and the outcome of every stimulation trial
+    trial_durations = {'SHAM': [], 'STIMULATION_CONFIGURATION': []}
+    trial_outcomes = []
+
+    ### Trials as in stimulation_loop, until the stimulus list is used up or the search strategy ends the search
+    trial_index = 0
+    while trial_index < len(stimulus_list):
+        trial_duration = 0
+        trial = run_stimulation_trial(trial_index, parameter_search, send_stimulus, send_sham, record_trial_outcome,
+                                      configuration_dictionary, args.p_sham_trials, trial_outcome=get_trial_outcome,
+                                      wait=wait, random_generator=random_generator)
+        if trial is None:
+            best_parameters = parameter_search.get_best_parameters()
+            print(f"Best stimulation parameters identified after {trial_index} trials: {best_parameters['location']['label']} at {best_parameters['amplitude']} mA, {best_parameters['frequency']} Hz, {best_parameters['pulse_width']} us pulse width.")
+            break
+        stimulated, stimulation_parameters = trial
+        if stimulated:
+            trial_durations['STIMULATION_CONFIGURATION'].append(trial_duration)
+            trial_index += 1
+        else:
+            trial_durations['SHAM'].append(trial_duration)
+
+    server.send(message_templates['END'].message(client_time=datetime.now().strftime(datetime_format), sender='client', message_id=message_id))
+    server.close()
+    return trial_durations, trial_outcomes, server
+
+def print_report(trial_durations, trial_outcomes, server, recorded_duration):
+    all_durations = trial_durations['SHAM'] + trial_durations['STIMULATION_CONFIGURATION']
+    n_stimuli = len(trial_durations['STIMULATION_CONFIGURATION'])
+    if not len(all_durations):
+        print("No trials to replay.")
+        return
+    total_hours = sum(all_durations) / 1000 / 3600
+    print(f"Replayed {len(all_durations)} trials ({n_stimuli} stimuli, {len(trial_durations['SHAM'])} shams).")
+    if len(trial_outcomes):
+        print(f"{len(trial_outcomes)} trial outcomes, mean {sum(trial_outcomes) / len(trial_outcomes):.3f}.")
+    else:
+        print("No trial outcomes received from the server.")
+    for event_type, durations in trial_durations.items():
+        if len(durations):
+            print(f"{event_type:>26}: mean {sum(durations) / len(durations):.0f} ms, max {max(durations):.0f} ms per trial")
+    for event_type in trial_durations:
+        latency = server.get_latency_stats(event_type)
+        if latency['n']:
+            print(f"{event_type:>26}: server response mean {latency['mean'] * 1000:.1f} ms, max {latency['max'] * 1000:.1f} ms")
+    print(f"Full-length run: {total_hours * 60:.1f} minutes, {n_stimuli / total_hours:.0f} stimulation trials per hour.")
+    if recorded_duration is not None:
+        print(f"Recorded run: {recorded_duration / 1000:.1f} seconds from first to last trial.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay and time the stimulation loop headlessly.")
+    trials_source = parser.add_mutually_exclusive_group(required=True)
+    trials_source.add_argument('--stimulus-list', help="a session's stimulus_list.json")
+    trials_source.add_argument('--recording', help="received_messages.csv recorded by stimulation_server.py")
+    parser.add_argument('--configurations', default=None, help="a session's configurations.json with the waits to use")
+    parser.add_argument('--p-sham-trials', type=int, default=None, help="percentage of sham trials, by default as in configuration.py")
+    parser.add_argument('--search-strategy', default=None, help="search strategy, by default as in configurations.json or configuration.py")
+    parser.add_argument('--time-scale', type=float, default=1.0, help="factor applied to every wait, e.g. 0.01 for a run 100 times faster")
+    parser.add_argument('--host', default=server_ip)
+    parser.add_argument('--port', type=int, default=server_port)
+    parser.add_argument('--subject', default='SC000')
+    parser.add_argument('--session', default='replay')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.configurations is not None:
+        with open(args.configurations, 'r') as file_handle:
+            configuration_dictionary.update(json.load(file_handle))
+    if args.p_sham_trials is None:
+        args.p_sham_trials = p_sham_trials
+    if args.search_strategy is None:
+        args.search_strategy = configuration_dictionary['search_strategy']
+
+    recorded_duration = None
+    if args.recording is not None:
+        stimulus_list, recorded_duration = get_stimulus_list_from_recording(args.recording)
+    else:
+        with open(args.stimulus_list, 'r') as file_handle:
+            stimulus_list = json.load(file_handle)
+
+    trial_durations, trial_outcomes, server = replay(args, stimulus_list)
+    print_report(trial_durations, trial_outcomes, server, recorded_duration)
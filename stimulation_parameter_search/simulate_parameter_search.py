@@ -0,0 +1,103 @@
+"""
+Simulation of Stimulation Parameter Search Strategies
+
+Runs every search strategy of adaptive_search.py on simulated sessions, without the GUI
+or server, and compares how many trials each needs to identify the best combination of
+stimulation parameters, and how often the combination it identifies is within the margin
+of the true best.
+
+Each simulated session draws a true mean outcome for every combination, and the outcome
+of each trial is its combination's mean plus noise. A strategy has identified the best
+combination at the first trial where the leading combination is within the margin of the
+best with the configured confidence. Adaptive strategies stop there, while the shuffled grid
+runs to the end of its stimulus list; 'correct' is judged on the combination each strategy
+reports at the end of its run.
+
+    python simulate_parameter_search.py --n-locations 2 --sessions 50
+
+"""
+import argparse
+import itertools
+import random
+import numpy as np
+
+from adaptive_search import search_strategies, get_search_strategy, get_parameter_key
+
+### Defaults as in configuration.py
+amplitudes = [1, 2, 4]
+frequencies = [20, 50, 130]
+pulse_widths = [75, 150]
+trials_per_combination = 20
+parameter_fieldnames = ['location', 'amplitude', 'frequency', 'pulse_width']
+
+### Milliseconds of a trial in stimulation_loop (classification, configuration wait, stimulation,
+### lockout, classification, and intertrial interval)
+trial_duration = 1200 + 100 + 500 + 400 + 1200 + 500
+
+### Shuffled stimulus list as made by initialize_experiment.py
+def get_stimulus_list(n_locations, random_generator):
+    stimulation_locations = [{'label': f"L{idx}-L{idx + 1}", 'anode': idx, 'cathode': idx + 1} for idx in range(n_locations)]
+    parameter_combinations = itertools.product(stimulation_locations, amplitudes, frequencies, pulse_widths)
+    stimulus_list = [dict(zip(parameter_fieldnames, combination)) for combination in parameter_combinations]
+    stimulus_list = stimulus_list * trials_per_combination
+    random_generator.shuffle(stimulus_list)
+    return stimulus_list
+
+### Trials until the strategy identified the best combination (None if it never did), whether
+### its best combination at the end of the run was within margin of the true best, and the trials run
+def simulate_session(strategy, true_means, noise_sd, margin, random_state):
+    true_best_mean = max(true_means.values())
+    identified_trial = None
+    trial_index = 0
+    while True:
+        stimulation_parameters = strategy.next_parameters(trial_index)
+        if stimulation_parameters is None:
+            break
+        key = get_parameter_key(stimulation_parameters)
+        strategy.update(stimulation_parameters, random_state.normal(true_means[key], noise_sd))
+        trial_index += 1
+        if identified_trial is None and strategy.is_identified():
+            identified_trial = trial_index
+    identified_best = get_parameter_key(strategy.get_best_parameters())
+    return identified_trial, true_means[identified_best] + margin >= true_best_mean, trial_index
+
+def print_results(strategy_name, results):
+    identified_trials = [identified_trial for identified_trial, correct, n_trials in results if identified_trial is not None]
+    accuracy = np.mean([correct for identified_trial, correct, n_trials in results])
+    total_trials = np.mean([n_trials for identified_trial, correct, n_trials in results])
+    if len(identified_trials):
+        median_trials = np.median(identified_trials)
+        identified = f"{median_trials:7.0f} ({median_trials * trial_duration / 60000:5.1f} min)"
+    else:
+        identified = f"{'never':>18}"
+    print(f"{strategy_name:>24} {identified} {len(identified_trials) / len(results):11.0%} {accuracy:9.0%} {total_trials:10.0f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare stimulation parameter search strategies on simulated sessions.")
+    parser.add_argument('--n-locations', type=int, default=2)
+    parser.add_argument('--sessions', type=int, default=50)
+    parser.add_argument('--effect-sd', type=float, default=0.5, help="standard deviation of the true mean outcomes of the combinations")
+    parser.add_argument('--noise-sd', type=float, default=1.0, help="standard deviation of the outcome of a trial around its combination's mean")
+    parser.add_argument('--min-trials', type=int, default=3, help="trials of every combination before the best can be identified")
+    parser.add_argument('--margin', type=float, default=0.1, help="outcome difference from the best within which a combination counts as the best")
+    parser.add_argument('--confidence', type=float, default=0.95, help="probability of being the best needed to identify a combination")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random_generator = random.Random(args.seed)
+    random_state = np.random.RandomState(args.seed)
+    results = {strategy_name: [] for strategy_name in search_strategies}
+    for session in range(args.sessions):
+        stimulus_list = get_stimulus_list(args.n_locations, random_generator)
+        keys = sorted(set(get_parameter_key(stimulation_parameters) for stimulation_parameters in stimulus_list))
+        true_means = dict(zip(keys, random_state.normal(0, args.effect_sd, len(keys))))
+        for strategy_name in search_strategies:
+            strategy = get_search_strategy(strategy_name, stimulus_list, min_trials=args.min_trials,
+                                           confidence=args.confidence, margin=args.margin, seed=random_state.randint(2 ** 31))
+            results[strategy_name].append(simulate_session(strategy, true_means, args.noise_sd, args.margin, random_state))
+
+    n_combinations = len(keys)
+    print(f"{args.sessions} sessions, {n_combinations} combinations, {len(stimulus_list)} trials in the stimulus list ({len(stimulus_list) * trial_duration / 60000:.0f} min).")
+    print(f"{'strategy':>24} {'median trials to identify':>18} {'identified':>11} {'correct':>9} {'trials run':>10}")
+    for strategy_name in search_strategies:
+        print_results(strategy_name, results[strategy_name])
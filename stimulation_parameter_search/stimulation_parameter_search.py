@@ -8,28 +8,33 @@ For details about experiment parameters view configuration.py
 """
 
 from smile.pennsyncbox import *
+from smile.session_writer import SessionWriter
+from smile.message_client import MessageClient
+from smile.message_template import compile_message_templates
+from smile.pulse_scheduler import PulseScheduler
 import pandas as pd
 import numpy as np
 import os
 import sys 
-import socket
 import json
 import time
 import random
-from csv import DictWriter
-from datetime import datetime
+from datetime import datetime, timedelta
 import tkinter as tk
 import ttkbootstrap as ttk
 from ttkbootstrap import Style
 import ttkbootstrap as tb
 import asyncio
 from threading import Thread, Event
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from PIL import Image, ImageTk
 
 ### Import configuration, initialization, and experiment functions
 from configuration import *
 from initialize_experiment import *
 from experiment_utils import *
+from adaptive_search import get_search_strategy
+from stimulation_trial import run_stimulation_trial, get_trial_outcome
 
 ############################################################### Experiment initialization ###############################################################################
 
@@ -91,6 +96,16 @@ if not os.path.isfile(communications_file):
 ### Allow time for files to be written before accessing
 time.sleep(0.5)
 
+### Session files stay open, and rows are buffered and written by a background thread so that
+### sync pulse, stimulation, and GUI threads never wait on file writes
+session_writer = SessionWriter()
+session_writer.add_file(checkpoint_file, checkpoint_fieldnames)
+session_writer.add_file(pulses_file, pulses_fieldnames)
+session_writer.add_file(events_file, events_fieldnames)
+session_writer.add_file(ratings_file, ratings_fieldnames)
+session_writer.add_file(scores_file, scores_fieldnames)
+session_writer.add_file(communications_file, communications_fieldnames)
+
 ### If stimulation is enabled, get trial list
 if stimulation_enabled:
     with open(stimulus_list_file, 'r') as file_handle:
@@ -98,10 +113,19 @@ if stimulation_enabled:
     global max_trial_index
     max_trial_index = len(stimulus_list)
 
+    ### Strategy choosing the parameters of each trial from the stimulus list, within max_trial_index trials
+    parameter_search = get_search_strategy(search_strategy, stimulus_list,
+                                           min_trials=min_trials_per_combination,
+                                           confidence=best_combination_confidence,
+                                           margin=best_combination_margin)
+
 ### Get message dictionary (event entries in addition to server-client messages)
 with open(message_dictionary_file, 'r') as file_handle:
     message_dictionary = json.load(file_handle)
 
+### Server-client messages are precompiled into encoders that only fill in the fields that vary between messages
+message_templates = compile_message_templates(message_dictionary, variable_keys=('client_time', 'sender', 'message_id'))
+
 global stimulation_parameters, trial_index, experiment_block, pulse_id
 stimulation_parameters = message_dictionary['STIMULATION_PARAMETERS']
 trial_index = 0
@@ -111,91 +135,106 @@ experiment_block = 0
 
 ############################ Pulses and communications #############################
 
-### For executing sync pulse from imported pennsyncbox.py and recording client time in which it was sent
-def single_sync_pulse():
+### Sync pulses from imported pennsyncbox.py are sent by pulse schedulers at absolute deadlines, so the time
+### taken by each pulse, printing, and logging does not add up into drift of the pulse intervals.
+### For logging a sent pulse with the client time in which it was sent, and the times it was intended for and sent
+def log_sync_pulse(pulse_record, pulse_label):
     global pulse_id
-    current_time = datetime.now().strftime(datetime_format)
-    SyncPulse()
+    print(pulse_label)
+    pulse_time = datetime.now() - timedelta(seconds=time.perf_counter() - pulse_record['actual'])
     pulse_entry = message_dictionary['PULSE']
-    pulse_entry['time'] = current_time
+    pulse_entry['time'] = pulse_time.strftime(datetime_format)
     pulse_entry['pulse_id'] = pulse_id
-    with open(pulses_file, 'a') as file_handle:
-        writer = DictWriter(file_handle, fieldnames=pulses_fieldnames)
-        writer.writerow(pulse_entry)
+    pulse_entry['intended_time'] = round(pulse_record['intended'] * 1000, 3)
+    pulse_entry['actual_time'] = round(pulse_record['actual'] * 1000, 3)
+    session_writer.writerow(pulses_file, pulse_entry)
     pulse_id += 1
     
-### For sending message to server and logging message in communications file
-def send_server_message(server_handle, communications_file, message):
+### For sending message to server and logging message in communications file.
+### Message is encoded from its precompiled template with the given data fields, and written to server
+### by the client thread, so this does not wait on the network.
+### Returns the future response of the server if one is expected.
+def send_server_message(server_handle, communications_file, message_type, expect_response=True, **fields):
     global message_id
-    message['client_time'] = datetime.now().strftime(datetime_format)
-    message['sender'] = 'client'
-    message['message_id'] = message_id
-    message_string = json.dumps(message) + '\n'
+    fields['client_time'] = datetime.now().strftime(datetime_format)
+    fields['sender'] = 'client'
+    fields['message_id'] = message_id
+    template = message_templates[message_type]
+    response = None
 
     if server_connection_enabled:
-        server_handle.send(message_string.encode('utf-8'))    
+        response = server_handle.send_encoded(template.encode(**fields), expect_response, message_id, message_type)
 
-    with open(communications_file, 'a') as file_handle:
-        writer = DictWriter(file_handle, fieldnames=communications_fieldnames)
-        writer.writerow(message)
+    session_writer.writerow(communications_file, template.message(**fields))
     message_id += 1
+    return response
 
 ### For receiving response from server and logging message in communications file
-def receive_server_response(server_handle, communications_file):
+def receive_server_response(response, communications_file):
     global message_id
-    buffer = ''
-    continue_loop = True
-    while continue_loop:
-        new_data = server_handle.recv(1024)
-        if not new_data:
-            break
-        buffer += new_data.decode('utf-8')
-        while '\n' in buffer:
-            message_string, buffer = buffer.split('\n', 1)
-            message = json.loads(message_string)
-        if not buffer:
-            continue_loop = False
+    message = response.result(timeout=server_response_timeout)
     message['client_time'] = datetime.now().strftime(datetime_format)
     message['sender'] = 'server'
     message['message_id'] = message_id
-    with open(communications_file, 'a') as file_handle:
-        writer = DictWriter(file_handle, fieldnames=communications_fieldnames)
-        writer.writerow(message)
+    session_writer.writerow(communications_file, message)
     message_id += 1
+    return message
 
 ### For executing a quicker burst of sync pulses to signal experiment start/interruptions
 def sync_pulses_burst():
-    for idx in range(n_sync_pulses_burst):
-        print("Burst Pulse")
-        single_sync_pulse()
-        time.sleep(inter_burst_time / 1000)
+    burst_scheduler = PulseScheduler(SyncPulse, log=lambda pulse_record: log_sync_pulse(pulse_record, "Burst Pulse"))
+    burst_scheduler.run(inter_burst_time / 1000, count=n_sync_pulses_burst)
+
+### For logging pulses of the sync pulse loop
+def log_loop_sync_pulse(pulse_record, keep_alive_requests):
+    log_sync_pulse(pulse_record, "Sync Pulse")
+    if not stimulation_enabled:
+        keep_alive_requests.set() # So that the server continues receiving messages throughout the experiment
+
+### For executing a thread that sends a sham for the sync pulses of the sync pulse loop when stimulation is not enabled.
+### Shams wait for the server's response on this thread rather than on the sync pulse thread, so a slow server can not
+### delay or stop the sync pulses. Pulses sent while a sham is waiting for its response are answered by a single sham.
+def keep_alive_loop(keep_alive_requests, stop_keep_alive):
+    while True:
+        keep_alive_requests.wait()
+        keep_alive_requests.clear()
+        if stop_keep_alive.is_set():
+            return
+        try:
+            send_sham()
+        except FutureTimeoutError:
+            print("No response from Blackrock to sham.")
 
 ### For executing a thread that will intermittently send sync pulses with a jittered time interval
 def sync_pulses_loop():
-    time.sleep(burst_wait_time / 1000)
-    global stop_sync_pulses
-    while not stop_sync_pulses:
-        print("Sync Pulse")
-        single_sync_pulse()
-        if not stimulation_enabled:
-            send_sham() # So that the server continues receiving messages throughout the experiment
-        jittered_time_duration = np.random.normal(inter_sync_pulses_interval, sync_pulses_jitter)
-        time.sleep(jittered_time_duration / 1000)
+    global sync_pulses_scheduler
+    keep_alive_requests = Event()
+    stop_keep_alive = Event()
+    keep_alive_thread = Thread(target=keep_alive_loop, args=(keep_alive_requests, stop_keep_alive), daemon=True)
+    keep_alive_thread.start()
+    sync_pulses_scheduler = PulseScheduler(SyncPulse, log=lambda pulse_record: log_loop_sync_pulse(pulse_record, keep_alive_requests))
+    sync_pulses_scheduler.run(lambda: np.random.normal(inter_sync_pulses_interval, sync_pulses_jitter) / 1000,
+                              start_delay=burst_wait_time / 1000,
+                              until=lambda: stop_sync_pulses)
+    stop_keep_alive.set()
+    keep_alive_requests.set()
+    error_stats = sync_pulses_scheduler.get_error_stats()
+    if error_stats['n']:
+        print(f"{error_stats['n']} sync pulses sent {error_stats['mean'] * 1000:.3f} ms after their scheduled time on average (max {error_stats['max'] * 1000:.3f} ms).")
 
 ### For sending stimulation configurations as a message to server and logging events
 def send_stimulus():
     global trial_index, stimulation_parameters
-    message = message_dictionary['STIMULATION_CONFIGURATION']
-    message['data']['label'] = stimulation_parameters['location']['label']
-    message['data']['anode'] = stimulation_parameters['location']['anode']
-    message['data']['cathode'] = stimulation_parameters['location']['cathode']
-    message['data']['amplitude'] = stimulation_parameters['amplitude']
-    message['data']['frequency'] = stimulation_parameters['frequency']
-    message['data']['pulse_width'] = stimulation_parameters['pulse_width']
-    message['data']['duration'] = stimulation_parameters['duration']
     
     print("Sending stimulation configurations.")
-    send_server_message(server_handle, communications_file, message)
+    response = send_server_message(server_handle, communications_file, 'STIMULATION_CONFIGURATION',
+                                   label=stimulation_parameters['location']['label'],
+                                   anode=stimulation_parameters['location']['anode'],
+                                   cathode=stimulation_parameters['location']['cathode'],
+                                   amplitude=stimulation_parameters['amplitude'],
+                                   frequency=stimulation_parameters['frequency'],
+                                   pulse_width=stimulation_parameters['pulse_width'],
+                                   duration=stimulation_parameters['duration'])
     
     event_entry = message_dictionary['EVENT']
     current_time = datetime.now().strftime(datetime_format)
@@ -210,39 +249,47 @@ def send_stimulus():
     event_entry['time'] = current_time
     event_entry['trial_index'] = trial_index
 
-    with open(events_file, 'a') as file_handle:
-        writer = DictWriter(file_handle, fieldnames=events_fieldnames)
-        if os.stat(events_file).st_size == 0:
-            writer.writeheader()
-        writer.writerow(event_entry)
+    session_writer.writerow(events_file, event_entry)
 
     checkpoint_entry = {'subject': subject, 'session': session, 'experiment_block': experiment_block, 'trial_index': trial_index}
-    with open(checkpoint_file, 'a') as file_handle:
-        writer = DictWriter(file_handle, fieldnames=checkpoint_fieldnames)
-        if os.stat(checkpoint_file).st_size == 0:
-            writer.writeheader()
-        writer.writerow(checkpoint_entry)
+    session_writer.writerow(checkpoint_file, checkpoint_entry)
 
     print("Receiving response from Blackrock.")
+    server_message = None
     if server_connection_enabled:
-        receive_server_response(server_handle, communications_file)
+        server_message = receive_server_response(response, communications_file)
     
     print("Done with stimulation.")
+    return server_message
+
+### For sending the stimulation parameters chosen for a trial of the stimulation loop
+def send_trial_stimulus(stimulation_configuration):
+    for parameter in parameter_fieldnames:
+        stimulation_parameters[parameter] = stimulation_configuration[parameter]
+    return send_stimulus()
+
+### For logging the outcome score of a stimulation trial and passing it to the search strategy
+def record_trial_outcome(stimulation_configuration, outcome):
+    parameter_search.update(stimulation_configuration, outcome)
+    event_entry = message_dictionary['EVENT']
+    event_entry['event_type'] = 'OUTCOME'
+    event_entry['time'] = datetime.now().strftime(datetime_format)
+    event_entry['outcome'] = outcome
+    session_writer.writerow(events_file, event_entry)
+    event_entry['outcome'] = None
 
 ### For sending message to server that would stop execution of stimulus
 def stop_stimulus():
-    message = message_dictionary['STOP_STIMULATION']
     print("Stopping stimulation.")
-    send_server_message(server_handle, communications_file, message)
+    response = send_server_message(server_handle, communications_file, 'STOP_STIMULATION')
     print("Stopped stimulation.")
     if server_connection_enabled:
-        receive_server_response(server_handle, communications_file)
+        receive_server_response(response, communications_file)
 
 ### For sending message to server to deliver sham trial
 def send_sham():    
     print("Sham message to Blackrock.")    
-    message = message_dictionary['SHAM']
-    send_server_message(server_handle, communications_file, message)
+    response = send_server_message(server_handle, communications_file, 'SHAM')
     
     event_entry = message_dictionary['EVENT']
     current_time = datetime.now().strftime(datetime_format)
@@ -254,46 +301,35 @@ def send_sham():
     if not stimulation_enabled:
         event_entry['event_type'] = 'SYNC_PULSE'
 
-    with open(events_file, 'a') as file_handle:
-        writer = DictWriter(file_handle, fieldnames=events_fieldnames)
-        writer.writerow(event_entry)
+    session_writer.writerow(events_file, event_entry)
 
     print("Receiving response from Blackrock.")
     if server_connection_enabled:
-        receive_server_response(server_handle, communications_file) 
+        receive_server_response(response, communications_file) 
     print("Done with sham.")
     
 
-### For executing a thread that will loop through stimulation parameter combinations to send to server
+### For executing a thread that will loop through stimulation parameter combinations chosen by the search strategy to send to server
 def stimulation_loop():
     global stop_stimulation, stimulation_parameters, trial_index, max_trial_index
     
     while not stop_stimulation and trial_index < max_trial_index:
-        
-        stimulation_configuration = stimulus_list[trial_index]
-        
-        for parameter in parameter_fieldnames:
-            stimulation_parameters[parameter] = stimulation_configuration[parameter]
-
-        ### Before sending stimulus for each trial, wait interval of time for pre-stimulus classification
-        time.sleep(classification_duration / 1000)
-        
-        ### Will randomly send sham instead p_sham_trials/100 times
-        random_number = random.randint(1, 100)
-        if random_number <= p_sham_trials:
-            send_sham()
-        else:
-            send_stimulus()
-            trial_index += 1
-        
-        ### After sending stimulus/sham, wait time of stimulus delivery, stimulation decay, and time for post-stimulus classification
-        time.sleep(stimulation_duration / 1000)
-        time.sleep(post_stim_lockout / 1000)
-        time.sleep(classification_duration / 1000)
 
-        ### Wait jittered intertrial interval before starting next trial
-        jittered_time_duration = np.random.normal(intertrial_interval, intertrial_jitter)
-        time.sleep(jittered_time_duration / 1000)
+        ### Trial schedule shared with server/replay_stimulation_loop.py (see stimulation_trial.py).
+        ### The outcome of a stimulation trial is read from the server's response by get_trial_outcome
+        trial = run_stimulation_trial(trial_index, parameter_search, send_trial_stimulus, send_sham, record_trial_outcome,
+                                      configuration_dictionary, p_sham_trials, trial_outcome=get_trial_outcome)
+
+        ### Adaptive search strategies end the loop once the best combination is identified
+        if trial is None:
+            best_parameters = parameter_search.get_best_parameters()
+            print(f"Best stimulation parameters identified after {trial_index} trials: {best_parameters['location']['label']} at {best_parameters['amplitude']} mA, {best_parameters['frequency']} Hz, {best_parameters['pulse_width']} us pulse width.")
+            max_trial_index = trial_index
+            break
+
+        stimulated, stimulation_configuration = trial
+        if stimulated:
+            trial_index += 1
 
     if trial_index == max_trial_index:
         print("Max trial index for stimulation loop reached. Experiment ended.")
@@ -310,6 +346,8 @@ def command_stop_sync():
     deactivate_stimulation_button.configure(state='disabled')
     global sync_pulses_thread, sync_pulses_burst_thread, stop_sync_pulses
     stop_sync_pulses = True
+    if sync_pulses_scheduler is not None:
+        sync_pulses_scheduler.stop()
     sync_pulses_burst_thread = Thread(target=sync_pulses_burst, daemon=True)
     sync_pulses_burst_thread.start()
     
@@ -367,11 +405,7 @@ def command_injection_start():
     current_time = datetime.now().strftime(datetime_format)
     event_entry['event_type'] = 'INJECTION_START'
     event_entry['time'] = current_time
-    with open(events_file, 'a') as file_handle:
-        writer = DictWriter(file_handle, fieldnames=events_fieldnames)
-        if os.stat(events_file).st_size == 0:
-            writer.writeheader()
-        writer.writerow(event_entry)
+    session_writer.writerow(events_file, event_entry)
 
 ### For reenabling stimulation controls when injection has ended (and logging injection end time)
 def command_injection_end():
@@ -387,11 +421,7 @@ def command_injection_end():
     current_time = datetime.now().strftime(datetime_format)
     event_entry['event_type'] = 'INJECTION_END'
     event_entry['time'] = current_time
-    with open(events_file, 'a') as file_handle:
-        writer = DictWriter(file_handle, fieldnames=events_fieldnames)
-        if os.stat(events_file).st_size == 0:
-            writer.writeheader()
-        writer.writerow(event_entry)
+    session_writer.writerow(events_file, event_entry)
 
 ### For enabling stimulation delivery thread. Button is disabled after clicked. Enables deactivate stimulation button.
 def command_activate_stimulation():
@@ -437,11 +467,7 @@ def command_ratings_box(psychiatric_scale, scale_type, ratings_box, idx):
     ratings_entry = {'subject': subject, 'session': session, 'test': psychiatric_scale, 'scale': scale_type,
                     'rating': scale_score, 'time': current_time}
 
-    with open(ratings_file, 'a') as file_handle:
-        writer = DictWriter(file_handle, fieldnames=ratings_fieldnames)
-        if os.stat(ratings_file).st_size == 0:
-            writer.writeheader()
-        writer.writerow(ratings_entry)
+    session_writer.writerow(ratings_file, ratings_entry)
 
 ### For logging sums of psychiatric scale ratings (scores) after pressing update button in GUI
 def command_score_update(psychiatric_scale):
@@ -468,11 +494,7 @@ def command_score_update(psychiatric_scale):
 
     scores_entry = {'subject': subject, 'session': session, 'test': psychiatric_scale, 'score': score, 'time': current_time}
 
-    with open(scores_file, 'a') as file_handle:
-        writer = DictWriter(file_handle, fieldnames=scores_fieldnames)
-        if os.stat(scores_file).st_size == 0:
-            writer.writeheader()
-        writer.writerow(scores_entry)
+    session_writer.writerow(scores_file, scores_entry)
 
 ############################## Other functions #######################################
 
@@ -484,15 +506,18 @@ def on_closing():
     global sync_pulses_thread, stimulation_thread, stop_stimulation, sync_pulses_burst_thread, stop_sync_pulses
     stop_sync_pulses = True
     stop_stimulation = True
+    if sync_pulses_scheduler is not None:
+        sync_pulses_scheduler.stop()
     
     sync_pulses_burst_thread = Thread(target=sync_pulses_burst, daemon=False)
     sync_pulses_burst_thread.start()
     
-    message = message_dictionary['END']
     print("Closing server.")
-    send_server_message(server_handle, communications_file, message)
+    send_server_message(server_handle, communications_file, 'END', expect_response=False)
     if server_connection_enabled:
         server_handle.close()
+    ### Write buffered rows now. Rows of the closing pulse burst are written when the program exits
+    session_writer.flush()
     root.destroy()
     sys.exit()
 
@@ -601,12 +626,12 @@ OpenUSB()
 
 ### Establish connection with server
 if server_connection_enabled:
-    server_handle = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_handle.connect((server_ip, server_port))
-    message = message_dictionary['CONNECTED']
+    ### Server answers every message with message_id 0 instead of echoing its id, so responses are matched to messages in the order they were sent
+    server_handle = MessageClient(server_ip, server_port, id_key='message_id', type_key='message_type', match_unknown_ids=True)
+    server_handle.connect(timeout=server_response_timeout)
     print("Connected to server.")
-    send_server_message(server_handle, communications_file, message)
-    receive_server_response(server_handle, communications_file)
+    response = send_server_message(server_handle, communications_file, 'CONNECTED')
+    receive_server_response(response, communications_file)
 
 ### Function that will start execution of GUI for experiment to be started
 root.mainloop()
@@ -621,8 +646,7 @@ if experiment_block == 1 and trial_index == max_trial_index:
 ### Disconnect USB, send ending message to server, and close server.
 CloseUSB()
 if server_connection_enabled:
-    message = message_dictionary['END']
     print("Closing server.")
-    send_server_message(server_handle, communications_file, message)
-    receive_server_response(server_handle, communications_file)
+    response = send_server_message(server_handle, communications_file, 'END')
+    receive_server_response(response, communications_file)
     server_handle.close()
\ No newline at end of file
@@ -0,0 +1,67 @@
+"""
+Stimulation Trial
+
+A single trial of the stimulation loop: the search strategy chooses the stimulation parameters,
+a stimulus (or, p_sham_trials percent of the time, a sham) is sent around the pre- and post-stimulus
+classification windows, and the outcome of a stimulation trial is passed back to the search strategy.
+The stimulation thread of stimulation_parameter_search.py and the headless replay in
+server/replay_stimulation_loop.py both run their trials with run_stimulation_trial, so the replay
+follows the experiment's trial schedule.
+
+"""
+
+import random
+import time
+
+### Outcome score of a stimulation trial for adaptive search strategies (higher is better), called once the
+### post-stimulus classification is over with the trial's stimulation parameters and the server's response to them.
+### By default the 'outcome' data field of the response, if the server sends one. Can be replaced by any function
+### returning a score (e.g., classifier output), or None when there is no outcome for the trial.
+def get_trial_outcome(stimulation_configuration, server_message):
+    if server_message is None:
+        return None
+    return server_message.get('data', {}).get('outcome')
+
+### Waits of the stimulation loop are given in milliseconds
+def wait_milliseconds(duration):
+    time.sleep(duration / 1000)
+
+### Runs one trial and returns whether a stimulus was sent (rather than a sham) with the trial's
+### stimulation parameters, or None without waiting once the search strategy has ended the search.
+### send_stimulus is called with the stimulation parameters and returns the server's response (or None),
+### send_sham is called with no arguments, and record_trial_outcome is called with the stimulation
+### parameters and outcome of every stimulation trial that has one. Waits are the durations in
+### configuration_dictionary (as in configuration.py), passed in milliseconds to wait.
+def run_stimulation_trial(trial_index, parameter_search, send_stimulus, send_sham, record_trial_outcome,
+                          configuration_dictionary, p_sham_trials, trial_outcome=get_trial_outcome,
+                          wait=wait_milliseconds, random_generator=random):
+
+    stimulation_configuration = parameter_search.next_parameters(trial_index)
+    if stimulation_configuration is None:
+        return None
+
+    ### Before sending stimulus for each trial, wait interval of time for pre-stimulus classification
+    wait(configuration_dictionary['pre_stim_classification_duration'])
+
+    ### Will randomly send sham instead p_sham_trials/100 times
+    stimulated = random_generator.randint(1, 100) > p_sham_trials
+    if stimulated:
+        server_message = send_stimulus(stimulation_configuration)
+    else:
+        send_sham()
+
+    ### After sending stimulus/sham, wait time of stimulus delivery, stimulation decay, and time for post-stimulus classification
+    wait(configuration_dictionary['stimulation_duration'])
+    wait(configuration_dictionary['post_stim_lockout'])
+    wait(configuration_dictionary['post_stim_classification_duration'])
+
+    ### Outcome of the stimulation trial, once post-stimulus classification is over
+    if stimulated:
+        outcome = trial_outcome(stimulation_configuration, server_message)
+        if outcome is not None:
+            record_trial_outcome(stimulation_configuration, outcome)
+
+    ### Wait jittered intertrial interval before starting next trial
+    wait(random_generator.gauss(configuration_dictionary['intertrial_interval'], configuration_dictionary['intertrial_jitter']))
+
+    return stimulated, stimulation_configuration
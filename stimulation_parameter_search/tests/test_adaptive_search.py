@@ -0,0 +1,60 @@
+"""
+Tests of the search strategies in adaptive_search.py, printing the values checked.
+
+    python tests/test_adaptive_search.py
+
+"""
+import itertools
+import os
+import random
+import sys
+import warnings
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from adaptive_search import get_search_strategy, get_parameter_key
+
+### Shuffled stimulus list of 8 combinations, 10 trials each, as made by initialize_experiment.py
+locations = [{'label': 'L1-L2', 'anode': 1, 'cathode': 2}, {'label': 'L3-L4', 'anode': 3, 'cathode': 4}]
+combinations = [dict(zip(['location', 'amplitude', 'frequency', 'pulse_width'], combination))
+                for combination in itertools.product(locations, [1, 2], [20, 130], [75])]
+stimulus_list = combinations * 10
+random.Random(0).shuffle(stimulus_list)
+
+### The shuffled grid walks the stimulus list to its end
+search = get_search_strategy('shuffled_grid', stimulus_list)
+print([search.next_parameters(index) for index in range(len(stimulus_list))] == stimulus_list,
+      search.next_parameters(len(stimulus_list)))
+
+### Adaptive strategies find the best combination from outcomes and stop before the end of the list
+true_means = {get_parameter_key(combination): index * 0.5 for index, combination in enumerate(combinations)}
+random_state = np.random.RandomState(1)
+for strategy_name in ('thompson_sampling', 'upper_confidence_bound'):
+    search = get_search_strategy(strategy_name, stimulus_list, min_trials=3, confidence=0.95, margin=0.1, seed=1)
+    trial_index = 0
+    while True:
+        stimulation_parameters = search.next_parameters(trial_index)
+        if stimulation_parameters is None:
+            break
+        search.update(stimulation_parameters, random_state.normal(true_means[get_parameter_key(stimulation_parameters)], 0.5))
+        trial_index += 1
+    print(strategy_name, search.is_identified(), trial_index < len(stimulus_list),
+          get_parameter_key(search.get_best_parameters()) == get_parameter_key(combinations[-1]))
+
+### Without outcomes an adaptive strategy warns once after a trial of every combination,
+### and walks the stimulus list instead of sampling at random
+search = get_search_strategy('thompson_sampling', stimulus_list, seed=1)
+with warnings.catch_warnings(record=True) as caught:
+    warnings.simplefilter('always')
+    chosen = [search.next_parameters(index) for index in range(len(stimulus_list))]
+    print(len(caught), caught[0].category.__name__ if len(caught) else None)
+print(chosen == stimulus_list, search.next_parameters(len(stimulus_list)))
+
+### No warning while outcomes are received, once the first one arrives
+search = get_search_strategy('upper_confidence_bound', stimulus_list, seed=1)
+with warnings.catch_warnings(record=True) as caught:
+    warnings.simplefilter('always')
+    for index in range(2 * len(combinations)):
+        stimulation_parameters = search.next_parameters(index)
+        search.update(stimulation_parameters, 1.0)
+    print(len(caught), search.counts.sum())
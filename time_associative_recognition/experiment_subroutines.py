@@ -79,7 +79,7 @@ def InstructionsQuestions(self):
 ### Function to display sequences (crosshair -> emoji -> blank time interval -> celebrity face) 
 ### followed by keypress choice of whether emoji is organic or inorganic
 @Subroutine
-def StudyPhase(self, study_phase, session_keys_dictionary):
+def StudyPhase(self, study_phase, session_keys_dictionary, checkpoint_journal):
 
     study_left_label = session_keys_dictionary['study_left_label']
     study_right_label = session_keys_dictionary['study_right_label']
@@ -174,6 +174,10 @@ def StudyPhase(self, study_phase, session_keys_dictionary):
                 experiment_block=sequence.current['experiment_block'],
                 experiment_phase=sequence.current['experiment_phase'],
                 trial_index=sequence.current['trial_index'])
+            Func(checkpoint_journal.append,
+                 experiment_block=sequence.current['experiment_block'],
+                 experiment_phase=sequence.current['experiment_phase'],
+                 trial_index=sequence.current['trial_index'])
 
 ### Additional experiment of temporal memory in which a fraction of inter-phase (study-test) intervals are deviant        
 @Subroutine
@@ -199,7 +203,7 @@ def DelayPeriod(self, experiment_block):
 ### whether the celebrity face associated to emoji has changed,
 ### whether the time interval between them has changed
 @Subroutine
-def TestPhase(self, test_phase, session_keys_dictionary):
+def TestPhase(self, test_phase, session_keys_dictionary, checkpoint_journal):
     
     test_left_label = session_keys_dictionary['test_left_label']
     test_right_label = session_keys_dictionary['test_right_label']
@@ -304,4 +308,8 @@ def TestPhase(self, test_phase, session_keys_dictionary):
                 session=sequence.current['session'],
                 experiment_block=sequence.current['experiment_block'],
                 experiment_phase=sequence.current['experiment_phase'],
-                trial_index=sequence.current['trial_index'])
\ No newline at end of file
+                trial_index=sequence.current['trial_index'])
+            Func(checkpoint_journal.append,
+                 experiment_block=sequence.current['experiment_block'],
+                 experiment_phase=sequence.current['experiment_phase'],
+                 trial_index=sequence.current['trial_index'])
\ No newline at end of file
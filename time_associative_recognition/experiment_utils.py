@@ -5,7 +5,7 @@ This code contains utilities like gathering valid user inputs and returning expe
 
 """
 from configuration import *
-from csv import DictReader
+from smile.checkpoint import read_last_checkpoint
 
 #########################################################################################################################################################################
 
@@ -106,20 +106,19 @@ def prompt_new_folder_creation():
     return True
 
 ### Function to return experiment block list from appropriate starting point based on saved checkpoint
-def update_list_from_checkpoint(experiment_block_list, checkpoint_file, session_lock_file):
+def update_list_from_checkpoint(experiment_block_list, checkpoint_file, checkpoint_journal_file, session_lock_file):
     skip_study_phase = False
     last_experiment_block = None
     last_experiment_phase = None
     last_trial_index = None
 
-    ### Iterate over each line as an ordered dictionary 
-    with open(checkpoint_file, 'r') as file_handle:
-        csv_dict_reader = DictReader(file_handle)
-    
-        for row in csv_dict_reader:
-            last_experiment_block = int(row['experiment_block'])
-            last_experiment_phase = row['experiment_phase']
-            last_trial_index = int(row['trial_index'])
+    ### Only the last checkpoint is needed. It is read from the session's checkpoint journal,
+    ### or from checkpoint.csv for sessions started before there was a journal
+    last_checkpoint = read_last_checkpoint(checkpoint_journal_file, checkpoint_file)
+    if last_checkpoint is not None:
+        last_experiment_block = int(last_checkpoint['experiment_block'])
+        last_experiment_phase = last_checkpoint['experiment_phase']
+        last_trial_index = int(last_checkpoint['trial_index'])
 
     ### Use gathered checkpoint information to remove previous items from stimulus list
     if last_experiment_block is not None:     
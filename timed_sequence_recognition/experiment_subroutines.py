@@ -93,7 +93,7 @@ def InstructionsQuestions(self):
 ### Subroutine to display study phase sequences (crosshair -> emoji -> celebrity face 1 -> blank time interval -> celebrity face 2) 
 ### followed by intersequence interval blank
 @Subroutine
-def StudyPhase(self, study_phase):
+def StudyPhase(self, study_phase, checkpoint_journal):
     with Loop(study_phase) as sequence:
         
         ### Send a sync pulse right before each sequence is started
@@ -117,6 +117,9 @@ def StudyPhase(self, study_phase):
         face2_source = face_directory + sequence.current['face2'] + '.jpg'
         face2_image = Image(source=face2_source, size=screen_size, duration=image_duration, allow_stretch=True)
 
+        ### Decode the images of the next sequences ahead of time
+        sequence.prefetch(emoji_source, face1_source, face2_source)
+
         ### Use SMILE's log function to capture details of sequence during intersequence interval
         with Parallel():
             intersequence_blank = Image(source=blank_image, size=screen_size, duration=intersequence_interval, jitter=intersequence_jitter, allow_stretch=True)
@@ -171,6 +174,10 @@ def StudyPhase(self, study_phase):
                 experiment_block=sequence.current['experiment_block'],
                 experiment_phase=sequence.current['experiment_phase'],
                 sequence_index=sequence.current['sequence_index'])
+            Func(checkpoint_journal.append,
+                 experiment_block=sequence.current['experiment_block'],
+                 experiment_phase=sequence.current['experiment_phase'],
+                 sequence_index=sequence.current['sequence_index'])
 
 ### Additional experiment of temporal memory in which a fraction of inter-phase (study-test) intervals are deviant        
 @Subroutine
@@ -194,7 +201,7 @@ def DelayPeriod(self, experiment_block):
 
 ### Function to display test phase sequence followed by choice of associated emoji
 @Subroutine
-def TestPhase(self, test_phase):
+def TestPhase(self, test_phase, checkpoint_journal):
         
     ### Send a sync pulse right before each sequence is started
     sync_pulse = Func(send_sync_pulse)
@@ -298,4 +305,8 @@ def TestPhase(self, test_phase):
             session=test_phase['session'],
             experiment_block=test_phase['experiment_block'],
             experiment_phase=test_phase['experiment_phase'],
-            sequence_index=test_phase['sequence']['sequence_index'])
\ No newline at end of file
+            sequence_index=test_phase['sequence']['sequence_index'])
+        Func(checkpoint_journal.append,
+             experiment_block=test_phase['experiment_block'],
+             experiment_phase=test_phase['experiment_phase'],
+             sequence_index=test_phase['sequence']['sequence_index'])
\ No newline at end of file
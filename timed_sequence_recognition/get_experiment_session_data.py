@@ -2,60 +2,83 @@
 Get Experiment Session Data
 
 SMILE creates new folder each time experiment is run, and pickles a dictionary before writing to .slog file.
-This code will use SMILE's log2dl function to retrieve data from .slog files and append it to .csv files for a session.
+This code will use SMILE's consolidate_logs function to retrieve data from .slog files and append it to .csv files for a session.
 This will allow for multiple experiment runs for a single session (in case there is a break or an interruption).
 Code can also be run independently in the case were there is an error impeding file transfer.
+Run with --batch to transfer every SMILE log folder in test_directory without prompts, matching each folder to the
+subject and session it logged. Folders already transferred are listed in a manifest in test_directory and skipped on reruns.
 
 """
-
-from smile.log import log2dl
+from smile.consolidate import consolidate_and_move_logs, batch_consolidate
 import time
 import os
+import sys
 import pandas as pd
 from configuration import *
 from experiment_utils import *
 
 ########################################################################################################################################################################
 
-### Matching smile log and .csv file names, this function will loop through all SMILE log instances
-### and append their data to corresponding .csv files
-
-def append_log_to_csv(new_session_log, file_key, csv_file_info):
-    csv_file, fieldnames = csv_file_info
-    smile_log_index = 0
-    file_exists = True
-    data = pd.DataFrame(columns=fieldnames)
-    while file_exists:
-        smile_log_file = new_session_log + f'log_{file_key}_{smile_log_index}.slog'
-        file_exists = os.path.isfile(smile_log_file)
-        if file_exists:
-            data_block = pd.DataFrame(log2dl(smile_log_file))
-            data = pd.concat([data, data_block.reindex(columns=fieldnames)], ignore_index=True)
-        smile_log_index += 1
-    if not data.empty:
-        data = data.sort_values(by='log_time')
-        data.to_csv(csv_file, mode='a', index=False, header=False)
-
-def get_experiment_data_func(new_session_log, smile_log_directory, file_dictionary):
-    
-    smile_log_files = os.listdir(smile_log_directory)
+def get_experiment_data_func(new_session_log, smile_log_directory, file_dictionary, processes=None):
 
-    ### Transfer all SMILE log files to session directory for better management
-    if not os.path.exists(new_session_log):
-        os.makedirs(new_session_log)
-    for file in smile_log_files:        
-        os.rename(smile_log_directory + file, new_session_log + file)
+    ### Append the records of all SMILE log instances to the corresponding .csv files, then transfer all SMILE log files
+    ### to session directory for better management. Files are only moved once their records were appended, so a failed
+    ### transfer can simply be run again (a folder moved by an earlier failed transfer is resumed from new_session_log)
+    appended = consolidate_and_move_logs(smile_log_directory, new_session_log, file_dictionary, processes=processes)
     print(f"Success! Log files transferred to {new_session_log}.")
     time.sleep(1)
+    return appended
+
+########################################################################################################################################################################
+
+def get_session_file_dictionary(session_directory):
+
+    ### Session .csv file and fieldnames for each SMILE log name
+    return {
+        'pulse': (session_directory + 'pulses.csv', pulses_fieldnames),
+        'event': (session_directory + 'events.csv', events_fieldnames),
+        'timing': (session_directory + 'timing.csv', timing_fieldnames),
+        'checkpoint': (session_directory + 'checkpoint.csv', checkpoint_fieldnames),
+        'delay': (session_directory + 'delays.csv', delays_fieldnames)
+    }
+
+def consolidate_smile_log_folder(smile_log_directory, subject, session):
 
-    for file_key, csv_file_info in file_dictionary.items():
-        append_log_to_csv(new_session_log, file_key, csv_file_info)
+    ### Batch mode: transfer one SMILE log folder to the session it logged and append its records
+    date = os.path.basename(os.path.normpath(smile_log_directory))
+    session_directory = data_directory + subject + '/session_'+ session + '/'
+    new_session_log = session_directory + 'session_logs/' + date + '/'
+    file_dictionary = get_session_file_dictionary(session_directory)
+    return get_experiment_data_func(new_session_log, os.path.join(smile_log_directory, ''), file_dictionary, processes=0)
+
+def batch_consolidate_func(processes=None):
+
+    ### Consolidate every SMILE log folder in test_directory, one session per process
+    if not os.path.isdir(test_directory):
+        print(f"SMILE log directory {test_directory} does not exist.")
+        return {}
+    processed = batch_consolidate(test_directory, consolidate_smile_log_folder, names=list(get_session_file_dictionary('')),
+                                  processes=processes)
+    for date in sorted(processed):
+        folder = processed[date]
+        if 'error' in folder:
+            print(f"Skipped {date}: {folder['error']}")
+        else:
+            print(f"Consolidated {date} to subject {folder['subject']} session {folder['session']}.")
+    if not len(processed):
+        print("No new SMILE log folders to consolidate.")
+    return processed
 
 ########################################################################################################################################################################
 
 ### Function can be executed independently from experiment after session runs in case files were not transferred
 if __name__ == '__main__':
 
+    ### Batch mode needs no prompts. Safe to use a process per CPU since this runs under __main__
+    if '--batch' in sys.argv[1:]:
+        batch_consolidate_func(processes=os.cpu_count())
+        quit()
+
     ### Gather a valid subject code:
     subject = prompt_subject_code()
         
@@ -76,13 +99,7 @@ if __name__ == '__main__':
     smile_log_directory = test_directory + date + '/'
     new_session_log = session_logs + date + '/'
 
-    file_dictionary = {
-        'pulse': (pulses_file, pulses_fieldnames),
-        'event': (events_file, events_fieldnames),
-        'timing': (timing_file, timing_fieldnames),
-        'checkpoint': (checkpoint_file, checkpoint_fieldnames),
-        'delay': (delays_file, delays_fieldnames)
-    }
+    file_dictionary = get_session_file_dictionary(session_directory)
 
     ### If there is no smile log for specified date, ask user to try again
     if not os.path.isdir(smile_log_directory):
@@ -126,4 +143,5 @@ if __name__ == '__main__':
     if not delays_exist:
         pd.DataFrame(columns=delays_fieldnames).to_csv(delays_file, index=False, header=True)
     
-    get_experiment_data_func(new_session_log, smile_log_directory, file_dictionary)
\ No newline at end of file
+    ### Safe to read logs with a process per CPU since this runs under __main__
+    get_experiment_data_func(new_session_log, smile_log_directory, file_dictionary, processes=os.cpu_count())
\ No newline at end of file
@@ -8,6 +8,7 @@ For details about experiment parameters view configuration.py
 """
 
 from smile.common import *
+from smile.checkpoint import CheckpointJournal
 from smile.pennsyncbox import *
 import pandas as pd
 import os
@@ -46,6 +47,7 @@ session_directory = data_directory + subject + '/session_'+ session + '/'
 experiment_block_list_file = session_directory + 'experiment_block_list.json'
 session_logs = session_directory + 'session_logs/'
 checkpoint_file = session_directory + 'checkpoint.csv'
+checkpoint_journal_file = session_directory + 'checkpoint.journal'
 pulses_file = session_directory + 'pulses.csv'
 events_file = session_directory + 'events.csv'
 timing_file = session_directory + 'timing.csv'
@@ -110,7 +112,11 @@ with open(experiment_block_list_file) as file_handle:
 
 ### If experimental session has been executed before gather information 
 ### from checkpoint file to start from the appropriate trial
-experiment_block_list, experiment.skip_study_phase = update_list_from_checkpoint(experiment_block_list, checkpoint_file, session_lock_file)
+experiment_block_list, experiment.skip_study_phase = update_list_from_checkpoint(experiment_block_list, checkpoint_file, checkpoint_journal_file, session_lock_file)
+
+### Each completed trial is committed to the checkpoint journal so a session can resume after a power interruption
+### Records are committed on a background thread so the fsyncs do not delay the next trial
+checkpoint_journal = CheckpointJournal(checkpoint_journal_file, checkpoint_journal_fields, background=True)
 
 ################################################################### Experiment Loop Definition #########################################################################
 
@@ -147,7 +153,7 @@ with Loop(experiment_block_list) as experiment_block:
         with UntilDone():
             KeyPress(keys=continue_key)
         
-        StudyPhase(experiment_block.current['study_phase'])
+        StudyPhase(experiment_block.current['study_phase'], checkpoint_journal)
 
         ### Experimental delay period between study phase and test phase
         DelayPeriod(experiment_block.current)
@@ -163,7 +169,7 @@ with Loop(experiment_block_list) as experiment_block:
         Label(text=f"Press {continue_key} to start.", font_size=small_font, bottom=small_offset)
     with UntilDone():
         KeyPress(keys=continue_key)
-    TestPhase(experiment_block.current['test_phase'])
+    TestPhase(experiment_block.current['test_phase'], checkpoint_journal)
 
 ### If the execution of the experiment ends with no exits or power interruptions:
 ### USB port will be closed, a file locking the session will be created, and thank you note displayed
@@ -176,6 +182,9 @@ Label(text="Thank you for participating!", font_size=large_font, duration=5)
 # Run the experiment
 experiment.run()
 
+### Commit the checkpoints still waiting on the background thread
+checkpoint_journal.close()
+
 ################################################################## Post-Experiment Run Data Management #################################################################
 ### The line below will run at experiment end or after exiting the experiment
 ### If there is a power interruption, then experiment data may need to be recovered 